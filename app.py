@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, make_response
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, make_response, Response, stream_with_context
 from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.utils import secure_filename
@@ -10,18 +10,35 @@ import json
 import csv
 import io
 import zipfile
+import mimetypes
 import shutil
+import tempfile
 import xml.etree.ElementTree as ET
 from datetime import datetime, timezone, timedelta
 from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment
 from urllib.parse import quote
+from sqlalchemy.orm import selectinload
 import time
 import random
 
 from config import Config
-from models import db, User, Admin, Form, FormField, Submission, SubmissionData, UploadFile, PaymentOrder, PaymentAccount
-from forms import LoginForm, RegisterForm, AdminLoginForm, CreateFormForm, EditFormForm, DynamicForm, FormFieldForm
+from models import db, User, Admin, Form, FormField, Submission, SubmissionData, UploadFile, PaymentOrder, PaymentAccount, ExportJob, StatCounter
+from forms import LoginForm, RegisterForm, AdminLoginForm, CreateFormForm, EditFormForm, FormFieldForm, UPLOAD_ID_SUFFIX
+from principal_cache import PrincipalCache
+from form_cache import FormCache, get_compiled_form, bump_schema_version, forget_form
+from submission_storage import SubmissionWriter, ensure_filterable_indexes, field_value_equals
+from query_utils import iter_keyset_chunks, iter_submission_chunks, keyset_page, payment_breakdown
+from export_utils import iter_csv_chunks, iter_xlsx_export, XlsxStreamWriter, ZipStreamWriter, XLSX_MIMETYPE
+from export_jobs import ExportJobRunner
+from payment_status import PaymentStatusResolver, GATEWAY_QUERIES, TERMINAL_STATUSES
+from payment_events import PaymentEventBroker, publish_payment_event
+from payment_reconciler import PendingOrderReconciler, get_reconcile_metrics, METRIC_PREFIX as RECONCILE_METRIC_PREFIX
+from order_numbers import generate_order_no
+from payment_callbacks import ingest_payment_callback, WECHAT_SUCCESS_RESPONSE, ALIPAY_SUCCESS_RESPONSE
+from chunked_uploads import ChunkedUploads, UploadError
+from upload_store import UploadStore, INCOMING_FOLDER
+from stats_counters import StatsCounters, get_counters, get_named_counters, get_daily_totals, adjust_counters, reconcile_counters
+from storage_ledger import StorageVerifier, get_storage_usage, get_owner_storage, verify_storage
 
 def encode_filename_for_http(filename):
     """对文件名进行HTTP头兼容的编码处理"""
@@ -29,12 +46,6 @@ def encode_filename_for_http(filename):
     encoded_filename = quote(filename, safe='')
     return f"attachment; filename*=UTF-8''{encoded_filename}"
 
-def generate_order_no(payment_type='PAY'):
-    """生成唯一订单号"""
-    timestamp = int(time.time() * 1000)  # 毫秒时间戳
-    random_num = random.randint(1000, 9999)  # 4位随机数
-    return f"{payment_type}{timestamp}{random_num}"
-
 def utc_to_local(utc_dt):
     """将UTC时间转换为北京时间"""
     if utc_dt is None:
@@ -61,7 +72,7 @@ def format_datetime(dt, format_str='%Y-%m-%d %H:%M:%S'):
     
     return local_dt.strftime(format_str)
 
-def create_app():
+def create_app(test_config=None, instance_path=None):
     from payment_config import get_payment_processor, PaymentResult
     from dotenv import load_dotenv
 
@@ -69,8 +80,10 @@ def create_app():
     load_dotenv()
 
     # 修复缩进问题
-    app = Flask(__name__)
+    app = Flask(__name__, instance_path=instance_path)
     app.config.from_object(Config)
+    if test_config:
+        app.config.update(test_config)
 
     # 初始化扩展
     db.init_app(app)
@@ -106,17 +119,84 @@ def create_app():
     # 允许同一账号在多个设备同时登录
     login_manager.session_protection = None  # type: ignore
 
+    # 登录身份按工作进程缓存，认证不再每个请求查询数据库
+    principal_cache = PrincipalCache(app)
+
+    # 编译后的表单类按应用实例缓存
+    FormCache(app)
+
+    # 支付状态查询（合并并发查询、缓存网关结果）
+    payment_status = PaymentStatusResolver(app)
+
+    # 支付状态推送（各工作进程轮询通知表，分发给订阅的支付页面）
+    payment_events = PaymentEventBroker(app)
+
     @login_manager.user_loader
     def load_user(user_id):
-        if user_id.startswith('admin_'):
-            admin_id = user_id.replace('admin_', '')
-            return Admin.query.get(int(admin_id))
-        return User.query.get(int(user_id))
+        return principal_cache.get(user_id)
 
     # 创建上传目录
     upload_dir = os.path.join(app.instance_path, app.config['UPLOAD_FOLDER'])
     os.makedirs(upload_dir, exist_ok=True)
 
+    # 附件按内容寻址保存（相同内容只保存一份，按引用计数删除）
+    upload_store = UploadStore(app)
+
+    # 分块上传（暂存文件在提交表单时转入上传目录）
+    chunked_uploads = ChunkedUploads(app)
+
+    # 后台导出任务
+    export_jobs = ExportJobRunner(app)
+
+    # 统计计数器（写操作时增量更新，后台定期校准）
+    stats_counters = StatsCounters(app)
+
+    # 待支付订单后台对账
+    payment_reconciler = PendingOrderReconciler(app)
+
+    # 存储用量台账（后台定期按上传目录校准）
+    storage_verifier = StorageVerifier(app)
+
+    @app.before_request
+    def start_background_tasks():
+        # 工作进程处理第一个请求时启动本进程的导出调度线程、计数器校准线程、订单对账线程、上传清理线程和存储校验线程
+        export_jobs.ensure_started()
+        stats_counters.ensure_started()
+        payment_reconciler.ensure_started()
+        chunked_uploads.ensure_started()
+        storage_verifier.ensure_started()
+
+    def current_admin_id():
+        return int(current_user.get_id().replace('admin_', ''))
+
+    def build_download_response(chunks, filename, mimetype):
+        """将导出数据块写入临时文件，生成完整后再作为下载响应返回
+
+        生成过程中出错时异常由路由捕获并返回错误信息，不会向浏览器发送不完整的文件。
+        管理后台页面的导出都提交为后台任务，这里只处理直接调用导出接口的小批量导出。
+        """
+        output = tempfile.TemporaryFile()
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+            size = output.tell()
+            output.seek(0)
+        except BaseException:
+            output.close()
+            raise
+        response = send_file(output, mimetype=mimetype)
+        response.content_length = size
+        response.headers['Content-Disposition'] = encode_filename_for_http(filename)
+        app.logger.info(f"📤 导出文件已生成: {filename}")
+        return response
+
+    def export_job_payload(job):
+        payload = job.to_dict()
+        payload['status_url'] = url_for('admin_export_job_status', job_id=job.id)
+        if job.status == 'completed':
+            payload['download_url'] = url_for('admin_export_job_download', job_id=job.id)
+        return payload
+
     # 添加请求日志中间件
     @app.before_request
     def log_request_info():
@@ -127,8 +207,8 @@ def create_app():
         return '.' in filename and \
                filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
-    def save_uploaded_file(file, field_name, submission_id):
-        """保存上传的文件"""
+    def save_uploaded_file(file, field_name):
+        """边读取边计算哈希写入临时文件，返回PendingBlob（登记引用和写入数据库由调用方负责）"""
         try:
             app.logger.info(f"📁 处理文件上传: field={field_name}, file={file}, filename={getattr(file, 'filename', 'N/A')}")
 
@@ -137,35 +217,12 @@ def create_app():
                 if file.content_length and file.content_length > app.config['MAX_CONTENT_LENGTH']:
                     raise ValueError(f"文件大小超过限制 {app.config['MAX_CONTENT_LENGTH']/1024/1024:.0f}MB")
 
-                # 生成唯一文件名
-                file_ext = file.filename.rsplit('.', 1)[1].lower()
-                saved_filename = f"{uuid.uuid4().hex}.{file_ext}"
-                file_path = os.path.join(upload_dir, saved_filename)
-
-                app.logger.info(f"📁 保存文件到: {file_path}")
-
-                # 保存文件
-                file.save(file_path)
-
-                # 检查实际文件大小
-                actual_size = os.path.getsize(file_path)
-                if actual_size > app.config['MAX_CONTENT_LENGTH']:
-                    os.remove(file_path)  # 删除超大文件
-                    raise ValueError(f"文件大小超过限制 {app.config['MAX_CONTENT_LENGTH']/1024/1024:.0f}MB")
+                # 写入过程中超过大小限制时立即停止（FileTooLarge）
+                blob = upload_store.ingest(file.stream, field_name, file.filename, file.content_type)
 
-                app.logger.info(f"✅ 文件保存成功: {file.filename} -> {saved_filename}, 大小: {actual_size} bytes")
+                app.logger.info(f"✅ 文件保存成功: {file.filename} -> {blob.row['saved_filename']}, 大小: {blob.size} bytes")
 
-                # 保存文件信息到数据库
-                upload_file = UploadFile(
-                    submission_id=submission_id,
-                    field_name=field_name,
-                    original_filename=file.filename,
-                    saved_filename=saved_filename,
-                    file_size=actual_size,
-                    file_type=file.content_type or 'application/octet-stream'
-                )
-                db.session.add(upload_file)
-                return upload_file
+                return blob
             else:
                 app.logger.warning(f"⚠️ 文件上传失败: 文件不存在或格式不支持, file={file}, filename={getattr(file, 'filename', 'N/A')}")
                 return None
@@ -244,43 +301,40 @@ def create_app():
         # 用户仪表板
         submissions = Submission.query.filter_by(user_id=current_user.id).order_by(Submission.submitted_at.desc()).all()
 
-        # 用户支付统计数据
-        user_payment_stats = {
-            'total_payments': 0,
-            'paid_orders': 0,
-            'pending_payments': 0,
-            'total_paid_amount': 0.0,
-            'wechat_payments': 0,
-            'alipay_payments': 0,
-            'wechat_amount': 0.0,
-            'alipay_amount': 0.0
-        }
-
-        # 获取用户所有支付订单
-        user_payment_orders = PaymentOrder.query.join(Submission).filter(
-            Submission.user_id == current_user.id
-        ).all()
+        # 用户支付统计数据（一次分组聚合查询）
+        user_payment_stats = get_user_payment_stats(payment_breakdown(user_payment_query()))
 
-        if user_payment_orders:
-            user_payment_stats['total_payments'] = len(user_payment_orders)
-            user_payment_stats['paid_orders'] = len([p for p in user_payment_orders if p.status == 'paid'])
-            user_payment_stats['pending_payments'] = len([p for p in user_payment_orders if p.status == 'pending'])
-            user_payment_stats['total_paid_amount'] = sum([p.amount for p in user_payment_orders if p.status == 'paid'])
-
-            # 按支付方式统计
-            wechat_orders = [p for p in user_payment_orders if p.payment_type == 'wechat_pay']
-            alipay_orders = [p for p in user_payment_orders if p.payment_type == 'alipay']
-
-            user_payment_stats['wechat_payments'] = len(wechat_orders)
-            user_payment_stats['alipay_payments'] = len(alipay_orders)
-            user_payment_stats['wechat_amount'] = sum([p.amount for p in wechat_orders if p.status == 'paid'])
-            user_payment_stats['alipay_amount'] = sum([p.amount for p in alipay_orders if p.status == 'paid'])
+        # 最近10条支付订单（完整列表在支付历史页面分页查看）
+        user_payment_orders = (user_payment_query()
+                               .options(selectinload(PaymentOrder.submission).selectinload(Submission.form))
+                               .order_by(PaymentOrder.created_at.desc(), PaymentOrder.id.desc())
+                               .limit(10)
+                               .all())
 
         return render_template('user/dashboard.html',
                                submissions=submissions,
                                payment_stats=user_payment_stats,
                                payment_orders=user_payment_orders)
 
+    def user_payment_query():
+        """当前用户的支付订单查询"""
+        return PaymentOrder.query.join(Submission, PaymentOrder.submission_id == Submission.id).filter(
+            Submission.user_id == current_user.id
+        )
+
+    def get_user_payment_stats(breakdown):
+        """用户支付统计数据（由分组聚合结果计算）"""
+        return {
+            'total_payments': breakdown.count(),
+            'paid_orders': breakdown.count('paid'),
+            'pending_payments': breakdown.count('pending'),
+            'total_paid_amount': breakdown.amount('paid'),
+            'wechat_payments': breakdown.count(payment_type='wechat_pay'),
+            'alipay_payments': breakdown.count(payment_type='alipay'),
+            'wechat_amount': breakdown.amount('paid', 'wechat_pay'),
+            'alipay_amount': breakdown.amount('paid', 'alipay')
+        }
+
     @app.route('/available_forms')
     @login_required
     def available_forms():
@@ -318,9 +372,7 @@ def create_app():
         payment_type_filter = request.args.get('payment_type', '')
 
         # 构建查询
-        query = PaymentOrder.query.join(Submission).filter(
-            Submission.user_id == current_user.id
-        )
+        query = user_payment_query()
 
         if status_filter:
             query = query.filter(PaymentOrder.status == status_filter)
@@ -328,21 +380,28 @@ def create_app():
             query = query.filter(PaymentOrder.payment_type == payment_type_filter)
 
         # 执行分页查询
-        payment_orders = query.order_by(PaymentOrder.created_at.desc()).paginate(
+        payment_orders = query.options(
+            selectinload(PaymentOrder.submission).selectinload(Submission.form)
+        ).order_by(PaymentOrder.created_at.desc()).paginate(
             page=page,
             per_page=per_page,
             error_out=False
         )
 
-        # 统计数据
+        # 统计数据：与个人中心共用同一个分组聚合，订单数按当前筛选条件计算，已支付金额为全部订单
+        breakdown = payment_breakdown(user_payment_query())
+        type_filter = payment_type_filter or None
+
+        def filtered_count(status):
+            if status_filter and status_filter != status:
+                return 0
+            return breakdown.count(status, type_filter)
+
         payment_stats = {
-            'total_payments': query.count(),
-            'paid_orders': query.filter(PaymentOrder.status == 'paid').count(),
-            'pending_payments': query.filter(PaymentOrder.status == 'pending').count(),
-            'total_paid_amount': db.session.query(db.func.sum(PaymentOrder.amount)).join(Submission).filter(
-                Submission.user_id == current_user.id,
-                PaymentOrder.status == 'paid'
-            ).scalar() or 0.0
+            'total_payments': breakdown.count(status_filter or None, type_filter),
+            'paid_orders': filtered_count('paid'),
+            'pending_payments': filtered_count('pending'),
+            'total_paid_amount': breakdown.amount('paid')
         }
 
         return render_template('user/payment_history.html',
@@ -373,44 +432,60 @@ def create_app():
                 flash('您已提交过此表单', 'info')
                 return redirect(url_for('view_submission', submission_id=existing_submission.id))
 
-        # 创建动态表单
-        form_fields = FormField.query.filter_by(form_id=form_id).order_by(FormField.order_index).all()
+        # 创建动态表单（表单类按字段结构版本缓存，只在首次访问或字段变更后编译）
+        compiled_form = get_compiled_form(form_obj.id, form_obj.schema_version)
+        form_fields = compiled_form.fields
         # 修复文件上传问题：需要传递 files 数据
         formdata = None
         if request.method == 'POST':
             # 将 form 和 files 数据合并为 CombinedMultiDict
             formdata = CombinedMultiDict([request.files, request.form])
 
-        dynamic_form = DynamicForm(form_fields, formdata=formdata)
+        dynamic_form = compiled_form.form_class(formdata=formdata)
 
         if request.method == 'POST' and dynamic_form.validate():
-            try:
-                # 创建提交记录
-                submission = Submission(
-                    form_id=form_id,
-                    user_id=current_user.id
-                )
-                db.session.add(submission)
-                db.session.flush()  # 获取submission.id
+            # 收集字段值、附件和支付订单，最后一次性批量写入
+            writer = SubmissionWriter(form_id, current_user.id)
+            claimed_uploads = []
+            pending_blobs = []
 
-                # 保存表单数据
-                payment_orders = []  # 存储支付订单
+            def discard_submission():
+                """提交失败时回滚事务，并删除本次已写入临时文件的附件"""
+                db.session.rollback()
+                upload_store.discard(pending_blobs)
 
+            try:
                 for field in form_fields:
                     form_field = getattr(dynamic_form, field.field_name, None)
                     if form_field:
                         field_value = form_field.data
 
-                        app.logger.info(f"📄 处理字段: {field.field_name} (类型: {field.field_type}), 值: {type(field_value)} - {field_value}")
+                        app.logger.debug("处理字段: %s (类型: %s)", field.field_name, field.field_type)
 
-                        if field.field_type == 'file' and field_value:
+                        upload_id = request.form.get(field.field_name + UPLOAD_ID_SUFFIX) if field.field_type == 'file' else None
+                        if field.field_type == 'file' and upload_id and not field_value:
+                            # 已通过分块上传完成的文件：暂存文件转入上传目录
+                            try:
+                                blob = chunked_uploads.claim(upload_id, current_user.id, form_id,
+                                                             field.field_name, upload_store)
+                            except UploadError as e:
+                                app.logger.warning(f"⚠️ 分块上传认领失败: {field.field_name}, {str(e)}")
+                                flash(f"文件上传失败: {str(e)}", 'danger')
+                                discard_submission()
+                                return render_template('user/form.html', form_obj=form_obj, form=dynamic_form, fields=form_fields)
+                            pending_blobs.append(blob)
+                            writer.add_file(**blob.row)
+                            claimed_uploads.append(upload_id)
+                        elif field.field_type == 'file' and field_value:
                             # 处理文件上传
-                            app.logger.info(f"📁 开始处理文件上传: {field.field_name}")
-                            if not save_uploaded_file(field_value, field.field_name, submission.id):
-                                # 文件上传失败，回滚提交
+                            blob = save_uploaded_file(field_value, field.field_name)
+                            if not blob:
+                                # 文件上传失败，放弃本次提交
                                 app.logger.error(f"❌ 文件上传失败，回滚事务: {field.field_name}")
-                                db.session.rollback()
-                                return render_template('user/form.html', form_obj=form_obj, form=dynamic_form)
+                                discard_submission()
+                                return render_template('user/form.html', form_obj=form_obj, form=dynamic_form, fields=form_fields)
+                            pending_blobs.append(blob)
+                            writer.add_file(**blob.row)
                         elif field.field_type in ['wechat_pay', 'alipay'] and field_value:
                             # 处理支付字段
                             try:
@@ -418,8 +493,7 @@ def create_app():
                                 if amount > 0:
                                     # 创建支付订单
                                     order_no = generate_order_no()
-                                    payment_order = PaymentOrder(
-                                        submission_id=submission.id,
+                                    writer.add_payment(
                                         field_name=field.field_name,
                                         payment_type=field.field_type,
                                         amount=amount,
@@ -427,49 +501,41 @@ def create_app():
                                         status='pending',
                                         payment_account_id=field.payment_account_id  # 关联收款账户
                                     )
-                                    db.session.add(payment_order)
-                                    payment_orders.append(payment_order)
 
                                     app.logger.info(f"💰 创建支付订单: {order_no}, 金额: {amount}元, 收款账户ID: {field.payment_account_id}")
 
                                     # 保存支付金额到提交数据中
-                                    submission_data = SubmissionData(
-                                        submission_id=submission.id,
-                                        field_name=field.field_name,
-                                        field_value=str(amount)
-                                    )
-                                    db.session.add(submission_data)
+                                    writer.add_value(field.field_name, str(amount))
                             except (ValueError, TypeError) as e:
-                                app.logger.error(f"❌ 支付金额无效: {field_value}, 错误: {str(e)}")
+                                app.logger.error(f"❌ 支付金额无效: {field.field_name}, 错误: {str(e)}")
                                 flash(f'支付金额格式错误: {field.field_label}', 'danger')
-                                db.session.rollback()
-                                return render_template('user/form.html', form_obj=form_obj, form=dynamic_form)
+                                discard_submission()
+                                return render_template('user/form.html', form_obj=form_obj, form=dynamic_form, fields=form_fields)
                         elif field_value is not None and field_value != '':
                             # 处理复选框数据
                             if field.field_type == 'checkbox' and isinstance(field_value, list):
                                 field_value = ','.join(field_value)
 
                             # 保存普通字段数据
-                            submission_data = SubmissionData(
-                                submission_id=submission.id,
-                                field_name=field.field_name,
-                                field_value=str(field_value)
-                            )
-                            db.session.add(submission_data)
+                            writer.add_value(field.field_name, str(field_value))
 
+                # 附件记录引用upload_blob，先登记引用（插入upload_blob行）再写入提交记录
+                upload_store.acquire(db.session.connection(), pending_blobs)
+                submission_id = writer.write(db.session.connection())
                 db.session.commit()
+                chunked_uploads.discard_staging(claimed_uploads)
 
                 # 检查是否有支付订单
-                if payment_orders:
-                    app.logger.info(f"💳 检测到 {len(payment_orders)} 个支付订单，跳转到支付页面")
+                if writer.payments:
+                    app.logger.info(f"💳 检测到 {len(writer.payments)} 个支付订单，跳转到支付页面")
                     flash('表单提交成功！请完成支付。', 'success')
-                    return redirect(url_for('payment_page', submission_id=submission.id))
+                    return redirect(url_for('payment_page', submission_id=submission_id))
                 else:
                     flash('表单提交成功！', 'success')
-                    return redirect(url_for('view_submission', submission_id=submission.id))
+                    return redirect(url_for('view_submission', submission_id=submission_id))
 
             except Exception as e:
-                db.session.rollback()
+                discard_submission()
                 app.logger.error(f"表单提交失败: {str(e)}")
                 flash('表单提交失败，请重试', 'danger')
 
@@ -477,7 +543,90 @@ def create_app():
             # 表单验证失败
             flash('请检查表单信息是否正确填写', 'warning')
 
-        return render_template('user/form.html', form_obj=form_obj, form=dynamic_form)
+        return render_template('user/form.html', form_obj=form_obj, form=dynamic_form, fields=form_fields)
+
+    def upload_response(session, status=200):
+        """分块上传状态响应，Upload-Offset为已接收的字节数"""
+        response = jsonify(session.to_dict())
+        response.status_code = status
+        response.headers['Upload-Offset'] = str(session.received_size)
+        response.headers['Upload-Length'] = str(session.total_size)
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    def get_own_upload(upload_id):
+        if current_user.get_id().startswith('admin_'):
+            return None
+        return chunked_uploads.get(upload_id, current_user.id)
+
+    @app.route('/api/uploads', methods=['POST'])
+    @login_required
+    def create_upload():
+        """创建分块上传：声明表单、文件字段、文件名和大小"""
+        if current_user.get_id().startswith('admin_'):
+            return jsonify({'error': '管理员无法使用此功能'}), 403
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': '请求格式错误'}), 400
+
+        form_obj = db.session.get(Form, data.get('form_id')) if isinstance(data.get('form_id'), int) else None
+        if form_obj is None or not form_obj.is_active:
+            return jsonify({'error': '表单不存在或已停用'}), 404
+        field_name = data.get('field_name')
+        compiled_form = get_compiled_form(form_obj.id, form_obj.schema_version)
+        if not any(field.field_name == field_name and field.field_type == 'file' for field in compiled_form.fields):
+            return jsonify({'error': '文件字段不存在'}), 400
+
+        try:
+            session = chunked_uploads.create(current_user.id, form_obj.id, field_name, data.get('filename'),
+                                             data.get('size'), data.get('content_type'))
+        except UploadError as e:
+            return jsonify({'error': str(e)}), e.status
+
+        app.logger.info(f"📁 创建分块上传: {session.id}, file={session.original_filename}, size={session.total_size}")
+        response = upload_response(session, 201)
+        response.headers['Location'] = url_for('upload_status', upload_id=session.id)
+        response.headers['Upload-Chunk-Max'] = str(chunked_uploads.chunk_max_bytes)
+        return response
+
+    @app.route('/api/uploads/<upload_id>', methods=['GET'])
+    @login_required
+    def upload_status(upload_id):
+        """查询已接收的字节数（HEAD请求只返回响应头），连接中断后从该位置继续上传"""
+        session = get_own_upload(upload_id)
+        if session is None:
+            return jsonify({'error': '上传不存在或已过期'}), 404
+        return upload_response(session)
+
+    @app.route('/api/uploads/<upload_id>', methods=['PATCH'])
+    @login_required
+    def upload_chunk(upload_id):
+        """写入一个分块：请求体为文件内容，Upload-Offset为该块在文件中的起始位置"""
+        session = get_own_upload(upload_id)
+        if session is None:
+            return jsonify({'error': '上传不存在或已过期'}), 404
+        offset = request.headers.get('Upload-Offset', type=int)
+        if offset is None or offset < 0:
+            return jsonify({'error': '缺少Upload-Offset'}), 400
+
+        try:
+            chunked_uploads.write_chunk(session, offset, request.stream, request.content_length)
+        except UploadError as e:
+            response = jsonify({'error': str(e), 'offset': session.received_size})
+            response.status_code = e.status
+            response.headers['Upload-Offset'] = str(session.received_size)
+            return response
+        return upload_response(session)
+
+    @app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+    @login_required
+    def abort_upload(upload_id):
+        """取消上传"""
+        session = get_own_upload(upload_id)
+        if session is None:
+            return jsonify({'error': '上传不存在或已过期'}), 404
+        chunked_uploads.abort(session)
+        return '', 204
 
     @app.route('/submission/<int:submission_id>')
     @login_required
@@ -576,6 +725,7 @@ def create_app():
                     # 微信支付显示二维码
                     return render_template('user/payment_process.html',
                                            payment_order=payment_order,
+                                           payment_result=result,
                                            qr_code=result.qr_code,
                                            payment_method='wechat')
                 elif payment_method == 'alipay':
@@ -629,34 +779,18 @@ def create_app():
             is_valid, result = processor.verify_wechat_callback(data.copy())
 
             if is_valid and data.get('return_code') == 'SUCCESS' and data.get('result_code') == 'SUCCESS':
-                # 查找对应的支付订单
                 order_no = data.get('out_trade_no')
-                payment_order = PaymentOrder.query.filter_by(order_no=order_no).first()
-
-                if payment_order and payment_order.status in ['pending', 'processing']:
-                    # 更新订单状态
-                    payment_order.status = 'paid'
-                    payment_order.trade_no = data.get('transaction_id')
-                    payment_order.paid_at = datetime.utcnow()
-
-                    # 保存回调数据
-                    callback_info = {
-                        'callback_data': data,
-                        'callback_time': datetime.utcnow().isoformat(),
-                        'payment_method': 'wechat'
-                    }
-                    existing_data = payment_order.get_payment_data() or {}
-                    existing_data.update(callback_info)
-                    payment_order.set_payment_data(existing_data)
-
-                    db.session.commit()
-
-                    app.logger.info(f"✅ 微信支付成功: 订单{order_no}, 交易号{data.get('transaction_id')}")
-
-                    # 返回成功响应
-                    return '<xml><return_code><![CDATA[SUCCESS]]></return_code><return_msg><![CDATA[OK]]></return_msg></xml>'
+                transaction_id = data.get('transaction_id') or order_no
+                outcome = ingest_payment_callback('wechat', transaction_id, order_no, data, WECHAT_SUCCESS_RESPONSE)
+
+                if outcome.response is not None:
+                    if outcome.result == 'paid':
+                        app.logger.info(f"✅ 微信支付成功: 订单{order_no}, 交易号{transaction_id}")
+                    else:
+                        app.logger.info(f"🔁 微信支付重复回调: 订单{order_no}, 交易号{transaction_id} ({outcome.result})")
+                    return outcome.response
                 else:
-                    app.logger.warning(f"⚠️ 微信支付回调: 未找到订单或状态异常 {order_no}")
+                    app.logger.warning(f"⚠️ 微信支付回调: 未找到订单或状态异常 {order_no} ({outcome.result})")
             else:
                 app.logger.warning(f"⚠️ 微信支付回调验证失败: {result}")
 
@@ -681,34 +815,18 @@ def create_app():
             is_valid, result = processor.verify_alipay_callback(callback_data.copy())
 
             if is_valid and callback_data.get('trade_status') == 'TRADE_SUCCESS':
-                # 查找对应的支付订单
                 order_no = callback_data.get('out_trade_no')
-                payment_order = PaymentOrder.query.filter_by(order_no=order_no).first()
-
-                if payment_order and payment_order.status in ['pending', 'processing']:
-                    # 更新订单状态
-                    payment_order.status = 'paid'
-                    payment_order.trade_no = callback_data.get('trade_no')
-                    payment_order.paid_at = datetime.utcnow()
-
-                    # 保存回调数据
-                    callback_info = {
-                        'callback_data': callback_data,
-                        'callback_time': datetime.utcnow().isoformat(),
-                        'payment_method': 'alipay'
-                    }
-                    existing_data = payment_order.get_payment_data() or {}
-                    existing_data.update(callback_info)
-                    payment_order.set_payment_data(existing_data)
-
-                    db.session.commit()
-
-                    app.logger.info(f"✅ 支付宝支付成功: 订单{order_no}, 交易号{callback_data.get('trade_no')}")
-
-                    # 返回成功响应
-                    return 'success'
+                transaction_id = callback_data.get('trade_no') or order_no
+                outcome = ingest_payment_callback('alipay', transaction_id, order_no, callback_data, ALIPAY_SUCCESS_RESPONSE)
+
+                if outcome.response is not None:
+                    if outcome.result == 'paid':
+                        app.logger.info(f"✅ 支付宝支付成功: 订单{order_no}, 交易号{transaction_id}")
+                    else:
+                        app.logger.info(f"🔁 支付宝支付重复回调: 订单{order_no}, 交易号{transaction_id} ({outcome.result})")
+                    return outcome.response
                 else:
-                    app.logger.warning(f"⚠️ 支付宝支付回调: 未找到订单或状态异常 {order_no}")
+                    app.logger.warning(f"⚠️ 支付宝支付回调: 未找到订单或状态异常 {order_no} ({outcome.result})")
             else:
                 app.logger.warning(f"⚠️ 支付宝支付回调验证失败: {result}")
 
@@ -755,42 +873,20 @@ def create_app():
         if not current_user.get_id().startswith('admin_') and payment_order.submission.user_id != current_user.id:
             return jsonify({'error': '无权访问'}), 403
 
-        try:
-            processor = get_payment_processor()
-
-            # 根据支付类型查询状态
-            if payment_order.payment_type == 'wechat_pay':
-                result = processor.query_wechat_payment(payment_order.order_no)
-            elif payment_order.payment_type == 'alipay':
-                result = processor.query_alipay_payment(payment_order.order_no)
-            else:
-                return jsonify({'error': '不支持的支付类型'}), 400
+        if payment_order.payment_type not in GATEWAY_QUERIES:
+            return jsonify({'error': '不支持的支付类型'}), 400
 
-            if result.success:
-                # 更新本地订单状态（如果需要）
-                api_data = result.data
-                if api_data:
-                    # 根据返回的状态更新本地订单
-                    if payment_order.payment_type == 'wechat_pay':
-                        trade_state = api_data.get('trade_state')
-                        if trade_state == 'SUCCESS' and payment_order.status != 'paid':
-                            payment_order.status = 'paid'
-                            payment_order.trade_no = api_data.get('transaction_id')
-                            payment_order.paid_at = datetime.utcnow()
-                            db.session.commit()
-                    elif payment_order.payment_type == 'alipay':
-                        trade_status = api_data.get('trade_status')
-                        if trade_status == 'TRADE_SUCCESS' and payment_order.status != 'paid':
-                            payment_order.status = 'paid'
-                            payment_order.trade_no = api_data.get('trade_no')
-                            payment_order.paid_at = datetime.utcnow()
-                            db.session.commit()
+        try:
+            # 终态订单按本地记录回答，其余查询网关（并发查询合并、结果短时缓存）
+            answer = payment_status.resolve(payment_order)
+            result = answer.result
 
+            if result is None or result.success:
                 return jsonify({
                     'success': True,
-                    'status': payment_order.status,
-                    'trade_no': payment_order.trade_no,
-                    'api_data': api_data
+                    'status': answer.status,
+                    'trade_no': answer.trade_no,
+                    'api_data': result.data if result is not None else None
                 })
             else:
                 return jsonify({
@@ -803,6 +899,66 @@ def create_app():
             app.logger.error(f"❌ 查询支付状态异常: {str(e)}")
             return jsonify({'error': f'查询异常: {str(e)}'}), 500
 
+    @app.route('/payment/events/<int:order_id>')
+    @login_required
+    def payment_status_events(order_id):
+        """支付状态推送（SSE），订单进入终态或连接到期后结束"""
+        payment_order = PaymentOrder.query.get_or_404(order_id)
+
+        # 验证权限
+        if not current_user.get_id().startswith('admin_') and payment_order.submission.user_id != current_user.id:
+            return jsonify({'error': '无权访问'}), 403
+
+        if payment_order.payment_type not in GATEWAY_QUERIES:
+            return jsonify({'error': '不支持的支付类型'}), 400
+
+        # 先订阅再读取状态，期间提交的变更不会遗漏
+        subscription = payment_events.subscribe(order_id)
+        if subscription is None:
+            # 本进程的推送连接已满，页面改为轮询/payment/query
+            return (jsonify({'error': '状态推送连接已满，请改为轮询',
+                             'poll_url': url_for('query_payment_status', order_id=order_id)}),
+                    503, {'Retry-After': '3'})
+
+        def check_status():
+            # 每次检查后归还数据库连接，长连接期间不占用连接池
+            try:
+                answer = payment_status.resolve(db.session.get(PaymentOrder, order_id))
+                return answer.status, answer.trade_no
+            finally:
+                db.session.close()
+
+        def sse(event, data):
+            return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+        def generate():
+            try:
+                deadline = time.monotonic() + payment_events.stream_seconds
+                status, trade_no = check_status()
+                yield 'retry: 3000\n' + sse('status', {'status': status, 'trade_no': trade_no})
+
+                while status not in TERMINAL_STATUSES:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        yield sse('timeout', {'status': status})
+                        return
+                    # 收到通知时立即检查；否则每隔一段时间兜底查询一次（网关查询有缓存）
+                    subscription.wait(min(payment_events.HEARTBEAT_SECONDS, remaining))
+                    new_status, trade_no = check_status()
+                    if new_status != status:
+                        status = new_status
+                        yield sse('status', {'status': status, 'trade_no': trade_no})
+                    else:
+                        yield ': ping\n\n'
+            except Exception as e:
+                app.logger.error(f"❌ 支付状态推送异常: {str(e)}")
+                yield sse('error', {'message': '状态推送异常'})
+            finally:
+                payment_events.unsubscribe(subscription)
+
+        return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
     # API路由
     @app.route('/admin/api/payment-accounts')
     @login_required
@@ -848,7 +1004,7 @@ def create_app():
         
         try:
             data = request.get_json()
-            user = current_user
+            user = User.query.get_or_404(current_user.id)
             
             # 更新基本信息
             if data.get('name'):
@@ -880,6 +1036,7 @@ def create_app():
                 user.set_password(data['new_password'])
             
             db.session.commit()
+            principal_cache.invalidate()
             
             return jsonify({
                 'success': True,
@@ -918,16 +1075,17 @@ def create_app():
         forms = Form.query.order_by(Form.created_at.desc()).all()
         users = User.query.order_by(User.created_at.desc()).limit(10).all()
 
-        # 统计数据
+        # 统计数据（读取计数器）
+        counters = get_counters()
         stats = {
-            'total_forms': Form.query.count(),
-            'total_users': User.query.count(),
-            'total_submissions': Submission.query.count(),
-            'active_forms': Form.query.filter_by(is_active=True).count(),
-            'total_payments': PaymentOrder.query.count(),
-            'paid_orders': PaymentOrder.query.filter_by(status='paid').count(),
-            'pending_payments': PaymentOrder.query.filter_by(status='pending').count(),
-            'total_revenue': db.session.query(db.func.sum(PaymentOrder.amount)).filter_by(status='paid').scalar() or 0
+            'total_forms': counters.count('forms.total'),
+            'total_users': counters.count('users.total'),
+            'total_submissions': counters.count('submissions.total'),
+            'active_forms': counters.count('forms.active'),
+            'total_payments': counters.count('payments.total'),
+            'paid_orders': counters.count('payments.status.paid'),
+            'pending_payments': counters.count('payments.status.pending'),
+            'total_revenue': counters.amount('payments.revenue')
         }
 
         return render_template('admin/dashboard.html', forms=forms, users=users, stats=stats)
@@ -939,8 +1097,12 @@ def create_app():
             flash('无权访问', 'danger')
             return redirect(url_for('index'))
 
-        forms = Form.query.order_by(Form.created_at.desc()).all()
-        return render_template('admin/forms.html', forms=forms)
+        page = get_listing_page(Form.query, Form.created_at, Form.id)
+        form_ids = [form.id for form in page.items]
+        return render_template('admin/forms.html', forms=page.items, page=page,
+                               total_forms=get_counters('forms.').count('forms.total'),
+                               submission_counts=get_form_submission_counts(form_ids),
+                               storage_usage=get_owner_storage('form', form_ids))
 
     @app.route('/admin/forms/create', methods=['GET', 'POST'])
     @login_required
@@ -977,6 +1139,7 @@ def create_app():
                 field_label = request.form.get(f'field_{i}_label')
                 field_type = request.form.get(f'field_{i}_type')
                 is_required = request.form.get(f'field_{i}_required') == 'on'
+                is_filterable = request.form.get(f'field_{i}_filterable') == 'on'
                 placeholder = request.form.get(f'field_{i}_placeholder', '')
                 options = request.form.get(f'field_{i}_options', '')
                 payment_account_id = request.form.get(f'field_{i}_payment_account') or None
@@ -988,6 +1151,7 @@ def create_app():
                         field_label=field_label,
                         field_type=field_type,
                         is_required=is_required,
+                        is_filterable=is_filterable,
                         placeholder=placeholder,
                         order_index=i,
                         payment_account_id=int(payment_account_id) if payment_account_id else None
@@ -1000,6 +1164,14 @@ def create_app():
                     db.session.add(form_field)
 
             db.session.commit()
+
+            # 为可筛选字段建立JSON表达式索引
+            try:
+                with db.engine.begin() as conn:
+                    ensure_filterable_indexes(conn, form_obj.id)
+            except Exception as e:
+                app.logger.error(f"创建字段索引失败: {str(e)}")
+
             flash('表单创建成功！', 'success')
             return redirect(url_for('admin_forms'))
 
@@ -1019,6 +1191,7 @@ def create_app():
             form_obj.description = request.form.get('description', form_obj.description)
             form_obj.is_active = request.form.get('is_active') == 'on'
             form_obj.updated_at = datetime.utcnow()
+            bump_schema_version(form_obj)
 
             db.session.commit()
             flash('表单更新成功！', 'success')
@@ -1034,9 +1207,140 @@ def create_app():
             return redirect(url_for('index'))
 
         form_obj = Form.query.get_or_404(form_id)
-        submissions = Submission.query.filter_by(form_id=form_id).order_by(Submission.submitted_at.desc()).all()
+        query = build_submission_listing_query(form_id, request.args.get('status', ''), request.args.get('q', '').strip(),
+                                               request.args.get('field', ''), request.args.get('value', '').strip())
+        page = get_listing_page(query, Submission.submitted_at, Submission.id)
+        filterable_fields = FormField.query.filter_by(form_id=form_id, is_filterable=True).order_by(FormField.order_index).all()
+
+        return render_template('admin/form_submissions.html', form=form_obj, submissions=page.items, page=page,
+                               status_counts=get_submission_status_counts(form_id), filterable_fields=filterable_fields)
 
-        return render_template('admin/form_submissions.html', form=form_obj, submissions=submissions)
+    @app.route('/admin/api/forms/<int:form_id>/submissions')
+    @login_required
+    def admin_api_form_submissions(form_id):
+        """提交记录分页列表API"""
+        if not current_user.get_id().startswith('admin_'):
+            return jsonify({'error': '无权访问'}), 403
+
+        Form.query.get_or_404(form_id)
+        query = build_submission_listing_query(form_id, request.args.get('status', ''), request.args.get('q', '').strip(),
+                                               request.args.get('field', ''), request.args.get('value', '').strip())
+        page = get_listing_page(query, Submission.submitted_at, Submission.id)
+
+        return jsonify(listing_payload(page, [
+            {
+                'id': submission.id,
+                'status': submission.status,
+                'submitted_at': format_datetime(submission.submitted_at),
+                'user': {
+                    'id': submission.user.id,
+                    'name': submission.user.name,
+                    'email': submission.user.email,
+                    'phone': submission.user.phone
+                } if submission.user else None,
+                'data': submission.get_data_dict(),
+                'file_count': len(submission.files)
+            }
+            for submission in page.items
+        ], get_submission_status_counts(form_id)))
+
+    def get_listing_page(query, sort_column, id_column):
+        """按请求中的after/before游标取一页列表数据"""
+        per_page = max(1, min(request.args.get('per_page', 20, type=int), 100))
+        try:
+            return keyset_page(query, sort_column, id_column, after=request.args.get('after'),
+                               before=request.args.get('before'), per_page=per_page)
+        except ValueError:
+            # 游标无效（如被手工修改）时回到第一页
+            return keyset_page(query, sort_column, id_column, per_page=per_page)
+
+    def listing_payload(page, items, counts):
+        return {
+            'success': True,
+            'items': items,
+            'next_cursor': page.next_cursor,
+            'prev_cursor': page.prev_cursor,
+            'counts': counts
+        }
+
+    def build_submission_listing_query(form_id, status, keyword, field_name='', field_value=''):
+        """提交记录列表查询：按状态、关键字（提交者姓名、联系方式、填写内容）和字段值筛选"""
+        query = (Submission.query.filter_by(form_id=form_id)
+                 .options(selectinload(Submission.user), selectinload(Submission.data), selectinload(Submission.files)))
+        if status:
+            query = query.filter(Submission.status == status)
+        if keyword:
+            pattern = f'%{keyword}%'
+            query = query.filter(db.or_(
+                Submission.user.has(db.or_(User.name.ilike(pattern), User.email.ilike(pattern), User.phone.ilike(pattern))),
+                Submission.data.any(SubmissionData.field_value.ilike(pattern)),
+                db.cast(Submission.payload, db.Text).ilike(pattern)
+            ))
+        if field_name and field_value:
+            query = query.filter(field_value_equals(field_name, field_value))
+        return query
+
+    def get_submission_status_counts(form_id):
+        """表单提交数统计（读取按表单维护的计数器）"""
+        counters = get_counters(f'form.{form_id}.submissions.')
+        prefix = f'form.{form_id}.submissions'
+        return {
+            'total': counters.count(f'{prefix}.total'),
+            'submitted': counters.count(f'{prefix}.status.submitted'),
+            'approved': counters.count(f'{prefix}.status.approved'),
+            'rejected': counters.count(f'{prefix}.status.rejected')
+        }
+
+    def get_form_submission_counts(form_ids):
+        """当前页表单的提交数，只读取这些表单的计数器"""
+        names = {form_id: f'form.{form_id}.submissions.total' for form_id in form_ids}
+        counters = get_named_counters(names.values())
+        return {form_id: counters.count(name) for form_id, name in names.items()}
+
+    def build_user_listing_query(status, register_type, keyword):
+        """用户列表查询：按状态、注册方式和关键字筛选"""
+        query = User.query
+        if status == 'active':
+            query = query.filter_by(is_active=True)
+        elif status == 'inactive':
+            query = query.filter_by(is_active=False)
+        if register_type == 'email':
+            query = query.filter(User.email.isnot(None), User.email != '')
+        elif register_type == 'phone':
+            query = query.filter(User.phone.isnot(None), User.phone != '')
+        if keyword:
+            pattern = f'%{keyword}%'
+            query = query.filter(db.or_(User.name.ilike(pattern), User.email.ilike(pattern), User.phone.ilike(pattern)))
+        return query
+
+    def get_user_submission_summaries(user_ids):
+        """当前页用户的提交数和最近一次提交（两次聚合查询，不逐个加载提交记录）"""
+        if not user_ids:
+            return {}
+        rows = (db.session.query(Submission.user_id, db.func.count(Submission.id), db.func.max(Submission.submitted_at))
+                .filter(Submission.user_id.in_(user_ids))
+                .group_by(Submission.user_id)
+                .all())
+        summaries = {user_id: {'count': count, 'latest_at': latest_at, 'latest_form_title': None}
+                     for user_id, count, latest_at in rows}
+
+        latest_rows = (db.session.query(Submission.user_id, Form.title)
+                       .join(Form, Form.id == Submission.form_id)
+                       .filter(db.tuple_(Submission.user_id, Submission.submitted_at).in_(
+                           [(user_id, summary['latest_at']) for user_id, summary in summaries.items()]))
+                       .all())
+        for user_id, title in latest_rows:
+            summaries[user_id]['latest_form_title'] = title
+        return summaries
+
+    def get_user_counts():
+        counters = get_counters('users.')
+        return {
+            'total': counters.count('users.total'),
+            'active': counters.count('users.active'),
+            'with_email': counters.count('users.with_email'),
+            'with_phone': counters.count('users.with_phone')
+        }
 
     @app.route('/admin/users')
     @login_required
@@ -1045,8 +1349,43 @@ def create_app():
             flash('无权访问', 'danger')
             return redirect(url_for('index'))
 
-        users = User.query.order_by(User.created_at.desc()).all()
-        return render_template('admin/users.html', users=users)
+        query = build_user_listing_query(request.args.get('status', ''), request.args.get('type', ''),
+                                         request.args.get('q', '').strip())
+        page = get_listing_page(query, User.created_at, User.id)
+        user_ids = [user.id for user in page.items]
+        submission_summaries = get_user_submission_summaries(user_ids)
+
+        return render_template('admin/users.html', users=page.items, page=page,
+                               user_counts=get_user_counts(), submission_summaries=submission_summaries,
+                               storage_usage=get_owner_storage('user', user_ids))
+
+    @app.route('/admin/api/users')
+    @login_required
+    def admin_api_users():
+        """用户分页列表API"""
+        if not current_user.get_id().startswith('admin_'):
+            return jsonify({'error': '无权访问'}), 403
+
+        query = build_user_listing_query(request.args.get('status', ''), request.args.get('type', ''),
+                                         request.args.get('q', '').strip())
+        page = get_listing_page(query, User.created_at, User.id)
+        summaries = get_user_submission_summaries([user.id for user in page.items])
+
+        items = []
+        for user in page.items:
+            summary = summaries.get(user.id, {})
+            items.append({
+                'id': user.id,
+                'name': user.name,
+                'email': user.email,
+                'phone': user.phone,
+                'is_active': user.is_active,
+                'created_at': format_datetime(user.created_at),
+                'submission_count': summary.get('count', 0),
+                'latest_submission_at': format_datetime(summary.get('latest_at')),
+                'latest_form_title': summary.get('latest_form_title')
+            })
+        return jsonify(listing_payload(page, items, get_user_counts()))
 
     @app.route('/admin/payments')
     @login_required
@@ -1060,28 +1399,135 @@ def create_app():
         status_filter = request.args.get('status', '')
         payment_type_filter = request.args.get('payment_type', '')
 
+        keyword = request.args.get('q', '').strip()
+        created_from, created_to = parse_date_range(request.args.get('start_date'), request.args.get('end_date'))
+
         # 构建查询
-        query = PaymentOrder.query
+        query = build_payment_listing_query(status_filter, payment_type_filter, keyword, created_from, created_to)
+        page = get_listing_page(query, PaymentOrder.created_at, PaymentOrder.id)
 
-        if status_filter:
-            query = query.filter(PaymentOrder.status == status_filter)
-        if payment_type_filter:
-            query = query.filter(PaymentOrder.payment_type == payment_type_filter)
+        return render_template('admin/payments.html', payments=page.items, page=page,
+                               payment_stats=get_payment_stats(created_from, created_to))
 
-        payments = query.order_by(PaymentOrder.created_at.desc()).all()
+    @app.route('/admin/api/payments')
+    @login_required
+    def admin_api_payments():
+        """支付订单分页列表API"""
+        if not current_user.get_id().startswith('admin_'):
+            return jsonify({'error': '无权访问'}), 403
 
-        # 统计数据
-        payment_stats = {
-            'total_orders': PaymentOrder.query.count(),
-            'paid_orders': PaymentOrder.query.filter_by(status='paid').count(),
-            'pending_orders': PaymentOrder.query.filter_by(status='pending').count(),
-            'failed_orders': PaymentOrder.query.filter_by(status='failed').count(),
-            'total_revenue': db.session.query(db.func.sum(PaymentOrder.amount)).filter_by(status='paid').scalar() or 0,
-            'wechat_revenue': db.session.query(db.func.sum(PaymentOrder.amount)).filter_by(status='paid', payment_type='wechat_pay').scalar() or 0,
-            'alipay_revenue': db.session.query(db.func.sum(PaymentOrder.amount)).filter_by(status='paid', payment_type='alipay').scalar() or 0
-        }
+        created_from, created_to = parse_date_range(request.args.get('start_date'), request.args.get('end_date'))
+        query = build_payment_listing_query(request.args.get('status', ''), request.args.get('payment_type', ''),
+                                            request.args.get('q', '').strip(), created_from, created_to)
+        page = get_listing_page(query, PaymentOrder.created_at, PaymentOrder.id)
+
+        items = [
+            {
+                'id': payment.id,
+                'order_no': payment.order_no,
+                'trade_no': payment.trade_no,
+                'payment_type': payment.payment_type,
+                'amount': float(payment.amount),
+                'status': payment.status,
+                'submission_id': payment.submission_id,
+                'form_id': payment.submission.form_id,
+                'form_title': payment.submission.form.title if payment.submission.form else None,
+                'user_name': payment.submission.user.name if payment.submission.user else None,
+                'payment_account': payment.payment_account.account_name if payment.payment_account else None,
+                'created_at': format_datetime(payment.created_at)
+            }
+            for payment in page.items
+        ]
+        stats = get_payment_stats(created_from, created_to)
+        stats = {key: float(value) if key.endswith('revenue') else value for key, value in stats.items()}
+        return jsonify(listing_payload(page, items, stats))
+
+    @app.route('/admin/api/payments/reconcile-metrics')
+    @login_required
+    def admin_api_payment_reconcile_metrics():
+        """待支付订单对账指标"""
+        if not current_user.get_id().startswith('admin_'):
+            return jsonify({'error': '无权访问'}), 403
+        return jsonify(get_reconcile_metrics())
+
+    @app.route('/admin/api/payments/status-cache')
+    @login_required
+    def admin_api_payment_status_cache():
+        """支付状态查询的命中统计（本工作进程）"""
+        if not current_user.get_id().startswith('admin_'):
+            return jsonify({'error': '无权访问'}), 403
+        return jsonify(payment_status.stats())
 
-        return render_template('admin/payments.html', payments=payments, payment_stats=payment_stats)
+    @app.route('/admin/api/payments/gateway-stats')
+    @login_required
+    def admin_api_payment_gateway_stats():
+        """支付网关调用统计：熔断状态和各接口耗时（本工作进程）"""
+        if not current_user.get_id().startswith('admin_'):
+            return jsonify({'error': '无权访问'}), 403
+        return jsonify(get_payment_processor().gateway_stats())
+
+    def parse_date_range(start_date, end_date):
+        """将页面上的起止日期（北京时间，含结束当天）转换为UTC时间范围[start, end)，无效日期视为未填"""
+        def to_utc(value, days=0):
+            try:
+                local_midnight = datetime.strptime(value, '%Y-%m-%d') + timedelta(days=days)
+            except (TypeError, ValueError):
+                return None
+            return local_midnight - timedelta(hours=8)
+        return to_utc(start_date), to_utc(end_date, days=1)
+
+    def filter_created_between(query, created_from, created_to):
+        if created_from:
+            query = query.filter(PaymentOrder.created_at >= created_from)
+        if created_to:
+            query = query.filter(PaymentOrder.created_at < created_to)
+        return query
+
+    def build_payment_listing_query(status, payment_type, keyword, created_from=None, created_to=None):
+        """支付订单列表查询：按状态、支付方式、订单号/交易号和创建日期筛选
+
+        关联数据只为当前页的订单批量预加载。
+        """
+        query = PaymentOrder.query.options(
+            selectinload(PaymentOrder.submission).selectinload(Submission.form),
+            selectinload(PaymentOrder.submission).selectinload(Submission.user),
+            selectinload(PaymentOrder.payment_account)
+        )
+        if status:
+            query = query.filter(PaymentOrder.status == status)
+        if payment_type:
+            query = query.filter(PaymentOrder.payment_type == payment_type)
+        if keyword:
+            pattern = f'%{keyword}%'
+            query = query.filter(db.or_(PaymentOrder.order_no.ilike(pattern), PaymentOrder.trade_no.ilike(pattern)))
+        return filter_created_between(query, created_from, created_to)
+
+    def get_payment_stats(created_from=None, created_to=None):
+        """支付统计数据
+
+        不限日期时读取计数器；限定日期范围时对范围内的订单执行一次分组聚合查询。
+        """
+        if created_from or created_to:
+            breakdown = payment_breakdown(filter_created_between(PaymentOrder.query, created_from, created_to))
+            return {
+                'total_orders': breakdown.count(),
+                'paid_orders': breakdown.count('paid'),
+                'pending_orders': breakdown.count('pending'),
+                'failed_orders': breakdown.count('failed'),
+                'total_revenue': breakdown.amount('paid'),
+                'wechat_revenue': breakdown.amount('paid', 'wechat_pay'),
+                'alipay_revenue': breakdown.amount('paid', 'alipay')
+            }
+        counters = get_counters('payments.')
+        return {
+            'total_orders': counters.count('payments.total'),
+            'paid_orders': counters.count('payments.status.paid'),
+            'pending_orders': counters.count('payments.status.pending'),
+            'failed_orders': counters.count('payments.status.failed'),
+            'total_revenue': counters.amount('payments.revenue'),
+            'wechat_revenue': counters.amount('payments.revenue.wechat_pay'),
+            'alipay_revenue': counters.amount('payments.revenue.alipay')
+        }
 
     @app.route('/admin/payments/<int:order_id>/update-status', methods=['POST'])
     @login_required
@@ -1110,6 +1556,10 @@ def create_app():
                 if not payment_order.trade_no:
                     payment_order.trade_no = f"ADMIN{int(time.time())}{random.randint(100, 999)}"
 
+            # 通知正在等待该订单的支付页面
+            if new_status != old_status:
+                publish_payment_event(db.session.connection(), payment_order.id, new_status)
+
             db.session.commit()
 
             # 返回成功响应
@@ -1262,22 +1712,16 @@ def create_app():
             'uptime': '1 天 3 小时',  # 模拟数据
             'disk_usage': 0,
             'security_status': 'normal',
-            'last_security_check': None
+            'last_security_check': None,
+            'dedup': None
         }
         
-        # 统计上传文件数量和大小
+        # 上传文件数量和大小读取存储用量台账（后台定期按上传目录校准）
         try:
-            upload_path = os.path.join(app.instance_path, app.config['UPLOAD_FOLDER'])
-            if os.path.exists(upload_path):
-                files = [f for f in os.listdir(upload_path) if os.path.isfile(os.path.join(upload_path, f))]
-                system_stats['total_files'] = len(files)
-                
-                # 计算总文件大小
-                total_size = 0
-                for f in files:
-                    file_path = os.path.join(upload_path, f)
-                    total_size += os.path.getsize(file_path)
-                system_stats['total_size'] = total_size
+            storage = get_storage_usage()
+            system_stats['total_files'] = storage['files']
+            system_stats['total_size'] = storage['stored_bytes']
+            system_stats['dedup'] = storage
         except Exception as e:
             app.logger.warning(f"统计文件失败: {str(e)}")
 
@@ -1312,58 +1756,56 @@ def create_app():
             return jsonify({'error': '无权访问'}), 403
 
         try:
-            # 基本统计
+            # 基本统计（读取计数器和按日汇总）
+            counters = get_counters()
+            today = get_daily_totals(['users.registered', 'submissions.created'])
+            storage = get_storage_usage()
+            last_7_days = get_daily_totals(['users.registered', 'forms.created', 'submissions.created'], days=7)
+            total_size = counters.count('files.size')
+
             stats = {
                 'users': {
-                    'total': User.query.count(),
-                    'active': User.query.filter_by(is_active=True).count(),
-                    'inactive': User.query.filter_by(is_active=False).count(),
-                    'today_registered': User.query.filter(
-                        User.created_at >= datetime.now().replace(hour=0, minute=0, second=0)
-                    ).count()
+                    'total': counters.count('users.total'),
+                    'active': counters.count('users.active'),
+                    'inactive': counters.count('users.total') - counters.count('users.active'),
+                    'today_registered': today.count('users.registered')
                 },
                 'forms': {
-                    'total': Form.query.count(),
-                    'active': Form.query.filter_by(is_active=True).count(),
-                    'inactive': Form.query.filter_by(is_active=False).count()
+                    'total': counters.count('forms.total'),
+                    'active': counters.count('forms.active'),
+                    'inactive': counters.count('forms.total') - counters.count('forms.active')
                 },
                 'submissions': {
-                    'total': Submission.query.count(),
-                    'today': Submission.query.filter(
-                        Submission.submitted_at >= datetime.now().replace(hour=0, minute=0, second=0)
-                    ).count(),
-                    'pending': Submission.query.filter_by(status='submitted').count(),
-                    'approved': Submission.query.filter_by(status='approved').count(),
-                    'rejected': Submission.query.filter_by(status='rejected').count()
+                    'total': counters.count('submissions.total'),
+                    'today': today.count('submissions.created'),
+                    'pending': counters.count('submissions.status.submitted'),
+                    'approved': counters.count('submissions.status.approved'),
+                    'rejected': counters.count('submissions.status.rejected')
                 },
                 'payments': {
-                    'total': PaymentOrder.query.count(),
-                    'paid': PaymentOrder.query.filter_by(status='paid').count(),
-                    'pending': PaymentOrder.query.filter_by(status='pending').count(),
-                    'failed': PaymentOrder.query.filter_by(status='failed').count(),
-                    'total_amount': float(db.session.query(db.func.sum(PaymentOrder.amount))
-                                       .filter_by(status='paid').scalar() or 0)
+                    'total': counters.count('payments.total'),
+                    'paid': counters.count('payments.status.paid'),
+                    'pending': counters.count('payments.status.pending'),
+                    'failed': counters.count('payments.status.failed'),
+                    'total_amount': float(counters.amount('payments.revenue'))
                 },
                 'files': {
-                    'total': UploadFile.query.count(),
-                    'total_size': 0,
-                    'today_uploaded': UploadFile.query.filter(
-                        UploadFile.uploaded_at >= datetime.now().replace(hour=0, minute=0, second=0)
-                    ).count()
+                    'total': counters.count('files.total'),
+                    'total_size': total_size,
+                    'total_size_mb': round(total_size / 1024 / 1024, 2),
+                    'today_uploaded': storage['today_uploaded'],
+                    'today_uploaded_size': storage['today_uploaded_size'],
+                    'stored_files': storage['files'],
+                    'stored_size': storage['stored_bytes'],
+                    'dedup': storage
                 }
             }
 
-            # 计算文件总大小
-            total_size = db.session.query(db.func.sum(UploadFile.file_size)).scalar() or 0
-            stats['files']['total_size'] = total_size
-            stats['files']['total_size_mb'] = round(total_size / 1024 / 1024, 2)
-
-            # 最近活动统计
-            last_7_days = datetime.now() - timedelta(days=7)
+            # 最近活动统计（近7天，含今天）
             stats['recent_activity'] = {
-                'users_registered': User.query.filter(User.created_at >= last_7_days).count(),
-                'forms_created': Form.query.filter(Form.created_at >= last_7_days).count(),
-                'submissions_made': Submission.query.filter(Submission.submitted_at >= last_7_days).count()
+                'users_registered': last_7_days.count('users.registered'),
+                'forms_created': last_7_days.count('forms.created'),
+                'submissions_made': last_7_days.count('submissions.created')
             }
 
             return jsonify({
@@ -1608,14 +2050,18 @@ def create_app():
                 
                 # 备份上传文件
                 if include_uploads:
-                    upload_path = os.path.join(app.instance_path, app.config['UPLOAD_FOLDER'])
-                    if os.path.exists(upload_path):
-                        for root, dirs, files in os.walk(upload_path):
-                            for file in files:
-                                file_path = os.path.join(root, file)
-                                archive_path = os.path.join('uploads', os.path.relpath(file_path, upload_path))
-                                zipf.write(file_path, archive_path)
-                        app.logger.info(f"上传文件已添加到备份: {len(os.listdir(upload_path))}个文件")
+                    backed_up = 0
+                    for relpath, _ in upload_store.iter_files():
+                        try:
+                            zipf.write(os.path.join(upload_store.root, relpath), os.path.join('uploads', relpath))
+                        except FileNotFoundError:
+                            # 备份期间被删除，或从根目录迁移到了分片目录
+                            relpath = upload_store.legacy_relpath(relpath) if os.sep not in relpath else None
+                            if not relpath or not os.path.exists(os.path.join(upload_store.root, relpath)):
+                                continue
+                            zipf.write(os.path.join(upload_store.root, relpath), os.path.join('uploads', relpath))
+                        backed_up += 1
+                    app.logger.info(f"上传文件已添加到备份: {backed_up}个文件")
                 
                 # 备份配置文件（注意不包含敏感信息）
                 if include_config:
@@ -1655,30 +2101,34 @@ def create_app():
         try:
             export_type = request.args.get('type', 'all')
             format_type = request.args.get('format', 'excel')
-            
-            app.logger.info(f"管理员 {current_user.email} 开始系统数据导出: {export_type}")
-            
-            if export_type == 'all':
-                # 导出所有系统数据
-                return export_all_system_data(format_type)
-            elif export_type == 'users':
-                # 导出用户数据
-                return export_users_data(format_type)
-            elif export_type == 'forms':
-                # 导出表单数据
-                return export_forms_data(format_type)
-            elif export_type == 'submissions':
-                # 导出提交数据
-                return export_submissions_data(format_type)
-            elif export_type == 'statistics':
-                # 导出统计报表
-                return export_statistics_report(format_type)
-            else:
+
+            if export_type not in system_export_builders:
                 return jsonify({'error': '不支持的导出类型'}), 400
-                
+
+            # 后台任务模式：立即返回任务ID，由前端轮询进度
+            if request.args.get('background') == 'true':
+                job = export_jobs.submit('system', {
+                    'type': export_type,
+                    'format': format_type,
+                    'admin_email': current_user.email
+                }, created_by=current_admin_id())
+                return jsonify(export_job_payload(job)), 202
+
+            app.logger.info(f"管理员 {current_user.email} 开始系统数据导出: {export_type}")
+
+            chunks, filename, mimetype = build_system_export(export_type, format_type, current_user.email)
+            return build_download_response(chunks, filename, mimetype)
+
         except Exception as e:
             app.logger.error(f"系统数据导出失败: {str(e)}")
             return jsonify({'error': f'导出失败: {str(e)}'}), 500
+
+    def build_system_export(export_type, format_type, admin_email, progress=None):
+        """构建系统数据导出，返回(数据块迭代器, 文件名, MIME类型)"""
+        if export_type == 'statistics':
+            # 导出统计报表
+            return export_statistics_report(format_type, admin_email)
+        return system_export_builders[export_type](format_type)
     
     def export_all_system_data(format_type):
         """导出所有系统数据"""
@@ -1734,14 +2184,15 @@ def create_app():
                 
                 # 提交数据统计
                 submissions_data = []
-                for submission in Submission.query.all():
-                    submissions_data.append({
-                        'ID': submission.id,
-                        '表单': submission.form.title,
-                        '提交者': submission.user.name,
-                        '状态': submission.status,
-                        '提交时间': submission.submitted_at.strftime('%Y-%m-%d %H:%M:%S')
-                    })
+                for chunk in iter_submission_chunks(Submission.query, descending=False):
+                    for submission in chunk:
+                        submissions_data.append({
+                            'ID': submission.id,
+                            '表单': submission.form.title,
+                            '提交者': submission.user.name,
+                            '状态': submission.status,
+                            '提交时间': submission.submitted_at.strftime('%Y-%m-%d %H:%M:%S')
+                        })
                 submissions_df = pd.DataFrame(submissions_data)
                 submissions_excel = BytesIO()
                 with pd.ExcelWriter(submissions_excel, engine='openpyxl') as writer:
@@ -1771,10 +2222,7 @@ def create_app():
             
             zip_buffer.seek(0)
             
-            response = make_response(zip_buffer.getvalue())
-            response.headers['Content-Type'] = 'application/zip'
-            response.headers['Content-Disposition'] = f'attachment; filename=system_export_{timestamp}.zip'
-            return response
+            return [zip_buffer.getvalue()], f'system_export_{timestamp}.zip', 'application/zip'
         
         else:
             # 单一Excel文件包含多个工作表
@@ -1810,14 +2258,15 @@ def create_app():
                 
                 # 提交统计
                 submissions_data = []
-                for submission in Submission.query.all():
-                    submissions_data.append({
-                        'ID': submission.id,
-                        '表单': submission.form.title,
-                        '提交者': submission.user.name,
-                        '状态': submission.status,
-                        '提交时间': submission.submitted_at.strftime('%Y-%m-%d %H:%M:%S')
-                    })
+                for chunk in iter_submission_chunks(Submission.query, descending=False):
+                    for submission in chunk:
+                        submissions_data.append({
+                            'ID': submission.id,
+                            '表单': submission.form.title,
+                            '提交者': submission.user.name,
+                            '状态': submission.status,
+                            '提交时间': submission.submitted_at.strftime('%Y-%m-%d %H:%M:%S')
+                        })
                 submissions_df = pd.DataFrame(submissions_data)
                 submissions_df.to_excel(writer, sheet_name='提交数据', index=False)
                 
@@ -1829,10 +2278,7 @@ def create_app():
             
             output.seek(0)
             
-            response = make_response(output.getvalue())
-            response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            response.headers['Content-Disposition'] = f'attachment; filename=system_export_{timestamp}.xlsx'
-            return response
+            return [output.getvalue()], f'system_export_{timestamp}.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
     
     def export_users_data(format_type):
         """导出用户数据"""
@@ -1859,10 +2305,7 @@ def create_app():
             df.to_csv(output, index=False, encoding='utf-8-sig')
             output.seek(0)
             
-            response = make_response(output.getvalue())
-            response.headers['Content-Type'] = 'text/csv; charset=utf-8'
-            response.headers['Content-Disposition'] = f'attachment; filename=users_{timestamp}.csv'
-            return response
+            return [output.getvalue()], f'users_{timestamp}.csv', 'text/csv; charset=utf-8'
         else:
             output = BytesIO()
             with pd.ExcelWriter(output, engine='openpyxl') as writer:
@@ -1872,10 +2315,7 @@ def create_app():
                 df.to_excel(writer, index=False)
             output.seek(0)
             
-            response = make_response(output.getvalue())
-            response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            response.headers['Content-Disposition'] = f'attachment; filename=users_{timestamp}.xlsx'
-            return response
+            return [output.getvalue()], f'users_{timestamp}.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
     
     def export_forms_data(format_type):
         """导出表单数据"""
@@ -1902,10 +2342,7 @@ def create_app():
             df.to_csv(output, index=False, encoding='utf-8-sig')
             output.seek(0)
             
-            response = make_response(output.getvalue())
-            response.headers['Content-Type'] = 'text/csv; charset=utf-8'
-            response.headers['Content-Disposition'] = f'attachment; filename=forms_{timestamp}.csv'
-            return response
+            return [output.getvalue()], f'forms_{timestamp}.csv', 'text/csv; charset=utf-8'
         else:
             output = BytesIO()
             with pd.ExcelWriter(output, engine='openpyxl') as writer:
@@ -1915,10 +2352,7 @@ def create_app():
                 df.to_excel(writer, index=False)
             output.seek(0)
             
-            response = make_response(output.getvalue())
-            response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            response.headers['Content-Disposition'] = f'attachment; filename=forms_{timestamp}.xlsx'
-            return response
+            return [output.getvalue()], f'forms_{timestamp}.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
     
     def export_submissions_data(format_type):
         """导出提交数据"""
@@ -1926,17 +2360,18 @@ def create_app():
         from io import BytesIO
         
         submissions_data = []
-        for submission in Submission.query.all():
-            submissions_data.append({
-                'ID': submission.id,
-                '表单ID': submission.form_id,
-                '表单标题': submission.form.title,
-                '用户ID': submission.user_id,
-                '提交者': submission.user.name,
-                '状态': submission.status,
-                '文件数': len(submission.files),
-                '提交时间': submission.submitted_at.strftime('%Y-%m-%d %H:%M:%S')
-            })
+        for chunk in iter_submission_chunks(Submission.query, descending=False):
+            for submission in chunk:
+                submissions_data.append({
+                    'ID': submission.id,
+                    '表单ID': submission.form_id,
+                    '表单标题': submission.form.title,
+                    '用户ID': submission.user_id,
+                    '提交者': submission.user.name,
+                    '状态': submission.status,
+                    '文件数': len(submission.files),
+                    '提交时间': submission.submitted_at.strftime('%Y-%m-%d %H:%M:%S')
+                })
         
         df = pd.DataFrame(submissions_data)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -1946,10 +2381,7 @@ def create_app():
             df.to_csv(output, index=False, encoding='utf-8-sig')
             output.seek(0)
             
-            response = make_response(output.getvalue())
-            response.headers['Content-Type'] = 'text/csv; charset=utf-8'
-            response.headers['Content-Disposition'] = f'attachment; filename=submissions_{timestamp}.csv'
-            return response
+            return [output.getvalue()], f'submissions_{timestamp}.csv', 'text/csv; charset=utf-8'
         else:
             output = BytesIO()
             with pd.ExcelWriter(output, engine='openpyxl') as writer:
@@ -1959,12 +2391,9 @@ def create_app():
                 df.to_excel(writer, index=False)
             output.seek(0)
             
-            response = make_response(output.getvalue())
-            response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            response.headers['Content-Disposition'] = f'attachment; filename=submissions_{timestamp}.xlsx'
-            return response
+            return [output.getvalue()], f'submissions_{timestamp}.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
     
-    def export_statistics_report(format_type):
+    def export_statistics_report(format_type, admin_email):
         """导出统计报表"""
         import pandas as pd
         from io import BytesIO
@@ -1972,31 +2401,33 @@ def create_app():
         # 生成统计报表数据
         stats_data = []
         
-        # 基本统计
-        stats_data.append({'类别': '用户统计', '项目': '总用户数', '数值': User.query.count()})
-        stats_data.append({'类别': '用户统计', '项目': '活跃用户', '数值': User.query.filter_by(is_active=True).count()})
-        stats_data.append({'类别': '用户统计', '项目': '禁用用户', '数值': User.query.filter_by(is_active=False).count()})
+        # 基本统计（读取计数器和按日汇总）
+        counters = get_counters()
+        today = get_daily_totals(['users.registered', 'submissions.created', 'files.uploaded'])
+
+        stats_data.append({'类别': '用户统计', '项目': '总用户数', '数值': counters.count('users.total')})
+        stats_data.append({'类别': '用户统计', '项目': '活跃用户', '数值': counters.count('users.active')})
+        stats_data.append({'类别': '用户统计', '项目': '禁用用户', '数值': counters.count('users.total') - counters.count('users.active')})
         
-        stats_data.append({'类别': '表单统计', '项目': '总表单数', '数值': Form.query.count()})
-        stats_data.append({'类别': '表单统计', '项目': '启用表单', '数值': Form.query.filter_by(is_active=True).count()})
-        stats_data.append({'类别': '表单统计', '项目': '禁用表单', '数值': Form.query.filter_by(is_active=False).count()})
+        stats_data.append({'类别': '表单统计', '项目': '总表单数', '数值': counters.count('forms.total')})
+        stats_data.append({'类别': '表单统计', '项目': '启用表单', '数值': counters.count('forms.active')})
+        stats_data.append({'类别': '表单统计', '项目': '禁用表单', '数值': counters.count('forms.total') - counters.count('forms.active')})
         
-        stats_data.append({'类别': '提交统计', '项目': '总提交数', '数值': Submission.query.count()})
-        stats_data.append({'类别': '提交统计', '项目': '待审核', '数值': Submission.query.filter_by(status='submitted').count()})
-        stats_data.append({'类别': '提交统计', '项目': '已通过', '数值': Submission.query.filter_by(status='approved').count()})
-        stats_data.append({'类别': '提交统计', '项目': '已拒绝', '数值': Submission.query.filter_by(status='rejected').count()})
+        stats_data.append({'类别': '提交统计', '项目': '总提交数', '数值': counters.count('submissions.total')})
+        stats_data.append({'类别': '提交统计', '项目': '待审核', '数值': counters.count('submissions.status.submitted')})
+        stats_data.append({'类别': '提交统计', '项目': '已通过', '数值': counters.count('submissions.status.approved')})
+        stats_data.append({'类别': '提交统计', '项目': '已拒绝', '数值': counters.count('submissions.status.rejected')})
         
-        stats_data.append({'类别': '文件统计', '项目': '总文件数', '数值': UploadFile.query.count()})
+        stats_data.append({'类别': '文件统计', '项目': '总文件数', '数值': counters.count('files.total')})
         
         # 今日统计
-        today = datetime.now().replace(hour=0, minute=0, second=0)
-        stats_data.append({'类别': '今日统计', '项目': '新用户', '数值': User.query.filter(User.created_at >= today).count()})
-        stats_data.append({'类别': '今日统计', '项目': '新提交', '数值': Submission.query.filter(Submission.submitted_at >= today).count()})
-        stats_data.append({'类别': '今日统计', '项目': '新文件', '数值': UploadFile.query.filter(UploadFile.uploaded_at >= today).count()})
+        stats_data.append({'类别': '今日统计', '项目': '新用户', '数值': today.count('users.registered')})
+        stats_data.append({'类别': '今日统计', '项目': '新提交', '数值': today.count('submissions.created')})
+        stats_data.append({'类别': '今日统计', '项目': '新文件', '数值': today.count('files.uploaded')})
         
         # 添加导出时间
         stats_data.append({'类别': '报表信息', '项目': '导出时间', '数值': datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
-        stats_data.append({'类别': '报表信息', '项目': '导出管理员', '数值': current_user.email})
+        stats_data.append({'类别': '报表信息', '项目': '导出管理员', '数值': admin_email})
         
         df = pd.DataFrame(stats_data)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -2006,10 +2437,7 @@ def create_app():
             df.to_csv(output, index=False, encoding='utf-8-sig')
             output.seek(0)
             
-            response = make_response(output.getvalue())
-            response.headers['Content-Type'] = 'text/csv; charset=utf-8'
-            response.headers['Content-Disposition'] = f'attachment; filename=statistics_{timestamp}.csv'
-            return response
+            return [output.getvalue()], f'statistics_{timestamp}.csv', 'text/csv; charset=utf-8'
         else:
             output = BytesIO()
             with pd.ExcelWriter(output, engine='openpyxl') as writer:
@@ -2019,10 +2447,16 @@ def create_app():
                 df.to_excel(writer, index=False)
             output.seek(0)
             
-            response = make_response(output.getvalue())
-            response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            response.headers['Content-Disposition'] = f'attachment; filename=statistics_{timestamp}.xlsx'
-            return response
+            return [output.getvalue()], f'statistics_{timestamp}.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+    # 系统数据导出类型（统计报表需要导出管理员信息，单独处理）
+    system_export_builders = {
+        'all': export_all_system_data,
+        'users': export_users_data,
+        'forms': export_forms_data,
+        'submissions': export_submissions_data,
+        'statistics': export_statistics_report
+    }
 
     @app.route('/admin/system/import', methods=['POST'])
     @login_required
@@ -2170,8 +2604,14 @@ def create_app():
                 
                 # 按顺序清空表数据（考虑外键约束）
                 from sqlalchemy import text
+                # 导出任务引用管理员，回调去重记录和状态通知按订单号/订单ID关联，先于订单和管理员清空
+                db.session.execute(text('DELETE FROM export_job'))
+                db.session.execute(text('DELETE FROM payment_event'))
+                db.session.execute(text('DELETE FROM payment_callback'))
                 db.session.execute(text('DELETE FROM submission_data'))
                 db.session.execute(text('DELETE FROM upload_file'))
+                db.session.execute(text('DELETE FROM upload_blob'))
+                db.session.execute(text('DELETE FROM upload_session'))
                 db.session.execute(text('DELETE FROM payment_order'))
                 db.session.execute(text('DELETE FROM submission'))
                 db.session.execute(text('DELETE FROM form_field'))
@@ -2180,8 +2620,15 @@ def create_app():
                 db.session.execute(text('DELETE FROM user'))
                 # 只保留当前登录的管理员
                 db.session.execute(text('DELETE FROM admin WHERE id != :admin_id'), {'admin_id': admin_id})
+                # 对账指标以下划线开头不参与校准，随订单一起清零
+                StatCounter.query.filter(StatCounter.name.startswith(RECONCILE_METRIC_PREFIX, autoescape=True)) \
+                    .delete(synchronize_session=False)
                 
                 db.session.commit()
+
+                # 直接执行的SQL不经过会话事件，立即校准统计计数器
+                reconcile_counters()
+                principal_cache.invalidate()
                 
                 # 清理上传文件
                 try:
@@ -2191,9 +2638,23 @@ def create_app():
                             file_path = os.path.join(upload_path, filename)
                             if os.path.isfile(file_path):
                                 os.remove(file_path)
+                            elif os.path.isdir(file_path) and filename != INCOMING_FOLDER:
+                                # 内容寻址存储的分片目录
+                                shutil.rmtree(file_path)
                         app.logger.info("📁 上传文件已清理")
+                    # 直接删除的文件不经过附件存储，立即按上传目录校准存储用量
+                    verify_storage(upload_store)
                 except Exception as e:
                     app.logger.warning(f"清理上传文件时出错: {str(e)}")
+
+                # 清理导出结果文件（任务记录已删除）
+                try:
+                    for filename in os.listdir(export_jobs.export_dir):
+                        file_path = os.path.join(export_jobs.export_dir, filename)
+                        if os.path.isfile(file_path):
+                            os.remove(file_path)
+                except Exception as e:
+                    app.logger.warning(f"清理导出文件时出错: {str(e)}")
                 
                 app.logger.warning("🧹 数据库已清空（保留当前管理员）")
                 flash('数据库已成功清空！当前管理员账户已保留。', 'success')
@@ -2256,60 +2717,70 @@ def create_app():
         try:
             app.logger.info(f"开始导出用户数据，参数: {request.args}")
 
-            # 获取查询参数
-            format_type = request.args.get('format', 'excel')  # excel 或 csv
-            file_name = request.args.get('fileName', 'users_data')
-
-            # 获取导出内容选项
-            include_basic = request.args.get('includeBasicInfo', 'true') == 'true'
-            include_contact = request.args.get('includeContactInfo', 'true') == 'true'
-            include_submissions = request.args.get('includeSubmissions', 'true') == 'true'
-            include_activity = request.args.get('includeActivity', 'true') == 'true'
-
-            # 获取筛选选项
-            status_filter = request.args.get('statusFilter', '')
-            type_filter = request.args.get('typeFilter', '')
-
-            app.logger.info(f"导出选项: format={format_type}, file_name={file_name}, include_basic={include_basic}")
-
-            # 构建查询
-            query = User.query
-
-            # 应用状态筛选
-            if status_filter == 'active':
-                query = query.filter(User.is_active == True)
-            elif status_filter == 'inactive':
-                query = query.filter(User.is_active == False)
-
-            # 应用类型筛选
-            if type_filter == 'email':
-                query = query.filter(User.email.isnot(None))
-            elif type_filter == 'phone':
-                query = query.filter(User.phone.isnot(None))
-
-            users = query.order_by(User.created_at.desc()).all()
-            app.logger.info(f"查询到 {len(users)} 个用户")
-
-            if format_type == 'csv':
-                # CSV格式导出
-                output = io.StringIO()
-                writer = csv.writer(output)
-
-                # 构建表头
-                headers = []
-                if include_basic:
-                    headers.extend(['用户ID', '用户名', '注册时间', '账户状态'])
-                if include_contact:
-                    headers.extend(['邮箱', '手机号'])
-                if include_submissions:
-                    headers.extend(['提交数量'])
-                if include_activity:
-                    headers.extend(['最后活动时间', '最后提交表单'])
-
-                writer.writerow(headers)
-
-                # 写入数据
-                for user in users:
+            # 后台任务模式：立即返回任务ID，由前端轮询进度
+            if request.args.get('background') == 'true':
+                job = export_jobs.submit('users', {'args': request.args.to_dict()}, created_by=current_admin_id())
+                return jsonify(export_job_payload(job)), 202
+
+            chunks, filename, mimetype = build_users_export(request.args.to_dict())
+            return build_download_response(chunks, filename, mimetype)
+
+        except Exception as e:
+            app.logger.error(f"用户数据导出失败: {str(e)}", exc_info=True)
+            return jsonify({'error': f'导出失败: {str(e)}'}), 500
+
+    def build_users_export(args, progress=None):
+        """构建用户数据导出，返回(数据块迭代器, 文件名, MIME类型)"""
+        # 获取查询参数
+        format_type = args.get('format', 'excel')  # excel 或 csv
+        file_name = args.get('fileName', 'users_data')
+
+        # 获取导出内容选项
+        include_basic = args.get('includeBasicInfo', 'true') == 'true'
+        include_contact = args.get('includeContactInfo', 'true') == 'true'
+        include_submissions = args.get('includeSubmissions', 'true') == 'true'
+        include_activity = args.get('includeActivity', 'true') == 'true'
+
+        # 获取筛选选项
+        status_filter = args.get('statusFilter', '')
+        type_filter = args.get('typeFilter', '')
+
+        app.logger.info(f"导出选项: format={format_type}, file_name={file_name}, include_basic={include_basic}")
+
+        # 构建查询
+        query = User.query
+
+        # 应用状态筛选
+        if status_filter == 'active':
+            query = query.filter(User.is_active == True)
+        elif status_filter == 'inactive':
+            query = query.filter(User.is_active == False)
+
+        # 应用类型筛选
+        if type_filter == 'email':
+            query = query.filter(User.email.isnot(None))
+        elif type_filter == 'phone':
+            query = query.filter(User.phone.isnot(None))
+
+        total = query.count()
+        app.logger.info(f"查询到 {total} 个用户")
+        if progress:
+            progress.set_total(total)
+
+        # 构建表头
+        headers = []
+        if include_basic:
+            headers.extend(['用户ID', '用户名', '注册时间', '账户状态'])
+        if include_contact:
+            headers.extend(['邮箱', '手机号'])
+        if include_submissions:
+            headers.extend(['提交数量'])
+        if include_activity:
+            headers.extend(['最后活动时间', '最后提交表单'])
+
+        def generate_rows():
+            for chunk in iter_keyset_chunks(query, User.created_at, User.id):
+                for user in chunk:
                     row = []
                     if include_basic:
                         row.extend([
@@ -2333,111 +2804,17 @@ def create_app():
                             last_submission.submitted_at.strftime('%Y-%m-%d %H:%M:%S') if last_submission else '无记录',
                             (last_submission.form.title if last_submission.form else '表单已删除') if last_submission else '无记录'
                         ])
-                    writer.writerow(row)
-
-                # 创建响应
-                csv_content = output.getvalue()
-                # 添加BOM以支持中文编码
-                csv_content = '\ufeff' + csv_content
-                response = make_response(csv_content.encode('utf-8'))
-                response.headers['Content-Type'] = 'text/csv; charset=utf-8'
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f'{file_name}_{timestamp}.csv'
-                response.headers['Content-Disposition'] = encode_filename_for_http(filename)
+                    yield row
+                    if progress:
+                        progress.advance()
 
-                app.logger.info(f"CSV导出完成，文件名: {filename}")
-                return response
-
-            else:
-                # Excel格式导出
-                app.logger.info("开始生成Excel文件")
-                wb = Workbook()
-                ws = wb.active
-                ws.title = "用户数据"
-
-                # 设置表头样式
-                header_font = Font(bold=True, color="FFFFFF")
-                header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-                header_alignment = Alignment(horizontal="center", vertical="center")
-
-                # 构建表头
-                headers = []
-                if include_basic:
-                    headers.extend(['用户ID', '用户名', '注册时间', '账户状态'])
-                if include_contact:
-                    headers.extend(['邮箱', '手机号'])
-                if include_submissions:
-                    headers.extend(['提交数量'])
-                if include_activity:
-                    headers.extend(['最后活动时间', '最后提交表单'])
-
-                # 写入表头
-                for col, header in enumerate(headers, 1):
-                    cell = ws.cell(row=1, column=col, value=header)
-                    cell.font = header_font
-                    cell.fill = header_fill
-                    cell.alignment = header_alignment
-
-                # 写入用户数据
-                for row, user in enumerate(users, 2):
-                    col = 1
-                    if include_basic:
-                        ws.cell(row=row, column=col, value=user.id)
-                        ws.cell(row=row, column=col+1, value=user.name)
-                        ws.cell(row=row, column=col+2, value=user.created_at.strftime('%Y-%m-%d %H:%M:%S'))
-                        ws.cell(row=row, column=col+3, value='活跃' if user.is_active else '禁用')
-                        col += 4
-
-                    if include_contact:
-                        ws.cell(row=row, column=col, value=user.email or '未设置')
-                        ws.cell(row=row, column=col+1, value=user.phone or '未设置')
-                        col += 2
-
-                    if include_submissions:
-                        ws.cell(row=row, column=col, value=len(user.submissions))
-                        col += 1
-
-                    if include_activity:
-                        last_submission = None
-                        if user.submissions:
-                            last_submission = max(user.submissions, key=lambda s: s.submitted_at)
-                        ws.cell(row=row, column=col, value=last_submission.submitted_at.strftime('%Y-%m-%d %H:%M:%S') if last_submission else '无记录')
-                        ws.cell(row=row, column=col+1, value=(last_submission.form.title if last_submission.form else '表单已删除') if last_submission else '无记录')
-                        col += 2
-
-                # 调整列宽
-                for col in range(1, len(headers) + 1):
-                    max_length = 0
-                    column = ws.cell(row=1, column=col).column_letter
-                    for row_cells in ws[column]:
-                        try:
-                            if len(str(row_cells.value)) > max_length:
-                                max_length = len(str(row_cells.value))
-                        except:
-                            pass
-                    adjusted_width = min(max_length + 2, 50)  # 最大宽度50
-                    ws.column_dimensions[column].width = max(adjusted_width, 10)  # 最小宽度10
-
-                app.logger.info("Excel文件生成完成，开始保存到内存")
-
-                # 保存到内存
-                output = io.BytesIO()
-                wb.save(output)
-                output.seek(0)
-
-                # 创建响应
-                response = make_response(output.read())
-                response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f'{file_name}_{timestamp}.xlsx'
-                response.headers['Content-Disposition'] = encode_filename_for_http(filename)
-
-                app.logger.info(f"Excel导出完成，文件名: {filename}")
-                return response
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        if format_type == 'csv':
+            # CSV格式导出
+            return iter_csv_chunks(headers, generate_rows()), f'{file_name}_{timestamp}.csv', 'text/csv; charset=utf-8'
 
-        except Exception as e:
-            app.logger.error(f"用户数据导出失败: {str(e)}", exc_info=True)
-            return jsonify({'error': f'导出失败: {str(e)}'}), 500
+        # Excel格式导出
+        return iter_xlsx_export("用户数据", headers, generate_rows()), f'{file_name}_{timestamp}.xlsx', XLSX_MIMETYPE
 
     @app.route('/admin/test-form-export/<int:form_id>')
     @login_required
@@ -2535,58 +2912,85 @@ def create_app():
 
             app.logger.info(f"✅ 表单信息: {form_obj.title}")
 
-            # 获取查询参数
-            format_type = request.args.get('format', 'excel')  # excel 或 csv 或 zip
-            file_name = request.args.get('fileName', f'{form_obj.title}_submissions')
+            # 后台任务模式：立即返回任务ID，由前端轮询进度
+            if request.args.get('background') == 'true':
+                job = export_jobs.submit('form_submissions', {
+                    'form_id': form_id,
+                    'args': request.args.to_dict(),
+                    'host_url': request.host_url
+                }, created_by=current_admin_id())
+                app.logger.info(f"📦 导出任务已排队: {job.id}")
+                return jsonify(export_job_payload(job)), 202
 
-            # 获取导出内容选项
-            include_submitter = request.args.get('includeSubmitterInfo', 'true') == 'true'
-            include_time = request.args.get('includeSubmissionTime', 'true') == 'true'
-            include_form_data = request.args.get('includeFormData', 'true') == 'true'
-            include_attachments = request.args.get('includeAttachments', 'true') == 'true'
+            chunks, filename, mimetype = build_form_export(form_obj, request.args.to_dict(), request.host_url)
+            return build_download_response(chunks, filename, mimetype)
 
-            # 获取状态筛选
-            status_filter = request.args.get('statusFilter', '')
+        except Exception as e:
+            app.logger.error(f"❌ 表单数据导出失败: {str(e)}", exc_info=True)
+            return jsonify({'error': f'导出失败: {str(e)}'}), 500
 
-            app.logger.info(f"📊 导出选项: format={format_type}, file_name={file_name}, include_submitter={include_submitter}")
+    def build_form_export(form_obj, args, host_url, progress=None):
+        """构建表单提交数据导出，返回(数据块迭代器, 文件名, MIME类型)"""
+        # 获取查询参数
+        format_type = args.get('format', 'excel')  # excel 或 csv 或 zip
+        file_name = args.get('fileName', f'{form_obj.title}_submissions')
 
-            # 构建查询
-            query = Submission.query.filter_by(form_id=form_id)
+        # 获取导出内容选项
+        include_submitter = args.get('includeSubmitterInfo', 'true') == 'true'
+        include_time = args.get('includeSubmissionTime', 'true') == 'true'
+        include_form_data = args.get('includeFormData', 'true') == 'true'
+        include_attachments = args.get('includeAttachments', 'true') == 'true'
 
-            # 应用状态筛选
-            if status_filter:
-                query = query.filter(Submission.status == status_filter)
-                app.logger.info(f"🔍 应用状态筛选: {status_filter}")
+        # 获取状态筛选
+        status_filter = args.get('statusFilter', '')
 
-            submissions = query.order_by(Submission.submitted_at.desc()).all()
-            app.logger.info(f"📝 查询到 {len(submissions)} 个提交记录")
+        app.logger.info(f"📊 导出选项: format={format_type}, file_name={file_name}, include_submitter={include_submitter}")
 
-            # 获取表单字段
-            fields = FormField.query.filter_by(form_id=form_id).order_by(FormField.order_index).all()
-            app.logger.info(f"📋 表单字段数量: {len(fields)}")
+        # 构建查询
+        query = Submission.query.filter_by(form_id=form_obj.id)
 
-            if format_type == 'csv':
-                app.logger.info("📄 开始生成CSV文件")
-                return export_csv(submissions, fields, file_name, include_submitter, include_time, include_form_data, include_attachments)
+        # 应用状态筛选
+        if status_filter:
+            query = query.filter(Submission.status == status_filter)
+            app.logger.info(f"🔍 应用状态筛选: {status_filter}")
 
-            elif format_type == 'zip':
-                app.logger.info("📦 开始生成ZIP打包文件")
-                return export_zip(form_obj, submissions, fields, file_name, include_submitter, include_time, include_form_data, include_attachments)
+        # 获取表单字段
+        fields = FormField.query.filter_by(form_id=form_obj.id).order_by(FormField.order_index).all()
+        app.logger.info(f"📋 表单字段数量: {len(fields)}")
 
-            else:
-                app.logger.info("📊 开始生成Excel文件")
-                return export_excel(form_obj, submissions, fields, file_name, include_submitter, include_time, include_form_data, include_attachments)
+        # 按批次分页读取提交记录，不一次性加载
+        total = query.count()
+        app.logger.info(f"📝 查询到 {total} 个提交记录")
+        if progress:
+            progress.set_total(total)
 
-        except Exception as e:
-            app.logger.error(f"❌ 表单数据导出失败: {str(e)}", exc_info=True)
-            return jsonify({'error': f'导出失败: {str(e)}'}), 500
+        options = (include_submitter, include_time, include_form_data, include_attachments)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
-    def export_csv(submissions, fields, file_name, include_submitter, include_time, include_form_data, include_attachments):
-        """导出CSV格式"""
-        output = io.StringIO()
-        writer = csv.writer(output)
+        if format_type == 'csv':
+            app.logger.info("📄 开始生成CSV文件")
+            chunks = iter_csv_export(query, fields, *options, host_url=host_url, progress=progress)
+            return chunks, f'{file_name}_{timestamp}.csv', 'text/csv; charset=utf-8'
 
-        # 构建表头
+        elif format_type == 'zip':
+            app.logger.info("📦 开始生成ZIP打包文件")
+            chunks = iter_zip_export(form_obj, query, fields, f'{file_name}_{timestamp}', *options, progress=progress)
+            return chunks, f'{file_name}_{timestamp}.zip', 'application/zip'
+
+        else:
+            app.logger.info("📊 开始生成Excel文件")
+            chunks = iter_excel_export(form_obj, query, fields, *options, host_url=host_url, progress=progress)
+            return chunks, f'{file_name}_{timestamp}.xlsx', XLSX_MIMETYPE
+
+    # 提交状态显示文本
+    submission_status_text = {
+        'submitted': '待审核',
+        'approved': '已通过',
+        'rejected': '已拒绝'
+    }
+
+    def build_submission_headers(fields, include_submitter, include_time, include_form_data, include_attachments):
+        """构建表单提交数据导出的表头"""
         headers = ['提交ID']
         if include_submitter:
             headers.extend(['提交者', '邮箱', '手机号'])
@@ -2597,330 +3001,159 @@ def create_app():
                 headers.append(field.field_label)
         if include_attachments:
             headers.append('附件信息')
+        return headers
 
-        writer.writerow(headers)
-        app.logger.info(f"📋 CSV表头: {headers}")
-
-        # 写入数据
-        for i, submission in enumerate(submissions):
-            try:
-                data_dict = submission.get_data_dict()
-
-                # 状态映射
-                status_map = {
-                    'submitted': '待审核',
-                    'approved': '已通过',
-                    'rejected': '已拒绝'
-                }
-
-                row = [submission.id]
-                if include_submitter:
-                    row.extend([
-                        submission.user.name if submission.user else '未知用户',
-                        submission.user.email or '未设置' if submission.user else '未设置',
-                        submission.user.phone or '未设置' if submission.user else '未设置'
-                    ])
-                if include_time:
-                    row.extend([
-                        submission.submitted_at.strftime('%Y-%m-%d %H:%M:%S'),
-                        status_map.get(submission.status, submission.status)
-                    ])
-                if include_form_data:
-                    for field in fields:
-                        field_value = data_dict.get(field.field_name, '')
-                        # 处理复选框数据
-                        if field.field_type == 'checkbox' and ',' in str(field_value):
-                            field_value = field_value.replace(',', '; ')
-                        row.append(field_value)
-                if include_attachments:
-                    # 构建附件信息（包含下载链接）
-                    attachment_info = []
-                    if submission.files:
-                        for file in submission.files:
-                            # 生成文件下载链接
-                            download_url = f"{request.host_url}uploads/{file.saved_filename}"
-                            file_info = f"{file.original_filename} ({download_url})"
-                            attachment_info.append(file_info)
-
-                    # 将附件信息合并为一个字符串
-                    attachment_text = '; '.join(attachment_info) if attachment_info else '无附件'
-                    row.append(attachment_text)
-
-                writer.writerow(row)
-
-                if (i + 1) % 100 == 0:  # 每100条记录记录一次日志
-                    app.logger.info(f"📝 已处理 {i + 1} 条记录")
-
-            except Exception as row_error:
-                app.logger.error(f"❌ 处理第 {i+1} 条记录时出错: {str(row_error)}", exc_info=True)
-                # 继续处理下一条记录，不中断整个导出过程
-                continue
-
-        # 创建响应
-        csv_content = output.getvalue()
-        # 添加BOM以支持中文编码
-        csv_content = '\ufeff' + csv_content
-        response = make_response(csv_content.encode('utf-8'))
-        response.headers['Content-Type'] = 'text/csv; charset=utf-8'
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f'{file_name}_{timestamp}.csv'
-        response.headers['Content-Disposition'] = encode_filename_for_http(filename)
-
-        app.logger.info(f"✅ CSV导出完成，文件名: {filename}, 大小: {len(csv_content)} bytes")
-        return response
-
-    def export_excel(form_obj, submissions, fields, file_name, include_submitter, include_time, include_form_data, include_attachments):
-        """导出Excel格式"""
-        wb = Workbook()
-        ws = wb.active
-        ws.title = f"{form_obj.title}提交数据"
-
-        # 设置表头样式
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-        header_alignment = Alignment(horizontal="center", vertical="center")
-
-        # 构建表头
-        headers = ['提交ID']
+    def build_submission_row(submission, fields, include_submitter, include_time, include_form_data):
+        """构建单条提交记录的导出行（不含附件信息列）"""
+        row = [submission.id]
         if include_submitter:
-            headers.extend(['提交者', '邮箱', '手机号'])
+            row.extend([
+                submission.user.name if submission.user else '未知用户',
+                submission.user.email or '未设置' if submission.user else '未设置',
+                submission.user.phone or '未设置' if submission.user else '未设置'
+            ])
         if include_time:
-            headers.extend(['提交时间', '状态'])
+            row.extend([
+                submission.submitted_at.strftime('%Y-%m-%d %H:%M:%S'),
+                submission_status_text.get(submission.status, submission.status)
+            ])
         if include_form_data:
+            data_dict = submission.get_data_dict()
             for field in fields:
-                headers.append(field.field_label)
-        if include_attachments:
-            headers.append('附件信息')
-
-        # 写入表头
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = header_alignment
-
-        app.logger.info(f"📋 Excel表头: {headers}")
-
-        # 写入提交数据
-        for row_num, submission in enumerate(submissions, 2):
-            try:
-                data_dict = submission.get_data_dict()
-
-                # 状态映射
-                status_map = {
-                    'submitted': '待审核',
-                    'approved': '已通过',
-                    'rejected': '已拒绝'
-                }
-
-                col = 1
-                ws.cell(row=row_num, column=col, value=submission.id)
-                col += 1
-
-                if include_submitter:
-                    ws.cell(row=row_num, column=col, value=submission.user.name if submission.user else '未知用户')
-                    ws.cell(row=row_num, column=col+1, value=submission.user.email or '未设置' if submission.user else '未设置')
-                    ws.cell(row=row_num, column=col+2, value=submission.user.phone or '未设置' if submission.user else '未设置')
-                    col += 3
-
-                if include_time:
-                    ws.cell(row=row_num, column=col, value=submission.submitted_at.strftime('%Y-%m-%d %H:%M:%S'))
-                    ws.cell(row=row_num, column=col+1, value=status_map.get(submission.status, submission.status))
-                    col += 2
-
-                if include_form_data:
-                    for field in fields:
-                        field_value = data_dict.get(field.field_name, '')
-                        # 处理复选框数据
-                        if field.field_type == 'checkbox' and ',' in str(field_value):
-                            field_value = field_value.replace(',', '; ')
-                        ws.cell(row=row_num, column=col, value=field_value)
-                        col += 1
-
-                if include_attachments:
-                    # 构建附件信息（包含下载链接）
-                    attachment_info = []
-                    if submission.files:
-                        for file in submission.files:
-                            # 生成文件下载链接
-                            download_url = f"{request.host_url}uploads/{file.saved_filename}"
-                            file_info = f"{file.original_filename} ({download_url})"
-                            attachment_info.append(file_info)
-
-                    # 将附件信息合并为一个字符串
-                    attachment_text = '; '.join(attachment_info) if attachment_info else '无附件'
-                    ws.cell(row=row_num, column=col, value=attachment_text)
-                    col += 1
-
-                if row_num % 100 == 1:  # 每100条记录记录一次日志
-                    app.logger.info(f"📝 已处理 {row_num - 1} 条Excel记录")
-
-            except Exception as row_error:
-                app.logger.error(f"❌ 处理Excel第 {row_num-1} 条记录时出错: {str(row_error)}", exc_info=True)
-                # 继续处理下一条记录
-                continue
-
-        # 调整列宽
-        for col in range(1, len(headers) + 1):
-            max_length = 0
-            column = ws.cell(row=1, column=col).column_letter
-            for row_cells in ws[column]:
+                field_value = data_dict.get(field.field_name, '')
+                # 处理复选框数据
+                if field.field_type == 'checkbox' and ',' in str(field_value):
+                    field_value = field_value.replace(',', '; ')
+                row.append(field_value)
+        return row
+
+    def build_attachment_links(submission, host_url):
+        """构建附件信息（包含下载链接）"""
+        attachment_info = []
+        if submission.files:
+            for file in submission.files:
+                # 生成文件下载链接
+                download_url = f"{host_url}uploads/{file.saved_filename}"
+                file_info = f"{file.original_filename} ({download_url})"
+                attachment_info.append(file_info)
+
+        # 将附件信息合并为一个字符串
+        return '; '.join(attachment_info) if attachment_info else '无附件'
+
+    def iter_submission_export_rows(submission_query, fields, include_submitter, include_time, include_form_data, include_attachments, host_url, progress=None):
+        """按键集分批遍历提交记录，逐行生成导出数据"""
+        processed = 0
+        for chunk in iter_submission_chunks(submission_query, sort_column=Submission.submitted_at):
+            for submission in chunk:
+                processed += 1
                 try:
-                    if len(str(row_cells.value)) > max_length:
-                        max_length = len(str(row_cells.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)  # 最大宽度50
-            ws.column_dimensions[column].width = max(adjusted_width, 10)  # 最小宽度10
-
-        # 保存到内存
-        output = io.BytesIO()
-        wb.save(output)
-        output.seek(0)
-
-        # 创建响应
-        response = make_response(output.read())
-        response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f'{file_name}_{timestamp}.xlsx'
-        response.headers['Content-Disposition'] = encode_filename_for_http(filename)
+                    row = build_submission_row(submission, fields, include_submitter, include_time, include_form_data)
+                    if include_attachments:
+                        row.append(build_attachment_links(submission, host_url))
 
-        app.logger.info(f"✅ Excel导出完成，文件名: {filename}")
-        return response
+                    yield row
+                    if progress:
+                        progress.advance()
 
+                    if processed % 100 == 0:  # 每100条记录记录一次日志
+                        app.logger.info(f"📝 已处理 {processed} 条记录")
 
+                except Exception as row_error:
+                    app.logger.error(f"❌ 处理第 {processed} 条记录时出错: {str(row_error)}", exc_info=True)
+                    # 继续处理下一条记录，不中断整个导出过程
+                    continue
 
-    def export_zip(form_obj, submissions, fields, file_name, include_submitter, include_time, include_form_data, include_attachments):
-        """导出ZIP打包格式（包含Excel文件和所有附件）"""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    def iter_csv_export(submission_query, fields, include_submitter, include_time, include_form_data, include_attachments, host_url, progress=None):
+        """生成CSV格式导出数据（逐块输出，内存占用与记录数无关）"""
+        headers = build_submission_headers(fields, include_submitter, include_time, include_form_data, include_attachments)
+        app.logger.info(f"📋 CSV表头: {headers}")
 
-        # 创建临时目录
-        temp_dir = os.path.join(upload_dir, f'temp_export_{timestamp}')
-        os.makedirs(temp_dir, exist_ok=True)
+        rows = iter_submission_export_rows(submission_query, fields, include_submitter, include_time,
+                                           include_form_data, include_attachments, host_url, progress)
+        yield from iter_csv_chunks(headers, rows)
+        app.logger.info("✅ CSV导出完成")
 
-        try:
-            # 首先生成Excel文件
-            wb = Workbook()
-            ws = wb.active
-            ws.title = f"{form_obj.title}提交数据"
-
-            # 设置表头样式
-            header_font = Font(bold=True, color="FFFFFF")
-            header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-            header_alignment = Alignment(horizontal="center", vertical="center")
-
-            # 构建表头
-            headers = ['提交ID']
-            if include_submitter:
-                headers.extend(['提交者', '邮箱', '手机号'])
-            if include_time:
-                headers.extend(['提交时间', '状态'])
-            if include_form_data:
-                for field in fields:
-                    headers.append(field.field_label)
-            if include_attachments:
-                headers.append('附件信息')
-
-            # 写入表头
-            for col, header in enumerate(headers, 1):
-                cell = ws.cell(row=1, column=col, value=header)
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.alignment = header_alignment
-
-            app.logger.info(f"📋 Excel表头: {headers}")
-
-            # 创建附件目录
-            attachments_dir = os.path.join(temp_dir, '附件')
-            os.makedirs(attachments_dir, exist_ok=True)
-
-            # 处理数据和附件
-            attachment_files = []
-            for row_num, submission in enumerate(submissions, 2):
-                try:
-                    data_dict = submission.get_data_dict()
+    def iter_excel_export(form_obj, submission_query, fields, include_submitter, include_time, include_form_data, include_attachments, host_url, progress=None):
+        """生成Excel格式导出数据（只写模式，生成结果暂存于临时文件）"""
+        headers = build_submission_headers(fields, include_submitter, include_time, include_form_data, include_attachments)
+        app.logger.info(f"📋 Excel表头: {headers}")
 
-                    # 状态映射
-                    status_map = {
-                        'submitted': '待审核',
-                        'approved': '已通过',
-                        'rejected': '已拒绝'
-                    }
+        rows = iter_submission_export_rows(submission_query, fields, include_submitter, include_time,
+                                           include_form_data, include_attachments, host_url, progress)
+        yield from iter_xlsx_export(f"{form_obj.title}提交数据", headers, rows)
+        app.logger.info("✅ Excel导出完成")
 
-                    col = 1
-                    ws.cell(row=row_num, column=col, value=submission.id)
-                    col += 1
+    def iter_zip_export(form_obj, submission_query, fields, base_name, include_submitter, include_time, include_form_data, include_attachments, progress=None):
+        """生成ZIP打包格式导出数据（包含Excel文件和所有附件）
 
-                    if include_submitter:
-                        ws.cell(row=row_num, column=col, value=submission.user.name if submission.user else '未知用户')
-                        ws.cell(row=row_num, column=col+1, value=submission.user.email or '未设置' if submission.user else '未设置')
-                        ws.cell(row=row_num, column=col+2, value=submission.user.phone or '未设置' if submission.user else '未设置')
-                        col += 3
+        附件直接从上传目录读入输出流，不复制到临时目录；
+        内存占用与附件总量无关。
+        """
+        excel_filename = f'{base_name}.xlsx'
 
-                    if include_time:
-                        ws.cell(row=row_num, column=col, value=submission.submitted_at.strftime('%Y-%m-%d %H:%M:%S'))
-                        ws.cell(row=row_num, column=col+1, value=status_map.get(submission.status, submission.status))
-                        col += 2
+        # 构建表头
+        headers = build_submission_headers(fields, include_submitter, include_time, include_form_data, include_attachments)
+        app.logger.info(f"📋 Excel表头: {headers}")
 
-                    if include_form_data:
-                        for field in fields:
-                            field_value = data_dict.get(field.field_name, '')
-                            # 处理复选框数据
-                            if field.field_type == 'checkbox' and ',' in str(field_value):
-                                field_value = field_value.replace(',', '; ')
-                            ws.cell(row=row_num, column=col, value=field_value)
-                            col += 1
+        zip_stream = ZipStreamWriter()
+        writer = XlsxStreamWriter(f"{form_obj.title}提交数据", headers)
+        attachment_count = 0
+        processed = 0
 
-                    if include_attachments:
-                        # 处理附件
-                        attachment_info = []
-                        if submission.files:
+        try:
+            for chunk in iter_submission_chunks(submission_query, sort_column=Submission.submitted_at):
+                for submission in chunk:
+                    processed += 1
+                    pending_files = []
+                    try:
+                        row = build_submission_row(submission, fields, include_submitter, include_time, include_form_data)
+
+                        if include_attachments:
+                            # 处理附件
+                            attachment_info = []
+                            used_names = set()
                             for file in submission.files:
-                                # 复制附件到临时目录
-                                source_path = os.path.join(upload_dir, file.saved_filename)
+                                source_path = upload_store.path(file.saved_filename)
                                 if os.path.exists(source_path):
                                     # 使用提交ID和原始文件名创建新文件名
                                     new_filename = f"提交{submission.id}_{file.original_filename}"
-                                    dest_path = os.path.join(attachments_dir, new_filename)
-                                    shutil.copy2(source_path, dest_path)
-                                    attachment_files.append(new_filename)
+                                    if new_filename in used_names:
+                                        new_filename = f"提交{submission.id}_{file.id}_{file.original_filename}"
+                                    used_names.add(new_filename)
+                                    pending_files.append((source_path, f"附件/{new_filename}"))
                                     attachment_info.append(f"{file.original_filename} -> 附件/{new_filename}")
-                                    app.logger.info(f"📁 复制附件: {file.original_filename} -> {new_filename}")
                                 else:
                                     app.logger.warning(f"⚠️ 附件不存在: {source_path}")
                                     attachment_info.append(f"{file.original_filename} (文件丢失)")
 
-                        # 将附件信息合并为一个字符串
-                        attachment_text = '; '.join(attachment_info) if attachment_info else '无附件'
-                        ws.cell(row=row_num, column=col, value=attachment_text)
-                        col += 1
+                            # 将附件信息合并为一个字符串
+                            attachment_text = '; '.join(attachment_info) if attachment_info else '无附件'
+                            row.append(attachment_text)
 
-                    if row_num % 100 == 1:  # 每100条记录记录一次日志
-                        app.logger.info(f"📝 已处理 {row_num - 1} 条Excel记录")
+                        writer.append(row)
+                        if progress:
+                            progress.advance()
 
-                except Exception as row_error:
-                    app.logger.error(f"❌ 处理Excel第 {row_num-1} 条记录时出错: {str(row_error)}", exc_info=True)
-                    # 继续处理下一条记录
-                    continue
+                        if processed % 100 == 0:  # 每100条记录记录一次日志
+                            app.logger.info(f"📝 已处理 {processed} 条Excel记录")
 
-            # 调整列宽
-            for col in range(1, len(headers) + 1):
-                max_length = 0
-                column = ws.cell(row=1, column=col).column_letter
-                for row_cells in ws[column]:
-                    try:
-                        if len(str(row_cells.value)) > max_length:
-                            max_length = len(str(row_cells.value))
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)  # 最大宽度50
-                ws.column_dimensions[column].width = max(adjusted_width, 10)  # 最小宽度10
-
-            # 保存Excel文件
-            excel_filename = f'{file_name}_{timestamp}.xlsx'
-            excel_path = os.path.join(temp_dir, excel_filename)
-            wb.save(excel_path)
-            app.logger.info(f"✅ Excel文件保存完成: {excel_filename}")
+                    except Exception as row_error:
+                        app.logger.error(f"❌ 处理Excel第 {processed} 条记录时出错: {str(row_error)}", exc_info=True)
+                        # 继续处理下一条记录
+                        continue
+
+                    # 附件直接从上传目录写入ZIP流
+                    for source_path, arc_name in pending_files:
+                        yield from zip_stream.write_file(source_path, arc_name)
+                        attachment_count += 1
+
+            # 写入Excel文件
+            excel_file = writer.save()
+            try:
+                yield from zip_stream.write_fileobj(excel_file, excel_filename)
+            finally:
+                excel_file.close()
+            app.logger.info(f"✅ Excel文件写入完成: {excel_filename}")
 
             # 创建说明文件
             readme_content = f"""导出说明
@@ -2928,8 +3161,8 @@ def create_app():
 
 表单名称: {form_obj.title}
 导出时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-提交记录数: {len(submissions)}
-附件数量: {len(attachment_files)}
+提交记录数: {processed}
+附件数量: {attachment_count}
 
 文件说明:
 - {excel_filename}: 表单提交数据（Excel格式）
@@ -2939,54 +3172,60 @@ def create_app():
 - 请维护文件完整性，不要随意修改文件名
 - 附件文件名中的提交ID与Excel表中的提交ID对应
 """
-            readme_path = os.path.join(temp_dir, '说明.txt')
-            with open(readme_path, 'w', encoding='utf-8') as f:
-                f.write(readme_content)
-
-            # 创建ZIP文件
-            zip_filename = f'{file_name}_{timestamp}.zip'
-            zip_path = os.path.join(upload_dir, zip_filename)
-
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                # 添加Excel文件
-                zipf.write(excel_path, excel_filename)
-                # 添加说明文件
-                zipf.write(readme_path, '说明.txt')
-                # 添加附件目录
-                for root, dirs, files in os.walk(attachments_dir):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        arc_name = os.path.join('附件', file)
-                        zipf.write(file_path, arc_name)
-
-            app.logger.info(f"📁 ZIP文件创建完成: {zip_filename}")
+            yield from zip_stream.write_bytes('说明.txt', readme_content.encode('utf-8'))
+            yield from zip_stream.close()
 
-            # 清理临时文件
-            shutil.rmtree(temp_dir)
-            app.logger.info(f"🧹 临时文件已清理: {temp_dir}")
+            app.logger.info(f"✅ ZIP导出完成，记录数: {processed}, 附件数: {attachment_count}")
 
-            # 返回ZIP文件
-            with open(zip_path, 'rb') as f:
-                zip_data = f.read()
+        except Exception as zip_error:
+            app.logger.error(f"❌ ZIP导出失败: {str(zip_error)}", exc_info=True)
+            raise
+        finally:
+            writer.close()
 
-            # 删除临时ZIP文件
-            os.remove(zip_path)
+    def run_form_export_job(params, progress):
+        form_obj = Form.query.get(params['form_id'])
+        if not form_obj:
+            raise ValueError(f"表单ID {params['form_id']} 不存在")
+        return build_form_export(form_obj, params['args'], params['host_url'], progress)
 
-            response = make_response(zip_data)
-            response.headers['Content-Type'] = 'application/zip'
-            response.headers['Content-Disposition'] = encode_filename_for_http(zip_filename)
+    export_jobs.register('form_submissions', run_form_export_job)
+    export_jobs.register('users', lambda params, progress: build_users_export(params['args'], progress))
+    export_jobs.register('system', lambda params, progress: build_system_export(
+        params['type'], params['format'], params['admin_email'], progress))
 
-            app.logger.info(f"✅ ZIP导出完成，文件名: {zip_filename}, 大小: {len(zip_data)} bytes")
-            return response
+    @app.route('/admin/export/jobs/<job_id>')
+    @login_required
+    def admin_export_job_status(job_id):
+        """查询后台导出任务进度"""
+        if not current_user.get_id().startswith('admin_'):
+            return jsonify({'error': '无权访问'}), 403
 
-        except Exception as zip_error:
-            app.logger.error(f"❌ ZIP导出失败: {str(zip_error)}", exc_info=True)
-            # 清理临时文件
-            if os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
-            if 'zip_path' in locals() and os.path.exists(zip_path):
-                os.remove(zip_path)
+        job = db.session.get(ExportJob, job_id)
+        if not job:
+            return jsonify({'error': '导出任务不存在或已过期'}), 404
+        return jsonify(export_job_payload(job))
+
+    @app.route('/admin/export/jobs/<job_id>/download')
+    @login_required
+    def admin_export_job_download(job_id):
+        """下载后台导出结果，支持Range断点续传"""
+        if not current_user.get_id().startswith('admin_'):
+            return jsonify({'error': '无权访问'}), 403
 
+        job = db.session.get(ExportJob, job_id)
+        if not job:
+            return jsonify({'error': '导出任务不存在或已过期'}), 404
+        if job.status != 'completed':
+            return jsonify({'error': '导出任务尚未完成', 'status': job.status}), 409
+        if not job.output_path or not os.path.exists(job.output_path):
+            return jsonify({'error': '导出文件已过期，请重新导出'}), 410
+
+        response = send_file(job.output_path, mimetype=job.output_mimetype, as_attachment=True,
+                             download_name=job.output_filename, conditional=True)
+        # 完整下载时也声明支持Range，下载工具中断后可以续传
+        response.headers['Accept-Ranges'] = 'bytes'
+        return response
 
     @app.route('/admin/forms/<int:form_id>/delete', methods=['DELETE', 'POST'])
     @login_required
@@ -2998,20 +3237,15 @@ def create_app():
         try:
             form_obj = Form.query.get_or_404(form_id)
 
-            # 删除相关的上传文件
-            submissions = Submission.query.filter_by(form_id=form_id).all()
-            for submission in submissions:
-                for upload_file in submission.files:
-                    file_path = os.path.join(upload_dir, upload_file.saved_filename)
-                    if os.path.exists(file_path):
-                        try:
-                            os.remove(file_path)
-                        except Exception as e:
-                            app.logger.warning(f"删除文件失败 {file_path}: {str(e)}")
+            # 释放相关的上传文件（其他提交仍引用的文件保留）
+            upload_files = UploadFile.query.join(Submission).filter(Submission.form_id == form_id).all()
+            released = upload_store.release(db.session.connection(), upload_files)
 
             # 删除表单（由于设置了cascade，相关的字段、提交记录、提交数据和上传文件记录会自动删除）
             db.session.delete(form_obj)
             db.session.commit()
+            upload_store.purge(released)
+            forget_form(form_id)
 
             if request.is_json:
                 return jsonify({'success': True, 'message': '表单删除成功'})
@@ -3083,19 +3317,14 @@ def create_app():
             user_name = submission.user.name if submission.user else '未知用户'
             form_title = submission.form.title if submission.form else '未知表单'
             
-            # 删除相关的上传文件
-            for upload_file in submission.files:
-                file_path = os.path.join(upload_dir, upload_file.saved_filename)
-                if os.path.exists(file_path):
-                    try:
-                        os.remove(file_path)
-                        app.logger.info(f"已删除文件: {file_path}")
-                    except Exception as e:
-                        app.logger.warning(f"删除文件失败 {file_path}: {str(e)}")
+            # 释放相关的上传文件（其他提交仍引用的文件保留）
+            released = upload_store.release(db.session.connection(), submission.files)
 
             # 删除提交记录（SQLAlchemy会自动删除相关的提交数据和上传文件记录，因为设置了cascade）
             db.session.delete(submission)
             db.session.commit()
+            removed = upload_store.purge(released)
+            app.logger.info(f"提交记录 #{submission_id} 的附件已释放，删除文件 {removed} 个")
 
             app.logger.info(f"管理员 {current_user.email} 删除了提交记录 #{submission_id} (用户: {user_name}, 表单: {form_title})")
 
@@ -3128,19 +3357,13 @@ def create_app():
             if len(submissions) != len(submission_ids):
                 return jsonify({'error': '部分提交记录不存在'}), 400
 
+            # 一次释放全部附件的引用（其他提交仍引用的文件保留）
+            upload_files = UploadFile.query.filter(UploadFile.submission_id.in_(submission_ids)).all()
+            released = upload_store.release(db.session.connection(), upload_files)
+
             deleted_count = 0
             for submission in submissions:
                 try:
-                    # 删除相关的上传文件
-                    for upload_file in submission.files:
-                        file_path = os.path.join(upload_dir, upload_file.saved_filename)
-                        if os.path.exists(file_path):
-                            try:
-                                os.remove(file_path)
-                                app.logger.info(f"已删除文件: {file_path}")
-                            except Exception as e:
-                                app.logger.warning(f"删除文件失败 {file_path}: {str(e)}")
-
                     # 删除提交记录
                     db.session.delete(submission)
                     deleted_count += 1
@@ -3148,6 +3371,8 @@ def create_app():
                     app.logger.error(f"删除提交记录 #{submission.id} 失败: {str(e)}")
 
             db.session.commit()
+            removed = upload_store.purge(released)
+            app.logger.info(f"批量删除提交记录的附件已释放，删除文件 {removed} 个")
 
             app.logger.info(f"管理员 {current_user.email} 批量删除了 {deleted_count} 个提交记录")
 
@@ -3175,6 +3400,7 @@ def create_app():
             # 切换状态
             user.is_active = not user.is_active
             db.session.commit()
+            principal_cache.invalidate()
 
             return jsonify({
                 'success': True,
@@ -3202,33 +3428,35 @@ def create_app():
             if not user_ids:
                 return jsonify({'error': '请选择要操作的用户'}), 400
 
+            released = None
             if action == 'activate':
-                # 批量启用用户
-                User.query.filter(User.id.in_(user_ids)).update({'is_active': True}, synchronize_session=False)
+                # 批量启用用户（批量更新不经过会话事件，按实际变更数调整计数器）
+                changed = User.query.filter(User.id.in_(user_ids)).filter_by(is_active=False).update(
+                    {'is_active': True}, synchronize_session=False)
+                adjust_counters({'users.active': changed})
                 message = f'已成功启用 {len(user_ids)} 个用户'
             elif action == 'deactivate':
                 # 批量禁用用户
-                User.query.filter(User.id.in_(user_ids)).update({'is_active': False}, synchronize_session=False)
+                changed = User.query.filter(User.id.in_(user_ids)).filter_by(is_active=True).update(
+                    {'is_active': False}, synchronize_session=False)
+                adjust_counters({'users.active': -changed})
                 message = f'已成功禁用 {len(user_ids)} 个用户'
             elif action == 'delete':
                 # 批量删除用户（注意：这是危险操作）
                 users = User.query.filter(User.id.in_(user_ids)).all()
+                # 释放用户全部提交的附件（其他用户仍引用的文件保留）
+                upload_files = UploadFile.query.join(Submission).filter(Submission.user_id.in_(user_ids)).all()
+                released = upload_store.release(db.session.connection(), upload_files)
                 for user in users:
-                    # 删除用户的所有提交记录和相关文件
-                    for submission in user.submissions:
-                        for upload_file in submission.files:
-                            file_path = os.path.join(upload_dir, upload_file.saved_filename)
-                            if os.path.exists(file_path):
-                                try:
-                                    os.remove(file_path)
-                                except Exception as e:
-                                    app.logger.warning(f"删除文件失败 {file_path}: {str(e)}")
                     db.session.delete(user)
                 message = f'已成功删除 {len(user_ids)} 个用户'
             else:
                 return jsonify({'error': '无效的操作类型'}), 400
 
             db.session.commit()
+            if released is not None:
+                upload_store.purge(released)
+            principal_cache.invalidate()
 
             return jsonify({
                 'success': True,
@@ -3246,7 +3474,9 @@ def create_app():
     @login_required
     def uploaded_file(filename):
         from flask import send_from_directory
-        return send_from_directory(upload_dir, filename)
+        # 内容寻址的文件在分片目录中且没有扩展名，MIME类型按链接中的文件名判断
+        return send_from_directory(upload_dir, upload_store.relpath(filename),
+                                   mimetype=mimetypes.guess_type(filename)[0])
 
     # API路由
     @app.route('/api/user/profile', methods=['POST'])
@@ -3258,6 +3488,7 @@ def create_app():
 
         try:
             data = request.get_json() if request.is_json else request.form
+            user = User.query.get_or_404(current_user.id)
 
             # 获取表单数据
             name = data.get('name', '').strip()
@@ -3300,7 +3531,7 @@ def create_app():
                 if not current_password:
                     return jsonify({'error': '请输入当前密码'}), 400
 
-                if not current_user.check_password(current_password):
+                if not user.check_password(current_password):
                     return jsonify({'error': '当前密码错误'}), 400
 
                 if new_password != confirm_password:
@@ -3310,15 +3541,16 @@ def create_app():
                     return jsonify({'error': '密码长度不能少于6位'}), 400
 
             # 更新用户信息
-            current_user.name = name
-            current_user.email = email if email else None
-            current_user.phone = phone if phone else None
+            user.name = name
+            user.email = email if email else None
+            user.phone = phone if phone else None
 
             # 如果要修改密码
             if new_password:
-                current_user.set_password(new_password)
+                user.set_password(new_password)
 
             db.session.commit()
+            principal_cache.invalidate()
 
             app.logger.info(f"👤 用户 {current_user.id} 更新个人资料成功")
 
@@ -3326,9 +3558,9 @@ def create_app():
                 'success': True,
                 'message': '个人信息更新成功！',
                 'user': {
-                    'name': current_user.name,
-                    'email': current_user.email,
-                    'phone': current_user.phone
+                    'name': user.name,
+                    'email': user.email,
+                    'phone': user.phone
                 }
             })
 
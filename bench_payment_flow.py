@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+支付全流程压测
+在本进程中启动应用和本地模拟支付网关（fake_gateway.py），多个并发用户各自重复：
+提交带支付字段的表单 → 发起支付（网关下单） → 模拟付款（网关发送异步通知） → 轮询支付状态直到已支付，
+统计每秒完成的支付数和各阶段的p50/p99耗时
+
+用法: python bench_payment_flow.py [--users 20] [--rounds 5] [--payment-type mixed]
+                                   [--latency-ms 50] [--jitter-ms 20] [--failure-rate 0.05]
+                                   [--notify-delay-ms 100] [--duplicate-notifies 1] [--database-url URL]
+默认使用临时目录中的SQLite文件数据库
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+STAGES = ('submit', 'create', 'confirm', 'total')
+STAGE_LABELS = {'submit': '提交表单', 'create': '发起支付', 'confirm': '付款到确认', 'total': '全流程'}
+PASSWORD = 'bench-password'
+CONFIRM_TIMEOUT_SECONDS = 30
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class FlowError(Exception):
+    def __init__(self, stage, message):
+        super().__init__(message)
+        self.stage = stage
+
+
+def prepare_data(db, users):
+    """创建管理员、微信和支付宝各一个支付表单以及压测用户，返回({支付方式: 表单ID}, 用户邮箱列表)"""
+    from werkzeug.security import generate_password_hash
+    from models import Admin, Form, FormField, User
+
+    # 压测用户使用低迭代次数的密码哈希，避免登录时的哈希计算掩盖支付流程耗时
+    password_hash = generate_password_hash(PASSWORD, method='pbkdf2:sha256:1000')
+    admin = Admin(name='压测管理员', email='bench-admin@test.com', password_hash=password_hash)
+    db.session.add(admin)
+    db.session.flush()
+    form_ids = {}
+    for payment_type, field_type in (('wechat', 'wechat_pay'), ('alipay', 'alipay')):
+        form = Form(title=f'压测支付表单（{payment_type}）', created_by=admin.id, allow_multiple_submissions=True)
+        db.session.add(form)
+        db.session.flush()
+        db.session.add(FormField(form_id=form.id, field_name='fee', field_label='报名费', field_type=field_type))
+        form_ids[payment_type] = form.id
+    emails = [f'bench{i}@test.com' for i in range(users)]
+    db.session.add_all([User(name=f'压测用户{i}', email=email, password_hash=password_hash)
+                        for i, email in enumerate(emails)])
+    db.session.commit()
+    return form_ids, emails
+
+
+class VirtualUser:
+    """一个压测用户：独立会话，按顺序完成若干次支付"""
+
+    def __init__(self, app_url, gateway, form_ids, email, payment_types, poll_seconds, results):
+        self.app_url = app_url
+        self.gateway = gateway
+        self.form_ids = form_ids
+        self.email = email
+        self.payment_types = payment_types
+        self.poll_seconds = poll_seconds
+        self.results = results
+        self.http = requests.Session()
+
+    def login(self):
+        response = self.http.post(f'{self.app_url}/login', data={'login_id': self.email, 'password': PASSWORD},
+                                  allow_redirects=False)
+        if response.status_code != 302:
+            raise FlowError('login', f'登录失败: HTTP {response.status_code}')
+
+    def run(self):
+        try:
+            self.login()
+        except (FlowError, requests.RequestException) as e:
+            self.results.append({'error': 'login', 'message': str(e)})
+            return
+        for payment_type in self.payment_types:
+            try:
+                self.results.append(self.pay_once(payment_type))
+            except FlowError as e:
+                self.results.append({'error': e.stage, 'message': str(e)})
+            except requests.RequestException as e:
+                self.results.append({'error': 'http', 'message': str(e)})
+
+    def pay_once(self, payment_type):
+        timings = {}
+        started = time.perf_counter()
+
+        # 提交表单，跳转到支付页面
+        response = self.http.post(f'{self.app_url}/form/{self.form_ids[payment_type]}', data={'fee': '9.90'})
+        match = re.search(rf'/payment/process/(\d+)/{payment_type}', response.text)
+        if not match:
+            raise FlowError('submit', f'提交后未进入支付页面: HTTP {response.status_code} {response.url}')
+        order_id = match.group(1)
+        timings['submit'] = time.perf_counter() - started
+
+        # 发起支付：应用调用网关下单
+        stage_started = time.perf_counter()
+        response = self.http.get(f'{self.app_url}/payment/process/{order_id}/{payment_type}', allow_redirects=False)
+        if payment_type == 'wechat':
+            match = re.search(r'<code>(\w+)</code>', response.text)
+            if response.status_code != 200 or not match:
+                raise FlowError('create', f'微信下单失败: HTTP {response.status_code}')
+            order_no = match.group(1)
+        else:
+            location = response.headers.get('Location', '')
+            if not location.startswith(self.gateway.base_url):
+                raise FlowError('create', f'支付宝下单失败: HTTP {response.status_code} {location}')
+            # 跳转到收银台
+            order_no = requests.get(location).json()['out_trade_no']
+        timings['create'] = time.perf_counter() - stage_started
+
+        # 用户付款，网关异步通知；页面轮询支付状态
+        stage_started = time.perf_counter()
+        if requests.post(self.gateway.pay_url(order_no)).status_code != 200:
+            raise FlowError('confirm', f'网关中没有订单 {order_no}')
+        deadline = stage_started + CONFIRM_TIMEOUT_SECONDS
+        while True:
+            data = self.http.get(f'{self.app_url}/payment/query/{order_id}').json()
+            if data.get('status') == 'paid':
+                break
+            if time.perf_counter() > deadline:
+                raise FlowError('confirm', f'订单{order_no}未在{CONFIRM_TIMEOUT_SECONDS}秒内确认支付')
+            time.sleep(self.poll_seconds)
+        now = time.perf_counter()
+        timings['confirm'] = now - stage_started
+        timings['total'] = now - started
+        return timings
+
+
+def report(results, elapsed, gateway, processor):
+    completed = [result for result in results if 'error' not in result]
+    errors = {}
+    for result in results:
+        if 'error' in result:
+            errors[result['error']] = errors.get(result['error'], 0) + 1
+
+    print(f"完成 {len(completed)} 次支付，失败 {len(results) - len(completed)} 次，用时 {elapsed:.2f} 秒，"
+          f"吞吐量 {len(completed) / elapsed:.1f} 次/秒")
+    print(f"{'阶段':<10}{'p50(ms)':>10}{'p99(ms)':>10}{'最大(ms)':>10}")
+    for stage in STAGES:
+        values = [result[stage] * 1000 for result in completed]
+        print(f"{STAGE_LABELS[stage]:<10}{percentile(values, 0.5):>10.1f}{percentile(values, 0.99):>10.1f}"
+              f"{max(values, default=0):>10.1f}")
+    if errors:
+        print(f"失败阶段: {errors}")
+        samples = [result['message'] for result in results if 'error' in result][:3]
+        for message in samples:
+            print(f"  - {message}")
+
+    print(f"模拟网关: {gateway.stats()}")
+    for name, call in processor.gateway_stats()['calls'].items():
+        print(f"应用侧 {name}: 次数{call['count']} p50 {call['p50_ms']}ms p99 {call['p99_ms']}ms {call['outcomes']}")
+
+
+def run(args, database_url):
+    os.environ['DATABASE_URL'] = database_url
+    import logging
+    from werkzeug.serving import make_server
+
+    from app import create_app
+    from fake_gateway import FakePaymentGateway
+    from models import db, PaymentCallback, PaymentOrder
+    from payment_config import get_payment_processor
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.logger.setLevel(logging.WARNING)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        form_ids, emails = prepare_data(db, args.users)
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    app_url = f'http://127.0.0.1:{server.server_port}'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    gateway = FakePaymentGateway(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                 failure_rate=args.failure_rate, notify_delay_ms=args.notify_delay_ms,
+                                 duplicate_notifies=args.duplicate_notifies, seed=1)
+    processor = get_payment_processor()
+    processor.wechat_config.notify_url = f'{app_url}/payment/wechat/notify'
+    processor.alipay_config.notify_url = f'{app_url}/payment/alipay/notify'
+
+    with gateway:
+        gateway.configure(processor)
+        print(f"数据库: {database_url}，{args.users} 个并发用户 × {args.rounds} 次支付（{args.payment_type}），"
+              f"网关耗时 {args.latency_ms}±{args.jitter_ms}ms，失败率 {args.failure_rate:.0%}，"
+              f"重复通知 {args.duplicate_notifies} 次")
+
+        results = []
+        users = []
+        for i, email in enumerate(emails):
+            if args.payment_type == 'mixed':
+                types = ['wechat' if (i + n) % 2 == 0 else 'alipay' for n in range(args.rounds)]
+            else:
+                types = [args.payment_type] * args.rounds
+            users.append(VirtualUser(app_url, gateway, form_ids, email, types, args.poll_ms / 1000, results))
+
+        threads = [threading.Thread(target=user.run) for user in users]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        # 等待剩余的重复通知发送完
+        time.sleep(0.5)
+        report(results, elapsed, gateway, processor)
+
+    with app.app_context():
+        paid = PaymentOrder.query.filter_by(status='paid').count()
+        print(f"数据库: 已支付订单 {paid}，回调记录 {PaymentCallback.query.count()}")
+        db.session.remove()
+    server.shutdown()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='支付全流程压测')
+    parser.add_argument('--users', type=int, default=20, help='并发用户数')
+    parser.add_argument('--rounds', type=int, default=5, help='每个用户的支付次数')
+    parser.add_argument('--payment-type', choices=('wechat', 'alipay', 'mixed'), default='mixed')
+    parser.add_argument('--latency-ms', type=float, default=50, help='网关接口耗时')
+    parser.add_argument('--jitter-ms', type=float, default=20, help='网关接口耗时抖动')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='网关接口失败率（返回503）')
+    parser.add_argument('--notify-delay-ms', type=float, default=100, help='付款后延迟多久发送异步通知')
+    parser.add_argument('--duplicate-notifies', type=int, default=1, help='每笔付款额外发送的重复通知次数')
+    parser.add_argument('--poll-ms', type=float, default=200, help='支付状态轮询间隔')
+    parser.add_argument('--database-url', help='数据库URL，默认临时SQLite文件')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    if args.database_url:
+        run(args, args.database_url)
+    else:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            run(args, 'sqlite:///' + os.path.join(tmpdir, 'bench.db'))
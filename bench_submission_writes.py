@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+表单提交写入性能测试
+对比逐个session.add()的ORM写入与SubmissionWriter批量写入在不同字段数下的每秒提交数
+
+用法: python bench_submission_writes.py [每组提交次数] [数据库URL]
+默认使用临时目录中的SQLite文件数据库
+"""
+import os
+import sys
+import tempfile
+import time
+
+from flask import Flask
+
+from config import Config
+from models import db, User, Admin, Form, Submission, SubmissionData
+from stats_counters import register_counter_events
+from submission_storage import STORAGE_EAV, STORAGE_JSON, SubmissionWriter
+
+FIELD_COUNTS = (10, 50, 200)
+
+
+def create_bench_app(database_url):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = Config.SQLALCHEMY_ENGINE_OPTIONS
+    db.init_app(app)
+    return app
+
+
+def orm_write(form_id, user_id, values):
+    """原写入方式：提交记录flush取ID后逐个add字段数据"""
+    submission = Submission(form_id=form_id, user_id=user_id)
+    db.session.add(submission)
+    db.session.flush()
+    for field_name, field_value in values.items():
+        db.session.add(SubmissionData(submission_id=submission.id, field_name=field_name, field_value=field_value))
+    db.session.commit()
+
+
+def writer_write(mode):
+    def write(form_id, user_id, values):
+        writer = SubmissionWriter(form_id, user_id, mode)
+        for field_name, field_value in values.items():
+            writer.add_value(field_name, field_value)
+        writer.write(db.session.connection())
+        db.session.commit()
+    return write
+
+
+def measure(write, form_id, user_id, field_count, rounds):
+    values = {f'field_{i}': f'第{i}项的填写内容' for i in range(field_count)}
+    write(form_id, user_id, values)  # 预热
+    start = time.perf_counter()
+    for _ in range(rounds):
+        write(form_id, user_id, values)
+    return rounds / (time.perf_counter() - start)
+
+
+def run(rounds, database_url):
+    app = create_bench_app(database_url)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        register_counter_events()
+
+        admin = Admin(name="测试管理员", email="admin@test.com", password_hash="test")
+        user = User(name="测试用户", email="user@test.com", password_hash="test")
+        db.session.add_all([admin, user])
+        db.session.flush()
+        form = Form(title="性能测试表单", created_by=admin.id, allow_multiple_submissions=True)
+        db.session.add(form)
+        db.session.commit()
+        form_id, user_id = form.id, user.id
+
+        methods = [('ORM逐个写入', orm_write),
+                   ('批量写入(EAV)', writer_write(STORAGE_EAV)),
+                   ('批量写入(JSON)', writer_write(STORAGE_JSON))]
+
+        print(f"数据库: {db.engine.url.render_as_string(hide_password=True)}，每组 {rounds} 次提交")
+        print(f"{'字段数':>6} " + ' '.join(f'{name:>14}' for name, _ in methods) + '   (提交/秒)')
+        for field_count in FIELD_COUNTS:
+            rates = [measure(write, form_id, user_id, field_count, rounds) for _, write in methods]
+            print(f"{field_count:>6} " + ' '.join(f'{rate:>14.1f}' for rate in rates))
+        db.session.remove()
+
+
+if __name__ == '__main__':
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    if len(sys.argv) > 2:
+        run(rounds, sys.argv[2])
+    else:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            run(rounds, 'sqlite:///' + os.path.join(tmpdir, 'bench.db'))
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+分块、可续传的附件上传
+普通表单提交要等Werkzeug缓冲完整个multipart请求体之后才能检查文件大小，大视频会长时间占用同步工作进程，
+超过限制的文件也要整个写完才被拒绝。分块上传参考tus协议：
+- 创建上传时声明文件名和大小，格式不支持或超过MAX_CONTENT_LENGTH时立即拒绝
+- 每块请求携带Upload-Offset请求头，请求体直接流式写入暂存文件；每块不超过UPLOAD_CHUNK_MAX_BYTES，
+  偏移量必须等于已接收的字节数，写入后才推进已接收字节数
+- 连接中断时已收到的字节保留，客户端查询已接收的字节数后从该位置继续上传
+- 提交表单时文件字段附带上传ID，暂存文件登记到附件存储并写入UploadFile记录，与提交在同一事务中
+- 超过UPLOAD_SESSION_EXPIRE_SECONDS未更新的上传由后台线程清理
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+from werkzeug.exceptions import ClientDisconnected
+
+from models import db, UploadSession
+from stats_counters import claim_periodic_run
+
+try:
+    import fcntl
+except ImportError:  # Windows开发环境不加锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 记录上次清理时间的计数器（以下划线开头，不参与统计校准）
+CLEANUP_MARKER = '_upload_sessions_cleaned_at'
+COPY_BUFFER_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """上传请求无效，status为返回的HTTP状态码"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class ChunkedUploads:
+    """分块上传扩展：管理上传会话和暂存文件"""
+
+    POLL_SECONDS = 60
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.staging_dir = os.path.join(app.instance_path, app.config['UPLOAD_STAGING_FOLDER'])
+        self.max_size = app.config['MAX_CONTENT_LENGTH']
+        self.chunk_max_bytes = app.config['UPLOAD_CHUNK_MAX_BYTES']
+        self.expire_seconds = app.config['UPLOAD_SESSION_EXPIRE_SECONDS']
+        self.allowed_extensions = app.config['ALLOWED_EXTENSIONS']
+        os.makedirs(self.staging_dir, exist_ok=True)
+        app.extensions['chunked_uploads'] = self
+
+    def ensure_started(self):
+        """确保当前进程的清理线程已启动（按进程号延迟启动，兼容preload_app）"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            thread = threading.Thread(target=self._cleanup_loop, name='upload-cleaner', daemon=True)
+            thread.start()
+
+    def _cleanup_loop(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    if claim_periodic_run(CLEANUP_MARKER, self.POLL_SECONDS):
+                        removed = self.cleanup_expired()
+                        if removed:
+                            logger.info(f"已清理 {removed} 个过期的分块上传")
+                    db.session.remove()
+            except Exception as e:
+                logger.error(f"清理过期分块上传失败: {str(e)}", exc_info=True)
+
+            time.sleep(self.POLL_SECONDS)
+
+    def staging_path(self, upload_id):
+        return os.path.join(self.staging_dir, f'{upload_id}.part')
+
+    def create(self, user_id, form_id, field_name, filename, size, file_type=None):
+        """声明一个新的上传，校验格式和大小后创建空的暂存文件"""
+        if not filename or '.' not in filename or \
+                filename.rsplit('.', 1)[1].lower() not in self.allowed_extensions:
+            raise UploadError('不支持的文件格式')
+        if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+            raise UploadError('文件大小无效')
+        if size > self.max_size:
+            raise UploadError(f"文件大小超过限制 {self.max_size/1024/1024:.0f}MB", 413)
+
+        session = UploadSession(id=uuid.uuid4().hex, user_id=user_id, form_id=form_id, field_name=field_name,
+                                original_filename=filename, file_type=file_type or 'application/octet-stream',
+                                total_size=size, received_size=0)
+        open(self.staging_path(session.id), 'wb').close()
+        db.session.add(session)
+        db.session.commit()
+        return session
+
+    def get(self, upload_id, user_id):
+        """返回该用户的上传会话，不存在时为None"""
+        session = db.session.get(UploadSession, upload_id)
+        if session is None or session.user_id != user_id:
+            return None
+        return session
+
+    def write_chunk(self, session, offset, stream, length):
+        """将请求体写入暂存文件的offset处，返回已接收的字节数
+
+        连接中断时保留已收到的部分并推进已接收字节数，然后抛出UploadError，客户端从新的位置继续。
+        """
+        if offset != session.received_size:
+            raise UploadError(f'偏移量不匹配，已接收 {session.received_size} 字节', 409)
+        if length is None:
+            raise UploadError('缺少Content-Length', 411)
+        if length > self.chunk_max_bytes:
+            raise UploadError(f'分块大小超过限制 {self.chunk_max_bytes} 字节', 413)
+        if offset + length > session.total_size:
+            raise UploadError('写入范围超过声明的文件大小', 413)
+
+        try:
+            staging = open(self.staging_path(session.id), 'r+b')
+        except FileNotFoundError:
+            raise UploadError('上传已过期，请重新上传', 410)
+
+        with staging:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(staging, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise UploadError('该文件的另一分块正在写入', 409)
+            # 加锁后重新读取已接收字节数，防止并发请求从同一位置重复写入
+            db.session.refresh(session)
+            if offset != session.received_size:
+                raise UploadError(f'偏移量不匹配，已接收 {session.received_size} 字节', 409)
+
+            # 丢弃上次中断时可能残留的未确认字节
+            staging.truncate(offset)
+            staging.seek(offset)
+            written = 0
+            disconnected = False
+            try:
+                while written < length:
+                    data = stream.read(min(COPY_BUFFER_SIZE, length - written))
+                    if not data:
+                        disconnected = True
+                        break
+                    staging.write(data)
+                    written += len(data)
+            except ClientDisconnected:
+                disconnected = True
+            staging.flush()
+            os.fsync(staging.fileno())
+
+            received = offset + written
+            if written:
+                result = db.session.execute(
+                    update(UploadSession)
+                    .where(UploadSession.id == session.id, UploadSession.received_size == offset)
+                    .values(received_size=received, updated_at=datetime.utcnow())
+                )
+                db.session.commit()
+                if result.rowcount != 1:
+                    raise UploadError('该文件的另一分块正在写入', 409)
+                db.session.refresh(session)
+
+        if disconnected:
+            raise UploadError(f'连接中断，已接收 {received} 字节', 400)
+        return received
+
+    def abort(self, session):
+        """取消上传，删除暂存文件"""
+        path = self.staging_path(session.id)
+        db.session.delete(session)
+        db.session.commit()
+        if os.path.exists(path):
+            os.remove(path)
+
+    def claim(self, upload_id, user_id, form_id, field_name, store):
+        """提交表单时认领已完成的上传：暂存文件登记到附件存储，返回PendingBlob
+
+        会话记录在调用方的事务中删除；暂存文件保留到提交成功后由discard_staging删除，
+        提交失败回滚时会话和暂存文件都还在，用户可以直接重新提交。
+        """
+        session = self.get(upload_id, user_id)
+        if session is None or session.form_id != form_id or session.field_name != field_name:
+            raise UploadError('上传不存在或已过期，请重新上传', 404)
+        staging = self.staging_path(session.id)
+        if not session.is_complete or not os.path.exists(staging) or os.path.getsize(staging) != session.total_size:
+            raise UploadError('文件尚未上传完成', 409)
+
+        blob = store.ingest_path(staging, field_name, session.original_filename, session.file_type)
+        db.session.delete(session)
+        return blob
+
+    def discard_staging(self, upload_ids):
+        """提交成功后删除已认领上传的暂存文件"""
+        for upload_id in upload_ids:
+            path = self.staging_path(upload_id)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def cleanup_expired(self):
+        """删除超过有效期未更新的上传会话和暂存文件，以及没有会话的暂存文件，返回清理的会话数"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.expire_seconds)
+        expired = [row.id for row in db.session.query(UploadSession.id).filter(UploadSession.updated_at < cutoff)]
+        if expired:
+            UploadSession.query.filter(UploadSession.id.in_(expired),
+                                       UploadSession.updated_at < cutoff).delete(synchronize_session=False)
+            db.session.commit()
+
+        active = {row.id for row in db.session.query(UploadSession.id)}
+        cutoff_ts = time.time() - self.expire_seconds
+        for name in os.listdir(self.staging_dir):
+            upload_id = name.rsplit('.', 1)[0]
+            path = os.path.join(self.staging_dir, name)
+            if upload_id in active:
+                continue
+            # 会话已删除，或刚创建但尚未提交的暂存文件（按修改时间判断）
+            if upload_id in expired or os.path.getmtime(path) < cutoff_ts:
+                os.remove(path)
+        return len(expired)
@@ -1,4 +1,5 @@
 import os
+import json
 from datetime import timedelta
 from dotenv import load_dotenv
 
@@ -17,12 +18,53 @@ class Config:
     
     SQLALCHEMY_DATABASE_URI = DATABASE_URL or os.environ.get('DATABASE_URL') or 'sqlite:///form_system.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # JSON列按原文保存中文，便于按内容搜索
+    SQLALCHEMY_ENGINE_OPTIONS = {'json_serializer': lambda obj: json.dumps(obj, ensure_ascii=False)}
+
+    # 提交数据存储方式：eav（每个字段一行SubmissionData）或json（整份答卷存为Submission.payload）
+    SUBMISSION_STORAGE_MODE = os.environ.get('SUBMISSION_STORAGE_MODE', 'eav')
     
     # 文件上传设置
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or 'uploads'
     MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 100 * 1024 * 1024))  # 默认100MB
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'mp4', 'avi', 'mov', 'pdf', 'doc', 'docx'}
+
+    # 分块上传设置（大附件分块写入暂存目录，可断点续传）
+    UPLOAD_STAGING_FOLDER = os.environ.get('UPLOAD_STAGING_FOLDER') or 'upload_staging'
+    UPLOAD_CHUNK_MAX_BYTES = int(os.environ.get('UPLOAD_CHUNK_MAX_BYTES', 8 * 1024 * 1024))  # 每块最大字节数
+    UPLOAD_SESSION_EXPIRE_SECONDS = int(os.environ.get('UPLOAD_SESSION_EXPIRE_SECONDS', 24 * 3600))  # 未完成的上传保留时间
+
+    # 后台导出任务设置
+    EXPORT_FOLDER = os.environ.get('EXPORT_FOLDER') or 'exports'
+    EXPORT_MAX_CONCURRENT_JOBS = int(os.environ.get('EXPORT_MAX_CONCURRENT_JOBS', 2))  # 所有工作进程合计同时运行的导出任务数
+    EXPORT_JOB_STALE_SECONDS = int(os.environ.get('EXPORT_JOB_STALE_SECONDS', 300))  # 心跳超时后视为进程已退出，任务重新排队
+    EXPORT_JOB_RETENTION_HOURS = int(os.environ.get('EXPORT_JOB_RETENTION_HOURS', 24))  # 导出文件保留时间
+
+    # 统计计数器设置
+    STATS_RECONCILE_INTERVAL_SECONDS = int(os.environ.get('STATS_RECONCILE_INTERVAL_SECONDS', 3600))  # 计数器校准间隔
+    STORAGE_VERIFY_INTERVAL_SECONDS = int(os.environ.get('STORAGE_VERIFY_INTERVAL_SECONDS', 6 * 3600))  # 存储用量按上传目录校准的间隔
     
+    # 登录身份缓存设置
+    PRINCIPAL_CACHE_TTL_SECONDS = int(os.environ.get('PRINCIPAL_CACHE_TTL_SECONDS', 300))  # 身份缓存有效期
+    PRINCIPAL_GENERATION_CHECK_SECONDS = int(os.environ.get('PRINCIPAL_GENERATION_CHECK_SECONDS', 5))  # 检查其他进程失效通知的间隔
+
+    # 支付状态查询设置
+    PAYMENT_STATUS_CACHE_SECONDS = int(os.environ.get('PAYMENT_STATUS_CACHE_SECONDS', 5))  # 网关查询结果缓存时间
+    PAYMENT_EVENT_POLL_SECONDS = int(os.environ.get('PAYMENT_EVENT_POLL_SECONDS', 1))  # 各工作进程读取状态通知的间隔
+    PAYMENT_EVENT_STREAM_SECONDS = int(os.environ.get('PAYMENT_EVENT_STREAM_SECONDS', 60))  # 单次状态推送连接的最长时间，到期后页面重新连接
+    PAYMENT_EVENT_MAX_STREAMS = int(os.environ.get('PAYMENT_EVENT_MAX_STREAMS', 8))  # 每个工作进程同时保持的推送连接数，超出时页面改为轮询（应小于gunicorn的threads）
+
+    # 订单号生成设置（多台服务器部署时每台设置不同的节点号，0-99）
+    ORDER_NODE_ID = int(os.environ.get('ORDER_NODE_ID', 0))
+
+    # 待支付订单后台对账设置
+    PAYMENT_RECONCILE_INTERVAL_SECONDS = int(os.environ.get('PAYMENT_RECONCILE_INTERVAL_SECONDS', 300))  # 对账运行间隔
+    PAYMENT_RECONCILE_MIN_AGE_SECONDS = int(os.environ.get('PAYMENT_RECONCILE_MIN_AGE_SECONDS', 300))  # 创建多久后的订单参与对账
+    PAYMENT_RECONCILE_BATCH_SIZE = int(os.environ.get('PAYMENT_RECONCILE_BATCH_SIZE', 50))  # 每批读取的订单数
+    PAYMENT_RECONCILE_MAX_PER_RUN = int(os.environ.get('PAYMENT_RECONCILE_MAX_PER_RUN', 500))  # 每次运行最多查询的订单数
+    PAYMENT_RECONCILE_RATE_PER_SECOND = int(os.environ.get('PAYMENT_RECONCILE_RATE_PER_SECOND', 5))  # 网关查询速率上限
+    PAYMENT_ORDER_EXPIRE_SECONDS = int(os.environ.get('PAYMENT_ORDER_EXPIRE_SECONDS', 7200))  # 超时未支付的订单关闭
+
     # Session设置
     PERMANENT_SESSION_LIFETIME = timedelta(hours=int(os.environ.get('SESSION_LIFETIME_HOURS', 24)))
     
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""
+后台导出任务
+任务持久化在export_job表中，由各工作进程内的线程池执行。
+- 认领任务时先锁定认领锁行，各进程依次统计运行数并认领，所有进程合计运行中的任务数不超过上限
+- 执行中的任务定期写入心跳，进程重启后超时任务会重新排队
+- 进度、心跳和完成状态只在任务仍由本进程执行时写入；超时后被其他进程重新认领的任务，
+  原进程的结果直接丢弃，各次执行写入各自的临时文件
+- 导出结果写入instance目录下的文件，供断点续传下载
+"""
+
+import os
+import socket
+import threading
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import update, delete, select, func
+
+from models import db, ExportJob
+from stats_counters import lock_counter_row
+
+logger = logging.getLogger(__name__)
+
+# 认领任务时锁定的计数器行，各进程的认领操作依次执行
+CLAIM_LOCK = '_export_claim_lock'
+
+
+class ExportProgress:
+    """导出进度上报，按行数和时间节流写入数据库"""
+
+    def __init__(self, job_id, worker_id=None, flush_rows=500, flush_seconds=2.0):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.rows_done = 0
+        self.rows_total = None
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self._flushed_rows = 0
+        self._flushed_at = time.monotonic()
+
+    def set_total(self, total):
+        self.rows_total = total
+        self.flush()
+
+    def advance(self, count=1):
+        self.rows_done += count
+        if (self.rows_done - self._flushed_rows >= self.flush_rows or
+                time.monotonic() - self._flushed_at >= self.flush_seconds):
+            self.flush()
+
+    def flush(self):
+        # 使用独立连接更新进度，不影响导出过程中会话里已加载的对象
+        values = {'rows_done': self.rows_done, 'heartbeat_at': datetime.utcnow()}
+        if self.rows_total is not None:
+            values['rows_total'] = self.rows_total
+        table = ExportJob.__table__
+        query = update(table).where(table.c.id == self.job_id)
+        if self.worker_id is not None:
+            # 任务已被其他进程重新认领时不覆盖其进度
+            query = query.where(table.c.worker_id == self.worker_id)
+        with db.engine.begin() as conn:
+            conn.execute(query.values(**values))
+        self._flushed_rows = self.rows_done
+        self._flushed_at = time.monotonic()
+
+
+class ExportJobRunner:
+    """导出任务调度器
+
+    处理函数通过register注册，签名为handler(params, progress)，
+    返回(数据块迭代器, 文件名, MIME类型)，由调度器写入导出文件。
+    """
+
+    MAX_ATTEMPTS = 3
+    IDLE_POLL_SECONDS = 5
+    CLEANUP_INTERVAL_SECONDS = 600
+
+    def __init__(self, app=None):
+        self.app = None
+        self.handlers = {}
+        self._pid = None
+        self._lock = threading.Lock()
+        # 调度线程和执行线程都会修改运行中的任务集合
+        self._running_lock = threading.Lock()
+        self._running = set()
+        self._wake = threading.Event()
+        self._last_cleanup = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.export_dir = os.path.join(app.instance_path, app.config['EXPORT_FOLDER'])
+        self.max_concurrent = app.config['EXPORT_MAX_CONCURRENT_JOBS']
+        self.stale_seconds = app.config['EXPORT_JOB_STALE_SECONDS']
+        self.retention_hours = app.config['EXPORT_JOB_RETENTION_HOURS']
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        os.makedirs(self.export_dir, exist_ok=True)
+        app.extensions['export_jobs'] = self
+
+    def register(self, job_type, handler):
+        """注册导出任务处理函数"""
+        self.handlers[job_type] = handler
+
+    def submit(self, job_type, params, created_by=None):
+        """创建导出任务并唤醒调度线程"""
+        if job_type not in self.handlers:
+            raise ValueError(f"不支持的导出任务类型: {job_type}")
+
+        job = ExportJob(id=uuid.uuid4().hex, job_type=job_type, status='queued',
+                        rows_done=0, attempts=0, created_by=created_by)
+        job.set_params(params)
+        db.session.add(job)
+        db.session.commit()
+
+        self.ensure_started()
+        self._wake.set()
+        return job
+
+    def ensure_started(self):
+        """确保当前进程的调度线程已启动
+
+        gunicorn在preload_app模式下会在fork前创建应用，线程不会随fork复制，
+        因此按进程号延迟启动，每个工作进程各自拥有调度线程和线程池。
+        """
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.worker_id = f"{socket.gethostname()}:{self._pid}"
+            with self._running_lock:
+                self._running = set()
+            self._wake = threading.Event()
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent,
+                                                thread_name_prefix='export-job')
+            thread = threading.Thread(target=self._dispatch_loop, name='export-dispatcher', daemon=True)
+            thread.start()
+
+    def _dispatch_loop(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    self._heartbeat()
+                    self._requeue_stale()
+                    self._cleanup_expired()
+                    while self.running_count() < self.max_concurrent:
+                        job_id = self._claim_next()
+                        if not job_id:
+                            break
+                        with self._running_lock:
+                            self._running.add(job_id)
+                        self._executor.submit(self._run_job, job_id)
+                    db.session.remove()
+            except Exception as e:
+                logger.error(f"导出任务调度异常: {str(e)}", exc_info=True)
+
+            self._wake.wait(self.IDLE_POLL_SECONDS)
+            self._wake.clear()
+
+    def running_count(self):
+        """本进程中正在执行的任务数"""
+        with self._running_lock:
+            return len(self._running)
+
+    def _claim_next(self):
+        """认领一个排队中的任务，全局运行数达到上限时不认领
+
+        READ COMMITTED下条件UPDATE中的计数子查询看不到并发事务的认领，多个进程可能同时通过检查；
+        因此先锁定认领锁行（PostgreSQL行锁、SQLite写锁），持锁统计运行数并认领，提交后才释放。
+        """
+        table = ExportJob.__table__
+        with db.engine.begin() as conn:
+            lock_counter_row(conn, CLAIM_LOCK)
+            running = conn.execute(select(func.count(table.c.id)).where(table.c.status == 'running')).scalar()
+            if running >= self.max_concurrent:
+                return None
+            job_id = conn.execute(select(table.c.id)
+                                  .where(table.c.status == 'queued')
+                                  .order_by(table.c.created_at)
+                                  .limit(1)).scalar()
+            if not job_id:
+                return None
+            now = datetime.utcnow()
+            conn.execute(
+                update(table)
+                .where(table.c.id == job_id)
+                .values(status='running', worker_id=self.worker_id, started_at=now,
+                        heartbeat_at=now, rows_done=0, attempts=table.c.attempts + 1)
+            )
+        return job_id
+
+    def _heartbeat(self):
+        with self._running_lock:
+            running = list(self._running)
+        if not running:
+            return
+        db.session.execute(
+            update(ExportJob.__table__)
+            .where(ExportJob.__table__.c.id.in_(running))
+            .where(ExportJob.__table__.c.worker_id == self.worker_id)
+            .values(heartbeat_at=datetime.utcnow())
+        )
+        db.session.commit()
+
+    def _requeue_stale(self):
+        """心跳超时的任务（执行进程已退出）重新排队，多次失败后标记为失败"""
+        table = ExportJob.__table__
+        cutoff = datetime.utcnow() - timedelta(seconds=self.stale_seconds)
+        stale = (table.c.status == 'running') & (table.c.heartbeat_at < cutoff)
+
+        failed = db.session.execute(
+            update(table).where(stale).where(table.c.attempts >= self.MAX_ATTEMPTS)
+            .values(status='failed', finished_at=datetime.utcnow(),
+                    error_message='导出进程多次中断，任务已终止')
+        )
+        requeued = db.session.execute(
+            update(table).where(stale)
+            .values(status='queued', worker_id=None, rows_done=0)
+        )
+        db.session.commit()
+
+        if failed.rowcount or requeued.rowcount:
+            logger.warning(f"导出任务恢复: 重新排队 {requeued.rowcount} 个, 终止 {failed.rowcount} 个")
+
+    def _cleanup_expired(self):
+        """删除超过保留时间的导出文件和任务记录"""
+        if time.monotonic() - self._last_cleanup < self.CLEANUP_INTERVAL_SECONDS:
+            return
+        self._last_cleanup = time.monotonic()
+
+        cutoff = datetime.utcnow() - timedelta(hours=self.retention_hours)
+        expired = (ExportJob.query
+                   .filter(ExportJob.status.in_(['completed', 'failed']))
+                   .filter(ExportJob.finished_at < cutoff)
+                   .all())
+        for job in expired:
+            if job.output_path and os.path.exists(job.output_path):
+                try:
+                    os.remove(job.output_path)
+                except OSError as e:
+                    logger.warning(f"删除过期导出文件失败 {job.output_path}: {str(e)}")
+
+        if expired:
+            db.session.execute(delete(ExportJob.__table__)
+                               .where(ExportJob.__table__.c.id.in_([job.id for job in expired])))
+            db.session.commit()
+            logger.info(f"已清理 {len(expired)} 个过期导出任务")
+
+    def _owned_job(self, job_id):
+        """任务仍由本进程执行的条件"""
+        table = ExportJob.__table__
+        return (table.c.id == job_id) & (table.c.worker_id == self.worker_id) & (table.c.status == 'running')
+
+    def _run_job(self, job_id):
+        with self.app.app_context():
+            part_path = None
+            table = ExportJob.__table__
+            try:
+                job = db.session.get(ExportJob, job_id)
+                handler = self.handlers[job.job_type]
+                progress = ExportProgress(job_id, self.worker_id)
+
+                logger.info(f"📦 开始执行导出任务 {job_id} ({job.job_type})")
+                chunks, filename, mimetype = handler(job.get_params(), progress)
+
+                ext = os.path.splitext(filename)[1]
+                output_path = os.path.join(self.export_dir, f"{job_id}{ext}")
+                # 同一任务被重新认领后可能有两个进程同时执行，临时文件按进程区分
+                part_path = os.path.join(self.export_dir, f"{job_id}.{self.worker_id.replace(':', '_')}.part")
+                with open(part_path, 'wb') as f:
+                    for chunk in chunks:
+                        f.write(chunk)
+                progress.flush()
+                output_size = os.path.getsize(part_path)
+
+                # 条件UPDATE：任务已超时并被其他进程重新认领时不更新，本次结果丢弃
+                completed = db.session.execute(
+                    update(table).where(self._owned_job(job_id))
+                    .values(status='completed', output_path=output_path, output_filename=filename,
+                            output_mimetype=mimetype, output_size=output_size,
+                            rows_done=progress.rows_done, finished_at=datetime.utcnow())
+                )
+                if completed.rowcount != 1:
+                    db.session.rollback()
+                    os.remove(part_path)
+                    logger.warning(f"⚠️ 导出任务 {job_id} 已由其他进程执行，丢弃本次结果")
+                    return
+                # 持有任务行的更新后再替换正式文件，随后提交
+                os.replace(part_path, output_path)
+                db.session.commit()
+                logger.info(f"✅ 导出任务完成 {job_id}: {filename}, {output_size} bytes")
+
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"❌ 导出任务失败 {job_id}: {str(e)}", exc_info=True)
+                if part_path and os.path.exists(part_path):
+                    os.remove(part_path)
+                db.session.execute(
+                    update(table).where(self._owned_job(job_id))
+                    .values(status='failed', error_message=str(e), finished_at=datetime.utcnow())
+                )
+                db.session.commit()
+            finally:
+                db.session.remove()
+                with self._running_lock:
+                    self._running.discard(job_id)
+                self._wake.set()
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+导出工具
+流式生成导出文件，避免在内存中构建完整文件
+"""
+
+import csv
+import io
+import os
+import pickle
+import tempfile
+import time
+import zipfile
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment
+from openpyxl.utils import get_column_letter
+
+# 添加BOM以支持Excel正确识别中文编码
+CSV_BOM = '\ufeff'
+
+# 本身已压缩的文件格式，打包时直接存储，不再重复压缩
+PRECOMPRESSED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'mp4', 'mov', 'avi', 'pdf', 'docx', 'xlsx', 'zip'}
+
+# 流式读取文件时每次读取的字节数
+STREAM_CHUNK_SIZE = 64 * 1024
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def iter_csv_chunks(headers, rows, include_bom=True, rows_per_chunk=500):
+    """将表头和行数据编码为UTF-8 CSV字节块
+
+    每写入rows_per_chunk行输出一次缓冲区内容并清空，
+    内存中最多只保留一个块的数据。
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    if include_bom:
+        buffer.write(CSV_BOM)
+    writer.writerow(headers)
+
+    row_count = 0
+    for row in rows:
+        writer.writerow(row)
+        row_count += 1
+
+        if row_count % rows_per_chunk == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    remaining = buffer.getvalue()
+    if remaining:
+        yield remaining.encode('utf-8')
+
+
+class XlsxStreamWriter:
+    """基于openpyxl只写模式的流式Excel写入器
+
+    openpyxl只写模式要求在写入第一行之前确定列宽，因此数据行先序列化到
+    临时文件中，同时累计每列的最大宽度；保存时再一次性按列宽写出工作表。
+    整个过程内存中只保留当前行，生成的xlsx同样写入临时文件而非内存。
+    """
+
+    HEADER_FONT = Font(bold=True, color="FFFFFF")
+    HEADER_FILL = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+    HEADER_ALIGNMENT = Alignment(horizontal="center", vertical="center")
+
+    def __init__(self, sheet_title, headers, min_width=10, max_width=50):
+        self.sheet_title = sheet_title
+        self.headers = list(headers)
+        self.min_width = min_width
+        self.max_width = max_width
+        self.row_count = 0
+
+        self._widths = [len(str(header)) for header in self.headers]
+        self._spool = tempfile.TemporaryFile()
+
+    def append(self, row):
+        """写入一行数据，并更新列宽统计"""
+        row = list(row)
+        for index, value in enumerate(row):
+            if value is None:
+                continue
+            length = len(str(value))
+            if index >= len(self._widths):
+                self._widths.append(length)
+            elif length > self._widths[index]:
+                self._widths[index] = length
+
+        pickle.dump(row, self._spool, protocol=pickle.HIGHEST_PROTOCOL)
+        self.row_count += 1
+
+    def _iter_spooled_rows(self):
+        self._spool.seek(0)
+        while True:
+            try:
+                yield pickle.load(self._spool)
+            except EOFError:
+                return
+
+    def save(self, target=None):
+        """生成xlsx文件
+
+        target为文件路径或可写文件对象；未指定时写入匿名临时文件，
+        并返回已定位到开头的文件对象，由调用方负责关闭。
+        """
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(title=self.sheet_title)
+
+        # 只写模式下列宽必须在写入数据之前设置
+        for index, width in enumerate(self._widths, 1):
+            adjusted_width = min(width + 2, self.max_width)  # 最大宽度
+            ws.column_dimensions[get_column_letter(index)].width = max(adjusted_width, self.min_width)  # 最小宽度
+
+        header_cells = []
+        for header in self.headers:
+            cell = WriteOnlyCell(ws, value=header)
+            cell.font = self.HEADER_FONT
+            cell.fill = self.HEADER_FILL
+            cell.alignment = self.HEADER_ALIGNMENT
+            header_cells.append(cell)
+        ws.append(header_cells)
+
+        for row in self._iter_spooled_rows():
+            ws.append(row)
+
+        output = target if target is not None else tempfile.TemporaryFile()
+        wb.save(output)
+        self.close()
+
+        if target is None:
+            output.seek(0)
+            return output
+        return target
+
+    def close(self):
+        """释放行缓存临时文件"""
+        if not self._spool.closed:
+            self._spool.close()
+
+
+class _ZipOutputBuffer(io.RawIOBase):
+    """ZipFile的输出目标：暂存写入的字节，由调用方按需取走
+
+    不支持seek，ZipFile会自动改用数据描述符（data descriptor）方式写入，
+    因此无需回写本地文件头，可直接边生成边发送。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStreamWriter:
+    """流式ZIP生成器
+
+    各写入方法均为生成器，逐块产出ZIP字节流，可直接作为响应体发送。
+    文件内容按STREAM_CHUNK_SIZE分块读取，内存占用与文件大小无关；
+    已压缩格式（图片、视频、PDF等）使用ZIP_STORED存储。
+    """
+
+    def __init__(self):
+        self._buffer = _ZipOutputBuffer()
+        self._zip = zipfile.ZipFile(self._buffer, 'w', zipfile.ZIP_DEFLATED)
+
+    @staticmethod
+    def _compress_type_for(arcname):
+        ext = arcname.rsplit('.', 1)[-1].lower() if '.' in arcname else ''
+        return zipfile.ZIP_STORED if ext in PRECOMPRESSED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+    def _write_stream(self, zinfo, source):
+        zinfo.compress_type = self._compress_type_for(zinfo.filename)
+        with self._zip.open(zinfo, 'w') as dest:
+            while True:
+                chunk = source.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                dest.write(chunk)
+                data = self._buffer.drain()
+                if data:
+                    yield data
+        data = self._buffer.drain()
+        if data:
+            yield data
+
+    def write_file(self, path, arcname):
+        """将磁盘文件直接读入ZIP流"""
+        zinfo = zipfile.ZipInfo.from_file(path, arcname)
+        with open(path, 'rb') as source:
+            yield from self._write_stream(zinfo, source)
+
+    def write_fileobj(self, fileobj, arcname):
+        """将已定位到开头的文件对象写入ZIP流"""
+        zinfo = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+        fileobj.seek(0, os.SEEK_END)
+        zinfo.file_size = fileobj.tell()
+        fileobj.seek(0)
+        yield from self._write_stream(zinfo, fileobj)
+
+    def write_bytes(self, arcname, data):
+        """写入内存中的小文件（如说明文件）"""
+        yield from self.write_fileobj(io.BytesIO(data), arcname)
+
+    def close(self):
+        """写入中央目录，结束ZIP流"""
+        self._zip.close()
+        data = self._buffer.drain()
+        if data:
+            yield data
+
+
+def iter_file_chunks(fileobj, chunk_size=STREAM_CHUNK_SIZE):
+    """分块读取文件对象，读取完毕后关闭文件"""
+    try:
+        while True:
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        fileobj.close()
+
+
+def iter_xlsx_export(sheet_title, headers, rows):
+    """将行数据写成xlsx并分块输出
+
+    生成器首次迭代时才开始写入，适合直接作为流式响应体或写入导出文件。
+    """
+    writer = XlsxStreamWriter(sheet_title, headers)
+    try:
+        for row in rows:
+            writer.append(row)
+        output = writer.save()
+    finally:
+        writer.close()
+    yield from iter_file_chunks(output)
@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+"""
+本地模拟支付网关
+在本机端口上模拟微信支付和支付宝的接口，供压测和测试使用，不需要商户账号和外网：
+- 微信支付：统一下单(pay/unifiedorder)、订单查询(pay/orderquery)、关闭订单(pay/closeorder)，
+  按商户密钥校验和生成签名
+- 支付宝：电脑网站支付(alipay.trade.page.pay)、交易查询(alipay.trade.query)、交易关闭(alipay.trade.close)，
+  用生成的RSA密钥对签名
+- 模拟用户付款：POST /pay/<订单号> 后按各自格式向下单时的notify_url发送签名的异步通知，
+  商户未确认时重发，可配置额外发送的重复通知
+- 可配置接口耗时、抖动和失败率（返回503），用于观察超时、熔断和对账行为
+
+用法：
+    with FakePaymentGateway(latency_ms=50) as gateway:
+        gateway.configure(get_payment_processor())
+        ...
+        gateway.pay(order_no)
+"""
+
+import json
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+import requests
+import xmltodict
+from Cryptodome.PublicKey import RSA
+from wechatpy.pay.utils import calculate_signature, dict_to_xml
+from wechatpy.utils import random_string
+
+from alipay import AliPay
+from gateway_clients import PooledAliPay
+
+# 商户未确认异步通知时的发送次数和重发间隔（秒）
+NOTIFY_ATTEMPTS = 3
+NOTIFY_RETRY_SECONDS = 0.5
+
+WECHAT_NOTIFY_SUCCESS = 'SUCCESS'
+ALIPAY_NOTIFY_SUCCESS = 'success'
+
+
+def _generate_key_pair():
+    key = RSA.generate(2048)
+    return key.export_key().decode(), key.publickey().export_key().decode()
+
+
+class FakePaymentGateway:
+    """本地模拟支付网关（在后台线程中运行HTTP服务）"""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, failure_rate=0.0, notify_delay_ms=0,
+                 duplicate_notifies=0, host='127.0.0.1', port=0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.notify_delay_ms = notify_delay_ms
+        self.duplicate_notifies = duplicate_notifies
+        self.host = host
+        self.port = port
+        self.wechat_api_key = None
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._orders = {}
+        self._counters = {}
+        self._server = None
+        self._notifier = None
+        self._http = requests.Session()
+
+        # 商户应用密钥和模拟支付宝的密钥；支付宝侧的签名和验签用一个交换了两把密钥的客户端完成
+        self.app_private_key, self.app_public_key = _generate_key_pair()
+        self.alipay_private_key, self.alipay_public_key = _generate_key_pair()
+        self._alipay_signer = AliPay(appid='fake', app_private_key_string=self.alipay_private_key,
+                                     alipay_public_key_string=self.app_public_key, sign_type='RSA2')
+
+    # ---- 生命周期 ----
+
+    @property
+    def base_url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def start(self):
+        handler = type('Handler', (_GatewayRequestHandler,), {'gateway': self})
+        self._server = ThreadingHTTPServer((self.host, self.port), handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_port
+        self._notifier = ThreadPoolExecutor(max_workers=8, thread_name_prefix='fake-gateway-notify')
+        threading.Thread(target=self._server.serve_forever, name='fake-gateway', daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._notifier:
+            self._notifier.shutdown(wait=True)
+            self._notifier = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def configure(self, processor):
+        """让支付处理器的两个网关客户端改为请求本模拟网关"""
+        wechat_client = processor.wechat_client
+        wechat_client.sandbox = False
+        wechat_client.API_BASE_URL = f'{self.base_url}/wechat/'
+        self.wechat_api_key = wechat_client.api_key
+
+        config = processor.alipay_config
+        processor.alipay_client = PooledAliPay(
+            http=processor.http,
+            timeout=processor.transport_config.timeout,
+            appid=config.app_id,
+            app_notify_url=config.notify_url,
+            app_private_key_string=self.app_private_key,
+            alipay_public_key_string=self.alipay_public_key,
+            sign_type='RSA2'
+        )
+        processor.alipay_client._gateway = f'{self.base_url}/alipay/gateway.do'
+
+    # ---- 订单与统计 ----
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def stats(self):
+        with self._lock:
+            orders = list(self._orders.values())
+            counters = dict(self._counters)
+        return {
+            'orders': len(orders),
+            'paid': sum(1 for order in orders if order['paid']),
+            'counters': counters,
+        }
+
+    def _register(self, gateway, order_no, amount, notify_url):
+        with self._lock:
+            order = self._orders.get(order_no)
+            if order is None:
+                order = self._orders[order_no] = {
+                    'gateway': gateway, 'order_no': order_no, 'amount': amount,
+                    'notify_url': notify_url, 'paid': False, 'closed': False, 'transaction_id': None,
+                    'paid_at': None,
+                }
+            return order
+
+    def _get_order(self, order_no):
+        with self._lock:
+            order = self._orders.get(order_no)
+            return dict(order) if order else None
+
+    def _close(self, order_no):
+        """关闭交易，返回missing（订单不存在）、paid（已付款无法关闭）或closed"""
+        with self._lock:
+            order = self._orders.get(order_no)
+            if order is None:
+                return 'missing'
+            if order['paid']:
+                return 'paid'
+            order['closed'] = True
+        self._count('close')
+        return 'closed'
+
+    def pay_url(self, order_no):
+        """模拟用户扫码/收银台付款的地址"""
+        return f'{self.base_url}/pay/{order_no}'
+
+    def pay(self, order_no):
+        """模拟用户完成付款，并异步通知商户；订单不存在或已关闭返回False"""
+        with self._lock:
+            order = self._orders.get(order_no)
+            if order is None or order['closed']:
+                return False
+            if not order['paid']:
+                order['paid'] = True
+                order['paid_at'] = datetime.now()
+                prefix = '4200' if order['gateway'] == 'wechat' else '2088'
+                order['transaction_id'] = prefix + uuid.uuid4().hex[:24]
+            order = dict(order)
+        self._count('pay')
+        self._notifier.submit(self._send_notifications, order)
+        return True
+
+    # ---- 异步通知 ----
+
+    def _send_notifications(self, order):
+        if self.notify_delay_ms:
+            time.sleep(self.notify_delay_ms / 1000)
+        acknowledged = False
+        for attempt in range(NOTIFY_ATTEMPTS):
+            if attempt:
+                time.sleep(NOTIFY_RETRY_SECONDS * attempt)
+            acknowledged = self._notify(order)
+            if acknowledged:
+                break
+        self._count('notify.acked' if acknowledged else 'notify.failed')
+        for _ in range(self.duplicate_notifies):
+            self._notify(order)
+
+    def _notify(self, order):
+        self._count('notify.sent')
+        try:
+            if order['gateway'] == 'wechat':
+                response = self._http.post(order['notify_url'], data=self._wechat_notification(order).encode('utf-8'),
+                                           headers={'Content-Type': 'text/xml'}, timeout=10)
+                return WECHAT_NOTIFY_SUCCESS in response.text
+            response = self._http.post(order['notify_url'], data=self._alipay_notification(order), timeout=10)
+            return response.text.strip() == ALIPAY_NOTIFY_SUCCESS
+        except requests.RequestException:
+            return False
+
+    def _wechat_notification(self, order):
+        data = {
+            'return_code': 'SUCCESS', 'result_code': 'SUCCESS', 'appid': 'fake', 'mch_id': 'fake',
+            'nonce_str': random_string(32), 'out_trade_no': order['order_no'],
+            'transaction_id': order['transaction_id'], 'total_fee': str(order['amount']),
+            'trade_type': 'NATIVE', 'time_end': order['paid_at'].strftime('%Y%m%d%H%M%S'),
+        }
+        return dict_to_xml(data, calculate_signature(data, self.wechat_api_key))
+
+    def _alipay_notification(self, order):
+        data = {
+            'notify_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'notify_type': 'trade_status_sync',
+            'notify_id': uuid.uuid4().hex, 'app_id': 'fake', 'charset': 'utf-8', 'version': '1.0',
+            'trade_no': order['transaction_id'], 'out_trade_no': order['order_no'],
+            'trade_status': 'TRADE_SUCCESS', 'total_amount': order['amount'],
+            'gmt_payment': order['paid_at'].strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        unsigned = '&'.join(f'{key}={value}' for key, value in sorted(data.items()))
+        return dict(data, sign_type='RSA2', sign=self._alipay_signer._sign(unsigned))
+
+    # ---- 接口实现 ----
+
+    def _inject(self):
+        """模拟接口耗时；按失败率返回True表示本次请求应失败"""
+        delay = self.latency_ms + (self._random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            self._count('injected_failures')
+            return True
+        return False
+
+    def _wechat_reply(self, data):
+        data = dict(data, nonce_str=random_string(32))
+        return dict_to_xml(data, calculate_signature(data, self.wechat_api_key))
+
+    def handle_wechat(self, endpoint, body):
+        params = xmltodict.parse(body)['xml']
+        sign = params.pop('sign', None)
+        if sign != calculate_signature(params, self.wechat_api_key):
+            return self._wechat_reply({'return_code': 'FAIL', 'return_msg': '签名错误'})
+
+        if endpoint == 'pay/unifiedorder':
+            order = self._register('wechat', params['out_trade_no'], params['total_fee'], params['notify_url'])
+            return self._wechat_reply({
+                'return_code': 'SUCCESS', 'result_code': 'SUCCESS', 'trade_type': params.get('trade_type', 'NATIVE'),
+                'prepay_id': 'wx' + uuid.uuid4().hex[:30], 'code_url': self.pay_url(order['order_no']),
+            })
+        if endpoint == 'pay/orderquery':
+            order = self._get_order(params.get('out_trade_no'))
+            if order is None:
+                return self._wechat_reply({'return_code': 'SUCCESS', 'result_code': 'FAIL',
+                                           'err_code': 'ORDERNOTEXIST', 'err_code_des': '订单不存在'})
+            trade_state = 'SUCCESS' if order['paid'] else 'CLOSED' if order['closed'] else 'NOTPAY'
+            reply = {'return_code': 'SUCCESS', 'result_code': 'SUCCESS', 'out_trade_no': order['order_no'],
+                     'total_fee': order['amount'], 'trade_state': trade_state}
+            if order['paid']:
+                reply['transaction_id'] = order['transaction_id']
+            return self._wechat_reply(reply)
+        if endpoint == 'pay/closeorder':
+            outcome = self._close(params.get('out_trade_no'))
+            if outcome == 'closed':
+                return self._wechat_reply({'return_code': 'SUCCESS', 'result_code': 'SUCCESS'})
+            err_code, err_code_des = ('ORDERNOTEXIST', '订单不存在') if outcome == 'missing' else ('ORDERPAID', '订单已支付')
+            return self._wechat_reply({'return_code': 'SUCCESS', 'result_code': 'FAIL',
+                                       'err_code': err_code, 'err_code_des': err_code_des})
+        return None
+
+    def handle_alipay(self, params):
+        # 请求签名覆盖除sign外的全部参数（与异步通知不同，包含sign_type）
+        sign = params.pop('sign', None)
+        unsigned = '&'.join(f'{key}={value}' for key, value in sorted(params.items()))
+        if not sign or not self._alipay_signer._verify(unsigned, sign):
+            return 400, 'text/plain', '签名错误'
+        biz_content = json.loads(params.get('biz_content') or '{}')
+        method = params.get('method')
+
+        if method == 'alipay.trade.page.pay':
+            # 收银台：登记订单，返回付款地址
+            order = self._register('alipay', biz_content['out_trade_no'], biz_content['total_amount'],
+                                   params.get('notify_url'))
+            body = json.dumps({'out_trade_no': order['order_no'], 'pay_url': self.pay_url(order['order_no'])})
+            return 200, 'application/json', body
+        if method == 'alipay.trade.query':
+            order = self._get_order(biz_content.get('out_trade_no'))
+            if order is None:
+                content = {'code': '40004', 'msg': 'Business Failed', 'sub_code': 'ACQ.TRADE_NOT_EXIST',
+                           'sub_msg': '交易不存在'}
+            else:
+                trade_status = 'TRADE_SUCCESS' if order['paid'] else 'TRADE_CLOSED' if order['closed'] else 'WAIT_BUYER_PAY'
+                content = {'code': '10000', 'msg': 'Success', 'out_trade_no': order['order_no'],
+                           'total_amount': order['amount'], 'trade_status': trade_status}
+                if order['paid']:
+                    content['trade_no'] = order['transaction_id']
+            return self._alipay_reply('alipay_trade_query_response', content)
+        if method == 'alipay.trade.close':
+            outcome = self._close(biz_content.get('out_trade_no'))
+            if outcome == 'closed':
+                content = {'code': '10000', 'msg': 'Success', 'out_trade_no': biz_content['out_trade_no']}
+            elif outcome == 'missing':
+                content = {'code': '40004', 'msg': 'Business Failed', 'sub_code': 'ACQ.TRADE_NOT_EXIST',
+                           'sub_msg': '交易不存在'}
+            else:
+                content = {'code': '40004', 'msg': 'Business Failed', 'sub_code': 'ACQ.TRADE_STATUS_ERROR',
+                           'sub_msg': '交易状态不合法'}
+            return self._alipay_reply('alipay_trade_close_response', content)
+        return 400, 'text/plain', '不支持的接口'
+
+    def _alipay_reply(self, response_type, content):
+        plain = json.dumps(content, ensure_ascii=False, separators=(',', ':'))
+        body = '{"%s":%s,"sign":"%s"}' % (response_type, plain, self._alipay_signer._sign(plain))
+        return 200, 'application/json', body
+
+
+class _GatewayRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    gateway = None
+
+    def _reply(self, status, content_type, body):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, body):
+        gateway = self.gateway
+        url = urlparse(self.path)
+        path = url.path.strip('/')
+
+        if path.startswith('pay/') and self.command == 'POST':
+            paid = gateway.pay(path[len('pay/'):])
+            return self._reply(200 if paid else 404, 'application/json', json.dumps({'paid': paid}))
+
+        if path.startswith('wechat/') or path == 'alipay/gateway.do':
+            gateway._count(path)
+            if gateway._inject():
+                return self._reply(503, 'text/plain', 'Service Unavailable')
+            if path.startswith('wechat/'):
+                reply = gateway.handle_wechat(path[len('wechat/'):], body)
+                if reply is not None:
+                    return self._reply(200, 'text/xml', reply)
+            else:
+                params = dict(parse_qsl(url.query, keep_blank_values=True))
+                return self._reply(*gateway.handle_alipay(params))
+
+        self._reply(404, 'text/plain', 'Not Found')
+
+    def do_GET(self):
+        self._handle('')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self._handle(self.rfile.read(length).decode('utf-8') if length else '')
+
+    def log_message(self, *args):
+        pass
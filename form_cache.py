@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+表单类缓存
+按(form_id, schema_version)缓存编译后的动态表单类和字段定义快照。
+- 缓存位于进程内、按应用实例保存在app.extensions中，每个工作进程只编译一次；
+  gunicorn preload_app时在fork前预热，各工作进程直接继承
+- 管理员修改表单后递增Form.schema_version，各进程读取到新版本号时自动重新编译，
+  无需跨进程通知
+"""
+
+import threading
+from collections import namedtuple
+
+from flask import current_app
+
+from models import db, Form, FormField
+from forms import FieldSpec, compile_form_class
+
+CompiledForm = namedtuple('CompiledForm', ['form_class', 'fields'])
+
+
+def _compile(form_id, schema_version):
+    form_fields = FormField.query.filter_by(form_id=form_id).order_by(FormField.order_index).all()
+    field_specs = [FieldSpec.from_model(field) for field in form_fields]
+    return CompiledForm(compile_form_class(form_id, schema_version, field_specs), tuple(field_specs))
+
+
+class FormCache:
+    """按应用实例缓存表单编译结果的扩展，同一进程中连接不同数据库的应用互不影响"""
+
+    def __init__(self, app=None):
+        self._entries = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['form_cache'] = self
+
+    def get(self, form_id, schema_version):
+        key = (form_id, schema_version or 0)
+        compiled = self._entries.get(key)
+        if compiled is not None:
+            return compiled
+
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is None:
+                compiled = _compile(*key)
+                # 同一表单的旧版本不再使用
+                for stale_key in [k for k in self._entries if k[0] == form_id and k[1] < key[1]]:
+                    del self._entries[stale_key]
+                self._entries[key] = compiled
+        return compiled
+
+    def forget(self, form_id):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == form_id]:
+                del self._entries[key]
+
+
+def get_compiled_form(form_id, schema_version):
+    """取得表单的编译结果，缓存未命中时从数据库加载字段并编译"""
+    return current_app.extensions['form_cache'].get(form_id, schema_version)
+
+
+def bump_schema_version(form_obj):
+    """表单字段变更后调用，使各进程中该表单的缓存失效（随调用方事务提交）"""
+    form_obj.schema_version = (form_obj.schema_version or 0) + 1
+
+
+def forget_form(form_id):
+    """表单删除后调用，释放当前应用中该表单的缓存"""
+    current_app.extensions['form_cache'].forget(form_id)
+
+
+def warm_form_cache():
+    """预先编译全部启用中的表单，返回编译的表单数"""
+    forms = db.session.query(Form.id, Form.schema_version).filter(Form.is_active.is_(True)).all()
+    for form_id, schema_version in forms:
+        get_compiled_form(form_id, schema_version)
+    return len(forms)
@@ -1,9 +1,11 @@
+from flask import request
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed
 from wtforms import StringField, TextAreaField, PasswordField, SelectField, BooleanField, IntegerField, FieldList, FormField, RadioField, SelectMultipleField, DecimalField
-from wtforms.validators import DataRequired, Email, Length, EqualTo, Optional, NumberRange
+from wtforms.validators import DataRequired, Email, Length, EqualTo, Optional, NumberRange, StopValidation
 from wtforms.widgets import CheckboxInput, ListWidget
 import re
+from collections import namedtuple
 
 class LoginForm(FlaskForm):
     """用户登录表单"""
@@ -85,111 +87,140 @@ class EditFormForm(FlaskForm):
     description = TextAreaField('表单描述', validators=[Optional()])
     is_active = BooleanField('是否启用')
 
+# 上传文件允许的扩展名
+FILE_FIELD_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'pdf', 'doc', 'docx', 'mp4', 'avi', 'mov']
+# 文件字段通过分块上传时，表单中附带的上传ID字段名后缀
+UPLOAD_ID_SUFFIX = '_upload_id'
+
+
+class FileOrUploadRequired:
+    """必填文件字段：直接选择了文件，或附带已完成的分块上传ID"""
+    field_flags = {'required': True}
+
+    def __init__(self, message=None):
+        self.message = message
+
+    def __call__(self, form, field):
+        if field.data or request.form.get(field.name + UPLOAD_ID_SUFFIX):
+            return
+        message = self.message or field.gettext('This field is required.')
+        field.errors[:] = []
+        raise StopValidation(message)
+
+
+
+class FieldSpec(namedtuple('FieldSpec', ['field_name', 'field_label', 'field_type', 'is_required', 'placeholder',
+                                         'order_index', 'payment_account_id', 'options'])):
+    """表单字段定义快照
+
+    与FormField的属性同名，可直接替代FormField用于模板渲染和提交处理；
+    选项在创建时解析一次，不与数据库会话绑定，可在线程间共享。
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_model(cls, field):
+        return cls(field.field_name, field.field_label, field.field_type, bool(field.is_required), field.placeholder,
+                   field.order_index, field.payment_account_id, tuple(field.get_options()))
+
+    def get_options(self):
+        return list(self.options)
+
+
+def build_unbound_field(field):
+    """根据字段定义创建未绑定的WTForms字段"""
+    validators = []
+    if field.is_required:
+        validators.append(DataRequired())
+
+    field_kwargs = {
+        'label': field.field_label,
+        'validators': validators
+    }
+
+    if field.placeholder:
+        field_kwargs['render_kw'] = {'placeholder': field.placeholder}
+
+    # 创建字段类型
+    if field.field_type == 'text':
+        field_class = StringField
+    elif field.field_type == 'textarea':
+        field_class = TextAreaField
+    elif field.field_type == 'email':
+        if field.is_required:
+            field_kwargs['validators'].append(Email())
+        field_class = StringField
+    elif field.field_type == 'tel':
+        field_class = StringField
+    elif field.field_type == 'number':
+        field_class = IntegerField
+    elif field.field_type == 'select':
+        options = [(opt, opt) for opt in field.get_options()]
+        options.insert(0, ('', '请选择...'))
+        field_kwargs['choices'] = options
+        field_class = SelectField
+    elif field.field_type == 'radio':
+        options = [(opt, opt) for opt in field.get_options()]
+        field_kwargs['choices'] = options
+        field_class = RadioField
+    elif field.field_type == 'checkbox':
+        options = [(opt, opt) for opt in field.get_options()]
+        field_kwargs['choices'] = options
+        field_kwargs['widget'] = ListWidget(prefix_label=False)
+        field_kwargs['option_widget'] = CheckboxInput()
+        field_class = SelectMultipleField
+    elif field.field_type == 'file':
+        # 必填文件字段也可以通过分块上传提供
+        required = [FileOrUploadRequired()] if field.is_required else []
+        field_kwargs['validators'] = [FileAllowed(FILE_FIELD_EXTENSIONS, '不支持的文件格式')] + required
+        field_class = FileField
+    elif field.field_type in ['wechat_pay', 'alipay']:
+        # 支付字段使用数字字段来输入金额
+        field_kwargs['validators'].append(NumberRange(min=0.01, message='支付金额必须大于0'))
+        field_kwargs['render_kw'] = {
+            'step': '0.01',
+            'min': '0.01',
+            'placeholder': '请输入支付金额（元）',
+            'class': 'form-control payment-amount'
+        }
+        field_class = DecimalField
+    else:
+        field_class = StringField
+
+    return field_class(**field_kwargs)
+
+
 class DynamicForm(FlaskForm):
     """动态表单基类"""
+    form_fields = None
+
     def __init__(self, form_fields=None, formdata=None, **kwargs):
         # 先调用父类初始化，这会处理CSRF保护
         super().__init__(formdata=formdata, **kwargs)
         
-        # 保存表单字段定义
-        self.form_fields = form_fields
-        
-        # 在父类初始化后再创建自定义字段
+        # 在父类初始化后再创建自定义字段（编译后的表单类字段已在类上定义，无需再创建）
         if form_fields:
+            self.form_fields = form_fields
             self.create_fields(form_fields, formdata)
     
     def create_fields(self, form_fields, formdata=None):
         """根据表单字段定义动态创建字段"""
         for field in form_fields:
-            validators = []
-            if field.is_required:
-                validators.append(DataRequired())
-            
-            field_kwargs = {
-                'label': field.field_label,
-                'validators': validators
-            }
-            
-            if field.placeholder:
-                field_kwargs['render_kw'] = {'placeholder': field.placeholder}
-            
-            # 创建字段类型
-            field_class = None
-            if field.field_type == 'text':
-                field_class = StringField
-            elif field.field_type == 'textarea':
-                field_class = TextAreaField
-            elif field.field_type == 'email':
-                if field.is_required:
-                    field_kwargs['validators'].append(Email())
-                field_class = StringField
-            elif field.field_type == 'tel':
-                field_class = StringField
-            elif field.field_type == 'number':
-                field_class = IntegerField
-            elif field.field_type == 'select':
-                options = [(opt, opt) for opt in field.get_options()]
-                options.insert(0, ('', '请选择...'))
-                field_kwargs['choices'] = options
-                field_class = SelectField
-            elif field.field_type == 'radio':
-                options = [(opt, opt) for opt in field.get_options()]
-                field_kwargs['choices'] = options
-                field_class = RadioField
-            elif field.field_type == 'checkbox':
-                options = [(opt, opt) for opt in field.get_options()]
-                field_kwargs['choices'] = options
-                field_kwargs['widget'] = ListWidget(prefix_label=False)
-                field_kwargs['option_widget'] = CheckboxInput()
-                field_class = SelectMultipleField
-            elif field.field_type == 'file':
-                allowed_extensions = ['jpg', 'jpeg', 'png', 'gif', 'pdf', 'doc', 'docx', 'mp4', 'avi', 'mov']
-                field_kwargs['validators'] = [FileAllowed(allowed_extensions, '不支持的文件格式')] + field_kwargs['validators']
-                field_class = FileField
-            elif field.field_type in ['wechat_pay', 'alipay']:
-                # 支付字段使用数字字段来输入金额
-                field_kwargs['validators'].append(NumberRange(min=0.01, message='支付金额必须大于0'))
-                field_kwargs['render_kw'] = {
-                    'step': '0.01',
-                    'min': '0.01',
-                    'placeholder': '请输入支付金额（元）',
-                    'class': 'form-control payment-amount'
-                }
-                field_class = DecimalField
-            else:
-                field_class = StringField
-            
-            # 创建绑定字段实例
-            if field_class:
-                # 获取初始数据
-                initial_data = None
-                if formdata and hasattr(formdata, 'get'):
-                    initial_data = formdata.get(field.field_name)
-                elif formdata and hasattr(formdata, '__getitem__'):
-                    try:
-                        initial_data = formdata[field.field_name]
-                    except KeyError:
-                        initial_data = None
-                
-                # 使用最简单的方式创建字段实例
-                field_instance = field_class(**field_kwargs)
-                
-                # 设置字段的必要属性
-                field_instance.name = field.field_name
-                field_instance.object_data = None
-                
-                # 手动绑定表单和处理数据
-                field_instance = field_instance.bind(self, field.field_name)
-                
-                # 正确处理表单数据
-                if formdata:
-                    field_instance.process(formdata)
-                elif initial_data is not None:
-                    field_instance.data = initial_data
-                else:
-                    # 为没有数据的情况提供空的formdata
-                    field_instance.process({})
-                
-                # 将字段添加到表单
-                setattr(self, field.field_name, field_instance)
-                self._fields[field.field_name] = field_instance
+            # 手动绑定表单和处理数据
+            field_instance = build_unbound_field(field).bind(self, field.field_name)
+            field_instance.process(formdata if formdata else {})
+
+            # 将字段添加到表单
+            setattr(self, field.field_name, field_instance)
+            self._fields[field.field_name] = field_instance
+
+
+def compile_form_class(form_id, schema_version, field_specs):
+    """将表单字段定义编译为DynamicForm子类
+
+    字段以类属性声明，由WTForms在实例化时统一绑定和处理表单数据，
+    同一表单的后续请求直接实例化该类，不再重复解析选项和构建字段。
+    """
+    attrs = {field.field_name: build_unbound_field(field) for field in field_specs}
+    attrs['form_fields'] = tuple(field_specs)
+    return type(f'CompiledForm{form_id}V{schema_version}', (DynamicForm,), attrs)
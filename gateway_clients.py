@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+支付网关连接
+原微信支付、支付宝客户端使用默认传输设置：支付宝每次请求新建连接，两者都没有超时上限，
+网关变慢时每个调用都会长时间占住工作线程。
+- 两个网关共用一个保持长连接的requests连接池，并设置连接超时和读取超时
+- 每个网关一个熔断器：连续多次网络错误或超时后在一段时间内直接失败，不再发出请求；
+  冷却期后放行一个试探请求，成功则恢复
+- 按网关和接口记录每次调用的耗时直方图
+"""
+
+import threading
+import time
+from urllib.error import URLError
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from alipay import AliPay
+
+# 耗时直方图的桶上限（毫秒），最后一个桶收集超过上限的调用
+LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class GatewayUnavailable(Exception):
+    """网关熔断中，调用未发出"""
+
+
+def create_http_session(pool_size):
+    """创建带连接池的会话；失败不自动重试，由调用方决定是否重查"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class PooledAliPay(AliPay):
+    """通过共用连接池请求支付宝网关的客户端（原实现每次请求用urlopen新建连接）"""
+
+    def __init__(self, *args, http=None, timeout=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._http = http or requests.Session()
+        self._timeout = timeout
+
+    def verified_sync_response(self, data, response_type):
+        url = self._gateway + "?" + self.sign_data(data)
+        response = self._http.get(url, timeout=self._timeout)
+        response.raise_for_status()
+        return self._verify_and_return_sync_response(response.text, response_type)
+
+
+def is_transport_error(error):
+    """网络错误、超时或网关5xx，计入熔断；业务错误（参数、签名等）不计入"""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, URLError, TimeoutError)):
+        return True
+    response = getattr(error, 'response', None)
+    status_code = getattr(response, 'status_code', None)
+    return status_code is not None and status_code >= 500
+
+
+class CircuitBreaker:
+    """单个网关的熔断器"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold, reset_seconds, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def allow(self):
+        """是否放行本次调用；熔断冷却期后只放行一个试探请求"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self._clock() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = self._clock()
+
+
+class LatencyHistogram:
+    """调用耗时直方图"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, elapsed_ms):
+        index = len(self.buckets)
+        for i, upper in enumerate(self.buckets):
+            if elapsed_ms <= upper:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def percentile(self, fraction):
+        """按桶估算的分位数（返回所在桶的上限，超过最大桶时返回最大耗时）"""
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for upper, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return float(upper)
+        return round(self.max_ms, 1)
+
+    def snapshot(self):
+        labels = [f'le_{upper}' for upper in self.buckets] + ['inf']
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total_ms / self.count, 1) if self.count else 0.0,
+            'max_ms': round(self.max_ms, 1),
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'buckets': dict(zip(labels, self.counts)),
+        }
+
+
+class GatewayGuard:
+    """网关调用的熔断与耗时统计"""
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._breakers = {}
+        self._histograms = {}
+        self._outcomes = {}
+
+    def breaker(self, gateway):
+        with self._lock:
+            if gateway not in self._breakers:
+                self._breakers[gateway] = CircuitBreaker(self.failure_threshold, self.reset_seconds)
+            return self._breakers[gateway]
+
+    def _observe(self, gateway, operation, outcome, elapsed_ms):
+        with self._lock:
+            key = (gateway, operation)
+            if key not in self._histograms:
+                self._histograms[key] = LatencyHistogram()
+            if outcome != 'rejected':
+                self._histograms[key].observe(elapsed_ms)
+            outcomes = self._outcomes.setdefault(key, {})
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    def call(self, gateway, operation, fn):
+        """调用网关；熔断中抛出GatewayUnavailable，网关异常原样抛出"""
+        breaker = self.breaker(gateway)
+        if not breaker.allow():
+            self._observe(gateway, operation, 'rejected', 0)
+            raise GatewayUnavailable(f"{gateway}网关暂时不可用，请稍后重试")
+
+        started = time.perf_counter()
+        try:
+            result = fn()
+        except Exception as e:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if is_transport_error(e):
+                breaker.record_failure()
+                self._observe(gateway, operation, 'transport_error', elapsed_ms)
+            else:
+                # 业务错误说明网关可用
+                breaker.record_success()
+                self._observe(gateway, operation, 'error', elapsed_ms)
+            raise
+        breaker.record_success()
+        self._observe(gateway, operation, 'ok', (time.perf_counter() - started) * 1000)
+        return result
+
+    def stats(self):
+        """各网关的熔断状态和各接口的耗时直方图"""
+        with self._lock:
+            breakers = dict(self._breakers)
+            calls = {f'{gateway}.{operation}': dict(histogram.snapshot(), outcomes=dict(self._outcomes[(gateway, operation)]))
+                     for (gateway, operation), histogram in self._histograms.items()}
+        return {
+            'breakers': {gateway: {'state': breaker.state, 'failures': breaker.failures}
+                         for gateway, breaker in breakers.items()},
+            'calls': calls,
+        }
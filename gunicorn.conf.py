@@ -7,7 +7,10 @@ import multiprocessing
 # 基本配置
 bind = "0.0.0.0:5000"
 workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"
+# 支付页面的状态推送是长连接，使用线程工作模式，避免每个连接独占一个进程
+worker_class = "gthread"
+# 每个推送连接占用一个线程，PAYMENT_EVENT_MAX_STREAMS限制其数量，其余线程处理普通请求
+threads = 16
 worker_connections = 1000
 max_requests = 1000
 max_requests_jitter = 100
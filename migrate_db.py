@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
 """
 数据库迁移脚本 - 添加支付功能支持（包括收款账户管理）
+创建缺失的表，执行带版本号的结构迁移，并输出热点查询迁移前后的执行计划
 """
 
 from app import create_app
 from models import db
+from migrations import run_migrations, collect_query_plans, format_plan_report
+from stats_counters import reconcile_counters
+from submission_storage import STORAGE_JSON, get_storage_mode, backfill_payloads, ensure_filterable_indexes
 import os
 
 def migrate_database():
@@ -17,6 +21,32 @@ def migrate_database():
             
             # 创建所有表（包括新的PaymentOrder表）
             db.create_all()
+
+            # 已有表的结构变更（如补充索引）按版本执行
+            before_plans = collect_query_plans(db.engine)
+            applied = run_migrations(db.engine)
+            after_plans = collect_query_plans(db.engine)
+
+            if applied:
+                for version, name in applied:
+                    print(f"  ✅ 已应用迁移 {version}: {name}")
+            else:
+                print("  ℹ️ 没有需要执行的结构迁移")
+
+            # 可筛选字段的JSON表达式索引
+            with db.engine.begin() as conn:
+                indexed_fields = ensure_filterable_indexes(conn)
+            if indexed_fields:
+                print(f"  ✅ 可筛选字段索引: {', '.join(indexed_fields)}")
+
+            # JSON存储方式下，将已有的SubmissionData合并为每条提交一行的payload
+            if get_storage_mode() == STORAGE_JSON:
+                merged = backfill_payloads(db.engine)
+                print(f"  ✅ 已将 {merged} 条提交记录的数据合并为JSON文档")
+
+            # 初始化或校准统计计数器
+            drift_totals, drift_daily = reconcile_counters()
+            print(f"  ✅ 统计计数器已校准（修正 {len(drift_totals)} 项总计、{len(drift_daily)} 项按日汇总）")
             
             print("✅ 数据库迁移完成！")
             print("📋 已创建的表包括：")
@@ -29,6 +59,15 @@ def migrate_database():
             print("  - UploadFile (上传文件表)")
             print("  - PaymentOrder (支付订单表) [新增]")
             print("  - PaymentAccount (收款账户表) [新增]")
+            print("  - ExportJob (后台导出任务表) [新增]")
+            print("  - PaymentCallback (支付回调去重表) [新增]")
+            print("  - PaymentEvent (支付状态通知表) [新增]")
+            print("  - SchemaMigration (迁移记录表) [新增]")
+            print("  - StatCounter / StatDailyCounter (统计计数器表) [新增]")
+            print("  - UploadSession (分块上传会话表) [新增]")
+            print("  - UploadBlob (附件内容寻址存储表) [新增]")
+            print()
+            print(format_plan_report(before_plans, after_plans))
             
         except Exception as e:
             print(f"❌ 数据库迁移失败: {str(e)}")
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+上传目录分片迁移脚本
+将上传目录根下的旧附件分批移入按文件名哈希分片的子目录（ab/cd/<文件名>），迁移期间网站照常运行：
+查找附件时先查分片位置，找不到再查根目录；每个文件的移动是一次原子重命名。
+可随时中断，再次运行时从剩余的文件继续。
+
+用法: python migrate_uploads.py [--batch-size 500] [--pause 0.2] [--dry-run]
+"""
+import argparse
+import os
+import sys
+import time
+
+from app import create_app
+
+
+def migrate_uploads(batch_size, pause, dry_run=False):
+    app = create_app()
+    store = app.extensions['upload_store']
+
+    with app.app_context():
+        if dry_run:
+            with os.scandir(store.root) as entries:
+                remaining = sum(1 for entry in entries
+                                if entry.is_file(follow_symlinks=False) and not entry.name.startswith('.'))
+            print(f"ℹ️ 上传目录根下有 {remaining} 个待迁移的文件: {store.root}")
+            return
+
+        print(f"🚀 开始迁移上传目录: {store.root}")
+        started = time.monotonic()
+        moved = 0
+        skipped = 0
+        for batch in store.iter_flat_batches(batch_size):
+            for name in batch:
+                if store.migrate_flat_file(name):
+                    moved += 1
+                else:
+                    skipped += 1
+            print(f"  ✅ 已迁移 {moved} 个文件（{moved / max(time.monotonic() - started, 0.001):.0f} 个/秒）")
+            # 每批之间暂停，减少对线上请求的磁盘IO影响
+            time.sleep(pause)
+
+        print(f"✅ 迁移完成：移动 {moved} 个文件，跳过 {skipped} 个迁移期间已删除的文件，"
+              f"用时 {time.monotonic() - started:.1f} 秒")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='上传目录分片迁移')
+    parser.add_argument('--batch-size', type=int, default=500, help='每批移动的文件数')
+    parser.add_argument('--pause', type=float, default=0.2, help='每批之间暂停的秒数')
+    parser.add_argument('--dry-run', action='store_true', help='只统计待迁移的文件数')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    migrate_uploads(args.batch_size, args.pause, args.dry_run)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+数据库版本迁移
+db.create_all()只会创建缺失的表，不会修改已有表（如补充索引），
+因此对已有表的结构变更以带版本号的迁移登记在MIGRATIONS中，
+执行后记录到schema_migration表，重复执行时自动跳过已应用的版本。
+支持SQLite和PostgreSQL。
+"""
+
+from datetime import datetime
+
+from sqlalchemy import insert, inspect, select, text
+from sqlalchemy.schema import CreateColumn
+
+from models import db, SchemaMigration
+
+
+def _find_index(name):
+    """按名称查找模型中定义的索引"""
+    for table in db.metadata.tables.values():
+        for index in table.indexes:
+            if index.name == name:
+                return index
+    raise KeyError(f"模型中未定义索引: {name}")
+
+
+def create_indexes(*names):
+    """生成创建索引的迁移步骤（索引定义以models中的__table_args__为准）"""
+    def upgrade(conn):
+        for name in names:
+            _find_index(name).create(conn, checkfirst=True)
+    return upgrade
+
+
+def add_columns(table_name, *column_names):
+    """生成为已有表补充列的迁移步骤（列定义以models为准，已存在的列跳过）"""
+    def upgrade(conn):
+        table = db.metadata.tables[table_name]
+        existing = {column['name'] for column in inspect(conn).get_columns(table_name)}
+        for name in column_names:
+            if name in existing:
+                continue
+            # 列定义（类型、默认值、NOT NULL）按模型生成，带默认值的列添加后已有行取默认值
+            column_ddl = CreateColumn(table.c[name]).compile(dialect=conn.dialect)
+            conn.execute(text(f'ALTER TABLE {conn.dialect.identifier_preparer.format_table(table)} ADD COLUMN {column_ddl}'))
+    return upgrade
+
+
+def run_steps(*steps):
+    def upgrade(conn):
+        for step in steps:
+            step(conn)
+    return upgrade
+
+
+# (版本号, 说明, 迁移函数)，版本号只增不改
+MIGRATIONS = [
+    (1, '热点查询复合索引', create_indexes(
+        'ix_submission_form_user',
+        'ix_submission_form_submitted',
+        'ix_submission_user_submitted',
+        'ix_submission_data_submission_field',
+        'ix_upload_file_submission',
+        'ix_payment_order_status_type',
+        'ix_payment_order_submission_status',
+    )),
+    (2, '提交数据JSON存储方式', run_steps(
+        add_columns('submission', 'payload'),
+        add_columns('form_field', 'is_filterable'),
+    )),
+    (3, '表单字段结构版本', add_columns('form', 'schema_version')),
+    (4, '待支付订单后台对账', add_columns('payment_order', 'reconcile_attempts', 'next_reconcile_at')),
+    (5, '支付订单列表按创建时间分页', create_indexes('ix_payment_order_created')),
+    (6, '附件内容寻址存储', run_steps(
+        add_columns('upload_file', 'blob_hash'),
+        create_indexes('ix_upload_file_blob'),
+    )),
+    (7, '用户列表按注册时间分页', create_indexes('ix_user_created_id')),
+]
+
+
+def get_applied_versions(engine):
+    SchemaMigration.__table__.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        return set(conn.execute(select(SchemaMigration.__table__.c.version)).scalars())
+
+
+def run_migrations(engine, migrations=MIGRATIONS):
+    """执行尚未应用的迁移，返回本次应用的(版本号, 说明)列表
+
+    每个版本在独立事务中执行并登记，某个版本失败时已成功的版本保持已应用状态。
+    """
+    applied = get_applied_versions(engine)
+    applied_now = []
+    for version, name, upgrade in sorted(migrations, key=lambda m: m[0]):
+        if version in applied:
+            continue
+        with engine.begin() as conn:
+            upgrade(conn)
+            conn.execute(insert(SchemaMigration.__table__).values(
+                version=version, name=name, applied_at=datetime.utcnow()))
+        applied_now.append((version, name))
+    return applied_now
+
+
+# 热点查询：(说明, SQL, 示例参数)，用于迁移前后的执行计划对比
+HOT_QUERIES = [
+    ('重复提交检查', 'SELECT id FROM submission WHERE form_id = :form_id AND user_id = :user_id LIMIT 1',
+     {'form_id': 1, 'user_id': 1}),
+    ('表单提交列表', 'SELECT id FROM submission WHERE form_id = :form_id ORDER BY submitted_at DESC LIMIT 20',
+     {'form_id': 1}),
+    ('个人中心提交记录', 'SELECT id FROM submission WHERE user_id = :user_id ORDER BY submitted_at DESC',
+     {'user_id': 1}),
+    ('提交数据读取', 'SELECT field_name, field_value FROM submission_data WHERE submission_id = :submission_id',
+     {'submission_id': 1}),
+    ('提交附件读取', 'SELECT id FROM upload_file WHERE submission_id = :submission_id',
+     {'submission_id': 1}),
+    ('支付统计', 'SELECT COUNT(*) FROM payment_order WHERE status = :status AND payment_type = :payment_type',
+     {'status': 'paid', 'payment_type': 'wechat_pay'}),
+    ('待支付订单', 'SELECT id FROM payment_order WHERE submission_id = :submission_id AND status = :status',
+     {'submission_id': 1, 'status': 'pending'}),
+    ('支付订单列表', 'SELECT id FROM payment_order WHERE created_at >= :start AND created_at < :end '
+                 'ORDER BY created_at DESC, id DESC LIMIT 21',
+     {'start': '2024-01-01 00:00:00', 'end': '2024-02-01 00:00:00'}),
+    ('用户列表', 'SELECT id FROM "user" ORDER BY created_at DESC, id DESC LIMIT 21', {}),
+]
+
+
+def explain_query(conn, sql, params):
+    """返回查询的执行计划文本"""
+    dialect = conn.dialect.name
+    if dialect == 'sqlite':
+        rows = conn.execute(text(f'EXPLAIN QUERY PLAN {sql}'), params).fetchall()
+        return '; '.join(str(row[-1]) for row in rows)
+    if dialect == 'postgresql':
+        rows = conn.execute(text(f'EXPLAIN {sql}'), params).fetchall()
+        return '; '.join(str(row[0]).strip() for row in rows)
+    return f'不支持的数据库类型: {dialect}'
+
+
+def collect_query_plans(engine):
+    """收集全部热点查询的执行计划，返回{说明: 执行计划}"""
+    plans = {}
+    with engine.connect() as conn:
+        for name, sql, params in HOT_QUERIES:
+            try:
+                plans[name] = explain_query(conn, sql, params)
+            except Exception as e:
+                conn.rollback()
+                plans[name] = f'无法获取执行计划: {str(e)}'
+    return plans
+
+
+def format_plan_report(before, after):
+    """生成迁移前后执行计划对比报告"""
+    lines = ['热点查询执行计划对比', '=' * 40]
+    for name, sql, _ in HOT_QUERIES:
+        lines.append(f'[{name}] {sql}')
+        lines.append(f'  迁移前: {before.get(name, "-")}')
+        lines.append(f'  迁移后: {after.get(name, "-")}')
+    return '\n'.join(lines)
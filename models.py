@@ -16,6 +16,10 @@ class User(UserMixin, db.Model):
     name = db.Column(db.String(100), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
+
+    __table_args__ = (
+        db.Index('ix_user_created_id', 'created_at', 'id'),  # 后台用户列表按注册时间分页
+    )
     
     # 关联提交记录
     submissions = db.relationship('Submission', backref='user', lazy=True)
@@ -65,6 +69,7 @@ class Form(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
     allow_multiple_submissions = db.Column(db.Boolean, default=False)  # 是否允许多次填写
+    schema_version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # 字段结构版本，修改字段后递增以刷新表单类缓存
     created_by = db.Column(db.Integer, db.ForeignKey('admin.id'), nullable=False)
     
     # 关联字段和提交记录
@@ -86,6 +91,7 @@ class FormField(db.Model):
     field_type = db.Column(db.String(50), nullable=False)  # text, email, tel, textarea, select, radio, checkbox, file, wechat_pay, alipay
     field_options = db.Column(db.Text)  # JSON格式存储选项
     is_required = db.Column(db.Boolean, default=False)
+    is_filterable = db.Column(db.Boolean, default=False)  # 是否可按该字段筛选（JSON存储方式下建立表达式索引）
     order_index = db.Column(db.Integer, default=0)
     placeholder = db.Column(db.String(200))
     payment_account_id = db.Column(db.Integer, db.ForeignKey('payment_account.id'))  # 关联收款账户（仅限支付字段）
@@ -114,12 +120,21 @@ class Submission(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     submitted_at = db.Column(db.DateTime, default=datetime.utcnow)
     status = db.Column(db.String(20), default='submitted')  # submitted, reviewed, approved, rejected
+    payload = db.Column(db.JSON)  # JSON存储方式下的完整答卷{字段名: 值}，EAV存储方式下为空
+
+    __table_args__ = (
+        db.Index('ix_submission_form_user', 'form_id', 'user_id'),  # 重复提交检查
+        db.Index('ix_submission_form_submitted', 'form_id', 'submitted_at'),  # 表单提交列表
+        db.Index('ix_submission_user_submitted', 'user_id', 'submitted_at'),  # 用户个人中心
+    )
     
     # 关联提交数据
     data = db.relationship('SubmissionData', backref='submission', lazy=True, cascade='all, delete-orphan')
     files = db.relationship('UploadFile', backref='submission', lazy=True, cascade='all, delete-orphan')
     
     def get_data_dict(self):
+        if self.payload is not None:
+            return dict(self.payload)
         result = {}
         for data in self.data:
             result[data.field_name] = data.field_value
@@ -134,6 +149,10 @@ class SubmissionData(db.Model):
     submission_id = db.Column(db.Integer, db.ForeignKey('submission.id'), nullable=False)
     field_name = db.Column(db.String(100), nullable=False)
     field_value = db.Column(db.Text)
+
+    __table_args__ = (
+        db.Index('ix_submission_data_submission_field', 'submission_id', 'field_name'),
+    )
     
     def __repr__(self):
         return f'<SubmissionData {self.field_name}>'
@@ -147,11 +166,57 @@ class UploadFile(db.Model):
     saved_filename = db.Column(db.String(255), nullable=False)
     file_size = db.Column(db.Integer)
     file_type = db.Column(db.String(100))
+    blob_hash = db.Column(db.String(64), db.ForeignKey('upload_blob.hash'))  # 内容寻址存储的文件，旧附件为空
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_upload_file_submission', 'submission_id'),
+        db.Index('ix_upload_file_blob', 'blob_hash'),
+    )
     
     def __repr__(self):
         return f'<UploadFile {self.original_filename}>'
 
+class UploadBlob(db.Model):
+    """按内容寻址保存的附件文件（相同内容只保存一份）"""
+    hash = db.Column(db.String(64), primary_key=True)  # 文件内容的SHA-256
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)  # 引用该文件的附件记录数
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<UploadBlob {self.hash[:12]} x{self.ref_count}>'
+
+class UploadSession(db.Model):
+    """分块上传会话（文件内容写入暂存文件，提交表单时转为UploadFile）"""
+    id = db.Column(db.String(32), primary_key=True)  # 上传ID（uuid）
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    form_id = db.Column(db.Integer, db.ForeignKey('form.id'), nullable=False)
+    field_name = db.Column(db.String(100), nullable=False)
+    original_filename = db.Column(db.String(255), nullable=False)
+    file_type = db.Column(db.String(100))
+    total_size = db.Column(db.BigInteger, nullable=False)  # 声明的文件大小
+    received_size = db.Column(db.BigInteger, nullable=False, default=0)  # 已确认写入暂存文件的字节数
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    @property
+    def is_complete(self):
+        return self.received_size == self.total_size
+
+    def to_dict(self):
+        return {
+            'upload_id': self.id,
+            'field_name': self.field_name,
+            'filename': self.original_filename,
+            'size': self.total_size,
+            'offset': self.received_size,
+            'complete': self.is_complete,
+        }
+
+    def __repr__(self):
+        return f'<UploadSession {self.id} {self.received_size}/{self.total_size}>'
+
 class PaymentOrder(db.Model):
     """支付订单模型"""
     id = db.Column(db.Integer, primary_key=True)
@@ -166,6 +231,14 @@ class PaymentOrder(db.Model):
     paid_at = db.Column(db.DateTime)
     payment_data = db.Column(db.Text)  # JSON格式存储支付相关数据
     payment_account_id = db.Column(db.Integer, db.ForeignKey('payment_account.id'))  # 关联收款账户
+    reconcile_attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # 后台对账查询次数
+    next_reconcile_at = db.Column(db.DateTime)  # 下次对账查询时间（按查询次数指数退避）
+
+    __table_args__ = (
+        db.Index('ix_payment_order_status_type', 'status', 'payment_type'),  # 支付统计
+        db.Index('ix_payment_order_submission_status', 'submission_id', 'status'),  # 待支付订单查询
+        db.Index('ix_payment_order_created', 'created_at', 'id'),  # 支付订单列表分页和日期范围筛选
+    )
     
     # 关联提交记录和收款账户
     submission = db.relationship('Submission', backref='payment_orders', lazy=True)
@@ -217,3 +290,113 @@ class PaymentAccount(db.Model):
     
     def __repr__(self):
         return f'<PaymentAccount {self.account_name}>'
+
+class ExportJob(db.Model):
+    """后台导出任务模型"""
+    id = db.Column(db.String(32), primary_key=True)  # 任务ID（uuid）
+    job_type = db.Column(db.String(50), nullable=False)  # form_submissions, users, system
+    params = db.Column(db.Text)  # JSON格式存储导出参数
+    status = db.Column(db.String(20), default='queued', index=True)  # queued, running, completed, failed
+    rows_done = db.Column(db.Integer, default=0)  # 已处理行数
+    rows_total = db.Column(db.Integer)  # 总行数（未知时为空）
+    output_path = db.Column(db.String(500))  # 导出文件路径
+    output_filename = db.Column(db.String(255))  # 下载文件名
+    output_mimetype = db.Column(db.String(100))
+    output_size = db.Column(db.Integer)
+    error_message = db.Column(db.Text)
+    attempts = db.Column(db.Integer, default=0)  # 执行次数（进程重启后会重新执行）
+    worker_id = db.Column(db.String(100))  # 执行该任务的进程标识
+    created_by = db.Column(db.Integer, db.ForeignKey('admin.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+
+    def get_params(self):
+        if self.params:
+            try:
+                return json.loads(self.params)
+            except:
+                return {}
+        return {}
+
+    def set_params(self, params):
+        self.params = json.dumps(params, ensure_ascii=False)
+
+    def to_dict(self):
+        """任务进度信息"""
+        progress = None
+        if self.rows_total:
+            progress = round(min(self.rows_done or 0, self.rows_total) * 100.0 / self.rows_total, 1)
+        return {
+            'job_id': self.id,
+            'job_type': self.job_type,
+            'status': self.status,
+            'rows_done': self.rows_done or 0,
+            'rows_total': self.rows_total,
+            'progress': progress,
+            'filename': self.output_filename,
+            'size': self.output_size,
+            'error': self.error_message,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+    def __repr__(self):
+        return f'<ExportJob {self.id} {self.status}>'
+
+class PaymentCallback(db.Model):
+    """已处理的支付回调（按网关交易号去重）"""
+    id = db.Column(db.Integer, primary_key=True)
+    gateway = db.Column(db.String(20), nullable=False)  # wechat, alipay
+    transaction_id = db.Column(db.String(64), nullable=False)  # 网关交易号
+    order_no = db.Column(db.String(64), nullable=False, index=True)
+    result = db.Column(db.String(20), nullable=False)  # paid: 本次回调完成支付; already_paid: 订单此前已支付
+    response = db.Column(db.Text, nullable=False)  # 返回给网关的应答，重复回调直接返回
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('gateway', 'transaction_id', name='uq_payment_callback_transaction'),
+    )
+
+    def __repr__(self):
+        return f'<PaymentCallback {self.gateway}:{self.transaction_id}>'
+
+class PaymentEvent(db.Model):
+    """支付订单状态变更通知（各工作进程轮询此表推送给订阅的页面）"""
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<PaymentEvent {self.order_id} {self.status}>'
+
+class StatCounter(db.Model):
+    """统计计数器（随写操作增量维护，管理后台直接读取）"""
+    name = db.Column(db.String(100), primary_key=True)  # 如 users.total、payments.status.paid
+    value = db.Column(db.Numeric(20, 2), nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<StatCounter {self.name}={self.value}>'
+
+class StatDailyCounter(db.Model):
+    """按日汇总的统计计数器（日期为北京时间）"""
+    name = db.Column(db.String(100), primary_key=True)  # 如 users.registered、submissions.created
+    day = db.Column(db.Date, primary_key=True)
+    value = db.Column(db.Numeric(20, 2), nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<StatDailyCounter {self.name}@{self.day}={self.value}>'
+
+class SchemaMigration(db.Model):
+    """已执行的数据库迁移记录"""
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<SchemaMigration {self.version}>'
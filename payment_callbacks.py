@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+支付回调入账
+支付网关会多次重试回调，多个工作进程可能同时收到同一笔交易的回调。
+- 每笔交易先在PaymentCallback表中登记（网关+交易号唯一），登记成功的请求才处理订单；
+  重复回调直接返回第一次保存的应答，不再读取或修改订单
+- 订单状态以条件UPDATE（WHERE status=原状态）更新，PostgreSQL下先SELECT … FOR UPDATE
+  锁定订单行，只有一个事务能把订单从待支付改为已支付
+- 订单不存在或状态异常时不登记，回滚后返回失败应答，网关稍后重试
+- 对账任务在网关上没有交易、无法关闭时取消的订单带有LATE_PAYMENT_MARK标记，
+  用户随后完成支付时仍可改为已支付
+"""
+
+import json
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, PaymentOrder, PaymentCallback
+from payment_events import publish_payment_event
+from stats_counters import collect_update_deltas, apply_counter_deltas
+
+# 支付成功回调的应答
+WECHAT_SUCCESS_RESPONSE = '<xml><return_code><![CDATA[SUCCESS]]></return_code><return_msg><![CDATA[OK]]></return_msg></xml>'
+ALIPAY_SUCCESS_RESPONSE = 'success'
+
+# 可由回调改为已支付的订单状态
+PAYABLE_STATUSES = ('pending', 'processing')
+
+# 订单payment_data中的标记：订单在本地取消时网关上的交易未能关闭，仍接受已验签的支付结果
+LATE_PAYMENT_MARK = 'accepts_late_payment'
+
+# 处理结果：paid 本次完成支付；already_paid 订单此前已支付；duplicate 重复回调；
+# not_found 订单不存在；rejected 订单状态不允许支付
+CallbackOutcome = namedtuple('CallbackOutcome', ['result', 'response'])
+
+
+def cached_response(gateway, transaction_id):
+    """已登记交易的应答，未登记时返回None"""
+    table = PaymentCallback.__table__
+    return db.session.execute(
+        select(table.c.response).where(table.c.gateway == gateway, table.c.transaction_id == transaction_id)
+    ).scalar()
+
+
+def _load_payment_data(raw):
+    if raw:
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return {}
+    return {}
+
+
+def _accepts_transition(order, new_status):
+    if order.status in PAYABLE_STATUSES:
+        return True
+    # 本地已取消但网关上未关闭的订单，用户仍可能完成支付
+    return (new_status == 'paid' and order.status == 'cancelled'
+            and bool(_load_payment_data(order.payment_data).get(LATE_PAYMENT_MARK)))
+
+
+def _transition_order(conn, order_no, new_status, extra_data, values):
+    """以条件UPDATE将可支付状态的订单改为new_status
+
+    返回(是否由本事务完成变更, 订单当前状态)，订单不存在时状态为None。
+    计数器和状态通知在同一事务中写入。
+    """
+    table = PaymentOrder.__table__
+    order = conn.execute(
+        select(table.c.id, table.c.status, table.c.amount, table.c.payment_type,
+               table.c.created_at, table.c.payment_data)
+        .where(table.c.order_no == order_no)
+        .with_for_update()
+    ).first()
+    if order is None:
+        return False, None
+
+    if _accepts_transition(order, new_status):
+        payment_data = _load_payment_data(order.payment_data)
+        payment_data.pop(LATE_PAYMENT_MARK, None)
+        payment_data.update(extra_data)
+        result = conn.execute(
+            update(table)
+            .where(table.c.id == order.id, table.c.status == order.status)
+            .values(status=new_status, payment_data=json.dumps(payment_data, ensure_ascii=False), **values)
+        )
+        if result.rowcount == 1:
+            # 计数器由ORM会话事件维护，直接更新时在同一事务中补上
+            old_row = {'created_at': order.created_at, 'status': order.status,
+                       'amount': order.amount, 'payment_type': order.payment_type}
+            totals, daily = collect_update_deltas(PaymentOrder, old_row, dict(old_row, status=new_status))
+            apply_counter_deltas(conn, totals, daily)
+            publish_payment_event(conn, order.id, new_status)
+            return True, new_status
+
+    return False, conn.execute(select(table.c.status).where(table.c.id == order.id)).scalar()
+
+
+def mark_order_paid(conn, order_no, transaction_id, extra_data):
+    """在给定连接的事务中将订单改为已支付
+
+    extra_data合并到订单的payment_data中。返回订单此时的状态结果：
+    paid 由本事务完成支付（包括带有LATE_PAYMENT_MARK的已取消订单）；already_paid 订单此前已支付；
+    not_found 订单不存在；rejected 订单状态不允许支付。
+    """
+    changed, status = _transition_order(conn, order_no, 'paid', extra_data,
+                                        {'trade_no': transaction_id, 'paid_at': datetime.utcnow()})
+    if status is None:
+        return 'not_found'
+    if changed:
+        return 'paid'
+    return 'already_paid' if status == 'paid' else 'rejected'
+
+
+def close_unpaid_order(conn, order_no, status, extra_data):
+    """将仍待支付的订单改为failed或cancelled，返回是否由本事务完成变更"""
+    changed, _ = _transition_order(conn, order_no, status, extra_data, {})
+    return changed
+
+
+def ingest_payment_callback(gateway, transaction_id, order_no, callback_data, success_response):
+    """处理一次已验签的支付成功回调，返回CallbackOutcome
+
+    response为None时表示未处理，调用方返回失败应答。
+    """
+    response = cached_response(gateway, transaction_id)
+    if response is not None:
+        return CallbackOutcome('duplicate', response)
+
+    callback_table = PaymentCallback.__table__
+    try:
+        conn = db.session.connection()
+        # 先登记交易：并发的重复回调在唯一约束上等待，第一个事务提交后其余均插入失败
+        conn.execute(insert(callback_table).values(
+            gateway=gateway, transaction_id=transaction_id, order_no=order_no,
+            result='paid', response=success_response, received_at=datetime.utcnow()
+        ))
+
+        result = mark_order_paid(conn, order_no, transaction_id, {
+            'callback_data': callback_data,
+            'callback_time': datetime.utcnow().isoformat(),
+            'payment_method': gateway
+        })
+        if result == 'already_paid':
+            conn.execute(update(callback_table)
+                         .where(callback_table.c.gateway == gateway,
+                                callback_table.c.transaction_id == transaction_id)
+                         .values(result=result))
+        elif result != 'paid':
+            db.session.rollback()
+            return CallbackOutcome(result, None)
+
+        db.session.commit()
+        return CallbackOutcome(result, success_response)
+
+    except IntegrityError:
+        # 其他请求已登记同一笔交易
+        db.session.rollback()
+        response = cached_response(gateway, transaction_id)
+        if response is None:
+            raise
+        return CallbackOutcome('duplicate', response)
+    except Exception:
+        db.session.rollback()
+        raise
@@ -19,6 +19,8 @@ from wechatpy.exceptions import WeChatPayException
 from alipay import AliPay
 from alipay.utils import AliPayConfig
 
+from gateway_clients import GatewayGuard, GatewayUnavailable, PooledAliPay, create_http_session
+
 logger = logging.getLogger(__name__)
 
 
@@ -34,6 +36,21 @@ class PaymentResult:
     qr_code: str = None  # 支付二维码内容
 
 
+class GatewayTransportConfig:
+    """支付网关连接配置"""
+
+    def __init__(self):
+        self.connect_timeout = float(os.getenv('PAYMENT_GATEWAY_CONNECT_TIMEOUT', '3'))  # 连接超时（秒）
+        self.read_timeout = float(os.getenv('PAYMENT_GATEWAY_READ_TIMEOUT', '10'))  # 读取超时（秒）
+        self.pool_size = int(os.getenv('PAYMENT_GATEWAY_POOL_SIZE', '16'))  # 每个网关保持的连接数
+        self.breaker_failures = int(os.getenv('PAYMENT_GATEWAY_BREAKER_FAILURES', '5'))  # 连续失败多少次后熔断
+        self.breaker_reset_seconds = float(os.getenv('PAYMENT_GATEWAY_BREAKER_RESET_SECONDS', '30'))  # 熔断冷却时间
+
+    @property
+    def timeout(self):
+        return (self.connect_timeout, self.read_timeout)
+
+
 class WeChatPayConfig:
     """微信支付配置类"""
     
@@ -52,15 +69,19 @@ class WeChatPayConfig:
         # 是否为沙箱环境
         self.sandbox = os.getenv('WECHAT_SANDBOX', 'true').lower() == 'true'
     
-    def get_wechat_pay_client(self) -> Optional[WeChatPay]:
+    def get_wechat_pay_client(self, http=None, timeout=None) -> Optional[WeChatPay]:
         """获取微信支付客户端"""
         try:
-            return WeChatPay(
+            client = WeChatPay(
                 appid=self.app_id,
                 mch_id=self.mch_id,
                 api_key=self.mch_key,  # 使用api_key参数
+                timeout=timeout,
                 sandbox=self.sandbox
             )
+            if http is not None:
+                client._http = http  # 使用共用的连接池
+            return client
         except Exception as e:
             logger.warning(f"微信支付客户端初始化失败: {str(e)}")
             return None
@@ -101,7 +122,7 @@ class AlipayConfig:
         # 在实际开发环境中，这里返回空字符串，让支付功能不可用但不会崩溃
         return ""
     
-    def get_alipay_client(self) -> Optional[AliPay]:
+    def get_alipay_client(self, http=None, timeout=None) -> Optional[AliPay]:
         """获取支付宝客户端"""
         try:
             # 如果没有配置私钥，直接返回None
@@ -109,7 +130,9 @@ class AlipayConfig:
                 logger.info("支付宝私钥未配置，跳过支付宝客户端初始化")
                 return None
             
-            return AliPay(
+            return PooledAliPay(
+                http=http,
+                timeout=timeout,
                 appid=self.app_id,
                 app_notify_url=self.notify_url,
                 app_private_key_string=self.app_private_key,
@@ -128,13 +151,19 @@ class PaymentProcessor:
     def __init__(self):
         self.wechat_config = WeChatPayConfig()
         self.alipay_config = AlipayConfig()
+        self.transport_config = GatewayTransportConfig()
+
+        # 两个网关共用连接池；熔断和耗时统计按网关区分
+        self.http = create_http_session(self.transport_config.pool_size)
+        self.gateway_guard = GatewayGuard(self.transport_config.breaker_failures,
+                                          self.transport_config.breaker_reset_seconds)
         
         # 初始化支付客户端
         self.wechat_client = None
         self.alipay_client = None
         
         try:
-            self.wechat_client = self.wechat_config.get_wechat_pay_client()
+            self.wechat_client = self.wechat_config.get_wechat_pay_client(self.http, self.transport_config.timeout)
             if self.wechat_client:
                 logger.info("微信支付客户端初始化成功")
             else:
@@ -143,7 +172,7 @@ class PaymentProcessor:
             logger.warning(f"微信支付客户端初始化失败: {str(e)}")
         
         try:
-            self.alipay_client = self.alipay_config.get_alipay_client()
+            self.alipay_client = self.alipay_config.get_alipay_client(self.http, self.transport_config.timeout)
             if self.alipay_client:
                 logger.info("支付宝客户端初始化成功")
             else:
@@ -151,6 +180,30 @@ class PaymentProcessor:
         except Exception as e:
             logger.warning(f"支付宝客户端初始化失败: {str(e)}")
     
+    def _gateway_unavailable(self, error: GatewayUnavailable) -> PaymentResult:
+        """网关熔断中，直接返回失败，不占用工作线程等待"""
+        logger.warning(str(error))
+        return PaymentResult(
+            success=False,
+            message=str(error),
+            error_code="GATEWAY_UNAVAILABLE"
+        )
+
+    def reset_http(self):
+        """fork后的子进程不能复用父进程的连接，重新创建连接池"""
+        self.http = create_http_session(self.transport_config.pool_size)
+        if self.wechat_client:
+            self.wechat_client._http = self.http
+        if self.alipay_client:
+            self.alipay_client._http = self.http
+
+    def gateway_stats(self) -> Dict[str, Any]:
+        """网关调用统计（熔断状态和耗时直方图）"""
+        return dict(self.gateway_guard.stats(),
+                    timeout={'connect': self.transport_config.connect_timeout,
+                             'read': self.transport_config.read_timeout},
+                    pool_size=self.transport_config.pool_size)
+
     def create_wechat_payment(self, order_no: str, amount: float, description: str, 
                              user_openid: str = None) -> PaymentResult:
         """创建微信支付订单"""
@@ -181,7 +234,8 @@ class PaymentProcessor:
                 order_data['openid'] = user_openid
             
             # 调用微信支付API
-            result = self.wechat_client.order.create(**order_data)
+            result = self.gateway_guard.call('wechat', 'order.create',
+                                             lambda: self.wechat_client.order.create(**order_data))
             
             if result.get('return_code') == 'SUCCESS' and result.get('result_code') == 'SUCCESS':
                 payment_url = result.get('code_url')  # 二维码支付链接
@@ -203,6 +257,8 @@ class PaymentProcessor:
                     data=result
                 )
                 
+        except GatewayUnavailable as e:
+            return self._gateway_unavailable(e)
         except WeChatPayException as e:
             logger.error(f"微信支付异常: {str(e)}")
             return PaymentResult(
@@ -240,13 +296,8 @@ class PaymentProcessor:
             # 调用支付宝API生成支付URL
             payment_url = self.alipay_client.api_alipay_trade_page_pay(**order_data)
             
-            # 完整的支付链接
-            if self.alipay_config.sandbox:
-                base_url = "https://openapi.alipaydev.com/gateway.do?"
-            else:
-                base_url = "https://openapi.alipay.com/gateway.do?"
-            
-            full_payment_url = base_url + payment_url
+            # 完整的支付链接（网关地址与客户端一致：沙箱或正式环境）
+            full_payment_url = self.alipay_client._gateway + "?" + payment_url
             
             return PaymentResult(
                 success=True,
@@ -309,7 +360,8 @@ class PaymentProcessor:
                     error_code="CLIENT_ERROR"
                 )
             
-            result = self.wechat_client.order.query(out_trade_no=order_no)
+            result = self.gateway_guard.call('wechat', 'order.query',
+                                             lambda: self.wechat_client.order.query(out_trade_no=order_no))
             
             if result.get('return_code') == 'SUCCESS':
                 trade_state = result.get('trade_state')
@@ -328,6 +380,20 @@ class PaymentProcessor:
                     data=result
                 )
                 
+        except GatewayUnavailable as e:
+            return self._gateway_unavailable(e)
+        except WeChatPayException as e:
+            if not e.errcode:
+                # 没有业务错误码（网络错误或网关返回非200）按系统异常处理
+                logger.error(f"查询微信支付订单异常: {str(e)}")
+                return PaymentResult(success=False, message=f"查询异常: {str(e)}", error_code="SYSTEM_ERROR")
+            # result_code为FAIL时wechatpy抛出异常，如订单不存在(ORDERNOTEXIST)
+            logger.warning(f"查询微信支付订单失败: {str(e)}")
+            return PaymentResult(
+                success=False,
+                message=f"查询失败: {e.errmsg or e.return_msg}",
+                error_code=e.errcode
+            )
         except Exception as e:
             logger.error(f"查询微信支付订单异常: {str(e)}")
             return PaymentResult(
@@ -346,7 +412,8 @@ class PaymentProcessor:
                     error_code="CLIENT_ERROR"
                 )
             
-            result = self.alipay_client.api_alipay_trade_query(out_trade_no=order_no)
+            result = self.gateway_guard.call('alipay', 'trade.query',
+                                             lambda: self.alipay_client.api_alipay_trade_query(out_trade_no=order_no))
             
             if result.get('code') == '10000':
                 return PaymentResult(
@@ -363,6 +430,8 @@ class PaymentProcessor:
                     data=result
                 )
                 
+        except GatewayUnavailable as e:
+            return self._gateway_unavailable(e)
         except Exception as e:
             logger.error(f"查询支付宝支付订单异常: {str(e)}")
             return PaymentResult(
@@ -371,9 +440,87 @@ class PaymentProcessor:
                 error_code="SYSTEM_ERROR"
             )
 
+    def close_wechat_payment(self, order_no: str) -> PaymentResult:
+        """关闭微信支付订单，关闭后用户无法再付款；订单此前已关闭时也视为成功"""
+        try:
+            if not self.wechat_client:
+                return PaymentResult(
+                    success=False,
+                    message="微信支付客户端未初始化",
+                    error_code="CLIENT_ERROR"
+                )
+
+            result = self.gateway_guard.call('wechat', 'order.close',
+                                             lambda: self.wechat_client.order.close(order_no))
+
+            if result.get('return_code') == 'SUCCESS' and result.get('result_code') == 'SUCCESS':
+                return PaymentResult(success=True, message="关闭成功", data=result)
+            error_code = result.get('err_code', 'CLOSE_ERROR')
+            if error_code == 'ORDERCLOSED':
+                return PaymentResult(success=True, message="订单已关闭", data=result, error_code=error_code)
+            return PaymentResult(
+                success=False,
+                message=result.get('err_code_des', result.get('return_msg', '关闭失败')),
+                error_code=error_code,
+                data=result
+            )
+
+        except GatewayUnavailable as e:
+            return self._gateway_unavailable(e)
+        except WeChatPayException as e:
+            if e.errcode == 'ORDERCLOSED':
+                return PaymentResult(success=True, message="订单已关闭", error_code=e.errcode)
+            logger.warning(f"关闭微信支付订单失败: {str(e)}")
+            return PaymentResult(
+                success=False,
+                message=f"关闭失败: {e.errmsg or e.return_msg}",
+                error_code=e.errcode or "WECHAT_PAY_ERROR"
+            )
+        except Exception as e:
+            logger.error(f"关闭微信支付订单异常: {str(e)}")
+            return PaymentResult(
+                success=False,
+                message=f"关闭异常: {str(e)}",
+                error_code="SYSTEM_ERROR"
+            )
+
+    def close_alipay_payment(self, order_no: str) -> PaymentResult:
+        """关闭支付宝交易，关闭后用户无法再付款"""
+        try:
+            if not self.alipay_client:
+                return PaymentResult(
+                    success=False,
+                    message="支付宝客户端未初始化",
+                    error_code="CLIENT_ERROR"
+                )
+
+            result = self.gateway_guard.call('alipay', 'trade.close',
+                                             lambda: self.alipay_client.api_alipay_trade_close(out_trade_no=order_no))
+
+            if result.get('code') == '10000':
+                return PaymentResult(success=True, message="关闭成功", data=result)
+            return PaymentResult(
+                success=False,
+                message=result.get('sub_msg', result.get('msg', '关闭失败')),
+                error_code=result.get('code', 'CLOSE_ERROR'),
+                data=result
+            )
+
+        except GatewayUnavailable as e:
+            return self._gateway_unavailable(e)
+        except Exception as e:
+            logger.error(f"关闭支付宝交易异常: {str(e)}")
+            return PaymentResult(
+                success=False,
+                message=f"关闭异常: {str(e)}",
+                error_code="SYSTEM_ERROR"
+            )
+
 
 # 全局支付处理器实例
 payment_processor = PaymentProcessor()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=payment_processor.reset_http)
 
 
 def get_payment_processor() -> PaymentProcessor:
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+支付状态推送
+支付页面原先每3秒请求一次/payment/query，现改为通过SSE订阅订单状态，
+每个待支付页面只保持一个长连接。
+- 订单状态变更时在同一事务中写入一条PaymentEvent通知（publish_payment_event）
+- 每个工作进程一个后台线程，有订阅时每隔PAYMENT_EVENT_POLL_SECONDS秒按ID增量读取一次
+  通知表，唤醒订阅了对应订单的连接；数据库查询次数与订阅数无关，跨gunicorn工作进程有效
+- PostgreSQL的自增ID在插入时分配、按提交顺序可见，较小的ID可能晚于较大的ID提交。
+  每次轮询回读已读最大ID以下ID_OVERLAP条范围内的通知，按ID去重后推送；
+  超出回读范围才提交的通知不会推送，由推送连接每HEARTBEAT_SECONDS秒一次的兜底查询发现
+- 推送连接在整个期间占用一个gthread线程，每个工作进程同时保持的连接数不超过
+  PAYMENT_EVENT_MAX_STREAMS，超出时页面改为轮询；单个连接PAYMENT_EVENT_STREAM_SECONDS秒后结束，
+  页面重新连接
+- 通知保留一小时后清理
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select
+
+from models import db, PaymentEvent
+
+logger = logging.getLogger(__name__)
+
+
+def publish_payment_event(conn, order_id, status):
+    """在给定连接的事务中登记订单状态变更，随事务提交后推送"""
+    conn.execute(insert(PaymentEvent.__table__).values(order_id=order_id, status=status,
+                                                       created_at=datetime.utcnow()))
+
+
+class Subscription:
+    """一个连接对某订单的订阅"""
+
+    def __init__(self, order_id):
+        self.order_id = order_id
+        self.status = None
+        self._event = threading.Event()
+
+    def deliver(self, status):
+        self.status = status
+        self._event.set()
+
+    def wait(self, timeout):
+        """等待状态变更通知，收到时返回True并重置"""
+        if not self._event.wait(timeout):
+            return False
+        self._event.clear()
+        return True
+
+
+class PaymentEventBroker:
+    """按工作进程分发支付状态通知的扩展"""
+
+    HEARTBEAT_SECONDS = 15  # 推送连接无通知时的心跳与兜底检查间隔
+    ID_OVERLAP = 200  # 每次轮询回读的ID范围，覆盖并发事务中晚提交的较小ID
+    RETENTION_SECONDS = 3600
+    CLEANUP_INTERVAL_SECONDS = 600
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._last_id = None
+        self._seen_ids = set()  # 回读范围内已推送的通知ID
+        self._last_cleanup = float('-inf')
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.poll_interval = app.config['PAYMENT_EVENT_POLL_SECONDS']
+        self.stream_seconds = app.config['PAYMENT_EVENT_STREAM_SECONDS']
+        self.max_streams = app.config['PAYMENT_EVENT_MAX_STREAMS']
+        app.extensions['payment_events'] = self
+
+    def ensure_started(self):
+        """确保当前进程的通知轮询线程已启动（线程不会随fork复制，按进程号延迟启动）"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._subscribers = {}
+            self._last_id = None
+            self._seen_ids = set()
+            self._wake = threading.Event()
+            thread = threading.Thread(target=self._poll_loop, name='payment-events', daemon=True)
+            thread.start()
+
+    def subscribe(self, order_id):
+        """订阅订单的状态变更
+
+        订阅后再读取订单当前状态，两者之间提交的变更也会推送，不会遗漏。
+        本进程的订阅数已达PAYMENT_EVENT_MAX_STREAMS时返回None，调用方应改为轮询。
+        """
+        self.ensure_started()
+        subscription = Subscription(order_id)
+        with self._lock:
+            if sum(len(subscribers) for subscribers in self._subscribers.values()) >= self.max_streams:
+                return None
+            if self._last_id is None:
+                self._last_id, self._seen_ids = self._read_start()
+            self._subscribers.setdefault(order_id, set()).add(subscription)
+        self._wake.set()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.order_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.order_id]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def _read_start(self):
+        """读取轮询起点：已有通知的最大ID，以及回读范围内已有的通知ID（订阅前的通知不推送）"""
+        table = PaymentEvent.__table__
+        with db.engine.connect() as conn:
+            last_id = conn.execute(select(func.coalesce(func.max(table.c.id), 0))).scalar()
+            seen_ids = set(conn.execute(
+                select(table.c.id).where(table.c.id > last_id - self.ID_OVERLAP)
+            ).scalars())
+        return last_id, seen_ids
+
+    def _poll_loop(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    self._poll_once()
+                    self._cleanup_expired()
+            except Exception as e:
+                logger.error(f"支付状态通知轮询异常: {str(e)}", exc_info=True)
+
+            if self._subscribers:
+                self._wake.wait(self.poll_interval)
+            else:
+                # 没有订阅时不查询数据库，等待新的订阅
+                self._wake.wait()
+            self._wake.clear()
+
+    def _poll_once(self):
+        with self._lock:
+            if not self._subscribers:
+                # 下次订阅时重新取得起点
+                self._last_id = None
+                self._seen_ids = set()
+                return
+            last_id = self._last_id
+
+        table = PaymentEvent.__table__
+        with db.engine.connect() as conn:
+            rows = conn.execute(
+                select(table.c.id, table.c.order_id, table.c.status)
+                .where(table.c.id > last_id - self.ID_OVERLAP)
+                .order_by(table.c.id)
+            ).all()
+
+        with self._lock:
+            for row in rows:
+                if row.id in self._seen_ids:
+                    continue
+                for subscription in self._subscribers.get(row.order_id, ()):
+                    subscription.deliver(row.status)
+            if rows:
+                self._last_id = max(last_id, rows[-1].id)
+            floor = self._last_id - self.ID_OVERLAP
+            self._seen_ids = {row.id for row in rows if row.id > floor}
+
+    def _cleanup_expired(self):
+        now = time.monotonic()
+        if now - self._last_cleanup < self.CLEANUP_INTERVAL_SECONDS:
+            return
+        self._last_cleanup = now
+        cutoff = datetime.utcnow() - timedelta(seconds=self.RETENTION_SECONDS)
+        with db.engine.begin() as conn:
+            conn.execute(delete(PaymentEvent.__table__).where(PaymentEvent.__table__.c.created_at < cutoff))
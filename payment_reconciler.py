@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+待支付订单后台对账
+用户关闭支付页面且回调丢失时，订单会一直停留在待支付状态并计入后台统计。
+- 后台线程每隔PAYMENT_RECONCILE_INTERVAL_SECONDS秒运行一次（多个工作进程中只有一个认领），
+  按创建时间从早到晚扫描创建超过PAYMENT_RECONCILE_MIN_AGE_SECONDS秒的待支付订单
+- 通过PaymentProcessor分批查询网关，查询速率不超过PAYMENT_RECONCILE_RATE_PER_SECOND
+- 网关返回终态时将订单改为已支付/支付失败/已取消；仍未支付或查询失败时按查询次数指数退避
+- 超过PAYMENT_ORDER_EXPIRE_SECONDS仍未支付的订单先在网关关闭交易，关闭成功后才在本地取消，
+  关闭失败时退避后重查；网关上尚无交易、无法关闭的订单在本地取消并标记为仍接受支付结果
+- 每次运行的处理量、吞吐和积压（最早一笔待查询订单已等待的时间）记录为计数器
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, or_, select, update
+
+from models import db, PaymentOrder
+from payment_callbacks import PAYABLE_STATUSES, LATE_PAYMENT_MARK, mark_order_paid, close_unpaid_order
+from payment_config import get_payment_processor
+from payment_status import GATEWAY_QUERIES
+from stats_counters import apply_counter_deltas, claim_periodic_run, set_counter_values, get_counters
+
+logger = logging.getLogger(__name__)
+
+# 记录上次运行时间的计数器；指标计数器均以METRIC_PREFIX开头（以下划线开头，不参与统计校准）
+RUN_MARKER = '_payment_reconciled_at'
+METRIC_PREFIX = '_payment_reconcile.'
+
+# 网关交易状态 -> 订单终态，未列出的状态视为仍未支付
+GATEWAY_FINAL_STATES = {
+    'wechat_pay': {'SUCCESS': 'paid', 'PAYERROR': 'failed', 'CLOSED': 'cancelled', 'REVOKED': 'cancelled'},
+    'alipay': {'TRADE_SUCCESS': 'paid', 'TRADE_FINISHED': 'paid', 'TRADE_CLOSED': 'cancelled'},
+}
+
+# 支付方式 -> 关闭网关交易的PaymentProcessor方法
+GATEWAY_CLOSES = {
+    'wechat_pay': 'close_wechat_payment',
+    'alipay': 'close_alipay_payment',
+}
+
+# 记录的处理结果；skipped表示订单已被支付回调等其他请求更新
+OUTCOMES = ('checked', 'paid', 'failed', 'cancelled', 'unpaid', 'skipped', 'errors')
+
+
+def _gateway_order_missing(payment_type, result):
+    """网关上不存在该订单（用户未发起支付）"""
+    if payment_type == 'wechat_pay':
+        return result.error_code == 'ORDERNOTEXIST'
+    return bool(result.data) and result.data.get('sub_code') == 'ACQ.TRADE_NOT_EXIST'
+
+
+class RateLimiter:
+    """按固定间隔放行，限制每秒请求数"""
+
+    def __init__(self, rate_per_second):
+        self.interval = 1.0 / rate_per_second if rate_per_second > 0 else 0
+        self._next = 0.0
+
+    def wait(self):
+        now = time.monotonic()
+        if now < self._next:
+            time.sleep(self._next - now)
+            now = self._next
+        self._next = now + self.interval
+
+
+class PendingOrderReconciler:
+    """待支付订单对账扩展"""
+
+    BACKOFF_BASE_SECONDS = 60
+    BACKOFF_MAX_SECONDS = 3600
+    POLL_SECONDS = 60
+    MAX_CONSECUTIVE_ERRORS = 5  # 网关连续查询失败达到该次数时结束本次运行，下次再查
+
+    def __init__(self, app=None, processor=None):
+        self.app = None
+        self.processor = processor
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config['PAYMENT_RECONCILE_INTERVAL_SECONDS']
+        self.min_age = app.config['PAYMENT_RECONCILE_MIN_AGE_SECONDS']
+        self.batch_size = app.config['PAYMENT_RECONCILE_BATCH_SIZE']
+        self.max_per_run = app.config['PAYMENT_RECONCILE_MAX_PER_RUN']
+        self.rate = app.config['PAYMENT_RECONCILE_RATE_PER_SECOND']
+        self.expire_seconds = app.config['PAYMENT_ORDER_EXPIRE_SECONDS']
+        app.extensions['payment_reconciler'] = self
+
+    def ensure_started(self):
+        """确保当前进程的对账线程已启动（按进程号延迟启动，兼容preload_app）"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            thread = threading.Thread(target=self._reconcile_loop, name='payment-reconciler', daemon=True)
+            thread.start()
+
+    def _reconcile_loop(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    if claim_periodic_run(RUN_MARKER, self.interval):
+                        stats = self.run_once()
+                        if stats['checked']:
+                            logger.info(f"待支付订单对账: {stats}")
+                    db.session.remove()
+            except Exception as e:
+                logger.error(f"待支付订单对账失败: {str(e)}", exc_info=True)
+
+            time.sleep(min(self.POLL_SECONDS, self.interval))
+
+    def backoff_seconds(self, attempts):
+        """第attempts次查询后距下次查询的间隔"""
+        return min(self.BACKOFF_BASE_SECONDS * 2 ** max(attempts - 1, 0), self.BACKOFF_MAX_SECONDS)
+
+    def _due_condition(self, now):
+        table = PaymentOrder.__table__
+        return and_(
+            table.c.status.in_(PAYABLE_STATUSES),
+            table.c.created_at <= now - timedelta(seconds=self.min_age),
+            or_(table.c.next_reconcile_at.is_(None), table.c.next_reconcile_at <= now),
+        )
+
+    def _next_batch(self, now, after, limit):
+        """按(创建时间, ID)顺序取下一批到期订单"""
+        table = PaymentOrder.__table__
+        query = (select(table.c.id, table.c.order_no, table.c.payment_type, table.c.created_at,
+                        table.c.reconcile_attempts)
+                 .where(self._due_condition(now))
+                 .where(table.c.payment_type.in_(list(GATEWAY_QUERIES)))
+                 .order_by(table.c.created_at, table.c.id)
+                 .limit(limit))
+        if after is not None:
+            query = query.where(or_(table.c.created_at > after[0],
+                                    and_(table.c.created_at == after[0], table.c.id > after[1])))
+        with db.engine.connect() as conn:
+            return conn.execute(query).all()
+
+    def run_once(self, now=None):
+        """执行一次对账，返回本次的处理统计"""
+        processor = self.processor or get_payment_processor()
+        limiter = RateLimiter(self.rate)
+        now = now or datetime.utcnow()
+        started = time.monotonic()
+        stats = Counter(checked=0)
+
+        after = None
+        consecutive_errors = 0
+        while stats['checked'] < self.max_per_run and consecutive_errors < self.MAX_CONSECUTIVE_ERRORS:
+            batch = self._next_batch(now, after, min(self.batch_size, self.max_per_run - stats['checked']))
+            if not batch:
+                break
+            after = (batch[-1].created_at, batch[-1].id)
+
+            for order in batch:
+                limiter.wait()
+                outcome = self._reconcile_order(processor, order, now)
+                stats['checked'] += 1
+                stats[outcome] += 1
+                consecutive_errors = consecutive_errors + 1 if outcome == 'errors' else 0
+                if consecutive_errors >= self.MAX_CONSECUTIVE_ERRORS:
+                    logger.warning("支付网关连续查询失败，提前结束本次对账")
+                    break
+
+        duration = time.monotonic() - started
+        stats = dict(stats)
+        stats['duration_seconds'] = round(duration, 2)
+        stats['throughput'] = round(stats['checked'] / duration, 2) if duration > 0 else 0.0
+        stats['lag_seconds'] = self._lag_seconds(now)
+        self._record_metrics(stats)
+        return stats
+
+    def _reconcile_order(self, processor, order, now):
+        """查询一笔订单并更新状态，返回处理结果"""
+        method_name, state_field, _, trade_no_field = GATEWAY_QUERIES[order.payment_type]
+        try:
+            result = getattr(processor, method_name)(order.order_no)
+        except Exception as e:
+            logger.warning(f"对账查询订单{order.order_no}异常: {str(e)}")
+            result = None
+
+        expired = (now - order.created_at).total_seconds() >= self.expire_seconds
+        extra_data = {'reconcile_time': datetime.utcnow().isoformat()}
+
+        if result is not None and result.success and result.data:
+            extra_data['reconcile_data'] = result.data
+            final_status = GATEWAY_FINAL_STATES[order.payment_type].get(result.data.get(state_field))
+            if final_status == 'paid':
+                with db.engine.begin() as conn:
+                    transition = mark_order_paid(conn, order.order_no, result.data.get(trade_no_field), extra_data)
+                return 'paid' if transition == 'paid' else 'skipped'
+            if final_status is not None:
+                return self._close_order(order, final_status, extra_data)
+            if not expired:
+                outcome = 'unpaid'
+            elif self._close_at_gateway(processor, order):
+                # 网关上的交易已关闭，用户无法再付款，才在本地取消
+                return self._close_order(order, 'cancelled', extra_data)
+            else:
+                # 关闭失败（网关不可用或用户刚刚完成支付），退避后重查
+                outcome = 'errors'
+        elif result is not None and expired and _gateway_order_missing(order.payment_type, result):
+            # 网关上还没有交易，无法关闭；用户随后仍可能发起支付，保留接受支付结果的标记
+            extra_data[LATE_PAYMENT_MARK] = True
+            return self._close_order(order, 'cancelled', extra_data)
+        else:
+            outcome = 'errors'
+
+        # 仍未支付或查询失败：指数退避后再查
+        attempts = (order.reconcile_attempts or 0) + 1
+        table = PaymentOrder.__table__
+        with db.engine.begin() as conn:
+            conn.execute(update(table).where(table.c.id == order.id).values(
+                reconcile_attempts=attempts,
+                next_reconcile_at=now + timedelta(seconds=self.backoff_seconds(attempts)),
+            ))
+        return outcome
+
+    def _close_at_gateway(self, processor, order):
+        """关闭网关上的交易，返回是否关闭成功"""
+        try:
+            result = getattr(processor, GATEWAY_CLOSES[order.payment_type])(order.order_no)
+        except Exception as e:
+            logger.warning(f"对账关闭订单{order.order_no}异常: {str(e)}")
+            return False
+        if not result.success:
+            logger.warning(f"对账关闭订单{order.order_no}失败: {result.message}")
+        return result.success
+
+    def _close_order(self, order, status, extra_data):
+        """在本地关闭订单，返回处理结果"""
+        with db.engine.begin() as conn:
+            changed = close_unpaid_order(conn, order.order_no, status, extra_data)
+        return status if changed else 'skipped'
+
+    def _lag_seconds(self, now):
+        """本次运行后仍到期未查询的最早订单已等待的时间（秒）"""
+        with db.engine.connect() as conn:
+            oldest = conn.execute(
+                select(func.min(PaymentOrder.__table__.c.created_at)).where(self._due_condition(now))
+            ).scalar()
+        if oldest is None:
+            return 0
+        return max(int((now - oldest).total_seconds()) - self.min_age, 0)
+
+    def _record_metrics(self, stats):
+        totals = {f'{METRIC_PREFIX}{name}': stats.get(name, 0) for name in OUTCOMES}
+        gauges = {f'{METRIC_PREFIX}last_run_at': int(time.time()),
+                  f'{METRIC_PREFIX}last_checked': stats['checked'],
+                  f'{METRIC_PREFIX}last_duration_seconds': stats['duration_seconds'],
+                  f'{METRIC_PREFIX}throughput': stats['throughput'],
+                  f'{METRIC_PREFIX}lag_seconds': stats['lag_seconds']}
+        with db.engine.begin() as conn:
+            apply_counter_deltas(conn, {name: value for name, value in totals.items() if value})
+            set_counter_values(conn, gauges)
+
+
+def get_reconcile_metrics():
+    """读取对账指标：累计处理数和最近一次运行的吞吐、积压"""
+    counters = get_counters(METRIC_PREFIX)
+    return {name[len(METRIC_PREFIX):]: float(value) for name, value in counters.items()}
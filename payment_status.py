@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+支付状态查询
+支付页面每隔几秒轮询一次订单状态，原实现每次轮询都请求支付网关。
+- 订单已处于终态（已支付、失败、已取消）时直接按本地订单回答，不请求网关
+- 同一订单的并发查询合并为一次网关请求（single-flight），其余请求等待并共用结果
+- 网关的查询结果在进程内缓存PAYMENT_STATUS_CACHE_SECONDS秒
+- 网关返回已支付时以条件UPDATE同步本地订单，只有一个请求完成状态变更
+"""
+
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from models import db
+from payment_callbacks import mark_order_paid
+from payment_config import get_payment_processor
+
+# 不会再变化的订单状态
+TERMINAL_STATUSES = ('paid', 'failed', 'cancelled')
+
+# 支付类型 -> (查询方法名, 网关状态字段, 支付成功状态值, 交易号字段)
+GATEWAY_QUERIES = {
+    'wechat_pay': ('query_wechat_payment', 'trade_state', 'SUCCESS', 'transaction_id'),
+    'alipay': ('query_alipay_payment', 'trade_status', 'TRADE_SUCCESS', 'trade_no'),
+}
+
+# source：local 本地订单；cache 缓存结果；shared 共用并发请求的结果；gateway 本次请求网关
+StatusAnswer = namedtuple('StatusAnswer', ['status', 'trade_no', 'result', 'source'])
+
+
+class _Flight:
+    """进行中的网关请求"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class PaymentStatusResolver:
+    """合并并缓存支付状态查询的扩展"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._cache = {}
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(('local_hits', 'cache_hits', 'shared_hits', 'misses', 'gateway_errors'), 0)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.ttl = app.config['PAYMENT_STATUS_CACHE_SECONDS']
+        app.extensions['payment_status'] = self
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        """命中计数；misses为实际发出的网关请求数"""
+        with self._lock:
+            stats = dict(self._stats)
+        hits = stats['local_hits'] + stats['cache_hits'] + stats['shared_hits']
+        total = hits + stats['misses']
+        stats['hit_rate'] = round(hits / total, 4) if total else 0.0
+        stats['cached_orders'] = len(self._cache)
+        return stats
+
+    def resolve(self, payment_order):
+        """查询订单的支付状态，返回StatusAnswer"""
+        if payment_order.status in TERMINAL_STATUSES:
+            self._count('local_hits')
+            return StatusAnswer(payment_order.status, payment_order.trade_no, None, 'local')
+
+        result, source = self._query(payment_order.payment_type, payment_order.order_no)
+        if result.success and _reports_paid(payment_order.payment_type, result.data):
+            trade_no = result.data.get(GATEWAY_QUERIES[payment_order.payment_type][3])
+            return StatusAnswer('paid', trade_no, result, source)
+        return StatusAnswer(payment_order.status, payment_order.trade_no, result, source)
+
+    def _query(self, payment_type, order_no):
+        key = (payment_type, order_no)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[1] > now:
+                self._stats['cache_hits'] += 1
+                return entry[0], 'cache'
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._stats['misses'] += 1
+            else:
+                self._stats['shared_hits'] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, 'shared'
+
+        try:
+            flight.result = self._fetch(payment_type, order_no)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                if flight.result is not None and flight.result.success:
+                    self._store(key, flight.result, time.monotonic())
+            flight.done.set()
+        return flight.result, 'gateway'
+
+    def _store(self, key, result, now):
+        # 顺带清理过期条目，缓存大小与正在轮询的订单数相当
+        if len(self._cache) >= 1000:
+            for stale_key in [k for k, entry in self._cache.items() if entry[1] <= now]:
+                del self._cache[stale_key]
+        self._cache[key] = (result, now + self.ttl)
+
+    def _fetch(self, payment_type, order_no):
+        """请求网关；网关返回已支付时同步本地订单"""
+        method_name, _, _, trade_no_field = GATEWAY_QUERIES[payment_type]
+        result = getattr(get_payment_processor(), method_name)(order_no)
+        if not result.success:
+            self._count('gateway_errors')
+            return result
+
+        if _reports_paid(payment_type, result.data):
+            with db.engine.begin() as conn:
+                mark_order_paid(conn, order_no, result.data.get(trade_no_field), {
+                    'query_data': result.data,
+                    'query_time': datetime.utcnow().isoformat(),
+                })
+        return result
+
+
+def _reports_paid(payment_type, data):
+    _, state_field, paid_value, _ = GATEWAY_QUERIES[payment_type]
+    return bool(data) and data.get(state_field) == paid_value
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+登录身份缓存
+Flask-Login每个请求都会调用user_loader，原实现每次都查询User/Admin表。
+这里在每个工作进程内缓存轻量的身份对象（Principal），有效期内直接返回，
+认证本身不再访问数据库。
+- 用户状态或资料变更后递增数据库中的代数计数器，各工作进程至多每隔
+  PRINCIPAL_GENERATION_CHECK_SECONDS秒读取一次代数，发现变化即清空本进程缓存
+- 身份对象只包含页面和权限判断所需的字段，需要修改用户数据时应按ID加载模型
+"""
+
+import threading
+import time
+
+from flask_login import UserMixin
+from sqlalchemy import select
+
+from models import db, User, Admin, StatCounter
+from stats_counters import apply_counter_deltas
+
+# 代数计数器名称（以下划线开头，不参与统计计数器校准）
+GENERATION_COUNTER = '_principal_generation'
+
+
+class Principal(UserMixin):
+    """缓存的登录身份"""
+
+    def __init__(self, id, name, email, phone, is_active, is_admin):
+        self.id = id
+        self.name = name
+        self.email = email
+        self.phone = phone
+        self._active = bool(is_active) if is_active is not None else True
+        self.is_admin = is_admin
+
+    @property
+    def is_active(self):
+        return self._active
+
+    def get_id(self):
+        return f"admin_{self.id}" if self.is_admin else str(self.id)
+
+    @classmethod
+    def from_model(cls, obj):
+        return cls(obj.id, obj.name, obj.email, getattr(obj, 'phone', None), obj.is_active, isinstance(obj, Admin))
+
+    def __repr__(self):
+        return f'<Principal {self.get_id()}>'
+
+
+def load_principal(user_id):
+    """从数据库加载身份，用户不存在时返回None"""
+    if user_id.startswith('admin_'):
+        obj = db.session.get(Admin, int(user_id.replace('admin_', '')))
+    else:
+        obj = db.session.get(User, int(user_id))
+    return Principal.from_model(obj) if obj is not None else None
+
+
+def read_generation(conn):
+    value = conn.execute(select(StatCounter.value).where(StatCounter.name == GENERATION_COUNTER)).scalar()
+    return int(value or 0)
+
+
+class PrincipalCache:
+    """按工作进程缓存登录身份的扩展"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._entries = {}
+        self._generation = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.ttl = app.config['PRINCIPAL_CACHE_TTL_SECONDS']
+        self.check_interval = app.config['PRINCIPAL_GENERATION_CHECK_SECONDS']
+        app.extensions['principal_cache'] = self
+
+    def _sync_generation(self, now):
+        """距上次检查超过check_interval秒时读取代数，变化时清空缓存"""
+        if now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return
+            generation = read_generation(db.session)
+            if generation != self._generation:
+                self._entries.clear()
+                self._generation = generation
+            self._checked_at = now
+
+    def get(self, user_id):
+        """取得登录身份；已禁用或不存在的用户返回None"""
+        now = time.monotonic()
+        self._sync_generation(now)
+
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[1] > now:
+            principal = entry[0]
+        else:
+            principal = load_principal(user_id)
+            self._entries[user_id] = (principal, now + self.ttl)
+
+        if principal is None or not principal.is_active:
+            return None
+        return principal
+
+    def invalidate(self):
+        """用户数据变更并提交后调用：递增代数，使所有工作进程的缓存失效"""
+        with db.engine.begin() as conn:
+            apply_counter_deltas(conn, {GENERATION_COUNTER: 1})
+        with self._lock:
+            self._entries.clear()
+            # 本进程立即重新读取代数
+            self._checked_at = 0
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+查询辅助工具
+按键集（keyset）分批遍历大表、分页列表，避免一次性加载全部记录；
+支付订单统计在数据库中分组聚合
+"""
+
+import base64
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import selectinload
+
+from models import PaymentOrder, Submission
+
+
+def keyset_filter(sort_column, id_column, last_sort, last_id, descending=True):
+    """构建"位于(last_sort, last_id)之后"的键集过滤条件"""
+    if descending:
+        return or_(sort_column < last_sort,
+                   and_(sort_column == last_sort, id_column < last_id))
+    return or_(sort_column > last_sort,
+               and_(sort_column == last_sort, id_column > last_id))
+
+
+def iter_keyset_chunks(query, sort_column, id_column, chunk_size=500, descending=True):
+    """按(sort_column, id_column)键集分批遍历查询结果
+
+    每批执行一次带LIMIT的查询，后续批次从上一批最后一行之后继续，
+    因此内存占用与总行数无关，且深翻页不会像OFFSET那样越来越慢。
+    传入的query不应再带有order_by。
+    """
+    if descending:
+        ordering = (sort_column.desc(), id_column.desc())
+    else:
+        ordering = (sort_column.asc(), id_column.asc())
+
+    last_key = None
+    while True:
+        chunk_query = query
+        if last_key is not None:
+            chunk_query = chunk_query.filter(
+                keyset_filter(sort_column, id_column, last_key[0], last_key[1], descending)
+            )
+
+        rows = chunk_query.order_by(*ordering).limit(chunk_size).all()
+        if not rows:
+            return
+
+        yield rows
+
+        if len(rows) < chunk_size:
+            return
+
+        last_row = rows[-1]
+        last_key = (getattr(last_row, sort_column.key), getattr(last_row, id_column.key))
+
+
+def encode_cursor(sort_value, id_value):
+    """将(排序值, id)编码为URL安全的分页游标"""
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    raw = f"{sort_value}|{id_value}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析分页游标，返回(排序时间, id)；游标无效时抛出ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        sort_value, id_value = raw.rsplit('|', 1)
+        return datetime.fromisoformat(sort_value), int(id_value)
+    except (TypeError, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+
+
+class KeysetPage:
+    """键集分页结果
+
+    items按(排序列, id)倒序排列；next_cursor/prev_cursor为None表示没有下一页/上一页。
+    """
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def keyset_page(query, sort_column, id_column, after=None, before=None, per_page=20):
+    """按(sort_column, id_column)倒序取一页数据（seek分页）
+
+    after为上一页最后一行的游标，before为下一页第一行的游标（向前翻页）；
+    均为空时返回第一页。每页只执行一次带LIMIT的查询，
+    无论翻到第几页都走索引定位，耗时不随总行数增长。
+    传入的query不应再带有order_by。
+    """
+    def key_of(row):
+        return getattr(row, sort_column.key), getattr(row, id_column.key)
+
+    if before:
+        # 向前翻页：按正序取游标之前的记录，再反转为倒序
+        before_key = decode_cursor(before)
+        rows = (query.filter(keyset_filter(sort_column, id_column, *before_key, descending=False))
+                .order_by(sort_column.asc(), id_column.asc())
+                .limit(per_page + 1).all())
+        has_prev = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        if not items:
+            return KeysetPage([])
+        return KeysetPage(items,
+                          next_cursor=encode_cursor(*key_of(items[-1])),
+                          prev_cursor=encode_cursor(*key_of(items[0])) if has_prev else None)
+
+    page_query = query
+    if after:
+        after_key = decode_cursor(after)
+        page_query = page_query.filter(keyset_filter(sort_column, id_column, *after_key, descending=True))
+    rows = page_query.order_by(sort_column.desc(), id_column.desc()).limit(per_page + 1).all()
+    items = rows[:per_page]
+    if not items:
+        return KeysetPage([])
+    return KeysetPage(items,
+                      next_cursor=encode_cursor(*key_of(items[-1])) if len(rows) > per_page else None,
+                      prev_cursor=encode_cursor(*key_of(items[0])) if after else None)
+
+
+def iter_submission_chunks(query, chunk_size=500, sort_column=None, descending=True):
+    """分批遍历提交记录，并按批预加载导出所需的关联数据
+
+    每批提交记录加载后，SubmissionData、UploadFile、User、Form各执行一次
+    IN查询批量加载，逐行访问get_data_dict()、files、user、form时不再触发
+    懒加载，总查询次数只与批次数有关，与记录数无关。
+    默认按id排序，可通过sort_column指定其他排序列（以id作为次序键）。
+    """
+    query = query.options(
+        selectinload(Submission.data),
+        selectinload(Submission.files),
+        selectinload(Submission.user),
+        selectinload(Submission.form),
+    )
+    yield from iter_keyset_chunks(query, sort_column if sort_column is not None else Submission.id,
+                                  Submission.id, chunk_size, descending)
+
+
+class PaymentBreakdown:
+    """支付订单按(状态, 支付方式)分组的订单数和金额
+
+    分组数只与状态和支付方式的组合有关（通常不超过十几行），
+    按任意状态/支付方式组合取数都在这几行上计算，不再访问数据库。
+    """
+
+    def __init__(self, rows):
+        self.rows = [(status, payment_type, count, Decimal(amount or 0))
+                     for status, payment_type, count, amount in rows]
+
+    def _matching(self, status, payment_type):
+        for row in self.rows:
+            if (status is None or row[0] == status) and (payment_type is None or row[1] == payment_type):
+                yield row
+
+    def count(self, status=None, payment_type=None):
+        return sum(row[2] for row in self._matching(status, payment_type))
+
+    def amount(self, status=None, payment_type=None):
+        return sum((row[3] for row in self._matching(status, payment_type)), Decimal(0))
+
+
+def payment_breakdown(query):
+    """对支付订单查询执行一次GROUP BY (status, payment_type)聚合
+
+    query为已加好筛选条件（可含join）的PaymentOrder查询，不应带order_by和预加载选项。
+    """
+    rows = (query.with_entities(PaymentOrder.status, PaymentOrder.payment_type,
+                                func.count(PaymentOrder.id), func.sum(PaymentOrder.amount))
+            .group_by(PaymentOrder.status, PaymentOrder.payment_type)
+            .all())
+    return PaymentBreakdown(rows)
@@ -6,6 +6,7 @@ import os
 import sys
 from app import create_app
 from models import db, Admin
+from migrations import run_migrations
 from config import Config
 
 def create_admin_user():
@@ -45,6 +46,10 @@ def main():
         # 创建数据库表
         db.create_all()
         print("数据库表创建完成")
+
+        # 执行结构迁移（补充已有表的索引等）
+        for version, name in run_migrations(db.engine):
+            print(f"已应用数据库迁移 {version}: {name}")
         
         # 创建默认管理员
         create_admin_user()
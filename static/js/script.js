@@ -449,6 +449,97 @@ function exportTableData(tableId, filename) {
     }
 }
 
+// 后台导出任务：提交任务后轮询进度，完成后下载导出文件
+function runExportJob(url, title) {
+    title = title || '导出';
+    var separator = url.indexOf('?') === -1 ? '?' : '&';
+    var panel = showExportProgress(title + '：任务排队中...', 0);
+
+    return fetch(url + separator + 'background=true', {
+        method: 'GET',
+        credentials: 'same-origin',
+        headers: { 'Accept': 'application/json' }
+    })
+    .then(function(response) {
+        return response.json().then(function(data) {
+            if (!response.ok) {
+                throw new Error(data.error || ('HTTP ' + response.status));
+            }
+            return data;
+        });
+    })
+    .then(function(job) {
+        return pollExportJob(job, panel, title);
+    })
+    .then(function(job) {
+        panel.remove();
+        var link = document.createElement('a');
+        link.href = job.download_url;
+        link.style.display = 'none';
+        document.body.appendChild(link);
+        link.click();
+        document.body.removeChild(link);
+        showToast(title + '完成，开始下载 ' + (job.filename || ''), 'success');
+        return job;
+    })
+    .catch(function(error) {
+        panel.remove();
+        showToast(title + '失败：' + error.message, 'error', 6000);
+        throw error;
+    });
+}
+
+function pollExportJob(job, panel, title) {
+    return new Promise(function(resolve, reject) {
+        function check() {
+            fetch(job.status_url, { credentials: 'same-origin' })
+                .then(function(response) {
+                    return response.json().then(function(data) {
+                        if (!response.ok) {
+                            throw new Error(data.error || ('HTTP ' + response.status));
+                        }
+                        return data;
+                    });
+                })
+                .then(function(data) {
+                    if (data.status === 'completed') {
+                        resolve(data);
+                    } else if (data.status === 'failed') {
+                        reject(new Error(data.error || '导出任务失败'));
+                    } else {
+                        var text = data.status === 'queued' ? '任务排队中...' :
+                            '已处理 ' + data.rows_done + (data.rows_total ? ' / ' + data.rows_total : '') + ' 行';
+                        panel.update(title + '：' + text, data.progress || 0);
+                        setTimeout(check, 1000);
+                    }
+                })
+                .catch(reject);
+        }
+        check();
+    });
+}
+
+function showExportProgress(message, percent) {
+    var box = $('<div class="alert alert-info position-fixed shadow-sm" ' +
+                'style="bottom: 20px; right: 20px; z-index: 1050; min-width: 320px;">' +
+                '<div class="export-progress-text mb-2"></div>' +
+                '<div class="progress" style="height: 6px;"><div class="progress-bar" role="progressbar"></div></div>' +
+                '</div>');
+    $('body').append(box);
+
+    var panel = {
+        update: function(text, value) {
+            box.find('.export-progress-text').text(text);
+            box.find('.progress-bar').css('width', value + '%');
+        },
+        remove: function() {
+            box.remove();
+        }
+    };
+    panel.update(message, percent);
+    return panel;
+}
+
 // 键盘快捷键
 $(document).on('keydown', function(e) {
     // Ctrl+S 保存表单
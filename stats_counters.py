@@ -0,0 +1,545 @@
+# -*- coding: utf-8 -*-
+"""
+统计计数器
+管理后台的统计数据读取计数器表，不再每次访问都全表COUNT/SUM。
+- 计数器在写操作所在事务中增量更新：会话flush前统一计算新增、修改、删除
+  对象带来的变化，覆盖注册、表单创建/启停、提交创建/审核/删除、支付状态变化等ORM写路径
+- 按日汇总的计数器（北京时间）用于今日、近7天等统计
+- 附件同时按所属表单、用户和上传日期记录数量和字节数，作为存储用量台账
+- 定期校准任务按基础表重新计算，修正绕过ORM的批量SQL等造成的偏差
+"""
+
+import os
+import threading
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from sqlalchemy import event, func, inspect, insert, select, update, case
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, User, Form, Submission, UploadFile, PaymentOrder, StatCounter, StatDailyCounter
+
+logger = logging.getLogger(__name__)
+
+# 按北京时间划分日期，与页面显示一致
+LOCAL_TZ = timezone(timedelta(hours=8))
+
+# 校准时重新计算最近多少天的按日汇总
+DAILY_RECONCILE_DAYS = 35
+
+# 记录上次校准时间的计数器，多个工作进程中同一时间只有一个执行校准
+RECONCILE_MARKER = '_reconciled_at'
+
+# 不按基础表校准的计数器：下划线开头的运行标记，以及由存储校验任务按文件系统校准的磁盘用量
+UNRECONCILED_PREFIXES = ('_', 'storage.')
+
+
+def local_day(dt):
+    """UTC时间对应的北京时间日期"""
+    return dt.replace(tzinfo=timezone.utc).astimezone(LOCAL_TZ).date()
+
+
+def local_today():
+    return local_day(datetime.utcnow())
+
+
+def _day_start_utc(day):
+    """北京时间某日零点对应的UTC时间（不带时区信息，与数据库中的时间一致）"""
+    start = datetime(day.year, day.month, day.day, tzinfo=LOCAL_TZ)
+    return start.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _amount(value):
+    if value is None:
+        return Decimal('0')
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+
+def _user_counters(values):
+    return {
+        'users.total': 1,
+        'users.active': 1 if values['is_active'] else 0,
+        'users.with_email': 1 if values['email'] else 0,
+        'users.with_phone': 1 if values['phone'] else 0,
+    }
+
+
+def _form_counters(values):
+    return {'forms.total': 1, 'forms.active': 1 if values['is_active'] else 0}
+
+
+def _submission_counters(values):
+    # 同时维护按表单的计数，供提交记录列表页读取
+    form_prefix = f"form.{values['form_id']}.submissions"
+    return {
+        'submissions.total': 1,
+        f"submissions.status.{values['status']}": 1,
+        f'{form_prefix}.total': 1,
+        f"{form_prefix}.status.{values['status']}": 1,
+    }
+
+
+def _payment_counters(values):
+    counters = {'payments.total': 1, f"payments.status.{values['status']}": 1}
+    if values['status'] == 'paid':
+        amount = _amount(values['amount'])
+        counters['payments.revenue'] = amount
+        counters[f"payments.revenue.{values['payment_type']}"] = amount
+    return counters
+
+
+def _file_counters(values):
+    size = values['file_size'] or 0
+    counters = {'files.total': 1, 'files.size': size}
+    # 按表单、按用户的存储用量
+    for owner in ('form', 'user'):
+        owner_id = values.get(f'{owner}_id')
+        if owner_id is not None:
+            counters[f'{owner}.{owner_id}.files.total'] = 1
+            counters[f'{owner}.{owner_id}.files.size'] = size
+    return counters
+
+
+# 模型 -> (创建时间字段, 按日计数器名, 影响计数的字段, 计数函数)
+TRACKED_MODELS = {
+    User: ('created_at', 'users.registered', ('is_active', 'email', 'phone'), _user_counters),
+    Form: ('created_at', 'forms.created', ('is_active',), _form_counters),
+    Submission: ('submitted_at', 'submissions.created', ('status', 'form_id'), _submission_counters),
+    PaymentOrder: ('created_at', None, ('status', 'amount', 'payment_type'), _payment_counters),
+    UploadFile: ('uploaded_at', 'files.uploaded', ('file_size',), _file_counters),
+}
+
+# 按日汇总字节数的模型 -> (按日计数器名, 字节数字段)
+DAILY_SIZE_COUNTERS = {
+    UploadFile: ('files.uploaded_size', 'file_size'),
+}
+
+# 按所属提交记录的表单和用户计数的模型（计数时需要提交记录的form_id、user_id）
+SUBMISSION_OWNED_MODELS = (UploadFile,)
+
+
+class CounterSnapshot(dict):
+    """计数器读取结果，不存在的计数器视为0"""
+
+    def count(self, name):
+        return int(self.get(name, 0))
+
+    def amount(self, name):
+        return self.get(name, Decimal('0'))
+
+
+def _column_default(model, attr):
+    """新对象flush前尚未应用列默认值，按模型定义补齐"""
+    if attr == TRACKED_MODELS[model][0]:
+        return datetime.utcnow()
+    default = model.__table__.c[attr].default
+    if default is not None and default.is_scalar:
+        return default.arg
+    return None
+
+
+def _current_values(obj, model):
+    time_attr, _, attrs, _ = TRACKED_MODELS[model]
+    values = {}
+    for attr in (time_attr,) + attrs:
+        value = getattr(obj, attr)
+        values[attr] = value if value is not None else _column_default(model, attr)
+    return values
+
+
+def _committed_values(obj, model):
+    """对象在数据库中的原值（修改或删除前）"""
+    time_attr, _, attrs, _ = TRACKED_MODELS[model]
+    state = inspect(obj)
+    values = {}
+    for attr in (time_attr,) + attrs:
+        history = state.attrs[attr].history
+        if history.deleted:
+            value = history.deleted[0]
+        elif history.unchanged:
+            value = history.unchanged[0]
+        else:
+            value = getattr(obj, attr)
+        values[attr] = value if value is not None else _column_default(model, attr)
+    return values
+
+
+def _owner_values(session, obj):
+    """附件所属提交记录的表单和用户"""
+    submission = obj.submission
+    if submission is None and obj.submission_id is not None:
+        submission = session.get(Submission, obj.submission_id)
+    if submission is None:
+        return {}
+    return {'form_id': submission.form_id, 'user_id': submission.user_id}
+
+
+def _add_contribution(totals, daily, model, values, sign):
+    time_attr, daily_name, _, counter_fn = TRACKED_MODELS[model]
+    for name, delta in counter_fn(values).items():
+        totals[name] = totals.get(name, 0) + sign * delta
+    if daily_name:
+        day = local_day(values[time_attr])
+        key = (daily_name, day)
+        daily[key] = daily.get(key, 0) + sign
+        if model in DAILY_SIZE_COUNTERS:
+            size_name, size_attr = DAILY_SIZE_COUNTERS[model]
+            key = (size_name, day)
+            daily[key] = daily.get(key, 0) + sign * (values[size_attr] or 0)
+
+
+def collect_session_deltas(session):
+    """计算本次flush对计数器的影响，返回(总计数变化, 按日计数变化)"""
+    totals, daily = {}, {}
+    with session.no_autoflush:
+        def owner(obj, model):
+            return _owner_values(session, obj) if model in SUBMISSION_OWNED_MODELS else {}
+
+        for obj in session.new:
+            model = type(obj)
+            if model in TRACKED_MODELS:
+                _add_contribution(totals, daily, model, dict(_current_values(obj, model), **owner(obj, model)), 1)
+
+        for obj in session.deleted:
+            model = type(obj)
+            if model in TRACKED_MODELS:
+                _add_contribution(totals, daily, model, dict(_committed_values(obj, model), **owner(obj, model)), -1)
+
+        for obj in session.dirty:
+            model = type(obj)
+            if model in TRACKED_MODELS and obj not in session.deleted and session.is_modified(obj):
+                owner_values = owner(obj, model)
+                _add_contribution(totals, daily, model, dict(_committed_values(obj, model), **owner_values), -1)
+                _add_contribution(totals, daily, model, dict(_current_values(obj, model), **owner_values), 1)
+
+    totals = {name: delta for name, delta in totals.items() if delta}
+    daily = {key: delta for key, delta in daily.items() if delta}
+    return totals, daily
+
+
+def collect_insert_deltas(inserts):
+    """计算绕过ORM直接插入的行对计数器的影响
+
+    inserts为(模型, 行字典列表)序列，返回(总计数变化, 按日计数变化)。
+    附件行需带上所属提交记录的form_id、user_id，才能计入按表单、按用户的用量。
+    """
+    totals, daily = {}, {}
+    for model, rows in inserts:
+        time_attr, _, attrs, _ = TRACKED_MODELS[model]
+        for row in rows:
+            values = {}
+            for attr in (time_attr,) + attrs:
+                value = row.get(attr)
+                values[attr] = value if value is not None else _column_default(model, attr)
+            if model in SUBMISSION_OWNED_MODELS:
+                values.update(form_id=row.get('form_id'), user_id=row.get('user_id'))
+            _add_contribution(totals, daily, model, values, 1)
+    return totals, daily
+
+
+def collect_update_deltas(model, old_row, new_row):
+    """计算绕过ORM直接更新一行对计数器的影响
+
+    old_row、new_row为更新前后影响计数的字段值，返回(总计数变化, 按日计数变化)。
+    """
+    totals, daily = {}, {}
+    for row, sign in ((old_row, -1), (new_row, 1)):
+        time_attr, _, attrs, _ = TRACKED_MODELS[model]
+        values = {}
+        for attr in (time_attr,) + attrs:
+            value = row.get(attr)
+            values[attr] = value if value is not None else _column_default(model, attr)
+        _add_contribution(totals, daily, model, values, sign)
+    return ({name: delta for name, delta in totals.items() if delta},
+            {key: delta for key, delta in daily.items() if delta})
+
+
+def _upsert_delta(conn, table, keys, delta, now):
+    """原子地将计数器加上delta，计数器不存在时创建"""
+    dialect = conn.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert_fn = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        stmt = insert_fn(table).values(value=delta, updated_at=now, **keys)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={'value': table.c.value + stmt.excluded.value, 'updated_at': stmt.excluded.updated_at}
+        )
+        conn.execute(stmt)
+        return
+
+    result = conn.execute(
+        update(table)
+        .where(*[table.c[key] == value for key, value in keys.items()])
+        .values(value=table.c.value + delta, updated_at=now)
+    )
+    if result.rowcount == 0:
+        conn.execute(insert(table).values(value=delta, updated_at=now, **keys))
+
+
+def apply_counter_deltas(conn, totals, daily=None):
+    """在给定连接的事务中累加计数器
+
+    按固定顺序更新，避免并发事务因加锁顺序不同而死锁。
+    """
+    now = datetime.utcnow()
+    for name, delta in sorted(totals.items()):
+        _upsert_delta(conn, StatCounter.__table__, {'name': name}, delta, now)
+    for (name, day), delta in sorted((daily or {}).items()):
+        _upsert_delta(conn, StatDailyCounter.__table__, {'name': name, 'day': day}, delta, now)
+
+
+def adjust_counters(totals, daily=None):
+    """在当前会话事务中调整计数器，供绕过ORM的批量更新使用"""
+    apply_counter_deltas(db.session.connection(), totals, daily)
+
+
+def _before_flush(session, flush_context, instances):
+    totals, daily = collect_session_deltas(session)
+    if totals or daily:
+        apply_counter_deltas(session.connection(), totals, daily)
+
+
+def _load_old_value(target, value, oldvalue, initiator):
+    return value
+
+
+def register_counter_events():
+    """注册会话事件，重复调用时只注册一次"""
+    if event.contains(db.session, 'before_flush', _before_flush):
+        return
+    event.listen(db.session, 'before_flush', _before_flush)
+
+    # 修改已过期的字段时先加载原值，才能正确扣减修改前的计数
+    for model, (_, _, attrs, _) in TRACKED_MODELS.items():
+        for attr in attrs:
+            event.listen(getattr(model, attr), 'set', _load_old_value, active_history=True, retval=True)
+
+
+def get_counters(prefix=None):
+    """读取计数器，可按名称前缀筛选"""
+    query = select(StatCounter.name, StatCounter.value)
+    if prefix:
+        # 用范围条件代替LIKE，可直接走主键索引
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        query = query.where(StatCounter.name >= prefix).where(StatCounter.name < upper)
+    return CounterSnapshot((name, _amount(value)) for name, value in db.session.execute(query))
+
+
+def get_named_counters(names):
+    """只读取指定名称的计数器，供列表页按当前页的ID读取"""
+    if not names:
+        return CounterSnapshot()
+    query = select(StatCounter.name, StatCounter.value).where(StatCounter.name.in_(list(names)))
+    return CounterSnapshot((name, _amount(value)) for name, value in db.session.execute(query))
+
+
+def get_daily_totals(names, days=1):
+    """读取最近days天（含今天）各按日计数器之和"""
+    since = local_today() - timedelta(days=days - 1)
+    query = (select(StatDailyCounter.name, func.sum(StatDailyCounter.value))
+             .where(StatDailyCounter.name.in_(names))
+             .where(StatDailyCounter.day >= since)
+             .group_by(StatDailyCounter.name))
+    return CounterSnapshot((name, _amount(value)) for name, value in db.session.execute(query))
+
+
+def compute_expected_counters(conn, since_day):
+    """按基础表计算计数器的正确值，按日汇总只计算since_day及之后的日期"""
+    totals = {}
+
+    def add(name, value):
+        totals[name] = totals.get(name, 0) + (value or 0)
+
+    for model, prefix in ((User, 'users'), (Form, 'forms')):
+        total, active = conn.execute(select(
+            func.count(model.id),
+            func.sum(case((func.coalesce(model.is_active, True).is_(True), 1), else_=0))
+        )).one()
+        add(f'{prefix}.total', total)
+        add(f'{prefix}.active', active)
+
+    with_email, with_phone = conn.execute(select(
+        func.sum(case((func.coalesce(User.email, '') != '', 1), else_=0)),
+        func.sum(case((func.coalesce(User.phone, '') != '', 1), else_=0))
+    )).one()
+    add('users.with_email', with_email)
+    add('users.with_phone', with_phone)
+
+    status = func.coalesce(Submission.status, 'submitted')
+    rows = conn.execute(select(Submission.form_id, status, func.count(Submission.id))
+                        .group_by(Submission.form_id, status))
+    for form_id, status_value, count in rows:
+        add('submissions.total', count)
+        add(f'submissions.status.{status_value}', count)
+        add(f'form.{form_id}.submissions.total', count)
+        add(f'form.{form_id}.submissions.status.{status_value}', count)
+
+    status = func.coalesce(PaymentOrder.status, 'pending')
+    rows = conn.execute(select(status, PaymentOrder.payment_type, func.count(PaymentOrder.id),
+                               func.sum(PaymentOrder.amount))
+                        .group_by(status, PaymentOrder.payment_type))
+    for status_value, payment_type, count, amount in rows:
+        add('payments.total', count)
+        add(f'payments.status.{status_value}', count)
+        if status_value == 'paid':
+            add('payments.revenue', _amount(amount))
+            add(f'payments.revenue.{payment_type}', _amount(amount))
+
+    rows = conn.execute(select(Submission.form_id, Submission.user_id, func.count(UploadFile.id),
+                               func.sum(UploadFile.file_size))
+                        .join(Submission, Submission.id == UploadFile.submission_id)
+                        .group_by(Submission.form_id, Submission.user_id))
+    for form_id, user_id, count, size in rows:
+        add('files.total', count)
+        add('files.size', size)
+        add(f'form.{form_id}.files.total', count)
+        add(f'form.{form_id}.files.size', size)
+        if user_id is not None:
+            add(f'user.{user_id}.files.total', count)
+            add(f'user.{user_id}.files.size', size)
+
+    # 按日汇总：只读取时间列，在Python中按北京时间分组，避免依赖各数据库的时区函数
+    daily = {}
+    since_utc = _day_start_utc(since_day)
+    for model, (time_attr, daily_name, _, _) in TRACKED_MODELS.items():
+        if not daily_name:
+            continue
+        column = getattr(model, time_attr)
+        size_name, size_attr = DAILY_SIZE_COUNTERS.get(model, (None, None))
+        columns = [column, getattr(model, size_attr)] if size_name else [column]
+        for row in conn.execute(select(*columns).where(column >= since_utc)):
+            day = local_day(row[0])
+            daily[(daily_name, day)] = daily.get((daily_name, day), 0) + 1
+            if size_name:
+                daily[(size_name, day)] = daily.get((size_name, day), 0) + (row[1] or 0)
+
+    return totals, daily
+
+
+def _diff(expected, current):
+    drift = {}
+    for key in set(expected) | set(current):
+        delta = _amount(expected.get(key)) - _amount(current.get(key))
+        if delta:
+            drift[key] = delta
+    return drift
+
+
+def reconcile_counters():
+    """按基础表校准计数器，返回(总计数偏差, 按日计数偏差)
+
+    基础表和计数器在同一快照中读取（PostgreSQL使用REPEATABLE READ，SQLite显式开启事务），
+    偏差以增量方式写回，校准期间并发的写操作不会被覆盖。
+    """
+    engine = db.engine
+    since_day = local_today() - timedelta(days=DAILY_RECONCILE_DAYS - 1)
+    daily_names = [spec[1] for spec in TRACKED_MODELS.values() if spec[1]]
+    daily_names += [name for name, _ in DAILY_SIZE_COUNTERS.values()]
+
+    with engine.connect() as conn:
+        if engine.dialect.name == 'postgresql':
+            conn = conn.execution_options(isolation_level='REPEATABLE READ')
+        with conn.begin():
+            if engine.dialect.name == 'sqlite':
+                # pysqlite只在写语句前自动BEGIN，只读查询各自独立执行；显式开启事务才能在同一快照中读取
+                conn.exec_driver_sql('BEGIN')
+            expected_totals, expected_daily = compute_expected_counters(conn, since_day)
+            current_totals = {
+                name: value for name, value in conn.execute(select(StatCounter.name, StatCounter.value))
+                if not name.startswith(UNRECONCILED_PREFIXES)
+            }
+            current_daily = {
+                (name, day): value for name, day, value in conn.execute(
+                    select(StatDailyCounter.name, StatDailyCounter.day, StatDailyCounter.value)
+                    .where(StatDailyCounter.name.in_(daily_names))
+                    .where(StatDailyCounter.day >= since_day))
+            }
+
+    drift_totals = _diff(expected_totals, current_totals)
+    drift_daily = _diff(expected_daily, current_daily)
+    if drift_totals or drift_daily:
+        with engine.begin() as conn:
+            apply_counter_deltas(conn, drift_totals, drift_daily)
+    return drift_totals, drift_daily
+
+
+def claim_periodic_run(marker, interval):
+    """距上次运行超过interval秒时认领本次运行，多个进程中只有一个认领成功
+
+    marker为保存上次运行时间的计数器名（以下划线开头，不参与校准）。
+    """
+    now = time.time()
+    table = StatCounter.__table__
+    with db.engine.begin() as conn:
+        _upsert_delta(conn, table, {'name': marker}, 0, datetime.utcnow())
+        result = conn.execute(
+            update(table)
+            .where(table.c.name == marker)
+            .where(table.c.value <= now - interval)
+            .values(value=now, updated_at=datetime.utcnow())
+        )
+    return result.rowcount == 1
+
+
+def lock_counter_row(conn, name):
+    """在调用方的事务中锁定一个计数器行（不存在时创建），用于在多个进程间依次执行一段操作
+
+    锁在事务结束时释放：PostgreSQL中为该行的行锁，SQLite中为数据库写锁。
+    """
+    _upsert_delta(conn, StatCounter.__table__, {'name': name}, 0, datetime.utcnow())
+
+
+def set_counter_values(conn, values):
+    """将计数器设为指定值（用于记录最近一次运行的指标等非累加的值）"""
+    now = datetime.utcnow()
+    table = StatCounter.__table__
+    for name, value in sorted(values.items()):
+        result = conn.execute(update(table).where(table.c.name == name).values(value=value, updated_at=now))
+        if result.rowcount == 0:
+            _upsert_delta(conn, table, {'name': name}, value, now)
+
+
+class StatsCounters:
+    """统计计数器扩展：注册写操作事件，并在后台定期校准"""
+
+    POLL_SECONDS = 60
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.reconcile_interval = app.config['STATS_RECONCILE_INTERVAL_SECONDS']
+        register_counter_events()
+        app.extensions['stats_counters'] = self
+
+    def ensure_started(self):
+        """确保当前进程的校准线程已启动（按进程号延迟启动，兼容preload_app）"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            thread = threading.Thread(target=self._reconcile_loop, name='stats-reconciler', daemon=True)
+            thread.start()
+
+    def _reconcile_loop(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    # 首次运行时计数器为空，校准即完成初始化
+                    if claim_periodic_run(RECONCILE_MARKER, self.reconcile_interval):
+                        drift_totals, drift_daily = reconcile_counters()
+                        if drift_totals or drift_daily:
+                            logger.warning(f"统计计数器已校准: {drift_totals}, 按日偏差 {len(drift_daily)} 项")
+            except Exception as e:
+                logger.error(f"统计计数器校准失败: {str(e)}", exc_info=True)
+
+            time.sleep(self.POLL_SECONDS)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+存储用量台账
+管理后台的附件数量和占用空间读取计数器表，不再每次访问都遍历上传目录、逐个读取文件大小：
+- 附件记录的数量和字节数（总计、按表单、按用户、按上传日期）由统计计数器在写入、删除附件记录的事务中维护
+- 磁盘上实际保存的文件数和字节数（storage.files、storage.bytes）由附件存储在放入、删除文件时
+  在同一事务中增减；相同内容只保存一份，附件字节数与磁盘字节数之差即去重节省的空间
+- 后台校验任务定期遍历上传目录，按实际文件修正磁盘用量
+"""
+
+import os
+import threading
+import time
+import logging
+
+from sqlalchemy import select
+
+from models import db, StatCounter
+from stats_counters import (apply_counter_deltas, claim_periodic_run, get_counters, get_daily_totals,
+                            set_counter_values)
+
+logger = logging.getLogger(__name__)
+
+STORED_FILES = 'storage.files'
+STORED_BYTES = 'storage.bytes'
+
+# 记录上次校验时间的计数器，多个工作进程中同一时间只有一个执行校验
+VERIFY_MARKER = '_storage_verified_at'
+
+
+def record_stored(conn, files, size):
+    """在调用方的事务中记录磁盘上放入（正数）或删除（负数）的文件"""
+    deltas = {name: delta for name, delta in ((STORED_FILES, files), (STORED_BYTES, size)) if delta}
+    if deltas:
+        apply_counter_deltas(conn, deltas)
+
+
+def get_storage_usage():
+    """存储用量：磁盘上的文件数和字节数、附件记录数和字节数、去重节省的字节数"""
+    counters = get_counters('files.')
+    counters.update(get_counters('storage.'))
+    today = get_daily_totals(['files.uploaded', 'files.uploaded_size'])
+    stored_bytes = counters.count(STORED_BYTES)
+    logical_bytes = counters.count('files.size')
+    return {
+        'files': counters.count(STORED_FILES),
+        'stored_bytes': stored_bytes,
+        'references': counters.count('files.total'),
+        'logical_bytes': logical_bytes,
+        'saved_bytes': max(logical_bytes - stored_bytes, 0),
+        'today_uploaded': today.count('files.uploaded'),
+        'today_uploaded_size': today.count('files.uploaded_size'),
+    }
+
+
+def get_owner_storage(owner, owner_ids):
+    """按表单（owner='form'）或用户（owner='user'）读取附件数和字节数，只读取指定ID的计数器"""
+    if not owner_ids:
+        return {}
+    names = {}
+    for owner_id in owner_ids:
+        names[f'{owner}.{owner_id}.files.total'] = (owner_id, 'files')
+        names[f'{owner}.{owner_id}.files.size'] = (owner_id, 'bytes')
+    usage = {owner_id: {'files': 0, 'bytes': 0} for owner_id in owner_ids}
+    for name, value in db.session.execute(select(StatCounter.name, StatCounter.value)
+                                          .where(StatCounter.name.in_(list(names)))):
+        owner_id, key = names[name]
+        usage[owner_id][key] = int(value)
+    return usage
+
+
+def _stored_counters():
+    with db.engine.connect() as conn:
+        rows = dict(conn.execute(select(StatCounter.name, StatCounter.value)
+                                 .where(StatCounter.name.in_([STORED_FILES, STORED_BYTES]))).all())
+    return int(rows.get(STORED_FILES, 0)), int(rows.get(STORED_BYTES, 0))
+
+
+def verify_storage(store):
+    """遍历上传目录，按实际文件修正磁盘用量，返回偏差；遍历期间用量有变化时不修正，返回None
+
+    偏差以增量方式写回，修正时并发放入、删除的文件不会被覆盖。
+    """
+    before = _stored_counters()
+    files = size = 0
+    for _, file_size in store.iter_files():
+        files += 1
+        size += file_size
+    current = _stored_counters()
+    if current != before:
+        # 遍历期间有上传或删除，无法判断哪些已计入遍历结果，留待下次校验
+        return None
+
+    drift = {name: delta for name, delta in ((STORED_FILES, files - current[0]), (STORED_BYTES, size - current[1]))
+             if delta}
+    if drift:
+        with db.engine.begin() as conn:
+            apply_counter_deltas(conn, drift)
+    return drift
+
+
+class StorageVerifier:
+    """存储用量校验扩展：在后台定期按文件系统校准磁盘用量"""
+
+    POLL_SECONDS = 60
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.verify_interval = app.config['STORAGE_VERIFY_INTERVAL_SECONDS']
+        app.extensions['storage_verifier'] = self
+
+    def ensure_started(self):
+        """确保当前进程的校验线程已启动（按进程号延迟启动，兼容preload_app）"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            thread = threading.Thread(target=self._verify_loop, name='storage-verifier', daemon=True)
+            thread.start()
+
+    def _verify_loop(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    # 首次运行时磁盘用量为空，校验即完成初始化
+                    if claim_periodic_run(VERIFY_MARKER, self.verify_interval):
+                        drift = verify_storage(self.app.extensions['upload_store'])
+                        if drift:
+                            logger.warning(f"存储用量已按上传目录校准: {drift}")
+                        elif drift is None:
+                            # 放弃本次认领，下一轮重新校验
+                            with db.engine.begin() as conn:
+                                set_counter_values(conn, {VERIFY_MARKER: 0})
+                            logger.info("校验期间存储用量有变化，稍后重新校验")
+                    db.session.remove()
+            except Exception as e:
+                logger.error(f"存储用量校验失败: {str(e)}", exc_info=True)
+
+            time.sleep(self.POLL_SECONDS)
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+提交数据存储
+支持两种存储方式，由配置SUBMISSION_STORAGE_MODE选择：
+- eav：每个字段保存为一行SubmissionData（默认，兼容已有数据）
+- json：整份答卷以JSON文档保存在Submission.payload中，每次提交只写一行，
+  读取和导出无需再关联SubmissionData；标记为可筛选的字段建立表达式索引
+两种方式的数据可以共存，Submission.get_data_dict()优先读取payload，结果一致。
+"""
+
+import hashlib
+import json
+import logging
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import and_, insert, inspect, literal_column, select, update
+from sqlalchemy.schema import CreateIndex
+
+from models import db, Submission, SubmissionData, FormField, UploadFile, PaymentOrder
+from stats_counters import collect_insert_deltas, apply_counter_deltas
+
+logger = logging.getLogger(__name__)
+
+STORAGE_EAV = 'eav'
+STORAGE_JSON = 'json'
+
+
+def get_storage_mode():
+    mode = current_app.config.get('SUBMISSION_STORAGE_MODE', STORAGE_EAV)
+    return STORAGE_JSON if mode == STORAGE_JSON else STORAGE_EAV
+
+
+def save_submission_values(submission, values, mode=None):
+    """保存一份答卷的字段值
+
+    values为按表单字段顺序排列的{字段名: 字符串值}。
+    """
+    if (mode or get_storage_mode()) == STORAGE_JSON:
+        submission.payload = dict(values)
+        return
+    for field_name, field_value in values.items():
+        submission.data.append(SubmissionData(field_name=field_name, field_value=field_value))
+
+
+class SubmissionWriter:
+    """批量写入一份提交
+
+    先收集字段值、附件和支付订单，write()时在同一事务中写入：提交记录一次INSERT，
+    SubmissionData、UploadFile、PaymentOrder各一次executemany INSERT，并同步更新
+    统计计数器。不经过ORM工作单元，字段较多的表单提交时开销与字段数基本无关。
+    事务由调用方提交或回滚。
+    """
+
+    def __init__(self, form_id, user_id, mode=None):
+        self.form_id = form_id
+        self.user_id = user_id
+        self.mode = mode or get_storage_mode()
+        self.values = {}
+        self.files = []
+        self.payments = []
+
+    def add_value(self, field_name, field_value):
+        self.values[field_name] = field_value
+
+    def add_file(self, **row):
+        """登记已保存到磁盘的附件（UploadFile的列值，不含submission_id）"""
+        self.files.append(row)
+
+    def add_payment(self, **row):
+        """登记待创建的支付订单（PaymentOrder的列值，不含submission_id）"""
+        self.payments.append(row)
+
+    def write(self, conn):
+        """写入全部数据，返回提交记录ID"""
+        now = datetime.utcnow()
+        submission_row = {'form_id': self.form_id, 'user_id': self.user_id, 'submitted_at': now, 'status': 'submitted'}
+        if self.mode == STORAGE_JSON:
+            submission_row['payload'] = dict(self.values)
+        submission_id = conn.execute(insert(Submission.__table__).values(**submission_row)).inserted_primary_key[0]
+
+        data_rows = []
+        if self.mode != STORAGE_JSON:
+            data_rows = [{'submission_id': submission_id, 'field_name': field_name, 'field_value': field_value}
+                         for field_name, field_value in self.values.items()]
+        file_rows = [dict(row, submission_id=submission_id, uploaded_at=now) for row in self.files]
+        payment_rows = [dict(row, submission_id=submission_id, created_at=now) for row in self.payments]
+
+        for model, rows in ((SubmissionData, data_rows), (UploadFile, file_rows), (PaymentOrder, payment_rows)):
+            if rows:
+                conn.execute(insert(model.__table__), rows)
+
+        # 计数器由ORM会话事件维护，直接插入时在同一事务中补上
+        owned_file_rows = [dict(row, form_id=self.form_id, user_id=self.user_id) for row in file_rows]
+        totals, daily = collect_insert_deltas([(Submission, [submission_row]), (UploadFile, owned_file_rows),
+                                               (PaymentOrder, payment_rows)])
+        apply_counter_deltas(conn, totals, daily)
+        return submission_id
+
+
+def _sql_string(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+def payload_field(field_name, dialect_name=None):
+    """JSON文档中某个字段的取值表达式
+
+    路径以字面量写入SQL（而非绑定参数），与表达式索引的定义完全一致，
+    查询时数据库才能命中索引。
+    """
+    dialect_name = dialect_name or db.engine.dialect.name
+    if dialect_name == 'postgresql':
+        return Submission.payload.op('->>')(literal_column(_sql_string(field_name)))
+    path = '$.' + json.dumps(field_name, ensure_ascii=False)
+    return db.func.json_extract(Submission.payload, literal_column(_sql_string(path)))
+
+
+def field_value_equals(field_name, value, mode=None):
+    """按字段值筛选提交记录的条件
+
+    JSON存储方式下（已有数据已合并）只按payload表达式筛选，可直接命中表达式索引；
+    EAV存储方式下同时覆盖两种方式保存的数据。
+    """
+    if (mode or get_storage_mode()) == STORAGE_JSON:
+        return payload_field(field_name) == value
+    return db.or_(
+        and_(Submission.payload.isnot(None), payload_field(field_name) == value),
+        and_(Submission.payload.is_(None),
+             Submission.data.any(and_(SubmissionData.field_name == field_name,
+                                      SubmissionData.field_value == value)))
+    )
+
+
+def payload_index_name(field_name):
+    digest = hashlib.sha1(field_name.encode('utf-8')).hexdigest()[:12]
+    return f'ix_submission_payload_{digest}'
+
+
+def ensure_payload_index(bind, field_name):
+    """为可筛选字段创建(form_id, 字段值)表达式索引（已存在时跳过）"""
+    table = Submission.__table__
+    index = db.Index(payload_index_name(field_name), table.c.form_id,
+                     payload_field(field_name, bind.dialect.name))
+    try:
+        # 表达式索引无法通过反射检查是否存在，直接使用IF NOT EXISTS
+        bind.execute(CreateIndex(index, if_not_exists=True))
+    finally:
+        # 按字段动态创建的索引不登记到模型元数据中，避免create_all重复创建
+        table.indexes.discard(index)
+
+
+def ensure_filterable_indexes(conn, form_id=None):
+    """为可筛选字段补建表达式索引，返回涉及的字段名列表"""
+    query = select(FormField.field_name).where(FormField.is_filterable.is_(True)).distinct()
+    if form_id is not None:
+        query = query.where(FormField.form_id == form_id)
+    field_names = sorted(conn.execute(query).scalars())
+    for field_name in field_names:
+        ensure_payload_index(conn, field_name)
+    return field_names
+
+
+def backfill_payloads(engine, batch_size=500, remove_rows=True):
+    """将已有的SubmissionData行合并为payload文档
+
+    按提交ID分批处理，每批在独立事务中写入payload；remove_rows为True时
+    同时删除已合并的SubmissionData行，使每条提交只保留一行数据。
+    已有payload的提交跳过，中断后可重复执行。返回处理的提交数。
+    """
+    if 'payload' not in {column['name'] for column in inspect(engine).get_columns('submission')}:
+        return 0
+
+    submission_table = Submission.__table__
+    data_table = SubmissionData.__table__
+    processed = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            ids = conn.execute(
+                select(submission_table.c.id)
+                .where(submission_table.c.id > last_id, submission_table.c.payload.is_(None))
+                .order_by(submission_table.c.id)
+                .limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                return processed
+
+            payloads = {submission_id: {} for submission_id in ids}
+            rows = conn.execute(
+                select(data_table.c.submission_id, data_table.c.field_name, data_table.c.field_value)
+                .where(data_table.c.submission_id.in_(ids))
+                .order_by(data_table.c.id)
+            )
+            for submission_id, field_name, field_value in rows:
+                payloads[submission_id][field_name] = field_value
+
+            for submission_id, payload in payloads.items():
+                conn.execute(update(submission_table)
+                             .where(submission_table.c.id == submission_id)
+                             .values(payload=payload))
+            if remove_rows:
+                conn.execute(data_table.delete().where(data_table.c.submission_id.in_(ids)))
+
+        processed += len(ids)
+        last_id = ids[-1]
+        logger.info(f"已合并 {processed} 条提交记录的数据")
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+测试分块上传
+分块写入暂存文件、每块大小和声明大小的限制、连接中断后从已接收的位置续传，
+提交表单时认领上传登记到附件存储，以及分块上传接口与附件下载路由互不冲突
+"""
+import io
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+from flask import Flask
+from sqlalchemy import event
+from werkzeug.exceptions import ClientDisconnected
+
+from chunked_uploads import ChunkedUploads, UploadError
+from config import Config
+from forms import UPLOAD_ID_SUFFIX
+from models import db, User, Admin, Form, FormField, UploadSession, UploadFile, UploadBlob
+from upload_store import UploadStore
+
+CHUNK = 1024
+
+def create_test_app(instance_path):
+    app = Flask(__name__, instance_path=instance_path)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['UPLOAD_FOLDER'] = 'uploads'
+    app.config['UPLOAD_STAGING_FOLDER'] = 'upload_staging'
+    app.config['MAX_CONTENT_LENGTH'] = 10 * CHUNK
+    app.config['UPLOAD_CHUNK_MAX_BYTES'] = CHUNK
+    app.config['UPLOAD_SESSION_EXPIRE_SECONDS'] = 3600
+    app.config['ALLOWED_EXTENSIONS'] = Config.ALLOWED_EXTENSIONS
+    db.init_app(app)
+    return app
+
+class DroppedStream:
+    """模拟客户端发送到一半断开连接"""
+
+    def __init__(self, data, drop_after):
+        self.stream = io.BytesIO(data[:drop_after])
+
+    def read(self, size):
+        data = self.stream.read(size)
+        if not data:
+            raise ClientDisconnected()
+        return data
+
+def expect_error(status, fn, *args):
+    try:
+        fn(*args)
+    except UploadError as e:
+        assert e.status == status, (e.status, str(e))
+        return
+    raise AssertionError(f'应返回 {status}')
+
+def create_user_and_form():
+    admin = Admin(name="测试管理员", email="admin@test.com", password_hash="test")
+    user = User(name="测试用户", email="user@test.com", password_hash="test")
+    db.session.add_all([admin, user])
+    db.session.flush()
+    form = Form(title="测试表单", created_by=admin.id)
+    db.session.add(form)
+    db.session.commit()
+    return user, form
+
+def test_chunked_upload_resume_and_claim():
+    instance_path = tempfile.mkdtemp()
+    try:
+        app = create_test_app(instance_path)
+        uploads = ChunkedUploads(app)
+        store = UploadStore(app)
+        content = os.urandom(3 * CHUNK + 100)
+        with app.app_context():
+            db.create_all()
+            user, form = create_user_and_form()
+
+            # 创建时检查格式和声明大小
+            expect_error(400, uploads.create, user.id, form.id, 'video', 'run.exe', 100)
+            expect_error(413, uploads.create, user.id, form.id, 'video', 'big.mp4', 10 * CHUNK + 1)
+            session = uploads.create(user.id, form.id, 'video', '演示.mp4', len(content), 'video/mp4')
+            assert uploads.get(session.id, user.id + 1) is None
+
+            # 每块不超过限制，不能超出声明大小，偏移量必须等于已接收字节数
+            expect_error(413, uploads.write_chunk, session, 0, io.BytesIO(content), CHUNK + 1)
+            assert uploads.write_chunk(session, 0, io.BytesIO(content[:CHUNK]), CHUNK) == CHUNK
+            expect_error(409, uploads.write_chunk, session, 0, io.BytesIO(content[:CHUNK]), CHUNK)
+            pending = uploads.create(user.id, form.id, 'video', 'b.mp4', 500)
+            expect_error(413, uploads.write_chunk, pending, 0, io.BytesIO(content), 501)
+
+            # 第二块发送到一半断开：已收到的部分保留，从新的位置续传
+            expect_error(400, uploads.write_chunk, session, CHUNK,
+                         DroppedStream(content[CHUNK:2 * CHUNK], 300), CHUNK)
+            assert session.received_size == CHUNK + 300
+            offset = session.received_size
+            while offset < len(content):
+                end = min(offset + CHUNK, len(content))
+                offset = uploads.write_chunk(session, offset, io.BytesIO(content[offset:end]), end - offset)
+            assert session.is_complete
+
+            # 未完成的上传不能认领；字段不匹配时不能认领
+            expect_error(409, uploads.claim, pending.id, user.id, form.id, 'video', store)
+            expect_error(404, uploads.claim, session.id, user.id, form.id, 'other', store)
+
+            # 认领：文件登记到附件存储，会话随提交一起删除，提交成功后删除暂存文件
+            blob = uploads.claim(session.id, user.id, form.id, 'video', store)
+            store.acquire(db.session.connection(), [blob])
+            db.session.commit()
+            uploads.discard_staging([session.id])
+            row = blob.row
+            assert row['original_filename'] == '演示.mp4' and row['file_size'] == len(content)
+            assert row['file_type'] == 'video/mp4' and row['saved_filename'].endswith('.mp4')
+            with open(store.path(row['saved_filename']), 'rb') as f:
+                assert f.read() == content
+            assert db.session.get(UploadSession, session.id) is None
+            assert not os.path.exists(uploads.staging_path(session.id))
+
+            # 过期的上传被清理
+            db.session.get(UploadSession, pending.id).updated_at = datetime.utcnow() - timedelta(hours=2)
+            db.session.commit()
+            assert uploads.cleanup_expired() == 1
+            assert UploadSession.query.count() == 0 and os.listdir(uploads.staging_dir) == []
+    finally:
+        shutil.rmtree(instance_path)
+    print("✅ 分块上传可限制大小、断点续传，并在提交时转为附件")
+
+def test_claim_rolled_back_can_retry():
+    instance_path = tempfile.mkdtemp()
+    try:
+        app = create_test_app(instance_path)
+        uploads = ChunkedUploads(app)
+        store = UploadStore(app)
+        with app.app_context():
+            db.create_all()
+            user, form = create_user_and_form()
+            session = uploads.create(user.id, form.id, 'photo', 'a.png', 10)
+            uploads.write_chunk(session, 0, io.BytesIO(b'0123456789'), 10)
+            upload_id = session.id
+
+            # 提交失败回滚：会话和暂存文件仍在，可以再次认领
+            blob = uploads.claim(upload_id, user.id, form.id, 'photo', store)
+            db.session.rollback()
+            store.discard([blob])
+            blob = uploads.claim(upload_id, user.id, form.id, 'photo', store)
+            store.acquire(db.session.connection(), [blob])
+            db.session.commit()
+            with open(store.path(blob.row['saved_filename']), 'rb') as f:
+                assert f.read() == b'0123456789'
+    finally:
+        shutil.rmtree(instance_path)
+    print("✅ 提交失败后上传仍可再次认领")
+
+def test_upload_routes_over_http():
+    from app import create_app
+
+    instance_path = tempfile.mkdtemp()
+    try:
+        app = create_app({
+            'TESTING': True,
+            'WTF_CSRF_ENABLED': False,
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(instance_path, 'app.db')}",
+        }, instance_path=instance_path)
+        # 后台线程不在测试中启动
+        for extension in app.extensions.values():
+            if hasattr(extension, 'ensure_started'):
+                extension.ensure_started = lambda: None
+        content = os.urandom(3 * CHUNK)
+
+        with app.app_context():
+            # 开启外键检查，与PostgreSQL的约束行为一致
+            event.listen(db.engine, 'connect', lambda conn, _: conn.execute('PRAGMA foreign_keys=ON'))
+            db.engine.dispose()
+            db.create_all()
+            user, form = create_user_and_form()
+            db.session.add(FormField(form_id=form.id, field_name='photo', field_label='照片', field_type='file'))
+            db.session.commit()
+            user_id, form_id = user.id, form.id
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+
+        response = client.post('/api/uploads', json={'form_id': form_id, 'field_name': 'photo', 'filename': '证件照.jpg',
+                                                     'size': len(content), 'content_type': 'image/jpeg'})
+        assert response.status_code == 201
+        upload_id = response.get_json()['upload_id']
+        location = response.headers['Location']
+        assert location.endswith(f'/api/uploads/{upload_id}')
+
+        response = client.patch(location, data=content[:CHUNK], headers={'Upload-Offset': '0'})
+        assert response.status_code == 200 and response.headers['Upload-Offset'] == str(CHUNK)
+        # 断线后查询已接收的位置
+        response = client.head(location)
+        assert response.status_code == 200 and response.headers['Upload-Offset'] == str(CHUNK)
+        assert client.get(location).get_json()['offset'] == CHUNK
+        response = client.patch(location, data=content[CHUNK:], headers={'Upload-Offset': str(CHUNK)})
+        assert response.get_json()['complete']
+
+        # 附件下载路由不会匹配到分块上传
+        assert client.get(f'/uploads/{upload_id}').status_code == 404
+        assert client.patch(f'/uploads/{upload_id}', data=b'x', headers={'Upload-Offset': '0'}).status_code == 405
+
+        # 提交表单时认领上传：附件记录引用的upload_blob行在同一事务中先插入
+        response = client.post(f'/form/{form_id}', data={'photo' + UPLOAD_ID_SUFFIX: upload_id})
+        assert response.status_code == 302 and '/submission/' in response.headers['Location']
+        with app.app_context():
+            upload_file = UploadFile.query.one()
+            assert upload_file.blob_hash and db.session.get(UploadBlob, upload_file.blob_hash).ref_count == 1
+            saved_filename = upload_file.saved_filename
+
+        response = client.get(f'/uploads/{saved_filename}')
+        assert response.status_code == 200 and response.mimetype == 'image/jpeg'
+        assert response.data == content
+        response.close()
+        # 已认领的上传不再出现在分块上传接口中
+        assert client.get(location).status_code == 404
+
+        # 取消上传
+        response = client.post('/api/uploads', json={'form_id': form_id, 'field_name': 'photo',
+                                                     'filename': 'b.jpg', 'size': 10})
+        location = response.headers['Location']
+        assert client.delete(location).status_code == 204
+        assert client.head(location).status_code == 404
+        with app.app_context():
+            db.engine.dispose()
+    finally:
+        shutil.rmtree(instance_path)
+    print("✅ 分块上传接口与附件下载路由互不冲突")
+
+if __name__ == '__main__':
+    test_chunked_upload_resume_and_claim()
+    test_claim_rolled_back_can_retry()
+    test_upload_routes_over_http()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+测试后台导出任务
+多个进程同时认领时运行中的任务数不超过上限、进程退出后心跳超时的任务重新排队、
+被重新认领的任务只保留新执行进程的结果，以及导出结果的下载支持Range断点续传
+"""
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from flask import Flask
+
+from export_jobs import ExportJobRunner
+from models import db, Admin, User, ExportJob
+
+def create_test_app(instance_path, max_concurrent=2):
+    app = Flask(__name__, instance_path=instance_path)
+    # 多线程认领需要各连接共享同一个数据库，使用文件数据库
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(instance_path, 'jobs.db')}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['EXPORT_FOLDER'] = 'exports'
+    app.config['EXPORT_MAX_CONCURRENT_JOBS'] = max_concurrent
+    app.config['EXPORT_JOB_STALE_SECONDS'] = 60
+    app.config['EXPORT_JOB_RETENTION_HOURS'] = 24
+    db.init_app(app)
+    return app
+
+def add_job(status='queued', **values):
+    values.setdefault('rows_done', 0)
+    values.setdefault('attempts', 0)
+    job = ExportJob(id=uuid.uuid4().hex, job_type='rows', status=status, **values)
+    job.set_params({})
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+def rows_handler(params, progress):
+    progress.set_total(3)
+    def chunks():
+        for i in range(3):
+            progress.advance()
+            yield f'row{i}\n'.encode('utf-8')
+    return chunks(), 'rows.txt', 'text/plain'
+
+def test_claims_respect_global_limit():
+    instance_path = tempfile.mkdtemp()
+    try:
+        app = create_test_app(instance_path, max_concurrent=2)
+        # 模拟4个工作进程的调度器
+        runners = [ExportJobRunner(app) for _ in range(4)]
+        for index, runner in enumerate(runners):
+            runner.worker_id = f'worker-{index}'
+        with app.app_context():
+            db.create_all()
+            for _ in range(6):
+                add_job()
+
+        claimed = []
+        barrier = threading.Barrier(len(runners))
+
+        def claim(runner):
+            with app.app_context():
+                barrier.wait()
+                for _ in range(3):
+                    job_id = runner._claim_next()
+                    if job_id:
+                        claimed.append((runner.worker_id, job_id))
+                db.session.remove()
+
+        threads = [threading.Thread(target=claim, args=(runner,)) for runner in runners]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(claimed) == 2 and len({job_id for _, job_id in claimed}) == 2
+        with app.app_context():
+            assert ExportJob.query.filter_by(status='running').count() == 2
+            assert ExportJob.query.filter_by(status='queued').count() == 4
+            # 有任务结束后才能认领下一个
+            assert runners[0]._claim_next() is None
+            job = db.session.get(ExportJob, claimed[0][1])
+            job.status = 'completed'
+            db.session.commit()
+            assert runners[1]._claim_next() is not None
+            db.engine.dispose()
+    finally:
+        shutil.rmtree(instance_path)
+    print("✅ 多个进程同时认领时运行中的任务数不超过上限")
+
+def test_stale_jobs_recover_after_restart():
+    instance_path = tempfile.mkdtemp()
+    try:
+        app = create_test_app(instance_path)
+        runner = ExportJobRunner(app)
+        runner.register('rows', rows_handler)
+        with app.app_context():
+            db.create_all()
+            stale = datetime.utcnow() - timedelta(minutes=10)
+            # 执行中的进程已退出：心跳停止
+            interrupted = add_job('running', worker_id='dead:1', attempts=1, heartbeat_at=stale, rows_done=40)
+            exhausted = add_job('running', worker_id='dead:1', attempts=ExportJobRunner.MAX_ATTEMPTS, heartbeat_at=stale)
+            alive = add_job('running', worker_id='alive:2', attempts=1, heartbeat_at=datetime.utcnow())
+
+            runner._requeue_stale()
+            job = db.session.get(ExportJob, interrupted)
+            assert job.status == 'queued' and job.worker_id is None and job.rows_done == 0
+            assert db.session.get(ExportJob, exhausted).status == 'failed'
+            assert db.session.get(ExportJob, alive).status == 'running'
+
+            # 重新排队的任务由其他进程认领并完成
+            assert runner._claim_next() == interrupted
+            runner._run_job(interrupted)
+            db.session.expire_all()
+            job = db.session.get(ExportJob, interrupted)
+            assert job.status == 'completed' and job.attempts == 2 and job.rows_done == 3
+            with open(job.output_path, 'rb') as f:
+                assert f.read() == b'row0\nrow1\nrow2\n'
+            assert not any(name.endswith('.part') for name in os.listdir(runner.export_dir))
+            db.engine.dispose()
+    finally:
+        shutil.rmtree(instance_path)
+    print("✅ 进程退出后心跳超时的任务重新排队，多次中断后终止")
+
+def test_requeued_job_keeps_only_new_run():
+    instance_path = tempfile.mkdtemp()
+    try:
+        app = create_test_app(instance_path)
+        slow, fast = ExportJobRunner(app), ExportJobRunner(app)
+        slow.worker_id, fast.worker_id = 'slow:1', 'fast:2'
+        for runner in (slow, fast):
+            runner.register('rows', rows_handler)
+        with app.app_context():
+            db.create_all()
+            job_id = add_job()
+            assert slow._claim_next() == job_id
+
+            # 执行进程心跳超时，任务被另一个进程重新认领
+            job = db.session.get(ExportJob, job_id)
+            job.heartbeat_at = datetime.utcnow() - timedelta(minutes=10)
+            db.session.commit()
+            fast._requeue_stale()
+            assert fast._claim_next() == job_id
+
+            # 原进程随后执行完：结果丢弃，不覆盖新执行进程的状态和进度
+            slow._run_job(job_id)
+            db.session.expire_all()
+            job = db.session.get(ExportJob, job_id)
+            assert job.status == 'running' and job.worker_id == 'fast:2' and job.rows_done == 0
+            assert os.listdir(slow.export_dir) == []
+
+            fast._run_job(job_id)
+            db.session.expire_all()
+            job = db.session.get(ExportJob, job_id)
+            assert job.status == 'completed' and job.attempts == 2 and job.rows_done == 3
+            assert os.listdir(fast.export_dir) == [os.path.basename(job.output_path)]
+            db.engine.dispose()
+    finally:
+        shutil.rmtree(instance_path)
+    print("✅ 被重新认领的任务只保留新执行进程的结果")
+
+def test_download_supports_range_resume():
+    from app import create_app
+
+    instance_path = tempfile.mkdtemp()
+    try:
+        app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(instance_path, 'app.db')}",
+        }, instance_path=instance_path)
+        # 后台线程不在测试中启动，任务由测试直接执行
+        for extension in app.extensions.values():
+            if hasattr(extension, 'ensure_started'):
+                extension.ensure_started = lambda: None
+        runner = app.extensions['export_jobs']
+
+        with app.app_context():
+            db.create_all()
+            admin = Admin(name="测试管理员", email="admin@test.com", password_hash="test")
+            db.session.add(admin)
+            db.session.add_all([User(name=f"用户{i}", email=f"user{i}@test.com", password_hash="test")
+                                for i in range(50)])
+            db.session.commit()
+            admin_id = admin.id
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = f'admin_{admin_id}'
+
+        response = client.get('/admin/export/users?format=csv&background=true')
+        assert response.status_code == 202
+        job = response.get_json()
+        assert job['status'] == 'queued'
+
+        with app.app_context():
+            assert runner._claim_next() == job['job_id']
+            runner._run_job(job['job_id'])
+
+        status = client.get(job['status_url']).get_json()
+        assert status['status'] == 'completed' and status['download_url']
+
+        full = client.get(status['download_url'])
+        assert full.status_code == 200 and full.headers.get('Accept-Ranges') == 'bytes'
+        content = full.data
+        assert '用户49'.encode('utf-8') in content
+
+        # 从中断的位置继续下载
+        partial = client.get(status['download_url'], headers={'Range': f'bytes={len(content) // 2}-'})
+        assert partial.status_code == 206
+        assert partial.headers['Content-Range'] == f'bytes {len(content) // 2}-{len(content) - 1}/{len(content)}'
+        assert content[:len(content) // 2] + partial.data == content
+
+        # 直接调用导出接口时先生成完整文件，再返回带长度的响应
+        direct = client.get('/admin/export/users?format=csv')
+        assert direct.status_code == 200 and int(direct.headers['Content-Length']) == len(direct.data)
+        assert direct.data.count(b'\n') == content.count(b'\n')
+        with app.app_context():
+            db.engine.dispose()
+    finally:
+        shutil.rmtree(instance_path)
+    print("✅ 导出结果支持Range断点续传")
+
+if __name__ == '__main__':
+    test_claims_respect_global_limit()
+    test_stale_jobs_recover_after_restart()
+    test_requeued_job_keeps_only_new_run()
+    test_download_supports_range_resume()
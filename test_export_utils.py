@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+测试流式导出工具
+验证CSV分块输出与BOM、流式写出的xlsx可读回且列宽符合预期，
+以及流式ZIP为有效压缩包、已压缩格式直接存储
+"""
+import csv
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+
+from openpyxl import load_workbook
+
+from export_utils import iter_csv_chunks, CSV_BOM, XlsxStreamWriter, iter_xlsx_export, ZipStreamWriter, STREAM_CHUNK_SIZE
+
+def test_csv_chunks_and_bom():
+    headers = ['姓名', '备注']
+    rows = [[f'用户{i}', 'a,"b"\n换行'] for i in range(25)]
+
+    chunks = list(iter_csv_chunks(headers, iter(rows), rows_per_chunk=10))
+    # 每10行输出一块，剩余5行单独一块
+    assert len(chunks) == 3
+    assert all(isinstance(chunk, bytes) for chunk in chunks)
+
+    content = b''.join(chunks).decode('utf-8')
+    assert content.startswith(CSV_BOM) and content.count(CSV_BOM) == 1
+    parsed = list(csv.reader(io.StringIO(content[len(CSV_BOM):])))
+    assert parsed == [headers] + rows
+
+    # 整数倍行数时不产生空块；不加BOM时只有表头
+    chunks = list(iter_csv_chunks(headers, iter(rows[:20]), rows_per_chunk=10))
+    assert len(chunks) == 2 and all(chunks)
+    assert b''.join(iter_csv_chunks(headers, iter([]), include_bom=False)) == '姓名,备注\r\n'.encode('utf-8')
+    print("✅ CSV按块输出，BOM只在开头出现一次")
+
+def test_xlsx_reads_back_with_widths():
+    writer = XlsxStreamWriter('提交记录', ['ID', '姓名', '备注'])
+    writer.append([1, '张三', 'x' * 80])
+    writer.append([2, None, '短'])
+    # 比表头多出的列也统计列宽
+    writer.append([3, '李四四四四四四四四四四四四', '', 'extra'])
+    assert writer.row_count == 3
+    output = writer.save()
+
+    wb = load_workbook(output)
+    ws = wb['提交记录']
+    assert [cell.value for cell in ws[1]] == ['ID', '姓名', '备注', None]
+    assert ws[1][0].font.bold
+    assert [cell.value for cell in ws[2]][:3] == [1, '张三', 'x' * 80]
+    assert ws.cell(row=3, column=2).value is None
+    assert ws.cell(row=4, column=4).value == 'extra'
+    # 列宽为最长内容加2，限制在10到50之间
+    widths = {letter: ws.column_dimensions[letter].width for letter in 'ABCD'}
+    assert widths == {'A': 10, 'B': 15, 'C': 50, 'D': 10}
+    output.close()
+
+    # 生成器形式的导出分块输出同一份文件
+    data = b''.join(iter_xlsx_export('用户', ['姓名'], iter([['王五']])))
+    ws = load_workbook(io.BytesIO(data))['用户']
+    assert [[cell.value for cell in row] for row in ws.iter_rows()] == [['姓名'], ['王五']]
+    print("✅ 流式xlsx可读回，列宽按内容计算")
+
+def test_zip_stream_is_valid():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        files = {
+            'photo.JPG': os.urandom(3 * STREAM_CHUNK_SIZE),
+            'doc.pdf': b'%PDF' * 1000,
+            'notes.txt': '备注'.encode('utf-8') * 5000,
+        }
+        for name, content in files.items():
+            with open(os.path.join(temp_dir, name), 'wb') as f:
+                f.write(content)
+
+        writer = ZipStreamWriter()
+        chunks = []
+        for name in files:
+            chunks.extend(writer.write_file(os.path.join(temp_dir, name), f'uploads/{name}'))
+        chunks.extend(writer.write_bytes('说明.txt', '导出说明'.encode('utf-8')))
+        chunks.extend(writer.close())
+        # 大文件按块产出，不是一次性输出整个压缩包
+        assert len(chunks) > 3
+
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as zf:
+            assert zf.testzip() is None
+            infos = {info.filename: info for info in zf.infolist()}
+            assert infos['uploads/photo.JPG'].compress_type == zipfile.ZIP_STORED
+            assert infos['uploads/doc.pdf'].compress_type == zipfile.ZIP_STORED
+            assert infos['uploads/notes.txt'].compress_type == zipfile.ZIP_DEFLATED
+            assert infos['说明.txt'].compress_type == zipfile.ZIP_DEFLATED
+            for name, content in files.items():
+                assert zf.read(f'uploads/{name}') == content
+            assert zf.read('说明.txt').decode('utf-8') == '导出说明'
+    finally:
+        shutil.rmtree(temp_dir)
+    print("✅ 流式ZIP有效，图片和PDF直接存储，其他文件压缩")
+
+if __name__ == '__main__':
+    test_csv_chunks_and_bom()
+    test_xlsx_reads_back_with_widths()
+    test_zip_stream_is_valid()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+测试导出数据批量加载
+验证导出遍历提交记录时查询次数与记录数无关（无N+1查询）
+"""
+from flask import Flask
+from sqlalchemy import event
+from models import db, User, Admin, Form, FormField, Submission, SubmissionData, UploadFile
+from query_utils import iter_submission_chunks
+
+def create_test_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+def create_submissions(count):
+    """创建指定数量的提交记录，每条包含两项数据和一个附件"""
+    admin = Admin(name="测试管理员", email="admin@test.com", password_hash="test")
+    db.session.add(admin)
+    db.session.flush()
+
+    form = Form(title="测试表单", created_by=admin.id)
+    db.session.add(form)
+    db.session.flush()
+    db.session.add(FormField(form_id=form.id, field_name='name', field_label='姓名', field_type='text'))
+
+    for i in range(count):
+        # 每5条记录换一个用户，模拟多个用户提交
+        if i % 5 == 0:
+            user = User(name=f"用户{i}", email=f"user{i}@test.com", password_hash="test")
+            db.session.add(user)
+            db.session.flush()
+
+        submission = Submission(form_id=form.id, user_id=user.id)
+        db.session.add(submission)
+        db.session.flush()
+        db.session.add(SubmissionData(submission_id=submission.id, field_name='name', field_value=f'值{i}'))
+        db.session.add(SubmissionData(submission_id=submission.id, field_name='note', field_value='备注'))
+        db.session.add(UploadFile(submission_id=submission.id, field_name='file',
+                                  original_filename=f'{i}.pdf', saved_filename=f'{i}.pdf'))
+    db.session.commit()
+    db.session.expunge_all()
+
+def count_export_queries(chunk_size):
+    """模拟导出遍历，返回执行的SQL查询次数和导出行"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        rows = []
+        for chunk in iter_submission_chunks(Submission.query, chunk_size=chunk_size, descending=False):
+            for submission in chunk:
+                data_dict = submission.get_data_dict()
+                rows.append((submission.id, submission.form.title, submission.user.name,
+                             data_dict.get('name'), len(submission.files)))
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return len(statements), rows
+
+def test_export_query_count_independent_of_rows():
+    """查询次数只与批次数有关：每批1次主查询 + 4次关联IN查询
+
+    整批读满时还会多执行一次确认没有后续记录的查询。
+    """
+    app = create_test_app()
+    results = {}
+    for count in (10, 50):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            create_submissions(count)
+            results[count] = count_export_queries(chunk_size=count)
+            db.session.remove()
+
+    small_queries, small_rows = results[10]
+    large_queries, large_rows = results[50]
+    assert len(small_rows) == 10 and len(large_rows) == 50
+    assert small_queries == large_queries == 6, (small_queries, large_queries)
+    print(f"✅ 10条记录查询 {small_queries} 次，50条记录查询 {large_queries} 次")
+
+def test_export_chunks_load_all_rows():
+    """分批遍历时每条记录都被加载一次，且关联数据正确"""
+    app = create_test_app()
+    with app.app_context():
+        db.create_all()
+        create_submissions(23)
+        query_count, rows = count_export_queries(chunk_size=10)
+
+        assert [row[0] for row in rows] == list(range(1, 24))
+        assert rows[0] == (1, '测试表单', '用户0', '值0', 1)
+        assert rows[22] == (23, '测试表单', '用户20', '值22', 1)
+        # 3批数据（10+10+3），每批5次查询
+        assert query_count == 15, query_count
+        print(f"✅ 23条记录分3批加载，共查询 {query_count} 次")
+
+if __name__ == '__main__':
+    test_export_query_count_independent_of_rows()
+    test_export_chunks_load_all_rows()
+    print("✅ 导出批量加载测试通过")
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+测试本地模拟支付网关
+用真实的微信支付、支付宝客户端请求模拟网关，验证下单、查询、关闭交易、签名的异步通知以及失败注入
+"""
+import threading
+import time
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+from fake_gateway import FakePaymentGateway
+from payment_config import PaymentProcessor
+
+class NotifyReceiver(BaseHTTPRequestHandler):
+    """商户回调地址：用支付处理器验签，记录收到的通知"""
+    protocol_version = 'HTTP/1.1'
+    processor = None
+    received = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        if self.path == '/wechat':
+            data = {child.tag: child.text for child in ET.fromstring(body)}
+            valid, _ = self.processor.verify_wechat_callback(dict(data))
+            reply = b'<xml><return_code>SUCCESS</return_code></xml>'
+        else:
+            data = dict(parse_qsl(body))
+            valid, _ = self.processor.verify_alipay_callback(dict(data))
+            reply = b'success'
+        NotifyReceiver.received.append((self.path, data.get('out_trade_no'), valid))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.02)
+
+def test_fake_gateway_round_trip():
+    processor = PaymentProcessor()
+    receiver = ThreadingHTTPServer(('127.0.0.1', 0), NotifyReceiver)
+    NotifyReceiver.processor = processor
+    threading.Thread(target=receiver.serve_forever, daemon=True).start()
+    notify_base = f'http://127.0.0.1:{receiver.server_port}'
+    processor.wechat_config.notify_url = notify_base + '/wechat'
+    processor.alipay_config.notify_url = notify_base + '/alipay'
+
+    try:
+        with FakePaymentGateway(duplicate_notifies=1) as gateway:
+            gateway.configure(processor)
+
+            wechat = processor.create_wechat_payment('WX0001', 9.9, '测试')
+            assert wechat.success and wechat.payment_url == gateway.pay_url('WX0001')
+            alipay = processor.create_alipay_payment('ALI0001', 9.9, '测试')
+            assert alipay.success and alipay.payment_url.startswith(gateway.base_url)
+            # 支付宝收银台：打开支付链接时登记订单
+            assert processor.http.get(alipay.payment_url).json()['out_trade_no'] == 'ALI0001'
+
+            assert processor.query_wechat_payment('WX0001').data['trade_state'] == 'NOTPAY'
+            assert processor.query_alipay_payment('ALI0001').data['trade_status'] == 'WAIT_BUYER_PAY'
+            missing = processor.query_alipay_payment('NOPE')
+            assert not missing.success and missing.data['sub_code'] == 'ACQ.TRADE_NOT_EXIST'
+
+            assert gateway.pay('WX0001') and gateway.pay('ALI0001') and not gateway.pay('NOPE')
+            # 每笔付款一次通知加一次重复通知，签名都能通过商户验签
+            wait_for(lambda: len(NotifyReceiver.received) == 4)
+            assert sorted(NotifyReceiver.received) == [('/alipay', 'ALI0001', True)] * 2 + [('/wechat', 'WX0001', True)] * 2
+
+            paid = processor.query_wechat_payment('WX0001')
+            assert paid.data['trade_state'] == 'SUCCESS' and paid.data['transaction_id'].startswith('4200')
+            assert processor.query_alipay_payment('ALI0001').data['trade_status'] == 'TRADE_SUCCESS'
+
+            # 关闭交易：未付款的交易关闭后无法再付款，已付款或不存在的交易关闭失败
+            assert processor.create_wechat_payment('WX0002', 9.9, '测试').success
+            assert processor.close_wechat_payment('WX0002').success and not gateway.pay('WX0002')
+            assert processor.query_wechat_payment('WX0002').data['trade_state'] == 'CLOSED'
+            assert processor.close_wechat_payment('WX0001').error_code == 'ORDERPAID'
+            assert processor.query_wechat_payment('NOPE').error_code == 'ORDERNOTEXIST'
+            closed = processor.close_alipay_payment('NOPE')
+            assert not closed.success and closed.data['sub_code'] == 'ACQ.TRADE_NOT_EXIST'
+
+            # 失败注入：网关返回503，计入网关调用统计
+            gateway.failure_rate = 1.0
+            failed = processor.query_wechat_payment('WX0001')
+            assert not failed.success and failed.error_code == 'SYSTEM_ERROR'
+            assert processor.gateway_stats()['calls']['wechat.order.query']['outcomes']['transport_error'] == 1
+            assert gateway.stats()['counters']['injected_failures'] == 1
+    finally:
+        receiver.shutdown()
+        receiver.server_close()
+    print("✅ 模拟网关下单、查询、关闭、异步通知和失败注入正常")
+
+if __name__ == '__main__':
+    test_fake_gateway_round_trip()
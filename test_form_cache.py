@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+测试表单类缓存
+表单字段编译为表单类并缓存，字段变更递增版本号后重新编译，删除表单时释放缓存，
+以及同一进程中不同应用实例的缓存互不影响
+"""
+import json
+
+from flask import Flask
+from werkzeug.datastructures import MultiDict
+
+from models import db, Admin, Form, FormField
+from form_cache import FormCache, get_compiled_form, bump_schema_version, forget_form
+
+def create_test_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SECRET_KEY'] = 'test'
+    app.config['WTF_CSRF_ENABLED'] = False
+    db.init_app(app)
+    FormCache(app)
+    return app
+
+def create_form(title, fields):
+    admin = Admin.query.first()
+    if admin is None:
+        admin = Admin(name="测试管理员", email="admin@test.com", password_hash="test")
+        db.session.add(admin)
+        db.session.flush()
+    form = Form(title=title, created_by=admin.id)
+    db.session.add(form)
+    db.session.flush()
+    for index, (name, label, field_type, options, required) in enumerate(fields):
+        db.session.add(FormField(form_id=form.id, field_name=name, field_label=label, field_type=field_type,
+                                 field_options=json.dumps(options) if options else None,
+                                 is_required=required, order_index=index))
+    db.session.commit()
+    return form
+
+def test_compiles_and_caches_form_class():
+    app = create_test_app()
+    with app.app_context():
+        db.create_all()
+        form = create_form("报名表", [
+            ('city', '城市', 'select', ['北京', '上海'], True),
+            ('name', '姓名', 'text', None, True),
+        ])
+
+        compiled = get_compiled_form(form.id, form.schema_version)
+        assert [field.field_name for field in compiled.fields] == ['city', 'name']
+        # 再次读取直接命中缓存，不重新编译
+        assert get_compiled_form(form.id, form.schema_version) is compiled
+
+        with app.test_request_context(method='POST'):
+            filled = compiled.form_class(formdata=MultiDict({'city': '上海', 'name': '张三'}))
+            assert filled.validate()
+            assert filled.city.data == '上海' and filled.name.data == '张三'
+            assert [choice[0] for choice in filled.city.choices] == ['', '北京', '上海']
+
+            missing = compiled.form_class(formdata=MultiDict({'city': '上海'}))
+            assert not missing.validate() and 'name' in missing.errors
+    print("✅ 表单字段编译为表单类并缓存")
+
+def test_bump_schema_version_recompiles():
+    app = create_test_app()
+    with app.app_context():
+        db.create_all()
+        form = create_form("报名表", [('name', '姓名', 'text', None, False)])
+        old = get_compiled_form(form.id, form.schema_version)
+
+        db.session.add(FormField(form_id=form.id, field_name='phone', field_label='电话',
+                                 field_type='tel', order_index=1))
+        bump_schema_version(form)
+        db.session.commit()
+        assert form.schema_version == 2
+
+        new = get_compiled_form(form.id, form.schema_version)
+        assert new is not old
+        assert [field.field_name for field in new.fields] == ['name', 'phone']
+        assert hasattr(new.form_class, 'phone') and not hasattr(old.form_class, 'phone')
+        # 旧版本的编译结果已被替换
+        assert list(app.extensions['form_cache']._entries) == [(form.id, 2)]
+    print("✅ 递增版本号后重新编译表单类")
+
+def test_forget_form_and_per_app_caches():
+    first_app, second_app = create_test_app(), create_test_app()
+    # 两个应用使用各自的数据库，表单ID和版本号相同但字段不同
+    with first_app.app_context():
+        db.create_all()
+        first_form = create_form("甲", [('name', '姓名', 'text', None, False)])
+        first = get_compiled_form(first_form.id, first_form.schema_version)
+    with second_app.app_context():
+        db.create_all()
+        second_form = create_form("乙", [('email', '邮箱', 'email', None, False)])
+        second = get_compiled_form(second_form.id, second_form.schema_version)
+    assert first_form.id == second_form.id
+    assert [field.field_name for field in first.fields] == ['name']
+    assert [field.field_name for field in second.fields] == ['email']
+
+    with first_app.app_context():
+        assert get_compiled_form(first_form.id, 1) is first
+        forget_form(first_form.id)
+        assert first_app.extensions['form_cache']._entries == {}
+        # 其他应用的缓存不受影响
+        assert second_app.extensions['form_cache']._entries
+        assert get_compiled_form(first_form.id, 1) is not first
+    print("✅ 删除表单释放缓存，各应用实例的缓存互不影响")
+
+if __name__ == '__main__':
+    test_compiles_and_caches_form_class()
+    test_bump_schema_version_recompiles()
+    test_forget_form_and_per_app_caches()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+测试支付网关连接
+用本地HTTP服务模拟微信支付网关，验证连接复用、读取超时、熔断后直接失败与冷却后恢复，
+以及耗时直方图
+"""
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from gateway_clients import CircuitBreaker, LatencyHistogram
+from payment_config import PaymentProcessor
+
+GATEWAY_SETTINGS = {'PAYMENT_GATEWAY_READ_TIMEOUT': '0.2', 'PAYMENT_GATEWAY_BREAKER_FAILURES': '3',
+                    'PAYMENT_GATEWAY_BREAKER_RESET_SECONDS': '0.5'}
+QUERY_RESPONSE = (b'<xml><return_code>SUCCESS</return_code><result_code>SUCCESS</result_code>'
+                  b'<trade_state>NOTPAY</trade_state></xml>')
+
+class FakeWeChatGateway(BaseHTTPRequestHandler):
+    """本地模拟网关：slow为True时超过读取超时才响应；记录请求数和客户端连接端口"""
+    protocol_version = 'HTTP/1.1'
+    slow = False
+    requests = 0
+    client_ports = set()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        FakeWeChatGateway.requests += 1
+        FakeWeChatGateway.client_ports.add(self.client_address[1])
+        if FakeWeChatGateway.slow:
+            time.sleep(0.5)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(QUERY_RESPONSE)))
+        self.end_headers()
+        self.wfile.write(QUERY_RESPONSE)
+
+    def log_message(self, *args):
+        pass
+
+def create_processor(server):
+    saved = {key: os.environ.get(key) for key in GATEWAY_SETTINGS}
+    os.environ.update(GATEWAY_SETTINGS)
+    try:
+        processor = PaymentProcessor()
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key)
+            else:
+                os.environ[key] = value
+    processor.wechat_client.sandbox = False
+    processor.wechat_client.API_BASE_URL = f'http://127.0.0.1:{server.server_port}/'
+    return processor
+
+def test_timeout_breaker_and_recovery():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeWeChatGateway)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        processor = create_processor(server)
+
+        # 正常响应：多次查询复用同一个连接
+        for _ in range(5):
+            result = processor.query_wechat_payment('ORDER01')
+            assert result.success and result.data['trade_state'] == 'NOTPAY'
+        assert len(FakeWeChatGateway.client_ports) == 1
+
+        # 网关变慢：每次调用在读取超时后返回失败，连续3次后熔断
+        FakeWeChatGateway.slow = True
+        for _ in range(3):
+            started = time.monotonic()
+            result = processor.query_wechat_payment('ORDER01')
+            assert not result.success and result.error_code == 'SYSTEM_ERROR'
+            assert time.monotonic() - started < 0.45
+        sent = FakeWeChatGateway.requests
+
+        # 熔断中直接失败，不再发出请求
+        started = time.monotonic()
+        result = processor.query_wechat_payment('ORDER01')
+        assert result.error_code == 'GATEWAY_UNAVAILABLE' and time.monotonic() - started < 0.05
+        assert FakeWeChatGateway.requests == sent
+
+        # 冷却后放行一个试探请求，成功后恢复
+        FakeWeChatGateway.slow = False
+        time.sleep(0.6)
+        assert processor.query_wechat_payment('ORDER01').success
+        assert processor.query_wechat_payment('ORDER01').success
+
+        stats = processor.gateway_stats()
+        assert stats['breakers']['wechat'] == {'state': 'closed', 'failures': 0}
+        query = stats['calls']['wechat.order.query']
+        assert query['outcomes'] == {'ok': 7, 'transport_error': 3, 'rejected': 1}
+        assert query['count'] == 10 and query['p99_ms'] >= 100
+    finally:
+        server.shutdown()
+        server.server_close()
+    print("✅ 网关超时后熔断，熔断中直接失败，冷却后恢复")
+
+def test_half_open_allows_single_probe():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=10, clock=lambda: now[0])
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open' and not breaker.allow()
+
+    now[0] = 10
+    assert breaker.allow() and not breaker.allow()
+    # 试探失败：重新计时
+    breaker.record_failure()
+    assert breaker.state == 'open' and not breaker.allow()
+    now[0] = 20
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.allow() and breaker.allow()
+    print("✅ 冷却后只放行一个试探请求")
+
+def test_latency_histogram():
+    histogram = LatencyHistogram()
+    for elapsed_ms in [10] * 90 + [300] * 9 + [20000]:
+        histogram.observe(elapsed_ms)
+    snapshot = histogram.snapshot()
+    assert snapshot['buckets']['le_25'] == 90 and snapshot['buckets']['le_500'] == 9
+    assert snapshot['buckets']['inf'] == 1
+    assert snapshot['p50_ms'] == 25 and snapshot['p95_ms'] == 500 and snapshot['p99_ms'] == 500
+    assert snapshot['max_ms'] == 20000
+    print("✅ 耗时直方图分桶和分位数正确")
+
+if __name__ == '__main__':
+    test_timeout_breaker_and_recovery()
+    test_half_open_allows_single_probe()
+    test_latency_histogram()
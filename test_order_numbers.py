@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+测试订单号生成
+多个进程、多个线程同时生成共数百万个订单号，验证没有重复、每个进程内单调递增，
+以及时钟回拨和同一毫秒序号用完时仍然唯一
+"""
+import multiprocessing
+import threading
+
+from order_numbers import OrderNumberGenerator, generate_order_no
+
+PROCESSES = 8
+IDS_PER_PROCESS = 250000
+
+def generate_batch(count):
+    ids = [generate_order_no() for _ in range(count)]
+    # 同一进程内单调递增（长度固定，按字符串比较即按数值比较）
+    assert all(a < b for a, b in zip(ids, ids[1:]))
+    return ids
+
+def test_no_duplicates_across_processes():
+    context = multiprocessing.get_context('fork')
+    with context.Pool(PROCESSES) as pool:
+        batches = pool.map(generate_batch, [IDS_PER_PROCESS] * PROCESSES)
+    # 父进程也参与生成，验证fork后各进程的进程号部分不同
+    batches.append(generate_batch(1000))
+
+    total = sum(len(batch) for batch in batches)
+    unique = set()
+    for batch in batches:
+        unique.update(batch)
+    assert total == PROCESSES * IDS_PER_PROCESS + 1000
+    assert len(unique) == total
+    assert {len(order_no) for order_no in unique} == {29}
+    print(f"✅ {PROCESSES}个进程生成{total}个订单号，无重复")
+
+def test_no_duplicates_across_threads():
+    generator = OrderNumberGenerator(node_id=1)
+    results = [[] for _ in range(8)]
+
+    def worker(index):
+        results[index] = [generator.next_id() for _ in range(20000)]
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ids = [order_no for batch in results for order_no in batch]
+    assert len(set(ids)) == len(ids) == 160000
+    print("✅ 多线程生成订单号无重复")
+
+def test_clock_skew_and_sequence_overflow():
+    now = [1700000000000]
+    generator = OrderNumberGenerator(node_id=7, clock=lambda: now[0])
+
+    # 同一毫秒内超过10000个：借用下一毫秒
+    ids = [generator.next_id() for _ in range(25000)]
+    assert len(set(ids)) == 25000 and ids == sorted(ids)
+    assert ids[-1].startswith('PAY1700000000002')
+
+    # 时钟回拨：继续在已发出的最大时间上递增
+    now[0] -= 5000
+    skewed = [generator.next_id() for _ in range(100)]
+    assert skewed == sorted(skewed) and skewed[0] > ids[-1]
+    assert not set(skewed) & set(ids)
+
+    # 时钟恢复并超过已发出的时间后按实际时间生成
+    now[0] += 10000
+    assert generator.next_id().startswith('PAY1700000005000')
+    print("✅ 时钟回拨和序号用完时订单号仍唯一且递增")
+
+if __name__ == '__main__':
+    test_no_duplicates_across_processes()
+    test_no_duplicates_across_threads()
+    test_clock_skew_and_sequence_overflow()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+测试游标分页
+验证按(时间, ID)翻页时记录不重复、不遗漏，且时间相同的记录按ID稳定排序
+"""
+from datetime import datetime, timedelta
+from flask import Flask
+from models import db, User
+from migrations import collect_query_plans
+from query_utils import keyset_page, encode_cursor, decode_cursor
+
+def create_test_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+def create_users(count):
+    """每3个用户共用同一注册时间，覆盖排序字段相同的情况"""
+    base = datetime(2024, 1, 1)
+    for i in range(count):
+        db.session.add(User(name=f"用户{i}", email=f"user{i}@test.com", password_hash="test",
+                            created_at=base + timedelta(minutes=i // 3)))
+    db.session.commit()
+
+def test_cursor_roundtrip():
+    value = datetime(2024, 5, 1, 12, 30, 15, 123456)
+    assert decode_cursor(encode_cursor(value, 42)) == (value, 42)
+    try:
+        decode_cursor('not-a-cursor')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('无效游标应抛出ValueError')
+    print("✅ 游标编码解码正确")
+
+def test_keyset_pages_cover_all_rows():
+    app = create_test_app()
+    with app.app_context():
+        db.create_all()
+        create_users(25)
+        expected = [user.id for user in User.query.order_by(User.created_at.desc(), User.id.desc())]
+
+        pages, cursor = [], None
+        while True:
+            page = keyset_page(User.query, User.created_at, User.id, after=cursor, per_page=10)
+            pages.append([user.id for user in page.items])
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+
+        assert [len(items) for items in pages] == [10, 10, 5]
+        assert sum(pages, []) == expected
+
+        # 从最后一页向前翻页，得到与向后翻页相同的内容
+        previous = keyset_page(User.query, User.created_at, User.id, before=page.prev_cursor, per_page=10)
+        assert [user.id for user in previous.items] == pages[1]
+        assert previous.has_next and previous.has_prev
+
+        # 用户列表翻页走(注册时间, ID)复合索引
+        assert 'ix_user_created_id' in collect_query_plans(db.engine)['用户列表']
+        print("✅ 25条记录分3页，向前向后翻页结果一致")
+
+if __name__ == '__main__':
+    test_cursor_roundtrip()
+    test_keyset_pages_cover_all_rows()
+    print("✅ 游标分页测试通过")
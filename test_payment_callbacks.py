@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+测试支付回调入账的幂等性
+并发发送100次同一笔交易的回调，验证订单只被更新一次、统计计数器只变化一次，
+且每次回调都得到成功应答；清空数据库后回调去重记录一并清除
+"""
+import os
+import tempfile
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from flask import Flask
+from sqlalchemy import event
+from config import Config
+from models import db, User, Admin, Form, Submission, PaymentOrder, PaymentCallback, PaymentEvent, ExportJob
+from payment_callbacks import ingest_payment_callback, WECHAT_SUCCESS_RESPONSE
+from payment_events import publish_payment_event
+from payment_reconciler import get_reconcile_metrics
+from stats_counters import register_counter_events, get_counters, apply_counter_deltas
+
+PARALLEL_CALLBACKS = 100
+
+def create_test_app(database_url):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(Config.SQLALCHEMY_ENGINE_OPTIONS, pool_size=20, max_overflow=0,
+                                                   connect_args={'timeout': 30})
+    db.init_app(app)
+    return app
+
+def create_order(admin_id=None):
+    if admin_id is None:
+        admin = Admin(name="测试管理员", email="admin@test.com", password_hash="test")
+        db.session.add(admin)
+        db.session.flush()
+        admin_id = admin.id
+    user = User(name="测试用户", email="user@test.com", password_hash="test")
+    db.session.add(user)
+    db.session.flush()
+    form = Form(title="测试表单", created_by=admin_id)
+    db.session.add(form)
+    db.session.flush()
+    submission = Submission(form_id=form.id, user_id=user.id)
+    db.session.add(submission)
+    db.session.flush()
+    order = PaymentOrder(submission_id=submission.id, field_name='fee', payment_type='wechat_pay',
+                         amount=Decimal('88.50'), order_no='ORDER0001', payment_data='{"prepay_id": "wx123"}')
+    db.session.add(order)
+    db.session.commit()
+    return admin_id
+
+def test_parallel_duplicate_callbacks():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app = create_test_app('sqlite:///' + os.path.join(tmpdir, 'callbacks.db'))
+        with app.app_context():
+            db.create_all()
+            register_counter_events()
+            create_order()
+            db.session.remove()
+
+        callback_data = {'out_trade_no': 'ORDER0001', 'transaction_id': 'WX420000', 'total_fee': '8850'}
+        barrier = threading.Barrier(PARALLEL_CALLBACKS)
+
+        def deliver(_):
+            with app.app_context():
+                barrier.wait()
+                try:
+                    return ingest_payment_callback('wechat', 'WX420000', 'ORDER0001', callback_data,
+                                                   WECHAT_SUCCESS_RESPONSE)
+                finally:
+                    db.session.remove()
+
+        with ThreadPoolExecutor(max_workers=PARALLEL_CALLBACKS) as executor:
+            outcomes = list(executor.map(deliver, range(PARALLEL_CALLBACKS)))
+
+        assert all(outcome.response == WECHAT_SUCCESS_RESPONSE for outcome in outcomes)
+        results = [outcome.result for outcome in outcomes]
+        assert results.count('paid') == 1
+        assert results.count('duplicate') == PARALLEL_CALLBACKS - 1
+
+        with app.app_context():
+            order = PaymentOrder.query.filter_by(order_no='ORDER0001').one()
+            assert order.status == 'paid' and order.trade_no == 'WX420000'
+            assert order.get_payment_data()['prepay_id'] == 'wx123'
+            assert order.get_payment_data()['callback_data'] == callback_data
+            assert PaymentCallback.query.count() == 1
+
+            counters = get_counters('payments.')
+            assert counters.count('payments.status.pending') == 0
+            assert counters.count('payments.status.paid') == 1
+            assert counters.amount('payments.revenue') == Decimal('88.50')
+            assert counters.amount('payments.revenue.wechat_pay') == Decimal('88.50')
+            db.session.remove()
+            db.engine.dispose()
+        print(f"✅ {PARALLEL_CALLBACKS}次并发重复回调只入账一次")
+
+def test_callback_for_paid_or_missing_order():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app = create_test_app('sqlite:///' + os.path.join(tmpdir, 'callbacks.db'))
+        with app.app_context():
+            db.create_all()
+            register_counter_events()
+            create_order()
+
+            # 未知订单不登记，网关重试时重新处理
+            outcome = ingest_payment_callback('alipay', 'ALI001', 'MISSING', {}, 'success')
+            assert outcome == ('not_found', None)
+            assert PaymentCallback.query.count() == 0
+
+            assert ingest_payment_callback('alipay', 'ALI002', 'ORDER0001', {}, 'success').result == 'paid'
+            # 同一订单的另一笔交易号：订单已支付，不再修改订单但返回成功
+            outcome = ingest_payment_callback('alipay', 'ALI003', 'ORDER0001', {}, 'success')
+            assert outcome == ('already_paid', 'success')
+            assert PaymentOrder.query.one().trade_no == 'ALI002'
+            assert get_counters('payments.').count('payments.status.paid') == 1
+            db.session.remove()
+            db.engine.dispose()
+        print("✅ 已支付订单与未知订单的回调处理正确")
+
+def test_clear_database_removes_callback_records():
+    from app import create_app
+
+    instance_path = tempfile.mkdtemp()
+    try:
+        app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(instance_path, 'app.db')}",
+        }, instance_path=instance_path)
+        # 后台线程不在测试中启动
+        for extension in app.extensions.values():
+            if hasattr(extension, 'ensure_started'):
+                extension.ensure_started = lambda: None
+        export_dir = app.extensions['export_jobs'].export_dir
+
+        with app.app_context():
+            # 开启外键检查，与PostgreSQL的约束行为一致
+            event.listen(db.engine, 'connect', lambda conn, _: conn.execute('PRAGMA foreign_keys=ON'))
+            db.engine.dispose()
+            db.create_all()
+            admin_id = create_order()
+            other = Admin(name="其他管理员", email="other@test.com", password_hash="test")
+            db.session.add(other)
+            db.session.flush()
+            db.session.add(ExportJob(id='job1', job_type='users', status='completed', created_by=other.id,
+                                     output_path=os.path.join(export_dir, 'job1.csv')))
+            db.session.commit()
+            with open(os.path.join(export_dir, 'job1.csv'), 'w') as f:
+                f.write('id\n')
+
+            assert ingest_payment_callback('wechat', 'WX420000', 'ORDER0001', {}, WECHAT_SUCCESS_RESPONSE).result == 'paid'
+            with db.engine.begin() as conn:
+                publish_payment_event(conn, PaymentOrder.query.one().id, 'paid')
+                apply_counter_deltas(conn, {'_payment_reconcile.paid': 3})
+            assert get_reconcile_metrics()['paid'] == 3
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = f'admin_{admin_id}'
+        response = client.post('/admin/database/clear', data={'confirm_code': 'CLEAR_ALL_DATA'})
+        assert response.status_code == 302 and response.headers['Location'].endswith('/admin/dashboard')
+
+        with app.app_context():
+            assert PaymentCallback.query.count() == 0 and PaymentEvent.query.count() == 0
+            assert ExportJob.query.count() == 0 and os.listdir(export_dir) == []
+            assert [admin.id for admin in Admin.query] == [admin_id]
+            assert get_reconcile_metrics() == {}
+
+            # 重建同一订单号后，同一交易号的回调重新入账而不是按重复回调处理
+            create_order(admin_id)
+            assert ingest_payment_callback('wechat', 'WX420000', 'ORDER0001', {}, WECHAT_SUCCESS_RESPONSE).result == 'paid'
+            db.session.remove()
+            db.engine.dispose()
+    finally:
+        shutil.rmtree(instance_path)
+    print("✅ 清空数据库时一并清除回调去重记录")
+
+if __name__ == '__main__':
+    test_parallel_duplicate_callbacks()
+    test_callback_for_paid_or_missing_order()
+    test_clear_database_removes_callback_records()
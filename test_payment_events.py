@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+测试支付状态推送
+模拟两个工作进程：一个处理支付回调，另一个持有支付页面的订阅，
+回调提交后订阅方应在轮询间隔内收到已支付通知；晚提交的较小ID通知在回读范围内仍会推送且不重复；
+每个工作进程的推送连接数有上限
+"""
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+
+from flask import Flask
+from sqlalchemy import insert
+from config import Config
+from models import db, User, Admin, Form, Submission, PaymentOrder, PaymentEvent
+from payment_callbacks import ingest_payment_callback
+from payment_events import PaymentEventBroker
+from stats_counters import register_counter_events
+
+def create_test_app(database_url, max_streams=8):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = Config.SQLALCHEMY_ENGINE_OPTIONS
+    app.config['PAYMENT_EVENT_POLL_SECONDS'] = 1
+    app.config['PAYMENT_EVENT_STREAM_SECONDS'] = 30
+    app.config['PAYMENT_EVENT_MAX_STREAMS'] = max_streams
+    db.init_app(app)
+    return app
+
+def create_orders():
+    admin = Admin(name="测试管理员", email="admin@test.com", password_hash="test")
+    user = User(name="测试用户", email="user@test.com", password_hash="test")
+    db.session.add_all([admin, user])
+    db.session.flush()
+    form = Form(title="测试表单", created_by=admin.id)
+    db.session.add(form)
+    db.session.flush()
+    submission = Submission(form_id=form.id, user_id=user.id)
+    db.session.add(submission)
+    db.session.flush()
+    orders = [PaymentOrder(submission_id=submission.id, field_name='fee', payment_type='alipay',
+                           amount=Decimal('10.00'), order_no=f'ORDER100{i}') for i in range(2)]
+    db.session.add_all(orders)
+    db.session.commit()
+    return [order.id for order in orders]
+
+def test_paid_callback_reaches_other_worker():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_url = 'sqlite:///' + os.path.join(tmpdir, 'events.db')
+        callback_app = create_test_app(database_url)
+        page_app = create_test_app(database_url)
+        broker = PaymentEventBroker(page_app)
+
+        with callback_app.app_context():
+            db.create_all()
+            register_counter_events()
+            order_id, other_id = create_orders()
+
+        with page_app.app_context():
+            subscription = broker.subscribe(order_id)
+            other = broker.subscribe(other_id)
+        assert broker.subscriber_count() == 2
+        assert not subscription.wait(1.2)
+
+        with callback_app.app_context():
+            outcome = ingest_payment_callback('alipay', 'ALI100', 'ORDER1000', {}, 'success')
+            assert outcome.result == 'paid'
+            db.session.remove()
+
+        start = time.monotonic()
+        assert subscription.wait(5)
+        assert subscription.status == 'paid'
+        assert time.monotonic() - start < 2.5
+        assert not other.wait(0.1)
+
+        broker.unsubscribe(subscription)
+        broker.unsubscribe(other)
+        assert broker.subscriber_count() == 0
+
+        with callback_app.app_context():
+            assert PaymentEvent.query.filter_by(order_id=order_id, status='paid').count() == 1
+            db.session.remove()
+            db.engine.dispose()
+        with page_app.app_context():
+            db.engine.dispose()
+    print("✅ 支付回调提交后另一工作进程的订阅及时收到通知")
+
+def add_event(event_id, order_id, status):
+    """按指定ID写入通知，模拟并发事务按与ID不同的顺序提交"""
+    with db.engine.begin() as conn:
+        conn.execute(insert(PaymentEvent.__table__).values(id=event_id, order_id=order_id, status=status,
+                                                           created_at=datetime.utcnow()))
+
+def test_late_commit_with_lower_id():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app = create_test_app('sqlite:///' + os.path.join(tmpdir, 'events.db'))
+        broker = PaymentEventBroker(app)
+        # 不启动后台线程，由测试直接执行轮询
+        broker.ensure_started = lambda: None
+        broker._wake = threading.Event()
+        with app.app_context():
+            db.create_all()
+            order_id, other_id = create_orders()
+            # 订阅前已有的通知不推送
+            add_event(10, order_id, 'failed')
+            subscription = broker.subscribe(order_id)
+            other = broker.subscribe(other_id)
+            broker._poll_once()
+            assert not subscription.wait(0)
+
+            add_event(20, other_id, 'paid')
+            broker._poll_once()
+            assert other.wait(0) and other.status == 'paid'
+
+            # ID较小的事务在较大的ID之后提交，仍在回读范围内
+            add_event(15, order_id, 'paid')
+            broker._poll_once()
+            assert subscription.wait(0) and subscription.status == 'paid'
+            # 已推送的通知不重复推送
+            assert not other.wait(0)
+            broker._poll_once()
+            assert not subscription.wait(0) and not other.wait(0)
+
+            # 超出回读范围才提交的通知不推送，由推送连接的兜底查询发现
+            add_event(20 + broker.ID_OVERLAP + 10, other_id, 'closed')
+            broker._poll_once()
+            assert other.wait(0)
+            add_event(18, order_id, 'refunded')
+            broker._poll_once()
+            assert not subscription.wait(0)
+            db.engine.dispose()
+    print("✅ 回读范围内晚提交的较小ID通知仍会推送且不重复")
+
+def test_stream_limit_per_worker():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app = create_test_app('sqlite:///' + os.path.join(tmpdir, 'events.db'), max_streams=2)
+        broker = PaymentEventBroker(app)
+        with app.app_context():
+            db.create_all()
+            order_id, other_id = create_orders()
+            first = broker.subscribe(order_id)
+            second = broker.subscribe(other_id)
+            # 连接数已达上限，新的页面改为轮询
+            assert first and second and broker.subscribe(order_id) is None
+            assert broker.subscriber_count() == 2
+
+            broker.unsubscribe(first)
+            third = broker.subscribe(order_id)
+            assert third is not None and broker.subscriber_count() == 2
+            broker.unsubscribe(second)
+            broker.unsubscribe(third)
+            db.engine.dispose()
+    print("✅ 每个工作进程的推送连接数不超过上限")
+
+if __name__ == '__main__':
+    test_paid_callback_reaches_other_worker()
+    test_late_commit_with_lower_id()
+    test_stream_limit_per_worker()
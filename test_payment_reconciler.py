@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+测试待支付订单后台对账
+使用本地模拟网关和真实的支付处理器，验证终态同步、未支付订单的指数退避、超时订单先在网关关闭再取消、
+网关上不存在的交易（用户未发起支付）取消后仍接受支付结果，以及对账指标
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from flask import Flask
+from config import Config
+from fake_gateway import FakePaymentGateway
+from models import db, User, Admin, Form, Submission, PaymentOrder
+from payment_callbacks import ingest_payment_callback
+from payment_config import PaymentProcessor
+from payment_reconciler import PendingOrderReconciler, get_reconcile_metrics
+from stats_counters import register_counter_events, reconcile_counters
+
+class RecordingProcessor(PaymentProcessor):
+    """请求模拟网关的支付处理器：记录查询的订单，可模拟用户在查询之后、关闭之前完成付款"""
+
+    def __init__(self, gateway, pay_after_query=()):
+        super().__init__()
+        self.gateway = gateway
+        self.pay_after_query = set(pay_after_query)
+        self.calls = []
+        # 异步通知发往不存在的商户地址，不影响对账
+        self.wechat_config.notify_url = self.alipay_config.notify_url = 'http://127.0.0.1:9/notify'
+        gateway.configure(self)
+
+    def _after_query(self, order_no, result):
+        self.calls.append(order_no)
+        if order_no in self.pay_after_query:
+            self.pay_after_query.discard(order_no)
+            self.gateway.pay(order_no)
+        return result
+
+    def query_wechat_payment(self, order_no):
+        return self._after_query(order_no, super().query_wechat_payment(order_no))
+
+    def query_alipay_payment(self, order_no):
+        return self._after_query(order_no, super().query_alipay_payment(order_no))
+
+    def open(self, payment_type, order_no):
+        """在网关上发起支付：微信统一下单，支付宝打开收银台"""
+        if payment_type == 'wechat_pay':
+            assert self.create_wechat_payment(order_no, 12.0, '测试').success
+        else:
+            result = self.create_alipay_payment(order_no, 12.0, '测试')
+            assert result.success and self.http.get(result.payment_url).status_code == 200
+
+def create_test_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = Config.SQLALCHEMY_ENGINE_OPTIONS
+    app.config.update(PAYMENT_RECONCILE_INTERVAL_SECONDS=300, PAYMENT_RECONCILE_MIN_AGE_SECONDS=300,
+                      PAYMENT_RECONCILE_BATCH_SIZE=2, PAYMENT_RECONCILE_MAX_PER_RUN=100,
+                      PAYMENT_RECONCILE_RATE_PER_SECOND=1000, PAYMENT_ORDER_EXPIRE_SECONDS=7200)
+    db.init_app(app)
+    return app
+
+def create_orders(now, processor=None):
+    admin = Admin(name="测试管理员", email="admin@test.com", password_hash="test")
+    user = User(name="测试用户", email="user@test.com", password_hash="test")
+    db.session.add_all([admin, user])
+    db.session.flush()
+    form = Form(title="测试表单", created_by=admin.id)
+    db.session.add(form)
+    db.session.flush()
+    submission = Submission(form_id=form.id, user_id=user.id)
+    db.session.add(submission)
+    db.session.flush()
+    # 订单号 -> (支付方式, 创建于多少分钟前, 是否在网关上发起了支付)
+    orders = {
+        'PAID01': ('wechat_pay', 30, True), 'CLOSED01': ('alipay', 20, True), 'NOTPAY01': ('wechat_pay', 10, True),
+        'ERROR01': ('alipay', 15, False), 'FRESH01': ('wechat_pay', 1, True), 'EXPIRED01': ('alipay', 180, True),
+        'EXPIRED02': ('wechat_pay', 170, True), 'MISSING01': ('alipay', 150, False),
+        'MISSING02': ('wechat_pay', 160, False),
+    }
+    for order_no, (payment_type, minutes, opened) in orders.items():
+        db.session.add(PaymentOrder(submission_id=submission.id, field_name='fee', payment_type=payment_type,
+                                    amount=Decimal('12.00'), order_no=order_no,
+                                    created_at=now - timedelta(minutes=minutes)))
+        if processor is not None and opened:
+            processor.open(payment_type, order_no)
+    db.session.commit()
+
+def order_status(order_no):
+    return db.session.execute(db.select(PaymentOrder.status).filter_by(order_no=order_no)).scalar()
+
+def test_reconcile_pending_orders():
+    app = create_test_app()
+    now = datetime.utcnow()
+    with FakePaymentGateway() as gateway, app.app_context():
+        # EXPIRED02：对账查询后用户完成付款，网关拒绝关闭
+        processor = RecordingProcessor(gateway, pay_after_query=['EXPIRED02'])
+        reconciler = PendingOrderReconciler(app, processor=processor)
+        db.create_all()
+        register_counter_events()
+        create_orders(now, processor)
+        assert gateway.pay('PAID01')
+        assert processor.close_alipay_payment('CLOSED01').success
+
+        stats = reconciler.run_once(now)
+        # 按创建时间从早到晚查询，未到最短等待时间的订单不查询
+        assert processor.calls == ['EXPIRED01', 'EXPIRED02', 'MISSING02', 'MISSING01', 'PAID01', 'CLOSED01',
+                                   'ERROR01', 'NOTPAY01']
+        assert stats['checked'] == 8 and stats['paid'] == 1 and stats['cancelled'] == 4
+        # ERROR01：支付宝收银台未打开，网关上还没有交易且订单未超时，按查询失败退避
+        assert stats['unpaid'] == 1 and stats['errors'] == 2 and stats['lag_seconds'] == 0
+        # 超时未支付的订单先在网关关闭，用户无法再付款
+        assert gateway._get_order('EXPIRED01')['closed'] and not gateway.pay('EXPIRED01')
+
+        assert order_status('PAID01') == 'paid'
+        assert db.session.execute(db.select(PaymentOrder.trade_no).filter_by(order_no='PAID01')).scalar() == \
+            gateway._get_order('PAID01')['transaction_id']
+        assert [order_status(no) for no in ('CLOSED01', 'EXPIRED01', 'MISSING01', 'MISSING02')] == ['cancelled'] * 4
+        assert order_status('NOTPAY01') == order_status('ERROR01') == order_status('FRESH01') == 'pending'
+        # 网关关闭失败时不在本地取消，退避后重查
+        assert order_status('EXPIRED02') == 'pending'
+
+        # 指数退避：第1次查询后60秒、第2次后120秒再查
+        order = PaymentOrder.query.filter_by(order_no='NOTPAY01').one()
+        assert order.reconcile_attempts == 1 and order.next_reconcile_at == now + timedelta(seconds=60)
+
+        processor.calls.clear()
+        assert reconciler.run_once(now + timedelta(seconds=30))['checked'] == 0
+        stats = reconciler.run_once(now + timedelta(seconds=61))
+        assert sorted(processor.calls) == ['ERROR01', 'EXPIRED02', 'NOTPAY01']
+        # 关闭失败的订单重查时已支付
+        assert stats['paid'] == 1 and order_status('EXPIRED02') == 'paid'
+        db.session.expire_all()
+        order = PaymentOrder.query.filter_by(order_no='ERROR01').one()
+        assert order.reconcile_attempts == 2
+        assert order.next_reconcile_at == now + timedelta(seconds=61 + 120)
+
+        # 网关上没有交易时取消的订单，用户随后完成支付仍可入账；已在网关关闭的订单不接受
+        assert ingest_payment_callback('alipay', 'ALI02', 'MISSING01', {}, 'success').result == 'paid'
+        assert ingest_payment_callback('wechat', 'WX02', 'MISSING02', {}, 'SUCCESS').result == 'paid'
+        assert ingest_payment_callback('alipay', 'ALI03', 'CLOSED01', {}, 'success').result == 'rejected'
+        assert order_status('MISSING01') == order_status('MISSING02') == 'paid'
+        assert order_status('CLOSED01') == 'cancelled'
+
+        # 直接更新的订单状态已同步到统计计数器
+        assert reconcile_counters() == ({}, {})
+
+        metrics = get_reconcile_metrics()
+        assert metrics['checked'] == 11 and metrics['paid'] == 2 and metrics['cancelled'] == 4
+        assert metrics['unpaid'] == 2 and metrics['errors'] == 3 and metrics.get('skipped', 0) == 0
+        assert metrics['last_checked'] == 3 and 'throughput' in metrics and 'lag_seconds' in metrics
+    print("✅ 待支付订单对账：终态同步、退避重查与指标记录正确")
+
+def test_stops_after_consecutive_gateway_errors():
+    app = create_test_app()
+    now = datetime.utcnow()
+    with FakePaymentGateway(failure_rate=1.0) as gateway, app.app_context():
+        processor = RecordingProcessor(gateway)
+        db.create_all()
+        create_orders(now)
+        reconciler = PendingOrderReconciler(app, processor=processor)
+        stats = reconciler.run_once(now)
+        assert stats['errors'] == reconciler.MAX_CONSECUTIVE_ERRORS == len(processor.calls)
+    print("✅ 网关连续失败时提前结束对账")
+
+def test_counts_orders_updated_concurrently():
+    app = create_test_app()
+    now = datetime.utcnow()
+
+    class CallbackDuringQuery(RecordingProcessor):
+        """查询期间支付回调先完成入账"""
+
+        def query_wechat_payment(self, order_no):
+            ingest_payment_callback('wechat', 'WX01', order_no, {}, 'success')
+            return super().query_wechat_payment(order_no)
+
+    with FakePaymentGateway() as gateway, app.app_context():
+        processor = CallbackDuringQuery(gateway)
+        reconciler = PendingOrderReconciler(app, processor=processor)
+        db.create_all()
+        create_orders(now)
+        PaymentOrder.query.filter(PaymentOrder.order_no != 'PAID01').delete()
+        db.session.commit()
+        processor.open('wechat_pay', 'PAID01')
+        assert gateway.pay('PAID01')
+
+        stats = reconciler.run_once(now)
+        # 订单由回调完成支付，对账按实际结果计为跳过
+        assert stats['checked'] == 1 and stats['skipped'] == 1 and 'paid' not in stats
+        assert order_status('PAID01') == 'paid'
+        assert get_reconcile_metrics()['skipped'] == 1
+    print("✅ 已被其他请求更新的订单按实际结果计数")
+
+if __name__ == '__main__':
+    test_reconcile_pending_orders()
+    test_stops_after_consecutive_gateway_errors()
+    test_counts_orders_updated_concurrently()
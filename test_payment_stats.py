@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+测试支付订单分组聚合统计
+对比一次GROUP BY查询得到的各状态、各支付方式的订单数和金额与逐条计算的结果
+"""
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from flask import Flask
+from config import Config
+from models import db, User, Admin, Form, Submission, PaymentOrder
+from migrations import collect_query_plans
+from query_utils import keyset_page, payment_breakdown
+
+STATUSES = ('pending', 'processing', 'paid', 'failed', 'cancelled')
+PAYMENT_TYPES = ('wechat_pay', 'alipay')
+
+def create_test_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = Config.SQLALCHEMY_ENGINE_OPTIONS
+    db.init_app(app)
+    return app
+
+def create_orders():
+    rng = random.Random(7)
+    admin = Admin(name="测试管理员", email="admin@test.com", password_hash="test")
+    users = [User(name=f"用户{i}", email=f"user{i}@test.com", password_hash="test") for i in range(3)]
+    db.session.add_all([admin] + users)
+    db.session.flush()
+    form = Form(title="测试表单", created_by=admin.id)
+    db.session.add(form)
+    db.session.flush()
+    for user in users:
+        submission = Submission(form_id=form.id, user_id=user.id)
+        db.session.add(submission)
+        db.session.flush()
+        for i in range(200):
+            db.session.add(PaymentOrder(submission_id=submission.id, field_name='fee', order_no=f'U{user.id}-{i}',
+                                        payment_type=rng.choice(PAYMENT_TYPES), status=rng.choice(STATUSES),
+                                        amount=Decimal(rng.randint(100, 99999)) / 100))
+    db.session.commit()
+    return users
+
+def test_breakdown_matches_row_by_row_totals():
+    app = create_test_app()
+    with app.app_context():
+        db.create_all()
+        user = create_orders()[1]
+        query = PaymentOrder.query.join(Submission, PaymentOrder.submission_id == Submission.id).filter(
+            Submission.user_id == user.id)
+        orders = query.all()
+        breakdown = payment_breakdown(query)
+
+        assert len(breakdown.rows) <= len(STATUSES) * len(PAYMENT_TYPES)
+        assert breakdown.count() == len(orders) == 200
+        for status in STATUSES + (None,):
+            for payment_type in PAYMENT_TYPES + (None,):
+                matching = [order for order in orders
+                            if status in (None, order.status) and payment_type in (None, order.payment_type)]
+                assert breakdown.count(status, payment_type) == len(matching)
+                assert breakdown.amount(status, payment_type) == sum((order.amount for order in matching), Decimal(0))
+
+        # 没有订单时为0
+        empty = payment_breakdown(PaymentOrder.query.filter(PaymentOrder.id < 0))
+        assert empty.count() == 0 and empty.amount('paid') == Decimal(0)
+    print("✅ 分组聚合统计与逐条计算结果一致")
+
+def test_date_range_listing_uses_created_index():
+    app = create_test_app()
+    with app.app_context():
+        db.create_all()
+        create_orders()
+        base = datetime(2024, 1, 1)
+        for i, order in enumerate(PaymentOrder.query.order_by(PaymentOrder.id)):
+            order.created_at = base + timedelta(hours=i)
+        db.session.commit()
+
+        start, end = base + timedelta(days=3), base + timedelta(days=5)
+        in_range = PaymentOrder.query.filter(PaymentOrder.created_at >= start, PaymentOrder.created_at < end)
+        expected = [order.id for order in in_range.order_by(PaymentOrder.created_at.desc(), PaymentOrder.id.desc())]
+        assert len(expected) == 48
+
+        # 日期范围内按游标翻页，结果与一次查询相同
+        seen, cursor = [], None
+        while True:
+            page = keyset_page(in_range, PaymentOrder.created_at, PaymentOrder.id, after=cursor, per_page=20)
+            seen += [order.id for order in page.items]
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        assert seen == expected
+
+        # 日期范围统计为一次聚合查询
+        assert payment_breakdown(in_range).count() == 48
+        # 日期范围筛选和排序走(created_at, id)索引
+        assert 'ix_payment_order_created' in collect_query_plans(db.engine)['支付订单列表']
+    print("✅ 日期范围内游标翻页完整，并使用创建时间索引")
+
+if __name__ == '__main__':
+    test_breakdown_matches_row_by_row_totals()
+    test_date_range_listing_uses_created_index()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+测试支付状态查询的合并与缓存
+并发轮询同一订单时只请求一次网关，缓存有效期内不再请求，
+网关返回已支付后订单同步为已支付，此后按本地订单回答
+"""
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from flask import Flask
+from config import Config
+from models import db, User, Admin, Form, Submission, PaymentOrder
+from payment_config import PaymentResult
+from stats_counters import register_counter_events, get_counters
+import payment_status
+from payment_status import PaymentStatusResolver
+
+class FakeGateway:
+    """模拟支付网关：每次查询耗时0.2秒，记录查询次数"""
+
+    def __init__(self):
+        self.calls = 0
+        self.trade_state = 'NOTPAY'
+        self.lock = threading.Lock()
+
+    def query_wechat_payment(self, order_no):
+        with self.lock:
+            self.calls += 1
+        time.sleep(0.2)
+        return PaymentResult(success=True, message="查询成功", data={
+            'return_code': 'SUCCESS', 'out_trade_no': order_no,
+            'trade_state': self.trade_state, 'transaction_id': 'WX9001'
+        })
+
+def create_test_app(database_url):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(Config.SQLALCHEMY_ENGINE_OPTIONS, pool_size=20, max_overflow=0)
+    app.config['PAYMENT_STATUS_CACHE_SECONDS'] = 60
+    db.init_app(app)
+    return app
+
+def create_order():
+    admin = Admin(name="测试管理员", email="admin@test.com", password_hash="test")
+    user = User(name="测试用户", email="user@test.com", password_hash="test")
+    db.session.add_all([admin, user])
+    db.session.flush()
+    form = Form(title="测试表单", created_by=admin.id)
+    db.session.add(form)
+    db.session.flush()
+    submission = Submission(form_id=form.id, user_id=user.id)
+    db.session.add(submission)
+    db.session.flush()
+    order = PaymentOrder(submission_id=submission.id, field_name='fee', payment_type='wechat_pay',
+                         amount=Decimal('20.00'), order_no='ORDER0002')
+    db.session.add(order)
+    db.session.commit()
+    return order.id
+
+def test_concurrent_polls_share_one_gateway_call():
+    gateway = FakeGateway()
+    original = payment_status.get_payment_processor
+    payment_status.get_payment_processor = lambda: gateway
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            app = create_test_app('sqlite:///' + os.path.join(tmpdir, 'status.db'))
+            resolver = PaymentStatusResolver(app)
+            with app.app_context():
+                db.create_all()
+                register_counter_events()
+                order_id = create_order()
+                db.session.remove()
+
+            def poll(_):
+                with app.app_context():
+                    try:
+                        return resolver.resolve(db.session.get(PaymentOrder, order_id))
+                    finally:
+                        db.session.remove()
+
+            with ThreadPoolExecutor(max_workers=20) as executor:
+                answers = list(executor.map(poll, range(20)))
+            assert gateway.calls == 1
+            assert all(answer.status == 'pending' for answer in answers)
+            assert sorted({answer.source for answer in answers}) == ['gateway', 'shared']
+
+            # 缓存有效期内不再请求网关
+            assert poll(0).source == 'cache' and gateway.calls == 1
+
+            # 缓存过期后网关返回已支付：订单同步为已支付，之后按本地订单回答
+            gateway.trade_state = 'SUCCESS'
+            resolver._cache.clear()
+            answer = poll(0)
+            assert (answer.status, answer.trade_no, answer.source) == ('paid', 'WX9001', 'gateway')
+            assert poll(0).source == 'local' and gateway.calls == 2
+
+            with app.app_context():
+                order = db.session.get(PaymentOrder, order_id)
+                assert order.status == 'paid' and order.trade_no == 'WX9001'
+                assert get_counters('payments.').amount('payments.revenue') == Decimal('20.00')
+                db.session.remove()
+                db.engine.dispose()
+
+            stats = resolver.stats()
+            assert stats['misses'] == 2 and stats['shared_hits'] == 19
+            assert stats['cache_hits'] == 1 and stats['local_hits'] == 1
+    finally:
+        payment_status.get_payment_processor = original
+    print("✅ 并发轮询合并为一次网关请求，结果缓存与本地终态回答正确")
+
+if __name__ == '__main__':
+    test_concurrent_polls_share_one_gateway_call()
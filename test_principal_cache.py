@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+测试登录身份缓存
+有效期内直接返回缓存的身份，其他工作进程递增代数后本进程清空缓存，
+以及已禁用的用户按未登录处理
+"""
+import os
+import tempfile
+import time
+
+from flask import Flask
+from flask_login import LoginManager, current_user
+from sqlalchemy import update
+
+from models import db, User, Admin
+from principal_cache import PrincipalCache
+
+def create_test_app(database_url, ttl=300, check_interval=3600):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SECRET_KEY'] = 'test'
+    app.config['PRINCIPAL_CACHE_TTL_SECONDS'] = ttl
+    app.config['PRINCIPAL_GENERATION_CHECK_SECONDS'] = check_interval
+    db.init_app(app)
+    cache = PrincipalCache(app)
+
+    login_manager = LoginManager(app)
+    login_manager.user_loader(cache.get)
+
+    @app.route('/whoami')
+    def whoami():
+        return 'anonymous' if current_user.is_anonymous else f'{current_user.get_id()}:{current_user.name}'
+
+    return app
+
+def create_users():
+    admin = Admin(name="测试管理员", email="admin@test.com", password_hash="test")
+    user = User(name="张三", email="user@test.com", password_hash="test")
+    db.session.add_all([admin, user])
+    db.session.commit()
+    return admin.id, user.id
+
+def rename_user(user_id, name):
+    """绕过缓存失效直接修改数据库"""
+    db.session.execute(update(User).where(User.id == user_id).values(name=name))
+    db.session.commit()
+
+def test_cached_until_ttl():
+    app = create_test_app('sqlite://', ttl=1)
+    cache = app.extensions['principal_cache']
+    with app.app_context():
+        db.create_all()
+        admin_id, user_id = create_users()
+
+        principal = cache.get(str(user_id))
+        assert principal.name == '张三' and not principal.is_admin
+        admin = cache.get(f'admin_{admin_id}')
+        assert admin.is_admin and admin.get_id() == f'admin_{admin_id}'
+        assert cache.get('999') is None
+
+        # 有效期内不访问数据库，返回缓存的身份
+        rename_user(user_id, '李四')
+        assert cache.get(str(user_id)) is principal
+
+        time.sleep(1.1)
+        assert cache.get(str(user_id)).name == '李四'
+    print("✅ 有效期内直接返回缓存的身份")
+
+def test_generation_invalidates_other_worker():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_url = 'sqlite:///' + os.path.join(tmpdir, 'principals.db')
+        admin_app = create_test_app(database_url)
+        page_app = create_test_app(database_url, check_interval=1)
+        page_cache = page_app.extensions['principal_cache']
+
+        with admin_app.app_context():
+            db.create_all()
+            _, user_id = create_users()
+
+        with page_app.app_context():
+            assert page_cache.get(str(user_id)).name == '张三'
+
+        # 另一个工作进程修改资料后递增代数
+        with admin_app.app_context():
+            rename_user(user_id, '李四')
+            admin_app.extensions['principal_cache'].invalidate()
+
+        with page_app.app_context():
+            # 检查间隔内仍使用缓存，超过间隔读取到新代数后清空缓存
+            assert page_cache.get(str(user_id)).name == '张三'
+            time.sleep(1.1)
+            assert page_cache.get(str(user_id)).name == '李四'
+            db.engine.dispose()
+        with admin_app.app_context():
+            db.engine.dispose()
+    print("✅ 其他工作进程递增代数后本进程清空缓存")
+
+def test_disabled_user_is_anonymous():
+    app = create_test_app('sqlite://')
+    cache = app.extensions['principal_cache']
+    with app.app_context():
+        db.create_all()
+        _, user_id = create_users()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+    assert client.get('/whoami').data.decode('utf-8') == f'{user_id}:张三'
+
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        user.is_active = False
+        db.session.commit()
+        cache.invalidate()
+    assert client.get('/whoami').data.decode('utf-8') == 'anonymous'
+    print("✅ 已禁用的用户按未登录处理")
+
+if __name__ == '__main__':
+    test_cached_until_ttl()
+    test_generation_invalidates_other_worker()
+    test_disabled_user_is_anonymous()
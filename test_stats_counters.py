@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+测试统计计数器
+创建、修改状态、删除时计数器在同一事务中更新，校准任务修正绕过ORM造成的偏差，
+以及多个进程中定期任务只有一个认领成功
+"""
+from datetime import datetime
+
+from flask import Flask
+from sqlalchemy import insert
+
+from models import db, User, Admin, Form, Submission, StatCounter
+from stats_counters import (register_counter_events, reconcile_counters, get_counters, get_named_counters,
+                            get_daily_totals, claim_periodic_run, set_counter_values, local_today)
+
+def create_test_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+def setup_data():
+    admin = Admin(name="测试管理员", email="admin@test.com", password_hash="test")
+    user = User(name="测试用户", email="user@test.com", password_hash="test")
+    db.session.add_all([admin, user])
+    db.session.flush()
+    form = Form(title="测试表单", created_by=admin.id)
+    db.session.add(form)
+    db.session.commit()
+    return user, form
+
+def test_flush_updates_counters():
+    app = create_test_app()
+    with app.app_context():
+        db.create_all()
+        register_counter_events()
+        user, form = setup_data()
+
+        counters = get_counters()
+        assert counters.count('users.total') == 1 and counters.count('users.with_email') == 1
+        assert counters.count('users.with_phone') == 0
+        assert counters.count('forms.total') == 1 and counters.count('forms.active') == 1
+        assert get_daily_totals(['users.registered', 'forms.created']) == {'users.registered': 1,
+                                                                            'forms.created': 1}
+
+        first = Submission(form_id=form.id, user_id=user.id)
+        second = Submission(form_id=form.id, user_id=user.id)
+        db.session.add_all([first, second])
+        db.session.commit()
+        counters = get_counters()
+        assert counters.count('submissions.total') == 2
+        assert counters.count('submissions.status.submitted') == 2
+        assert counters.count(f'form.{form.id}.submissions.total') == 2
+        # 按名称读取时只返回指定的计数器
+        names = [f'form.{form.id}.submissions.total', 'form.999.submissions.total']
+        assert get_named_counters(names) == {names[0]: 2}
+
+        # 修改状态：从原状态扣减，计入新状态，总数不变
+        first.status = 'approved'
+        form.is_active = False
+        db.session.commit()
+        counters = get_counters()
+        assert counters.count('submissions.total') == 2
+        assert counters.count('submissions.status.submitted') == 1
+        assert counters.count('submissions.status.approved') == 1
+        assert counters.count(f'form.{form.id}.submissions.status.approved') == 1
+        assert counters.count('forms.total') == 1 and counters.count('forms.active') == 0
+
+        # 对象过期后修改也按数据库中的原值扣减
+        db.session.expire_all()
+        first.status = 'rejected'
+        db.session.commit()
+        counters = get_counters()
+        assert counters.count('submissions.status.approved') == 0
+        assert counters.count('submissions.status.rejected') == 1
+
+        db.session.delete(first)
+        db.session.commit()
+        counters = get_counters()
+        assert counters.count('submissions.total') == 1
+        assert counters.count('submissions.status.rejected') == 0
+        assert counters.count(f'form.{form.id}.submissions.total') == 1
+        assert get_daily_totals(['submissions.created']).count('submissions.created') == 1
+
+        # 回滚的写操作不影响计数
+        db.session.add(Submission(form_id=form.id, user_id=user.id))
+        db.session.flush()
+        db.session.rollback()
+        assert get_counters().count('submissions.total') == 1
+
+        # 计数与基础表一致，校准不产生偏差
+        assert reconcile_counters() == ({}, {})
+    print("✅ 创建、修改状态、删除时计数器随之更新")
+
+def test_reconcile_corrects_drift():
+    app = create_test_app()
+    with app.app_context():
+        db.create_all()
+        register_counter_events()
+        user, form = setup_data()
+
+        # 绕过ORM的批量插入不经过会话事件
+        now = datetime.utcnow()
+        db.session.execute(insert(Submission), [
+            {'form_id': form.id, 'user_id': user.id, 'status': 'submitted', 'submitted_at': now},
+            {'form_id': form.id, 'user_id': user.id, 'status': 'approved', 'submitted_at': now},
+        ])
+        db.session.commit()
+        with db.engine.begin() as conn:
+            set_counter_values(conn, {'users.total': 7, 'forms.unknown': 3, '_marker': 42})
+        assert get_counters().count('submissions.total') == 0
+
+        drift_totals, drift_daily = reconcile_counters()
+        assert drift_totals['submissions.total'] == 2
+        assert drift_totals['users.total'] == -6 and drift_totals['forms.unknown'] == -3
+        assert '_marker' not in drift_totals
+        assert drift_daily == {('submissions.created', local_today()): 2}
+
+        counters = get_counters()
+        assert counters.count('users.total') == 1 and counters.count('forms.unknown') == 0
+        assert counters.count('submissions.status.approved') == 1
+        assert counters.count(f'form.{form.id}.submissions.total') == 2
+        # 下划线开头的运行标记不参与校准
+        assert counters.count('_marker') == 42
+        assert get_daily_totals(['submissions.created']).count('submissions.created') == 2
+
+        # 校准后再次校准没有偏差
+        assert reconcile_counters() == ({}, {})
+    print("✅ 校准任务按基础表修正计数器偏差")
+
+def test_claim_periodic_run():
+    app = create_test_app()
+    with app.app_context():
+        db.create_all()
+        # 首次运行时标记不存在，认领成功
+        assert claim_periodic_run('_job_ran_at', 3600)
+        # 间隔内其他进程认领失败
+        assert not claim_periodic_run('_job_ran_at', 3600)
+        assert not claim_periodic_run('_job_ran_at', 3600)
+        # 其他标记互不影响
+        assert claim_periodic_run('_other_ran_at', 3600)
+
+        # 超过间隔后可以再次认领；放弃认领（标记清零）后下一轮立即重新运行
+        assert claim_periodic_run('_job_ran_at', 0)
+        with db.engine.begin() as conn:
+            set_counter_values(conn, {'_job_ran_at': 0})
+        assert claim_periodic_run('_job_ran_at', 3600)
+        assert StatCounter.query.filter(StatCounter.name.like('\\_%', escape='\\')).count() == 2
+    print("✅ 定期任务在间隔内只有一个进程认领成功")
+
+if __name__ == '__main__':
+    test_flush_updates_counters()
+    test_reconcile_corrects_drift()
+    test_claim_periodic_run()
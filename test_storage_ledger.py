@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+测试存储用量台账
+上传和删除附件时按表单、按用户、按日期更新用量，磁盘用量随文件放入、删除增减（去重的文件只计一次），
+按基础表校准时结果不变，后台校验按上传目录修正磁盘用量
+"""
+import io
+import os
+import shutil
+import tempfile
+
+from flask import Flask
+
+from models import db, User, Admin, Form, Submission
+from stats_counters import register_counter_events, reconcile_counters, get_counters
+from storage_ledger import get_storage_usage, get_owner_storage, verify_storage
+from submission_storage import SubmissionWriter, STORAGE_EAV
+from upload_store import UploadStore
+
+def create_test_app(instance_path):
+    app = Flask(__name__, instance_path=instance_path)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['UPLOAD_FOLDER'] = 'uploads'
+    app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024
+    db.init_app(app)
+    return app
+
+def submit_files(store, form, user, files):
+    """按表单提交的写入方式：一次写入提交记录和附件记录，并登记文件引用"""
+    writer = SubmissionWriter(form.id, user.id, STORAGE_EAV)
+    blobs = [store.ingest(io.BytesIO(content), 'attachment', filename, None) for filename, content in files]
+    for blob in blobs:
+        writer.add_file(**blob.row)
+    conn = db.session.connection()
+    store.acquire(conn, blobs)
+    submission_id = writer.write(conn)
+    db.session.commit()
+    return db.session.get(Submission, submission_id)
+
+def delete_submission(store, submission):
+    released = store.release(db.session.connection(), submission.files)
+    db.session.delete(submission)
+    db.session.commit()
+    store.purge(released)
+
+def test_ledger_follows_uploads_and_deletes():
+    instance_path = tempfile.mkdtemp()
+    try:
+        app = create_test_app(instance_path)
+        store = UploadStore(app)
+        photo, pdf = b'photo' * 1000, b'%PDF' * 2000
+        with app.app_context():
+            db.create_all()
+            register_counter_events()
+            admin = Admin(name="测试管理员", email="admin@test.com", password_hash="test")
+            alice = User(name="用户甲", email="a@test.com", password_hash="test")
+            bob = User(name="用户乙", email="b@test.com", password_hash="test")
+            db.session.add_all([admin, alice, bob])
+            db.session.flush()
+            form = Form(title="测试表单", created_by=admin.id)
+            db.session.add(form)
+            db.session.commit()
+
+            first = submit_files(store, form, alice, [('证件照.jpg', photo), ('简历.pdf', pdf)])
+            submit_files(store, form, bob, [('photo.jpg', photo)])
+
+            usage = get_storage_usage()
+            assert usage['references'] == 3 and usage['logical_bytes'] == 2 * len(photo) + len(pdf)
+            # 相同的照片在磁盘上只保存一份
+            assert usage['files'] == 2 and usage['stored_bytes'] == len(photo) + len(pdf)
+            assert usage['saved_bytes'] == len(photo)
+            assert usage['today_uploaded'] == 3 and usage['today_uploaded_size'] == usage['logical_bytes']
+
+            assert get_owner_storage('form', [form.id]) == {form.id: {'files': 3, 'bytes': usage['logical_bytes']}}
+            by_user = get_owner_storage('user', [alice.id, bob.id, 999])
+            assert by_user[alice.id] == {'files': 2, 'bytes': len(photo) + len(pdf)}
+            assert by_user[bob.id] == {'files': 1, 'bytes': len(photo)}
+            assert by_user[999] == {'files': 0, 'bytes': 0}
+
+            # 台账与基础表一致，校准不产生偏差，也不改动按文件系统校准的磁盘用量
+            assert reconcile_counters() == ({}, {})
+            assert verify_storage(store) == {}
+
+            # 删除提交后附件用量减少；照片仍被引用，磁盘上只删除PDF
+            delete_submission(store, first)
+            usage = get_storage_usage()
+            assert usage['references'] == 1 and usage['logical_bytes'] == len(photo)
+            assert usage['files'] == 1 and usage['stored_bytes'] == len(photo)
+            assert usage['today_uploaded_size'] == len(photo)
+            assert get_owner_storage('user', [alice.id])[alice.id] == {'files': 0, 'bytes': 0}
+            assert reconcile_counters() == ({}, {})
+            assert verify_storage(store) == {}
+    finally:
+        shutil.rmtree(instance_path)
+    print("✅ 上传和删除附件时存储用量台账同步更新")
+
+def test_verify_storage_against_filesystem():
+    instance_path = tempfile.mkdtemp()
+    try:
+        app = create_test_app(instance_path)
+        store = UploadStore(app)
+        with app.app_context():
+            db.create_all()
+            register_counter_events()
+
+            # 台账建立之前已有的旧附件，首次校验时计入
+            for name, content in (('old.pdf', b'x' * 300), ('old.jpg', b'y' * 200)):
+                with open(os.path.join(store.root, name), 'wb') as f:
+                    f.write(content)
+            # 上传中的临时文件不计入
+            with open(os.path.join(store.incoming_dir, 'partial'), 'wb') as f:
+                f.write(b'z' * 100)
+            assert verify_storage(store) == {'storage.files': 2, 'storage.bytes': 500}
+            assert get_storage_usage()['files'] == 2 and get_storage_usage()['stored_bytes'] == 500
+
+            # 绕过附件存储删除的文件在下次校验时修正
+            os.remove(os.path.join(store.root, 'old.jpg'))
+            assert verify_storage(store) == {'storage.files': -1, 'storage.bytes': -200}
+            assert verify_storage(store) == {}
+            # 按基础表校准不会清除磁盘用量
+            reconcile_counters()
+            assert get_counters('storage.').count('storage.bytes') == 300
+    finally:
+        shutil.rmtree(instance_path)
+    print("✅ 后台校验按上传目录修正磁盘用量")
+
+if __name__ == '__main__':
+    test_ledger_follows_uploads_and_deletes()
+    test_verify_storage_against_filesystem()
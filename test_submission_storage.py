@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+测试提交数据存储方式
+验证EAV与JSON两种存储方式读取结果一致、已有数据可合并为JSON文档，
+可筛选字段的查询能命中表达式索引，以及批量写入失败时整体回滚、计数器与ORM写入一致
+"""
+from flask import Flask
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from config import Config
+from models import db, User, Admin, Form, FormField, Submission, SubmissionData, UploadFile, PaymentOrder
+from stats_counters import register_counter_events, get_counters, get_daily_totals
+from submission_storage import (STORAGE_EAV, STORAGE_JSON, SubmissionWriter, save_submission_values, backfill_payloads,
+                                ensure_filterable_indexes, field_value_equals)
+
+VALUES = {'name': '张三', 'city': "O'Brien 城", 'hobby': '阅读,跑步'}
+
+def create_test_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = Config.SQLALCHEMY_ENGINE_OPTIONS
+    db.init_app(app)
+    return app
+
+def create_form():
+    admin = Admin(name="测试管理员", email="admin@test.com", password_hash="test")
+    user = User(name="测试用户", email="user@test.com", password_hash="test")
+    db.session.add_all([admin, user])
+    db.session.flush()
+    form = Form(title="测试表单", created_by=admin.id)
+    db.session.add(form)
+    db.session.flush()
+    db.session.add(FormField(form_id=form.id, field_name='city', field_label='城市',
+                             field_type='text', is_filterable=True))
+    return form, user
+
+def add_submission(form, user, mode, values=VALUES):
+    submission = Submission(form_id=form.id, user_id=user.id)
+    db.session.add(submission)
+    save_submission_values(submission, values, mode)
+    db.session.commit()
+    return submission.id
+
+def test_both_modes_return_same_data():
+    app = create_test_app()
+    with app.app_context():
+        db.create_all()
+        form, user = create_form()
+        eav_id = add_submission(form, user, STORAGE_EAV)
+        json_id = add_submission(form, user, STORAGE_JSON)
+        db.session.expunge_all()
+
+        eav, doc = db.session.get(Submission, eav_id), db.session.get(Submission, json_id)
+        assert eav.payload is None and len(eav.data) == 3
+        assert doc.payload is not None and doc.data == []
+        assert eav.get_data_dict() == doc.get_data_dict() == VALUES
+        assert list(doc.get_data_dict()) == list(VALUES)
+
+        # 字段筛选同时覆盖两种存储方式
+        matched = Submission.query.filter(field_value_equals('city', "O'Brien 城")).all()
+        assert sorted(s.id for s in matched) == [eav_id, json_id]
+        assert Submission.query.filter(field_value_equals('city', '北京')).count() == 0
+        print("✅ EAV与JSON存储方式读取、筛选结果一致")
+
+def test_backfill_merges_rows():
+    app = create_test_app()
+    with app.app_context():
+        db.create_all()
+        form, user = create_form()
+        ids = [add_submission(form, user, STORAGE_EAV, {'name': f'用户{i}', 'city': '上海'}) for i in range(7)]
+        json_id = add_submission(form, user, STORAGE_JSON)
+
+        assert backfill_payloads(db.engine, batch_size=3) == 7
+        assert backfill_payloads(db.engine, batch_size=3) == 0
+        db.session.expunge_all()
+
+        assert SubmissionData.query.count() == 0
+        assert db.session.get(Submission, ids[4]).get_data_dict() == {'name': '用户4', 'city': '上海'}
+        assert db.session.get(Submission, json_id).get_data_dict() == VALUES
+        print("✅ 已有提交数据分批合并为JSON文档")
+
+def test_filterable_field_uses_expression_index():
+    app = create_test_app()
+    with app.app_context():
+        db.create_all()
+        form, user = create_form()
+        add_submission(form, user, STORAGE_JSON)
+        with db.engine.begin() as conn:
+            assert ensure_filterable_indexes(conn) == ['city']
+            ensure_filterable_indexes(conn)  # 重复执行时跳过已有索引
+
+        query = (db.session.query(Submission.id)
+                 .filter(Submission.form_id == form.id, field_value_equals('city', '上海', STORAGE_JSON)))
+        sql = str(query.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+        plan = ' '.join(str(row[-1]) for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}')))
+        assert 'ix_submission_payload_' in plan, plan
+        print(f"✅ 字段筛选命中表达式索引: {plan}")
+
+FILE_ROW = {'field_name': 'photo', 'original_filename': '证件照.jpg', 'saved_filename': 'ab/abcd.jpg',
+            'file_size': 2048, 'file_type': 'image/jpeg'}
+PAYMENT_ROW = {'field_name': 'fee', 'payment_type': 'wechat_pay', 'amount': 12.5, 'status': 'pending'}
+
+def fill_writer(writer, order_no, file_row=FILE_ROW):
+    writer.add_value('name', '张三')
+    writer.add_value('fee', '12.5')
+    writer.add_file(**file_row)
+    writer.add_payment(order_no=order_no, **PAYMENT_ROW)
+
+def test_writer_rolls_back_on_failure():
+    app = create_test_app()
+    with app.app_context():
+        db.create_all()
+        register_counter_events()
+        form, user = create_form()
+        db.session.commit()
+        writer = SubmissionWriter(form.id, user.id, STORAGE_EAV)
+        fill_writer(writer, 'ORDER-1')
+        writer.write(db.session.connection())
+        db.session.commit()
+        counters_before = dict(get_counters())
+
+        # 附件写入失败（缺少保存文件名）：提交记录、字段值和计数器都不保留
+        writer = SubmissionWriter(form.id, user.id, STORAGE_EAV)
+        fill_writer(writer, 'ORDER-2', dict(FILE_ROW, saved_filename=None))
+        try:
+            writer.write(db.session.connection())
+            assert False, '附件写入应失败'
+        except IntegrityError:
+            db.session.rollback()
+
+        # 支付订单写入失败（订单号重复）
+        writer = SubmissionWriter(form.id, user.id, STORAGE_JSON)
+        fill_writer(writer, 'ORDER-1')
+        try:
+            writer.write(db.session.connection())
+            assert False, '支付订单写入应失败'
+        except IntegrityError:
+            db.session.rollback()
+
+        assert Submission.query.count() == 1 and SubmissionData.query.count() == 2
+        assert UploadFile.query.count() == 1 and PaymentOrder.query.count() == 1
+        assert dict(get_counters()) == counters_before
+        print("✅ 附件或支付订单写入失败时整次提交回滚")
+
+def test_insert_deltas_match_orm_path():
+    results = []
+    for use_writer in (False, True):
+        app = create_test_app()
+        with app.app_context():
+            db.create_all()
+            register_counter_events()
+            form, user = create_form()
+            db.session.commit()
+            if use_writer:
+                writer = SubmissionWriter(form.id, user.id, STORAGE_EAV)
+                fill_writer(writer, 'ORDER-1')
+                writer.add_payment(order_no='ORDER-2', **dict(PAYMENT_ROW, payment_type='alipay', status='paid'))
+                writer.write(db.session.connection())
+            else:
+                submission = Submission(form_id=form.id, user_id=user.id)
+                db.session.add(submission)
+                save_submission_values(submission, {'name': '张三', 'fee': '12.5'}, STORAGE_EAV)
+                submission.files.append(UploadFile(**FILE_ROW))
+                db.session.add_all([
+                    PaymentOrder(submission=submission, order_no='ORDER-1', **PAYMENT_ROW),
+                    PaymentOrder(submission=submission, order_no='ORDER-2',
+                                 **dict(PAYMENT_ROW, payment_type='alipay', status='paid')),
+                ])
+            db.session.commit()
+            counters = {name: value for name, value in get_counters().items() if not name.startswith('_')}
+            daily = get_daily_totals(['users.registered', 'forms.created', 'submissions.created',
+                                      'files.uploaded', 'files.uploaded_size'])
+            results.append((counters, dict(daily)))
+
+    (orm_counters, orm_daily), (writer_counters, writer_daily) = results
+    assert writer_counters == orm_counters and writer_daily == orm_daily
+    assert orm_counters['payments.revenue.alipay'] == 12.5 and orm_counters['user.1.files.size'] == 2048
+    assert orm_daily['files.uploaded_size'] == 2048
+    print("✅ 批量写入与ORM写入的计数器变化一致")
+
+if __name__ == '__main__':
+    test_both_modes_return_same_data()
+    test_backfill_merges_rows()
+    test_filterable_field_uses_expression_index()
+    test_writer_rolls_back_on_failure()
+    test_insert_deltas_match_orm_path()
+    print("✅ 提交数据存储测试通过")
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+测试按内容寻址的附件存储
+相同内容只保存一份、引用计数随附件记录增减、计数为0时才在提交后删除文件（回滚时保留），以及去重节省的空间；
+旧附件分批迁移到分片目录，迁移期间按文件名查找时回退到根目录
+"""
+import io
+import os
+import shutil
+import tempfile
+import uuid
+
+from flask import Flask
+
+from models import db, User, Admin, Form, Submission, UploadFile, UploadBlob
+from upload_store import UploadStore, FileTooLarge
+
+def create_test_app(instance_path):
+    app = Flask(__name__, instance_path=instance_path)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['UPLOAD_FOLDER'] = 'uploads'
+    app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024
+    db.init_app(app)
+    return app
+
+def submit_files(store, form, user, files):
+    """模拟一次带附件的提交：写入临时文件、登记引用、写入附件记录"""
+    submission = Submission(form_id=form.id, user_id=user.id)
+    db.session.add(submission)
+    db.session.flush()
+    blobs = [store.ingest(io.BytesIO(content), 'attachment', filename, None) for filename, content in files]
+    store.acquire(db.session.connection(), blobs)
+    for blob in blobs:
+        db.session.add(UploadFile(submission_id=submission.id, **blob.row))
+    db.session.commit()
+    return submission
+
+def delete_submissions(store, submissions):
+    upload_files = [upload_file for submission in submissions for upload_file in submission.files]
+    released = store.release(db.session.connection(), upload_files)
+    for submission in submissions:
+        db.session.delete(submission)
+    db.session.commit()
+    return store.purge(released)
+
+def test_dedup_and_refcounted_delete():
+    instance_path = tempfile.mkdtemp()
+    try:
+        app = create_test_app(instance_path)
+        store = UploadStore(app)
+        photo, pdf = b'photo' * 1000, b'%PDF' * 2000
+        with app.app_context():
+            db.create_all()
+            admin = Admin(name="测试管理员", email="admin@test.com", password_hash="test")
+            user = User(name="测试用户", email="user@test.com", password_hash="test")
+            db.session.add_all([admin, user])
+            db.session.flush()
+            form = Form(title="测试表单", created_by=admin.id)
+            db.session.add(form)
+            db.session.commit()
+
+            # 同一张照片在三次提交中上传（其中一次同时作为两个附件），只保存一份
+            first = submit_files(store, form, user, [('证件照.jpg', photo), ('简历.pdf', pdf)])
+            second = submit_files(store, form, user, [('photo.JPG', photo)])
+            third = submit_files(store, form, user, [('a.jpg', photo), ('b.jpg', photo)])
+
+            photo_blob = db.session.get(UploadBlob, first.files[0].blob_hash)
+            assert photo_blob.ref_count == 4 and photo_blob.size == len(photo)
+            blob_path = store.path(first.files[0].saved_filename)
+            assert os.path.relpath(blob_path, store.root).split(os.sep)[:2] == [photo_blob.hash[:2], photo_blob.hash[2:4]]
+            assert store.path(second.files[0].saved_filename) == blob_path
+            assert second.files[0].saved_filename.endswith('.jpg')
+            assert os.listdir(store.incoming_dir) == []
+
+            usage = store.usage()
+            assert usage['blobs'] == 2 and usage['references'] == 5
+            assert usage['stored_bytes'] == len(photo) + len(pdf)
+            assert usage['saved_bytes'] == 3 * len(photo)
+
+            # 仍有引用时删除提交只减少计数，不删除文件；只被这次提交引用的文件删除
+            pdf_path = store.path(first.files[1].saved_filename)
+            assert delete_submissions(store, [first]) == 1
+            assert not os.path.exists(pdf_path)
+            assert os.path.exists(blob_path) and db.session.get(UploadBlob, photo_blob.hash).ref_count == 3
+
+            # 最后的引用删除后才删除文件和记录
+            assert delete_submissions(store, [second, third]) == 1
+            assert not os.path.exists(blob_path) and UploadBlob.query.count() == 0
+            assert store.usage()['saved_bytes'] == 0
+    finally:
+        shutil.rmtree(instance_path)
+    print("✅ 相同内容只保存一份，引用计数为0时才删除文件")
+
+def test_release_keeps_files_until_commit():
+    instance_path = tempfile.mkdtemp()
+    try:
+        app = create_test_app(instance_path)
+        store = UploadStore(app)
+        photo = b'photo' * 1000
+        with app.app_context():
+            db.create_all()
+            admin = Admin(name="测试管理员", email="admin@test.com", password_hash="test")
+            user = User(name="测试用户", email="user@test.com", password_hash="test")
+            db.session.add_all([admin, user])
+            db.session.flush()
+            form = Form(title="测试表单", created_by=admin.id)
+            db.session.add(form)
+            db.session.commit()
+
+            submission = submit_files(store, form, user, [('证件照.jpg', photo)])
+            blob_hash = submission.files[0].blob_hash
+            blob_path = store.blob_path(blob_hash)
+
+            # 释放后删除失败回滚：文件和引用计数都保持不变
+            released = store.release(db.session.connection(), submission.files)
+            assert released.blob_hashes == [blob_hash]
+            db.session.delete(submission)
+            db.session.rollback()
+            assert os.path.exists(blob_path) and db.session.get(UploadBlob, blob_hash).ref_count == 1
+
+            # 提交后、清理前相同内容被重新上传：文件保留给新的引用
+            released = store.release(db.session.connection(), submission.files)
+            db.session.delete(submission)
+            db.session.commit()
+            again = submit_files(store, form, user, [('again.jpg', photo)])
+            assert store.purge(released) == 0
+            assert os.path.exists(blob_path) and db.session.get(UploadBlob, blob_hash).ref_count == 1
+
+            assert delete_submissions(store, [again]) == 1
+            assert not os.path.exists(blob_path) and UploadBlob.query.count() == 0
+    finally:
+        shutil.rmtree(instance_path)
+    print("✅ 附件文件在删除提交后才清理，回滚时保留")
+
+def test_size_limit_while_streaming():
+    instance_path = tempfile.mkdtemp()
+    try:
+        app = create_test_app(instance_path)
+        store = UploadStore(app)
+        try:
+            store.ingest(io.BytesIO(b'x' * (1024 * 1024 + 1)), 'attachment', 'big.pdf', None)
+            raise AssertionError('应拒绝超过大小限制的文件')
+        except FileTooLarge:
+            pass
+        # 超限时临时文件已删除
+        assert os.listdir(store.incoming_dir) == []
+
+        # 放弃提交时删除临时文件
+        blob = store.ingest(io.BytesIO(b'content'), 'attachment', 'a.pdf', 'application/pdf')
+        assert os.path.exists(blob.temp_path)
+        store.discard([blob])
+        assert os.listdir(store.incoming_dir) == []
+    finally:
+        shutil.rmtree(instance_path)
+    print("✅ 写入时超过大小限制立即停止")
+
+def test_legacy_files_migrate_to_shards():
+    instance_path = tempfile.mkdtemp()
+    try:
+        app = create_test_app(instance_path)
+        store = UploadStore(app)
+        names = [f'{uuid.uuid4().hex}.pdf' for _ in range(25)]
+        for name in names:
+            with open(os.path.join(store.root, name), 'wb') as f:
+                f.write(name.encode())
+
+        # 迁移前按文件名查找回退到根目录
+        assert store.relpath(names[0]) == names[0]
+
+        batches = []
+        for batch in store.iter_flat_batches(10):
+            batches.append(len(batch))
+            for name in batch:
+                assert store.migrate_flat_file(name)
+                # 迁移后立即可以在分片位置找到
+                assert store.relpath(name) == store.legacy_relpath(name)
+        assert batches == [10, 10, 5]
+        assert not any(os.path.isfile(os.path.join(store.root, name)) for name in os.listdir(store.root))
+
+        for name in names:
+            with open(store.path(name), 'rb') as f:
+                assert f.read() == name.encode()
+        assert sorted(os.path.basename(relpath) for relpath, _ in store.iter_files()) == sorted(names)
+        # 已被删除的文件跳过
+        assert not store.migrate_flat_file('missing.pdf')
+
+        # 删除旧附件时在根目录或分片目录中找到文件
+        with open(os.path.join(store.root, 'flat.jpg'), 'wb') as f:
+            f.write(b'x')
+        legacy = [UploadFile(saved_filename=names[0]), UploadFile(saved_filename='flat.jpg')]
+        with app.app_context():
+            db.create_all()
+            released = store.release(db.session.connection(), legacy)
+            db.session.commit()
+            assert store.purge(released) == 2
+        assert not os.path.exists(store.path(names[0])) and not os.path.exists(store.path('flat.jpg'))
+    finally:
+        shutil.rmtree(instance_path)
+    print("✅ 旧附件分批迁移到分片目录，迁移期间仍能找到文件")
+
+if __name__ == '__main__':
+    test_dedup_and_refcounted_delete()
+    test_release_keeps_files_until_commit()
+    test_size_limit_while_streaming()
+    test_legacy_files_migrate_to_shards()
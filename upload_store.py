@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""
+按内容寻址的附件存储
+同一份PDF、证件照在不同提交中被反复上传时，磁盘上只保存一份：
+- 上传的文件边写入临时文件边计算SHA-256，超过大小限制时立即停止
+- 文件按哈希保存在上传目录下的 ab/cd/<哈希> 中，UploadFile.blob_hash 指向 UploadBlob，
+  UploadBlob.ref_count 记录引用该文件的附件记录数
+- 引用计数与附件记录在同一事务中增减；计数减到0的文件在事务提交后删除（release返回待删除的文件，
+  调用方提交后交给purge），事务回滚时文件保留
+- 附件记录的saved_filename为"<哈希>.<扩展名>"（下载链接和MIME类型仍按扩展名）
+- 未使用内容寻址存储的旧附件按文件名的哈希分片保存在 ab/cd/<文件名> 中，上传目录根下不再堆积文件；
+  migrate_uploads.py 将根目录下的旧附件分批移入分片目录，迁移期间查找附件时回退到根目录
+- 放入、删除文件时在同一事务中更新存储用量台账（见storage_ledger），管理后台不再遍历上传目录
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import uuid
+from datetime import datetime
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, UploadBlob
+from storage_ledger import record_stored
+
+COPY_BUFFER_SIZE = 64 * 1024
+INCOMING_FOLDER = '.incoming'
+BLOB_NAME = re.compile(r'^[0-9a-f]{64}$')
+
+
+class FileTooLarge(ValueError):
+    """文件超过大小限制"""
+
+
+class PendingBlob:
+    """已写入临时文件、尚未登记引用的上传文件
+
+    row为UploadFile的列值（不含submission_id），temp_path在登记引用时移入正式位置。
+    """
+
+    def __init__(self, blob_hash, size, temp_path, row):
+        self.blob_hash = blob_hash
+        self.size = size
+        self.temp_path = temp_path
+        self.row = row
+
+
+class ReleasedFiles:
+    """release后待删除的文件：引用计数已减到0的文件哈希和旧附件文件名，事务提交后交给purge删除"""
+
+    def __init__(self, blob_hashes, legacy_names):
+        self.blob_hashes = blob_hashes
+        self.legacy_names = legacy_names
+
+
+class UploadStore:
+    """内容寻址存储扩展"""
+
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.root = os.path.join(app.instance_path, app.config['UPLOAD_FOLDER'])
+        self.incoming_dir = os.path.join(self.root, INCOMING_FOLDER)
+        self.max_size = app.config['MAX_CONTENT_LENGTH']
+        os.makedirs(self.incoming_dir, exist_ok=True)
+        app.extensions['upload_store'] = self
+
+    @staticmethod
+    def blob_relpath(blob_hash):
+        return os.path.join(blob_hash[:2], blob_hash[2:4], blob_hash)
+
+    def blob_path(self, blob_hash):
+        return os.path.join(self.root, self.blob_relpath(blob_hash))
+
+    @staticmethod
+    def legacy_relpath(saved_filename):
+        """旧附件按文件名哈希分片的位置"""
+        prefix = hashlib.sha256(saved_filename.encode('utf-8')).hexdigest()
+        return os.path.join(prefix[:2], prefix[2:4], saved_filename)
+
+    def relpath(self, saved_filename):
+        """附件相对上传目录的路径
+
+        内容寻址的文件按内容哈希分片；旧附件按文件名哈希分片，尚未迁移的仍在根目录下。
+        文件可能恰好在两次检查之间被迁移，根目录下也找不到时返回分片位置。
+        """
+        stem = saved_filename.rsplit('.', 1)[0]
+        if BLOB_NAME.match(stem):
+            return self.blob_relpath(stem)
+        sharded = self.legacy_relpath(saved_filename)
+        if os.path.exists(os.path.join(self.root, sharded)):
+            return sharded
+        if os.path.isfile(os.path.join(self.root, saved_filename)):
+            return saved_filename
+        return sharded
+
+    def path(self, saved_filename):
+        return os.path.join(self.root, self.relpath(saved_filename))
+
+    def _new_temp_path(self):
+        return os.path.join(self.incoming_dir, uuid.uuid4().hex)
+
+    def ingest(self, stream, field_name, original_filename, file_type):
+        """从文件流读取内容写入临时文件并计算哈希，返回PendingBlob
+
+        超过MAX_CONTENT_LENGTH时删除临时文件并抛出FileTooLarge。
+        """
+        temp_path = self._new_temp_path()
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(temp_path, 'wb') as f:
+                while True:
+                    data = stream.read(COPY_BUFFER_SIZE)
+                    if not data:
+                        break
+                    size += len(data)
+                    if size > self.max_size:
+                        raise FileTooLarge(f"文件大小超过限制 {self.max_size/1024/1024:.0f}MB")
+                    digest.update(data)
+                    f.write(data)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return self._pending(digest.hexdigest(), size, temp_path, field_name, original_filename, file_type)
+
+    def ingest_path(self, path, field_name, original_filename, file_type):
+        """登记磁盘上已有的完整文件（如分块上传的暂存文件），原文件保持不变
+
+        只读取一遍计算哈希，临时文件用硬链接，不再复制内容。
+        """
+        digest = hashlib.sha256()
+        size = 0
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(COPY_BUFFER_SIZE)
+                if not data:
+                    break
+                size += len(data)
+                digest.update(data)
+        if size > self.max_size:
+            raise FileTooLarge(f"文件大小超过限制 {self.max_size/1024/1024:.0f}MB")
+
+        temp_path = self._new_temp_path()
+        try:
+            os.link(path, temp_path)
+        except OSError:
+            # 不在同一文件系统或不支持硬链接时复制
+            shutil.copyfile(path, temp_path)
+        return self._pending(digest.hexdigest(), size, temp_path, field_name, original_filename, file_type)
+
+    def _pending(self, blob_hash, size, temp_path, field_name, original_filename, file_type):
+        file_ext = original_filename.rsplit('.', 1)[1].lower()
+        row = {
+            'field_name': field_name,
+            'original_filename': original_filename,
+            'saved_filename': f'{blob_hash}.{file_ext}',
+            'file_size': size,
+            'file_type': file_type or 'application/octet-stream',
+            'blob_hash': blob_hash
+        }
+        return PendingBlob(blob_hash, size, temp_path, row)
+
+    def acquire(self, conn, pending_blobs):
+        """在调用方的事务中为新附件增加引用计数，并将临时文件移入正式位置
+
+        先更新计数（持有该行的锁）再检查文件，与并发的release互斥：
+        计数减到0的删除先完成时，这里会重新放入文件。
+        """
+        counts = {}
+        for pending in pending_blobs:
+            counts[pending.blob_hash] = counts.get(pending.blob_hash, 0) + 1
+        sizes = {pending.blob_hash: pending.size for pending in pending_blobs}
+        # 按固定顺序加锁，避免并发事务死锁
+        for blob_hash in sorted(counts):
+            _upsert_ref(conn, blob_hash, sizes[blob_hash], counts[blob_hash])
+
+        placed = placed_bytes = 0
+        for pending in pending_blobs:
+            target = self.blob_path(pending.blob_hash)
+            if os.path.exists(target):
+                os.remove(pending.temp_path)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(pending.temp_path, target)
+                placed += 1
+                placed_bytes += pending.size
+            pending.temp_path = None
+        record_stored(conn, placed, placed_bytes)
+
+    def discard(self, pending_blobs):
+        """放弃尚未登记引用的临时文件"""
+        for pending in pending_blobs:
+            if pending.temp_path and os.path.exists(pending.temp_path):
+                os.remove(pending.temp_path)
+            pending.temp_path = None
+
+    def release(self, conn, upload_files):
+        """在调用方的事务中释放附件引用，返回待删除的文件（ReleasedFiles）
+
+        内容寻址的文件引用计数减1；文件在调用方提交后由purge删除，事务回滚时文件和计数都保持不变。
+        """
+        counts = {}
+        legacy = []
+        for upload_file in upload_files:
+            if upload_file.blob_hash:
+                counts[upload_file.blob_hash] = counts.get(upload_file.blob_hash, 0) + 1
+            else:
+                legacy.append(upload_file.saved_filename)
+
+        table = UploadBlob.__table__
+        for blob_hash in sorted(counts):
+            conn.execute(update(table).where(table.c.hash == blob_hash)
+                         .values(ref_count=table.c.ref_count - counts[blob_hash]))
+        unreferenced = []
+        if counts:
+            unreferenced = sorted(conn.execute(
+                select(table.c.hash).where(table.c.hash.in_(sorted(counts)), table.c.ref_count <= 0)
+            ).scalars())
+        return ReleasedFiles(unreferenced, legacy)
+
+    def purge(self, released):
+        """release的事务提交后删除不再被引用的文件，返回删除的文件数
+
+        每个文件在独立事务中按acquire的方式锁定计数行后再检查：提交后又被重新登记的文件保留；
+        并发登记相同内容的请求等待本事务结束，发现文件已删除时重新放入。
+        进程在提交和purge之间退出时计数为0的记录和文件保留，再次上传相同内容时直接复用。
+        """
+        table = UploadBlob.__table__
+        removed = 0
+        for blob_hash in released.blob_hashes:
+            with db.engine.begin() as conn:
+                _upsert_ref(conn, blob_hash, 0, 0)
+                size, ref_count = conn.execute(
+                    select(table.c.size, table.c.ref_count).where(table.c.hash == blob_hash)).one()
+                if ref_count > 0:
+                    continue
+                conn.execute(delete(table).where(table.c.hash == blob_hash))
+                path = self.blob_path(blob_hash)
+                if os.path.exists(path):
+                    os.remove(path)
+                    removed += 1
+                    record_stored(conn, -1, -size)
+
+        legacy_removed = legacy_bytes = 0
+        for name in released.legacy_names:
+            # 迁移中的旧附件可能在根目录或分片目录中，两处都删除
+            for path in (os.path.join(self.root, name), os.path.join(self.root, self.legacy_relpath(name))):
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                    legacy_removed += 1
+                    legacy_bytes += size
+                    break
+                except FileNotFoundError:
+                    continue
+        if legacy_removed:
+            with db.engine.begin() as conn:
+                record_stored(conn, -legacy_removed, -legacy_bytes)
+        return removed + legacy_removed
+
+    def iter_files(self):
+        """遍历存储中的全部文件，逐个返回(相对路径, 字节数)，跳过正在上传的临时文件"""
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.root:
+                dirnames[:] = [name for name in dirnames if name != INCOMING_FOLDER]
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    size = os.path.getsize(path)
+                except FileNotFoundError:
+                    # 遍历期间被删除或迁移
+                    continue
+                yield os.path.relpath(path, self.root), size
+
+    def iter_flat_batches(self, batch_size):
+        """逐批返回上传目录根下尚未迁移的旧附件文件名"""
+        while True:
+            batch = []
+            with os.scandir(self.root) as entries:
+                for entry in entries:
+                    if entry.is_file(follow_symlinks=False) and not entry.name.startswith('.'):
+                        batch.append(entry.name)
+                        if len(batch) >= batch_size:
+                            break
+            if not batch:
+                return
+            yield batch
+
+    def migrate_flat_file(self, name):
+        """将根目录下的一个旧附件移入分片目录，文件已不存在（被删除或已迁移）时返回False
+
+        同一文件系统内的重命名是原子的，读取方在任意时刻都能在两个位置之一找到文件。
+        """
+        target = os.path.join(self.root, self.legacy_relpath(name))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.rename(os.path.join(self.root, name), target)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def usage(self):
+        """存储用量：实际占用、去重前应占用的字节数和去重节省的字节数"""
+        row = db.session.execute(select(
+            func.count(UploadBlob.hash),
+            func.coalesce(func.sum(UploadBlob.size), 0),
+            func.coalesce(func.sum(UploadBlob.size * UploadBlob.ref_count), 0),
+            func.coalesce(func.sum(UploadBlob.ref_count), 0),
+        )).one()
+        blobs, stored, logical, references = (int(value) for value in row)
+        return {
+            'blobs': blobs,
+            'references': references,
+            'stored_bytes': stored,
+            'logical_bytes': logical,
+            'saved_bytes': logical - stored,
+        }
+
+
+def _upsert_ref(conn, blob_hash, size, delta):
+    """原子地将文件引用计数加上delta，记录不存在时创建"""
+    table = UploadBlob.__table__
+    now = datetime.utcnow()
+    dialect = conn.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert_fn = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        stmt = insert_fn(table).values(hash=blob_hash, size=size, ref_count=delta, created_at=now)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['hash'],
+            set_={'ref_count': table.c.ref_count + stmt.excluded.ref_count}
+        )
+        conn.execute(stmt)
+        return
+
+    result = conn.execute(update(table).where(table.c.hash == blob_hash)
+                          .values(ref_count=table.c.ref_count + delta))
+    if result.rowcount == 0:
+        conn.execute(insert(table).values(hash=blob_hash, size=size, ref_count=delta, created_at=now))
@@ -14,6 +14,8 @@ sys.path.insert(0, str(project_root))
 
 from app import create_app
 from models import db, Admin
+from migrations import run_migrations
+from form_cache import warm_form_cache
 from config import Config
 
 # 创建应用实例
@@ -23,6 +25,7 @@ application = create_app()
 with application.app_context():
     try:
         db.create_all()
+        run_migrations(db.engine)
         
         # 创建默认管理员
         admin = Admin.query.filter_by(email=Config.ADMIN_EMAIL).first()
@@ -36,6 +39,9 @@ with application.app_context():
             db.session.commit()
             print(f"默认管理员账号已创建: {Config.ADMIN_EMAIL}")
         
+        # 预先编译启用中的表单（preload_app时在fork前完成，各工作进程直接继承）
+        warm_form_cache()
+
         # 创建上传目录
         upload_dir = os.path.join(application.instance_path, application.config['UPLOAD_FOLDER'])
         os.makedirs(upload_dir, exist_ok=True)